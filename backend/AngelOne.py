@@ -6,10 +6,17 @@ import pyotp
 from SmartApi import SmartConnect
 
 import backend.logger_util as logger_util
+from backend import broker_http
+from backend import broker_sessions
+from backend import positions_snapshot
+from backend import market_calendar
+from backend import circuit_breaker
+from backend import rate_limiter
+from backend import order_pipeline
+from backend import strategy_rules
+from backend import clock
 import pytz
-import requests
 import sys
-import http.client
 import json
 
 
@@ -29,10 +36,21 @@ def number_to_interval(num):
     }
     return mapping.get(num, None)  # returns None if not found
 
+ANGELONE_API = "https://apiconnect.angelone.in"
+
+ANGELONE_INTERVAL_MINUTES = {
+    "ONE_MINUTE": 1, "THREE_MINUTE": 3, "FIVE_MINUTE": 5, "TEN_MINUTE": 10,
+    "FIFTEEN_MINUTE": 15, "THIRTY_MINUTE": 30, "ONE_HOUR": 60,
+}
+
 def angelone_fetch_profile_and_balance(obj, refresh_token):
 
-    profile_res = obj.getProfile(refresh_token)
-    balance_res = obj.rmsLimit()
+    rate_limiter.acquire("angelone", "default", obj.access_token)
+    with circuit_breaker.guard("angelone", "default"):
+        profile_res = obj.getProfile(refresh_token)
+    rate_limiter.acquire("angelone", "default", obj.access_token)
+    with circuit_breaker.guard("angelone", "default"):
+        balance_res = obj.rmsLimit()
     data_profile = profile_res['data']
     data_balance = balance_res['data']
     profile= {
@@ -49,7 +67,8 @@ def angelone_fetch_profile_and_balance(obj, refresh_token):
 
 def angelone_get_token_by_name(name):
     url = "https://margincalculator.angelbroking.com/OpenAPI_File/files/OpenAPIScripMaster.json"
-    resp = requests.get(url)
+    # The scrip master is a large file; allow it a longer read than API calls
+    resp = broker_http.get(url, timeout=(broker_http.CONNECT_TIMEOUT, 60))
     resp.raise_for_status()
     df = pd.DataFrame(resp.json())
 
@@ -103,7 +122,7 @@ def angelone_get_nearest_option_details(api_key,auth_token, smart_api,name, spot
         return None
 
     # Expiry filter
-    today = datetime.date.today()
+    today = clock.today()
     df = df[df['expiry'] >= today].sort_values("expiry")
 
     if df.empty:
@@ -182,7 +201,7 @@ def angelone_get_nearest_option_details(api_key,auth_token, smart_api,name, spot
 
     quantity = lots * lot_size
 
-    positions = angelone_fetch_positions(api_key, auth_token)
+    positions = positions_snapshot.positions("angelone", auth_token, angelone_fetch_positions, api_key, auth_token)
     if positions:
         count = 0
         for pos in positions:
@@ -210,12 +229,18 @@ def angelone_connect(api_key, client_id, password, TOTP_Secret):
     feed_token = obj.getfeedToken()
     return obj, refresh_token, auth_token,feed_token
 
+def angelone_get_session(api_key, client_id, pin, totp_secret, user_id=None):
+    """Shared AngelOne session; logs in only when no valid cached session exists."""
+    return broker_sessions.angelone_session(api_key, client_id, pin, totp_secret, angelone_connect, user_id=user_id)
+
 
 # ----------- Historical Candle Data -------------
 def angelone_get_historical_data(api_key,auth_token, smart_api,exchange, symboltoken, interval):
     logger_util.push_log(f"{symboltoken}--{interval}")
-    now = datetime.datetime.now()
-    from_dt = (now - datetime.timedelta(days=25)).strftime("%Y-%m-%d %H:%M")
+    now = clock.now().replace(tzinfo=None)
+    minutes = ANGELONE_INTERVAL_MINUTES.get(interval, 1)
+    start_day = market_calendar.history_start_date(exchange, minutes, end_date=now.date() - datetime.timedelta(days=1), max_calendar_days=25)
+    from_dt = datetime.datetime.combine(start_day, datetime.time(0, 0)).strftime("%Y-%m-%d %H:%M")
     to_dt = now.strftime("%Y-%m-%d %H:%M")
 
     params = {
@@ -240,7 +265,9 @@ def angelone_get_historical_data(api_key,auth_token, smart_api,exchange, symbolt
         'Content-Type': 'application/json'
     }
 
-    candles = smart_api.getCandleData(params)
+    rate_limiter.acquire("angelone", "historical", smart_api.access_token)
+    with circuit_breaker.guard("angelone", "historical"):
+        candles = smart_api.getCandleData(params)
 
     if candles["data"]:
         df = pd.DataFrame(candles['data'], columns=["timestamp", "open", "high", "low", "close", "volume"])
@@ -255,8 +282,6 @@ def angelone_get_historical_data(api_key,auth_token, smart_api,exchange, symbolt
 
 # ----------- Positions Fetch -------------
 def angelone_fetch_positions(api_key, auth_token):
-    conn = http.client.HTTPSConnection("apiconnect.angelone.in")
-    payload = ''
     headers = {
       'Authorization': auth_token,
       'Content-Type': 'application/json',
@@ -268,11 +293,8 @@ def angelone_fetch_positions(api_key, auth_token):
       'X-MACAddress': 'MAC_ADDRESS',
       'X-PrivateKey': api_key
     }
-    conn.request("GET", "/rest/secure/angelbroking/order/v1/getPosition", payload, headers)
-
-    res = conn.getresponse()
-    data = res.read()
-    decoded = data.decode("utf-8")  # Convert bytes → string
+    res = broker_http.get(f"{ANGELONE_API}/rest/secure/angelbroking/order/v1/getPosition", headers=headers)
+    decoded = res.text
     if not decoded:
         logger_util.push_log("❌ Empty response from AngelOne API","error")
         return None
@@ -282,16 +304,28 @@ def angelone_fetch_positions(api_key, auth_token):
         logger_util.push_log(f"❌ Invalid JSON response: {decoded}","error")
         return None
 
+    if broker_sessions.is_angelone_auth_error(parsed):
+        broker_sessions.invalidate_token(auth_token)
+        logger_util.push_log(f"❌ AngelOne session expired: {parsed.get('message')}","error")
+        return None
+
     positions = parsed.get("data")
     return positions
 
 
 # ----------- Place Normal Order -------------
 def angel_place_order(api_key,auth_token, symbol, token, quantity,order_type, price):
-    url = "https://apiconnect.angelone.in/rest/secure/angelbroking/order/v1/placeOrder"
-    conn = http.client.HTTPSConnection(
-        "apiconnect.angelone.in"
+    """Queue a market order on the account's order lane (exits go before entries); returns a Future."""
+    return order_pipeline.submit(
+        "angelone", auth_token, order_type, _angel_submit_order,
+        api_key, auth_token, symbol, token, quantity, order_type, price,
+        instrument=token, quantity=quantity, tradingsymbol=symbol,
+        fill=int(quantity) if order_type == "BUY" else -int(quantity),
+        confirm=lambda order_id: angelone_order_status(api_key, auth_token, order_id),
     )
+
+def _angel_submit_order(api_key,auth_token, symbol, token, quantity,order_type, price, tag=None):
+    url = f"{ANGELONE_API}/rest/secure/angelbroking/order/v1/placeOrder"
     payload = {
         "exchange": "NFO",
         "tradingsymbol": symbol,
@@ -304,7 +338,8 @@ def angel_place_order(api_key,auth_token, symbol, token, quantity,order_type, pr
         "producttype": "CARRYFORWARD",
         "price": price,
         "triggerprice": 0,
-        "duration": "DAY"
+        "duration": "DAY",
+        "ordertag": tag or ""
     }
     headers = {
         'Authorization': auth_token,
@@ -317,12 +352,8 @@ def angel_place_order(api_key,auth_token, symbol, token, quantity,order_type, pr
         'X-MACAddress': 'MAC_ADDRESS',
         'X-PrivateKey': api_key
     }
-    response = requests.get(url, headers=headers, timeout=10)
-    conn.request("POST", "/rest/secure/angelbroking/order/v1/placeOrder", body=json.dumps(payload), headers=headers)
-
-    res = conn.getresponse()
-    data = res.read()
-    decoded = data.decode("utf-8")  # Convert bytes → string
+    res = broker_http.post(url, data=json.dumps(payload), headers=headers)
+    decoded = res.text
     if not decoded:
         logger_util.push_log("❌ Empty response from AngelOne API","error")
         return None
@@ -332,12 +363,46 @@ def angel_place_order(api_key,auth_token, symbol, token, quantity,order_type, pr
         logger_util.push_log(f"❌ Invalid JSON response: {decoded}","error")
         return None
 
-    order_id = parsed.get("data", {}).get("orderid")
+    order_id = (parsed.get("data") or {}).get("orderid")
     return order_id
 
 
+def angelone_order_status(api_key, auth_token, order_id):
+    """Status of one order from the order book ("complete", "rejected", "open", ...)."""
+    headers = {
+        'Authorization': auth_token,
+        'Content-Type': 'application/json',
+        'Accept': 'application/json',
+        'X-UserType': 'USER',
+        'X-SourceID': 'WEB',
+        'X-ClientLocalIP': 'CLIENT_LOCAL_IP',
+        'X-ClientPublicIP': 'CLIENT_PUBLIC_IP',
+        'X-MACAddress': 'MAC_ADDRESS',
+        'X-PrivateKey': api_key
+    }
+    res = broker_http.get(f"{ANGELONE_API}/rest/secure/angelbroking/order/v1/getOrderBook", headers=headers)
+    try:
+        orders = res.json().get("data") or []
+    except ValueError:
+        return None
+    for order in orders:
+        if str(order.get("orderid")) == str(order_id):
+            return order.get("orderstatus") or order.get("status")
+    return None
+
+
 # ----------- Place GTT Order -------------
 def angelone_gtt_order(api_key,auth_token, symbol, token, price, quantity):
+    """Queue the GTT entry on the account's order lane; returns a Future."""
+    # The position only exists once the rule triggers, so no fill is applied up front
+    return order_pipeline.submit(
+        "angelone", auth_token, "BUY", _angelone_submit_gtt,
+        api_key, auth_token, symbol, token, price, quantity,
+        instrument=str(token), quantity=int(quantity), tradingsymbol=str(symbol),
+    )
+
+def _angelone_submit_gtt(api_key,auth_token, symbol, token, price, quantity, tag=None):
+    # GTT rules take no order tag; duplicates are still caught by the pipeline's client order id
     symbol = str(symbol)
     token = str(token)
     try:
@@ -346,7 +411,6 @@ def angelone_gtt_order(api_key,auth_token, symbol, token, price, quantity):
         price = float(price)
     quantity = int(quantity)
 
-    conn = http.client.HTTPSConnection("apiconnect.angelone.in")
     payload = { "tradingsymbol": symbol,
                 "symboltoken": token,
                 "exchange": "NFO",
@@ -370,11 +434,8 @@ def angelone_gtt_order(api_key,auth_token, symbol, token, price, quantity):
     }
 
     # ✅ Convert dict to JSON string before sending
-    conn.request("POST", "/rest/secure/angelbroking/gtt/v1/createRule", body=json.dumps(payload), headers=headers)
-
-    res = conn.getresponse()
-    data = res.read()
-    decoded = data.decode("utf-8")  # Convert bytes → string
+    res = broker_http.post(f"{ANGELONE_API}/rest/secure/angelbroking/gtt/v1/createRule", data=json.dumps(payload), headers=headers)
+    decoded = res.text
     if not decoded:
         logger_util.push_log("❌ Empty response from AngelOne API","error")
         return None
@@ -393,227 +454,35 @@ def angelone_close_position(obj, pos):
     qty = int(pos['netqty'])
     if qty != 0:
         side = "SELL" if qty > 0 else "BUY"
-        position_close =obj.placeOrder({
-            "variety": "NORMAL",
-            "tradingsymbol": pos['tradingsymbol'],
-            "symboltoken": pos['symboltoken'],
-            "transactiontype": side,
-            "exchange": pos['exchange'],
-            "ordertype": "MARKET",
-            "producttype": pos['producttype'],
-            "duration": "DAY",
-            "price": 0,
-            "squareoff": "0",
-            "stoploss": "0",
-            "quantity": abs(qty)
-        })
+        rate_limiter.acquire("angelone", "order", obj.access_token)
+        with circuit_breaker.guard("angelone", "order"):
+            position_close =obj.placeOrder({
+                "variety": "NORMAL",
+                "tradingsymbol": pos['tradingsymbol'],
+                "symboltoken": pos['symboltoken'],
+                "transactiontype": side,
+                "exchange": pos['exchange'],
+                "ordertype": "MARKET",
+                "producttype": pos['producttype'],
+                "duration": "DAY",
+                "price": 0,
+                "squareoff": "0",
+                "stoploss": "0",
+                "quantity": abs(qty)
+            })
         return position_close
 
 def angelone_trade_conditions_check(obj, auth_token, lots, tgt, indicators_df, credentials, stock,strategy):
-
     api_key = credentials['api_key']
-    client_code = credentials['user_id']
-    PIN = credentials['pin']
-    TOTP_Secret = credentials['totp_secret']
-
-    # ✅ Check for signal
-    if strategy == "ADX_MACD_WillR_Supertrend":
-        latest_adx = indicators_df["ADX"].iloc[-1]
-        latest_adxema = indicators_df['ADX_EMA21'].iloc[-1]
-        latest_willr = indicators_df['WillR_14'].iloc[-1]
-        latest_supertrend = indicators_df['Supertrend'].iloc[-1]
-        latest_macd = indicators_df['MACD'].iloc[-1]
-        latest_macd_signal = indicators_df['MACD_signal'].iloc[-1]
-        close_price = float(indicators_df['close'].iloc[-1])
-        tgt = float(tgt)
-
-        positions1 = angelone_fetch_positions(api_key, auth_token)
-        if positions1:
-            for pos in positions1:
-                quantity = pos['netqty']
-                if quantity > 0:
-                    instrument_token = pos['symboltoken']
-                    tradingsymbol = pos['tradingsymbol']
-                    option_type = tradingsymbol[-2:]
-                    if option_type == "CE" and ((latest_willr < -70 and latest_supertrend > close_price) or (
-                            latest_willr < -70 and latest_macd < latest_macd_signal) or (
-                                                        latest_supertrend > close_price and latest_macd < latest_macd_signal)):
-                        angel_place_order(api_key, auth_token, tradingsymbol, instrument_token, quantity ,"SELL", close_price)
-                        logger_util.push_log(f"The existing position is type CE with symbol {tradingsymbol}. CE exit condition met, closing existing CE position.")
-                    elif option_type == "PE" and ((latest_willr > -30 and latest_supertrend < close_price) or (
-                            latest_willr > -30 and latest_macd > latest_macd_signal) or (
-                                                          latest_supertrend < close_price and latest_macd < latest_macd_signal)):
-                        angel_place_order(api_key, auth_token, tradingsymbol, instrument_token, quantity ,"SELL", close_price)
-                        logger_util.push_log(f"The existing position is type PE with symbol {tradingsymbol}. PE exit condition met, closing existing PE position.")
-
-        positions = angelone_fetch_positions(api_key, auth_token)
-        if latest_adx > latest_adxema and latest_willr > -30 and latest_supertrend < close_price and latest_macd > latest_macd_signal:
-            logger_util.push_log("🔼 BUY SIGNAL GENERATED")
-            sys.stdout.flush()
-            if positions:
-                count = 0
-                for pos in positions:
-                    quantity = pos['netqty']
-                    if quantity > 0:
-                        count +=1
-                        tradingsymbol = pos['tradingsymbol']
-                        option_type = tradingsymbol[-2:]
-                        if option_type == "CE":
-                            logger_util.push_log(f"The existing position is type CE with symbol {tradingsymbol}. No new CALL trade placed ")
-
-                if count == 0:
-                    angelone_get_nearest_option_details(api_key,auth_token, obj,stock, close_price, "CE", lots, tgt)
-                    logger_util.push_log(f"There are no live positions and BUY signal generated. Placing a new CE order")
-            else:
-                angelone_get_nearest_option_details(api_key,auth_token, obj,stock, close_price, "CE", lots, tgt)
-                logger_util.push_log(f"There are no positions and BUY signal generated. Placing a new CE order")
-
-        elif latest_adx > latest_adxema and latest_willr < -70 and latest_supertrend > close_price and latest_macd < latest_macd_signal:
-            logger_util.push_log("🔽 SELL SIGNAL GENERATED")
-            sys.stdout.flush()
-            if positions:
-                count = 0
-                for pos in positions:
-                    quantity = pos['netqty']
-                    if quantity > 0:
-                        count +=1
-                        tradingsymbol = pos['tradingsymbol']
-                        option_type = tradingsymbol[-2:]
-                        if option_type == "PE":
-                            logger_util.push_log(f"The existing position is type PE with symbol {tradingsymbol}. No new PUT trade placed ")
-                if count == 0:
-                    angelone_get_nearest_option_details(api_key,auth_token, obj,stock, close_price, "PE", lots, tgt)
-                    logger_util.push_log(f"There are no live positions and SELL signal generated. Placing a new PE order")
-            else:
-                angelone_get_nearest_option_details(api_key,auth_token, obj,stock, close_price, "PE", lots, tgt)
-                logger_util.push_log(f"There are no positions and SELL signal generated. Placing a new PE order")
-        else:
-            logger_util.push_log("⏸️ NO TRADE SIGNAL GENERATED")
-            sys.stdout.flush()
-
-    elif strategy == "Ema10_Ema20_Supertrend":
-        latest_Ema10 = indicators_df["ema10"].iloc[-1]
-        latest_Ema20 = indicators_df['ema20'].iloc[-1]
-        latest_supertrend = indicators_df['Supertrend'].iloc[-1]
-        close_price = float(indicators_df['close'].iloc[-1])
-        tgt = float(tgt)
-
-        positions1 = angelone_fetch_positions(api_key, auth_token)
-        if positions1:
-            for pos in positions1:
-                quantity = pos['netqty']
-                if quantity > 0:
-                    instrument_token = pos['instrument_token']
-                    tradingsymbol = pos['tradingsymbol']
-                    option_type = tradingsymbol[-2:]
-
-                    if option_type == "CE" and (latest_Ema10 < latest_Ema20 or latest_supertrend > close_price):
-                        angel_place_order(api_key, auth_token, tradingsymbol, instrument_token, quantity, "SELL",close_price)
-                        logger_util.push_log(f"The existing position is type CE with symbol {tradingsymbol}. CE exit condition met, closing existing CE position ")
-                    elif option_type == "PE" and (latest_Ema10 > latest_Ema20 or latest_supertrend < close_price):
-                        angel_place_order(api_key, auth_token, tradingsymbol, instrument_token, quantity, "SELL",close_price)
-                        logger_util.push_log(f"The existing position is type PE with symbol {tradingsymbol}. PE exit condition met, closing existing PE position ")
-
-        positions = angelone_fetch_positions(api_key, auth_token)
-        if latest_Ema10 > latest_Ema20 and latest_supertrend < close_price:
-            logger_util.push_log("🔼 BUY SIGNAL GENERATED")
-            sys.stdout.flush()
-            if positions:
-                count = 0
-                for pos in positions:
-                    quantity = pos['netqty']
-                    if quantity > 0:
-                        count +=1
-                        tradingsymbol = pos['tradingsymbol']
-                        option_type = tradingsymbol[-2:]
-                        if option_type == "CE":
-                            logger_util.push_log(
-                                f"The existing position is type CE with symbol {tradingsymbol}. No new CALL trade placed ")
-
-                if count == 0:
-                    angelone_get_nearest_option_details(api_key, auth_token, obj, stock, close_price, "CE",lots, tgt)
-                    logger_util.push_log(f"There are no live positions and BUY signal generated. Placing a new CE order")
-            else:
-                angelone_get_nearest_option_details(api_key, auth_token, obj, stock, close_price, "CE", lots, tgt)
-                logger_util.push_log(f"There are no positions and BUY signal generated. Placing a new CE order")
-
-        elif latest_Ema10 < latest_Ema20 and latest_supertrend > close_price:
-            logger_util.push_log("🔽 SELL SIGNAL GENERATED")
-            sys.stdout.flush()
-            if positions:
-                count = 0
-                for pos in positions:
-                    quantity = pos['netqty']
-                    if quantity > 0:
-                        count +=1
-                        tradingsymbol = pos['tradingsymbol']
-                        option_type = tradingsymbol[-2:]
-                        if option_type == "PE":
-                            logger_util.push_log(
-                                f"The existing position is type PE with symbol {tradingsymbol}. No new PUT trade placed ")
-                if count == 0:
-                    angelone_get_nearest_option_details(api_key, auth_token, obj, stock, close_price, "PE", lots,tgt)
-                    logger_util.push_log(f"There are no live positions and SELL signal generated. Placing a new PE order")
-            else:
-                angelone_get_nearest_option_details(api_key, auth_token, obj, stock, close_price, "PE", lots, tgt)
-                logger_util.push_log(f"There are no positions and SELL signal generated. Placing a new PE order")
-        else:
-            logger_util.push_log("⏸️ NO TRADE SIGNAL GENERATED")
-            sys.stdout.flush()
-    elif strategy == "Ema10_Ema20_MACD_Supertrend":
-        latest_Ema10 = indicators_df["ema10"].iloc[-1]
-        latest_Ema20 = indicators_df['ema20'].iloc[-1]
-        latest_supertrend = indicators_df['Supertrend'].iloc[-1]
-        latest_macd = indicators_df['MACD'].iloc[-1]
-        latest_macd_signal = indicators_df['MACD'].iloc[-1]
-        close_price = float(indicators_df['close'].iloc[-1])
-
-        positions = angelone_fetch_positions(api_key, auth_token)
-        if positions:
-            count = 0
-            for pos in positions:
-                quantity = pos['netqty']
-                if quantity > 0:
-                    instrument_token = pos['instrument_token']
-                    tradingsymbol = pos['tradingsymbol']
-                    option_type = tradingsymbol[-2:]
-                    if latest_Ema10 > latest_Ema20 and latest_supertrend < close_price and latest_macd > latest_macd_signal:
-                        if option_type == "CE":
-                            logger_util.push_log("BUY SIGNAL GENERATED. You have existing CALL position. No new order placed")
-                        elif option_type == "PE":
-                            logger_util.push_log("BUY SIGNAL GENERATED.  Closing existing PUT Position and place new CALL order")
-                            angel_place_order(api_key, auth_token, tradingsymbol, instrument_token, quantity, "SELL",close_price)
-                            angelone_get_nearest_option_details(api_key, auth_token, obj, stock, close_price, "CE",lots, tgt)
-                    elif latest_Ema10 < latest_Ema20 and latest_supertrend > close_price and latest_macd < latest_macd_signal:
-                        if option_type == "PE":
-                            logger_util.push_log("SELL SIGNAL GENERATED. You have existing PUT position. No new order placed")
-                        elif option_type == "CE":
-                            logger_util.push_log("SELL SIGNAL GENERATED.  Closing existing CALL Position and place new CALL order")
-                            angel_place_order(api_key, auth_token, tradingsymbol, instrument_token, quantity, "SELL",close_price)
-                            angelone_get_nearest_option_details(api_key, auth_token, obj, stock, close_price, "PE", lots, tgt)
-                    elif option_type == "CE":
-                        if latest_Ema10 < latest_Ema20 or latest_supertrend > close_price or latest_macd < latest_macd_signal:
-                            logger_util.push_log("NO Trade Signal Generated .CALL position exit condition met. Closing existing CALL position")
-                            angel_place_order(api_key, auth_token, tradingsymbol, instrument_token, quantity, "SELL",close_price)
-                    elif option_type == "PE":
-                        if latest_Ema10 > latest_Ema20 or latest_supertrend < close_price or latest_macd > latest_macd_signal:
-                            logger_util.push_log("NO Trade Signal Generated. PUT position exit condition met. Closing existing PUT position")
-                            angel_place_order(api_key, auth_token, tradingsymbol, instrument_token, quantity, "SELL",close_price)
-            if count == 0:
-                if latest_Ema10 > latest_Ema20 and latest_supertrend < close_price and latest_macd > latest_macd_signal:
-                    logger_util.push_log("BUY SIGNAL GENERATED. No live position exist. Placing new CALL order")
-                    angelone_get_nearest_option_details(api_key, auth_token, obj, stock, close_price, "CE",lots, tgt)
-                elif latest_Ema10 < latest_Ema20 and latest_supertrend > close_price and latest_macd < latest_macd_signal:
-                    logger_util.push_log("SELL SIGNAL GENERATED. No live position exist. Placing new PUT order")
-                    angelone_get_nearest_option_details(api_key, auth_token, obj, stock, close_price, "PE", lots, tgt)
-                else:
-                    logger_util.push_log("NO Trade Signal Generated")
-        else:
-            if latest_Ema10 > latest_Ema20 and latest_supertrend < close_price and latest_macd > latest_macd_signal:
-                logger_util.push_log("BUY SIGNAL GENERATED. Placing new CALL order")
-                angelone_get_nearest_option_details(api_key, auth_token, obj, stock, close_price, "CE",lots, tgt)
-            elif latest_Ema10 < latest_Ema20 and latest_supertrend > close_price and latest_macd < latest_macd_signal:
-                logger_util.push_log("SELL SIGNAL GENERATED. Placing new PUT order")
-                angelone_get_nearest_option_details(api_key, auth_token, obj, stock, close_price, "PE", lots, tgt)
-            else:
-                logger_util.push_log("NO Trade Signal Generated")
+    rules = strategy_rules.get(strategy)
+    if rules is None:
+        logger_util.push_log(f"❌ Unknown strategy {strategy}", level="error", log_type="trading")
+        return
+    tgt = float(tgt)
+    signals = rules.latest(indicators_df)
+    strategy_rules.run(
+        rules, signals, "angelone",
+        fetch_positions=lambda: positions_snapshot.positions("angelone", auth_token, angelone_fetch_positions, api_key, auth_token),
+        exit_position=lambda pos: angel_place_order(api_key, auth_token, pos.tradingsymbol, pos.raw['symboltoken'], pos.quantity, "SELL", signals.close),
+        enter=lambda option_type: angelone_get_nearest_option_details(api_key, auth_token, obj, stock, signals.close, option_type, lots, tgt),
+    )
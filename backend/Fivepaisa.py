@@ -1,8 +1,12 @@
-import requests
 import sys
 import datetime
 import pandas as pd
 import backend.logger_util as logger_util
+from backend import broker_http
+from backend import positions_snapshot
+from backend import order_pipeline
+from backend import strategy_rules
+from backend import clock
 
 def fivepaisa_get_balance(app_key, access_token, client_code):
 
@@ -18,7 +22,7 @@ def fivepaisa_get_balance(app_key, access_token, client_code):
         "body": {"ClientCode": client_code}
     }
 
-    response = requests.post(url, json=payload, headers=headers)
+    response = broker_http.post(url, json=payload, headers=headers)
 
     if response.status_code == 200:
         balance_data = response.json()
@@ -67,7 +71,7 @@ def fivepaisa_get_nearest_option(symbol_root, spot_value, option_type):
     # Sort by expiry
     df = df.sort_values("Expiry")
 
-    today = datetime.datetime.now().date()
+    today = clock.today()
     tomorrow = today + datetime.timedelta(days=1)
 
     # Exclude today and tomorrow expiry
@@ -101,7 +105,7 @@ def fivepaisa_fetch_positions(app_key, access_token, client_code):
         "body": {"ClientCode": client_code}
     }
 
-    response = requests.post(url, json=payload, headers=headers)
+    response = broker_http.post(url, json=payload, headers=headers)
 
     if response.status_code == 200:
         positions_data = response.json()
@@ -112,8 +116,8 @@ def fivepaisa_fetch_positions(app_key, access_token, client_code):
         return None
 
 def fivepaisa_historical_data_fetch(access_token, scripCode, interval,days):
-  end_date = datetime.datetime.today().strftime("%Y-%m-%d")
-  from_date = (datetime.datetime.today()-datetime.timedelta(days = days)).strftime("%Y-%m-%d")
+  end_date = clock.today().strftime("%Y-%m-%d")
+  from_date = (clock.today()-datetime.timedelta(days = days)).strftime("%Y-%m-%d")
   if days == 25:
       exchange_type = "C"
   elif days == 1:
@@ -121,7 +125,7 @@ def fivepaisa_historical_data_fetch(access_token, scripCode, interval,days):
   url = f"https://openapi.5paisa.com/V2/historical/N/{exchange_type}/{scripCode}/{interval}?from={from_date}&end={end_date}"
 
   headers = {"Content-Type": "application/json", "Authorization": f"Bearer {access_token}"}
-  resp = requests.get(url, headers=headers)
+  resp = broker_http.get(url, headers=headers)
 
   if resp.status_code == 200:
     data = resp.json()
@@ -176,14 +180,34 @@ def fivepaisa_close_position(credentials, pos):
             "AHPlaced": "N"
         }
     }
-    resp = requests.post(url, headers=headers, json=payload)
+    resp = broker_http.post(url, headers=headers, json=payload)
 
     if resp.status_code == 200:
+        positions_snapshot.record_fill("5paisa", access_token, scrip_code, -int(quantity), scrip_data)
         logger_util.push_log(resp.json())
     else:
         logger_util.push_log(f"Error: {resp.status_code}, {resp.text}","error")
 
+def _fivepaisa_order_id(resp, tag):
+    """Broker order id from a PlaceOrderRequest answer; the remote id when the body has none."""
+    try:
+        body = resp.json().get("body") or {}
+    except ValueError:
+        body = {}
+    if body.get("Status") not in (None, 0):
+        return None
+    return body.get("BrokerOrderID") or tag or True
+
 def fivepaisa_place_single_order(access_token, scripCode, user_key, scrip_data, price, quantity, order_type):
+    """Queue a limit order on the account's order lane ("S" exits go before entries); returns a Future."""
+    # Limit order: the fill is not known up front, the snapshot is refetched instead
+    return order_pipeline.submit(
+        "5paisa", access_token, order_type, _fivepaisa_submit_single_order,
+        access_token, scripCode, user_key, scrip_data, price, quantity, order_type,
+        instrument=scripCode, quantity=quantity, tradingsymbol=scrip_data,
+    )
+
+def _fivepaisa_submit_single_order(access_token, scripCode, user_key, scrip_data, price, quantity, order_type, tag=None):
     url = "https://Openapi.5paisa.com/VendorsAPI/Service1.svc/V1/PlaceOrderRequest"
 
     headers = {
@@ -207,18 +231,31 @@ def fivepaisa_place_single_order(access_token, scripCode, user_key, scrip_data,
             "IsIntraday": False,
             "IsStopLossOrder": False,
             "iOrderValidity": 0,           # 0 = Day, 1 = IOC
-            "AHPlaced": "N"
+            "AHPlaced": "N",
+            "RemoteOrderID": tag or ""
         }
     }
 
-    resp = requests.post(url, headers=headers, json=payload)
+    resp = broker_http.post(url, headers=headers, json=payload)
 
     if resp.status_code == 200:
+        # Limit order: the fill is not known yet, so refetch on the next read
+        positions_snapshot.mark_stale("5paisa", access_token)
         logger_util.push_log(resp.json())
+        return _fivepaisa_order_id(resp, tag)
     else:
         logger_util.push_log(f"Error: {resp.status_code}, {resp.text}","error")
+        return None
 
 def fivepaisa_place_bracket_order(access_token, scripCode, user_key, scrip_data, price, quantity, order_type, target):
+    """Queue a bracket order on the account's order lane; returns a Future."""
+    return order_pipeline.submit(
+        "5paisa", access_token, order_type, _fivepaisa_submit_bracket_order,
+        access_token, scripCode, user_key, scrip_data, price, quantity, order_type, target,
+        instrument=str(scripCode), quantity=int(quantity), tradingsymbol=str(scrip_data),
+    )
+
+def _fivepaisa_submit_bracket_order(access_token, scripCode, user_key, scrip_data, price, quantity, order_type, target, tag=None):
     url = "https://Openapi.5paisa.com/VendorsAPI/Service1.svc/V1/PlaceOrderRequest"
 
     headers = {
@@ -244,16 +281,21 @@ def fivepaisa_place_bracket_order(access_token, scripCode, user_key, scrip_data,
             "IsIntraday": True,
             "IsStopLossOrder": False,
             "iOrderValidity": 0,           # 0 = Day, 1 = IOC
-            "AHPlaced": "N"
+            "AHPlaced": "N",
+            "RemoteOrderID": tag or ""
         }
     }
 
-    resp = requests.post(url, headers=headers, json=payload)
+    resp = broker_http.post(url, headers=headers, json=payload)
 
     if resp.status_code == 200:
+        # Limit order: the fill is not known yet, so refetch on the next read
+        positions_snapshot.mark_stale("5paisa", access_token)
         logger_util.push_log(resp.json())
+        return _fivepaisa_order_id(resp, tag)
     else:
         logger_util.push_log(f"Error: {resp.status_code}, {resp.text}","error")
+        return None
 
 def format_option_name(option_str: str) -> str:
     parts = option_str.split()
@@ -288,227 +330,19 @@ def fivepaisa_fetch_option_data(access_token, user_key, stock, close_price, tgt,
 
 
 def fivepaisa_trade_conditions_check(lots, tgt, indicators_df, credentials, stock_details,strategy):
-
-    stock= stock_details['symbol']
+    stock = stock_details['symbol']
     access_token = credentials['access_token']
     user_key = credentials['app_key']
     client_code = credentials['client_id']
-    if strategy == "ADX_MACD_WillR_Supertrend":
-        # ✅ Check for signal
-        latest_adx = indicators_df["ADX"].iloc[-1]
-        latest_adxema = indicators_df['ADX_EMA21'].iloc[-1]
-        latest_willr = indicators_df['WillR_14'].iloc[-1]
-        latest_supertrend = indicators_df['Supertrend'].iloc[-1]
-        latest_macd = indicators_df['MACD'].iloc[-1]
-        latest_macd_signal = indicators_df['MACD_signal'].iloc[-1]
-        close_price = float(indicators_df['close'].iloc[-1])
-        tgt = float(tgt)
-
-        positions1 = fivepaisa_fetch_positions(user_key, access_token, client_code)
-        if positions1:
-            for pos in positions1:
-                quantity = pos['NetQty']
-                if quantity > 0:
-                    scrip_data = pos['ScripName']
-                    scrip_code = pos['ScripCode']
-                    parts = scrip_code.split("_")
-                    option_type = parts[2]
-                    price = pos['LTP']
-                    if option_type == "CE" and ((latest_willr < -70 and latest_supertrend > close_price) or (
-                            latest_willr < -70 and latest_macd < latest_macd_signal) or (
-                                                        latest_supertrend > close_price and latest_macd < latest_macd_signal)):
-                        fivepaisa_place_single_order(access_token, scrip_code, user_key, scrip_data, price, quantity, "S")
-                        logger_util.push_log(f"The existing position is type CE with symbol {scrip_data}. CE exit condition met, closing existing CE position.")
-                    elif option_type == "PE" and ((latest_willr > -30 and latest_supertrend < close_price) or (
-                            latest_willr > -30 and latest_macd > latest_macd_signal) or (
-                                                          latest_supertrend < close_price and latest_macd < latest_macd_signal)):
-                        fivepaisa_place_single_order(access_token, scrip_code, user_key, scrip_data, price, quantity, "S")
-                        logger_util.push_log(f"The existing position is type PE with symbol {scrip_data}. PE exit condition met, closing existing PE position.")
-
-        positions = fivepaisa_fetch_positions(user_key, access_token, client_code)
-        if latest_adx > latest_adxema and latest_willr > -30 and latest_supertrend < close_price and latest_macd > latest_macd_signal:
-            logger_util.push_log("🔼 BUY SIGNAL GENERATED")
-            sys.stdout.flush()
-            if positions:
-                count = 0
-                for pos in positions:
-                    quantity = pos['NetQty']
-                    if quantity > 0:
-                        count +=1
-                        scrip_data = pos['ScripName']
-                        scrip_code = pos['ScripCode']
-                        parts = scrip_code.split("_")
-                        option_type = parts[2]
-                        price = pos['LTP']
-                        if option_type == "CE":
-                            logger_util.push_log(f"The existing position is type CE with symbol {scrip_data}. No new CALL trade placed ")
-
-                if count == 0:
-                    fivepaisa_fetch_option_data(access_token, user_key, stock, close_price, tgt, lots,"CE")
-                    logger_util.push_log(f"There are no live positions and BUY signal generated. Placing a new CE order")
-            else:
-                fivepaisa_fetch_option_data(access_token, user_key, stock, close_price, tgt, lots, "CE")
-                logger_util.push_log(f"There are no positions and BUY signal generated. Placing a new CE order")
-
-        elif latest_adx > latest_adxema and latest_willr < -70 and latest_supertrend > close_price and latest_macd < latest_macd_signal:
-            logger_util.push_log("🔽 SELL SIGNAL GENERATED")
-            sys.stdout.flush()
-            if positions:
-                count = 0
-                for pos in positions:
-                    quantity = pos['NetQty']
-                    if quantity > 0:
-                        count += 1
-                        scrip_data = pos['ScripName']
-                        scrip_code = pos['ScripCode']
-                        parts = scrip_code.split("_")
-                        option_type = parts[2]
-                        price = pos['LTP']
-                        if option_type == "PE":
-                            logger_util.push_log(f"The existing position is type PE with symbol {scrip_data}. No new PUT trade placed ")
-                if count == 0:
-                    fivepaisa_fetch_option_data(access_token, user_key, stock, close_price, tgt, lots,"PE")
-                    logger_util.push_log(f"There are no live positions and SELL signal generated. Placing a new PE order")
-            else:
-                fivepaisa_fetch_option_data(access_token, user_key, stock, close_price, tgt, lots, "PE")
-                logger_util.push_log(f"There are no positions and SELL signal generated. Placing a new PE order")
-        else:
-            logger_util.push_log("⏸️ NO TRADE SIGNAL GENERATED")
-            sys.stdout.flush()
-
-    elif strategy == "Ema10_Ema20_Supertrend":
-        # ✅ Check for signal
-        latest_Ema10 = indicators_df["ema10"].iloc[-1]
-        latest_Ema20 = indicators_df['ema20'].iloc[-1]
-        latest_supertrend = indicators_df['Supertrend'].iloc[-1]
-        close_price = float(indicators_df['close'].iloc[-1])
-        tgt = float(tgt)
-
-        positions1 = fivepaisa_fetch_positions(user_key, access_token, client_code)
-        if positions1:
-            for pos in positions1:
-                quantity = pos['NetQty']
-                if quantity > 0:
-                    scrip_data = pos['ScripName']
-                    scrip_code = pos['ScripCode']
-                    parts = scrip_code.split("_")
-                    option_type = parts[2]
-                    price = pos['LTP']
-                    if option_type == "CE" and (latest_Ema10 < latest_Ema20 or latest_supertrend > close_price):
-                        fivepaisa_place_single_order(access_token, scrip_code, user_key, scrip_data, price, quantity, "S")
-                        logger_util.push_log(
-                            f"The existing position is type CE with symbol {scrip_data}. CE exit condition met, closing existing CE position ")
-                    elif option_type == "PE" and (latest_Ema10 > latest_Ema20 or latest_supertrend < close_price):
-                        fivepaisa_place_single_order(access_token, scrip_code, user_key, scrip_data, price, quantity, "S")
-                        logger_util.push_log(f"The existing position is type PE with symbol {scrip_data}. PE exit condition met, closing existing PE position ")
-
-        positions = fivepaisa_fetch_positions(user_key, access_token, client_code)
-        if latest_Ema10 > latest_Ema20 and latest_supertrend < close_price:
-            logger_util.push_log("🔼 BUY SIGNAL GENERATED")
-            sys.stdout.flush()
-            if positions:
-                count = 0
-                for pos in positions:
-                    quantity = pos['NetQty']
-                    if quantity > 0:
-                        count +=1
-                        scrip_data = pos['ScripName']
-                        scrip_code = pos['ScripCode']
-                        parts = scrip_code.split("_")
-                        option_type = parts[2]
-                        price = pos['LTP']
-                        if option_type == "CE":
-                            logger_util.push_log(f"The existing position is type CE with symbol {scrip_data}. No new CALL trade placed ")
-
-                if count == 0:
-                    fivepaisa_fetch_option_data(access_token, user_key, stock, close_price, tgt, lots, "CE")
-                    logger_util.push_log(f"There are no live positions and BUY signal generated. Placing a new CE order")
-            else:
-                fivepaisa_fetch_option_data(access_token, user_key, stock, close_price, tgt, lots, "CE")
-                logger_util.push_log(f"There are no positions and BUY signal generated. Placing a new CE order")
-
-        elif latest_Ema10 < latest_Ema20 and latest_supertrend > close_price:
-            logger_util.push_log("🔽 SELL SIGNAL GENERATED")
-            sys.stdout.flush()
-            if positions:
-                count = 0
-                for pos in positions:
-                    quantity = pos['NetQty']
-                    if quantity > 0:
-                        count +=1
-                        scrip_data = pos['ScripName']
-                        scrip_code = pos['ScripCode']
-                        parts = scrip_code.split("_")
-                        option_type = parts[2]
-                        price = pos['LTP']
-                        if option_type == "PE":
-                            logger_util.push_log(f"The existing position is type PE with symbol {scrip_data}. No new PUT trade placed ")
-
-                if count == 0:
-                    fivepaisa_fetch_option_data(access_token, user_key, stock, close_price, tgt, lots, "PE")
-                    logger_util.push_log(f"There are no live positions and SELL signal generated. Placing a new PE order")
-            else:
-                fivepaisa_fetch_option_data(access_token, user_key, stock, close_price, tgt, lots, "PE")
-                logger_util.push_log(f"There are no positions and SELL signal generated. Placing a new PE order")
-        else:
-            logger_util.push_log("⏸️ NO TRADE SIGNAL GENERATED")
-            sys.stdout.flush()
-    elif strategy == "Ema10_Ema20_MACD_Supertrend":
-        latest_Ema10 = indicators_df["ema10"].iloc[-1]
-        latest_Ema20 = indicators_df['ema20'].iloc[-1]
-        latest_supertrend = indicators_df['Supertrend'].iloc[-1]
-        latest_macd = indicators_df['MACD'].iloc[-1]
-        latest_macd_signal = indicators_df['MACD'].iloc[-1]
-        close_price = float(indicators_df['close'].iloc[-1])
-        positions = fivepaisa_fetch_positions(user_key, access_token, client_code)
-        if positions:
-            count = 0
-            for pos in positions:
-                quantity = pos['NetQty']
-                if quantity > 0:
-                    count += 1
-                    scrip_data = pos['ScripName']
-                    scrip_code = pos['ScripCode']
-                    parts = scrip_code.split("_")
-                    option_type = parts[2]
-                    price = pos['LTP']
-                    if latest_Ema10 > latest_Ema20 and latest_supertrend < close_price and latest_macd > latest_macd_signal:
-                        if option_type == "CE":
-                            logger_util.push_log("BUY SIGNAL GENERATED. You have existing CALL position. No new order placed")
-                        elif option_type == "PE":
-                            logger_util.push_log("BUY SIGNAL GENERATED.  Closing existing PUT Position and place new CALL order")
-                            fivepaisa_place_single_order(access_token, scrip_code, user_key, scrip_data, price, quantity, "S")
-                            fivepaisa_fetch_option_data(access_token, user_key, stock, close_price, tgt, lots, "CE")
-                    elif latest_Ema10 < latest_Ema20 and latest_supertrend > close_price and latest_macd < latest_macd_signal:
-                        if option_type == "PE":
-                            logger_util.push_log("SELL SIGNAL GENERATED. You have existing PUT position. No new order placed")
-                        elif option_type == "CE":
-                            logger_util.push_log("SELL SIGNAL GENERATED.  Closing existing CALL Position and place new CALL order")
-                            fivepaisa_place_single_order(access_token, scrip_code, user_key, scrip_data, price, quantity, "S")
-                            fivepaisa_fetch_option_data(access_token, user_key, stock, close_price, tgt, lots, "PE")
-                    elif option_type == "CE":
-                        if latest_Ema10 < latest_Ema20 or latest_supertrend > close_price or latest_macd < latest_macd_signal:
-                            logger_util.push_log("NO Trade Signal Generated .CALL position exit condition met. Closing existing CALL position")
-                            fivepaisa_place_single_order(access_token, scrip_code, user_key, scrip_data, price, quantity, "S")
-                    elif option_type == "PE":
-                        if latest_Ema10 > latest_Ema20 or latest_supertrend < close_price or latest_macd > latest_macd_signal:
-                            logger_util.push_log("NO Trade Signal Generated. PUT position exit condition met. Closing existing PUT position")
-                            fivepaisa_place_single_order(access_token, scrip_code, user_key, scrip_data, price, quantity, "S")
-            if count == 0:
-                if latest_Ema10 > latest_Ema20 and latest_supertrend < close_price and latest_macd > latest_macd_signal:
-                    logger_util.push_log("BUY SIGNAL GENERATED. No live position exist. Placing new CALL order")
-                    fivepaisa_fetch_option_data(access_token, user_key, stock, close_price, tgt, lots, "CE")
-                elif latest_Ema10 < latest_Ema20 and latest_supertrend > close_price and latest_macd < latest_macd_signal:
-                    logger_util.push_log("SELL SIGNAL GENERATED. No live position exist. Placing new PUT order")
-                    fivepaisa_fetch_option_data(access_token, user_key, stock, close_price, tgt, lots, "PE")
-                else:
-                    logger_util.push_log("NO Trade Signal Generated")
-        else:
-            if latest_Ema10 > latest_Ema20 and latest_supertrend < close_price and latest_macd > latest_macd_signal:
-                logger_util.push_log("BUY SIGNAL GENERATED. Placing new CALL order")
-                fivepaisa_fetch_option_data(access_token, user_key, stock, close_price, tgt, lots, "CE")
-            elif latest_Ema10 < latest_Ema20 and latest_supertrend > close_price and latest_macd < latest_macd_signal:
-                logger_util.push_log("SELL SIGNAL GENERATED. Placing new PUT order")
-                fivepaisa_fetch_option_data(access_token, user_key, stock, close_price, tgt, lots, "PE")
-            else:
-                logger_util.push_log("NO Trade Signal Generated")
+    rules = strategy_rules.get(strategy)
+    if rules is None:
+        logger_util.push_log(f"❌ Unknown strategy {strategy}", level="error", log_type="trading")
+        return
+    tgt = float(tgt)
+    signals = rules.latest(indicators_df)
+    strategy_rules.run(
+        rules, signals, "5paisa",
+        fetch_positions=lambda: positions_snapshot.positions("5paisa", access_token, fivepaisa_fetch_positions, user_key, access_token, client_code),
+        exit_position=lambda pos: fivepaisa_place_single_order(access_token, pos.raw['ScripCode'], user_key, pos.tradingsymbol, pos.raw['LTP'], pos.quantity, "S"),
+        enter=lambda option_type: fivepaisa_fetch_option_data(access_token, user_key, stock, signals.close, tgt, lots, option_type),
+    )
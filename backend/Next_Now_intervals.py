@@ -1,13 +1,20 @@
 import datetime
 from zoneinfo import ZoneInfo
 
-def round_to_next_interval(interval_minutes):
+from backend import clock
+from backend import market_calendar
+
+def round_to_next_interval(interval_minutes, exchange=None):
     if not str(interval_minutes).strip():
         interval_minutes = 1
     else:
         interval_minutes = int(interval_minutes)
 
-    now = datetime.datetime.now(ZoneInfo("Asia/Kolkata"))
+    # Session-aware boundaries (market hours, holidays, MCX evening) when the exchange is known
+    if exchange:
+        return market_calendar.current_interval(exchange, interval_minutes)
+
+    now = clock.now(ZoneInfo("Asia/Kolkata"))
     base = datetime.datetime.combine(now.date(), datetime.time(0, 15, tzinfo=ZoneInfo("Asia/Kolkata")))
     elapsed = (now - base).total_seconds()
 
@@ -0,0 +1,345 @@
+# backend/Paper.py
+"""
+Paper broker for load and soak tests of the trading loop.
+
+It implements the surface the loop uses from a real broker: instrument keys,
+historical and intraday candles, quotes, positions, market orders and GTT
+(OCO target) orders. Accounts live in memory and orders are matched against the
+current quote. Select it with broker key "p"; the credentials only need an
+`access_token`, which names the paper account.
+
+Prices come from recorded 1-minute candles in PAPER_DATA_DIR/{symbol}.csv or
+.parquet when present, otherwise from a random walk seeded by the symbol. Either
+series is replayed cyclically against wall-clock minutes, so every process sees
+the same candle for the same minute, at any hour of the day. Options are priced
+from the underlying: intrinsic value plus a time value of PAPER_TIME_VALUE_PCT
+of spot that fades away from the strike.
+
+PAPER_LATENCY_MS adds a delay to every call to stand in for a broker round trip
+(real-time runs only; it does not move a virtual clock).
+"""
+import datetime
+import itertools
+import os
+import threading
+import zlib
+
+import numpy as np
+import pandas as pd
+
+import backend.logger_util as logger_util
+from backend import clock
+from backend import order_pipeline
+from backend import positions_snapshot
+from backend import strategy_rules
+
+PAPER_DATA_DIR = os.getenv("PAPER_DATA_DIR", "paper_data")
+PAPER_LATENCY_MS = float(os.getenv("PAPER_LATENCY_MS", "0"))
+PAPER_HISTORY_BARS = int(os.getenv("PAPER_HISTORY_BARS", "300"))
+PAPER_SLIPPAGE_PCT = float(os.getenv("PAPER_SLIPPAGE_PCT", "0.05"))
+PAPER_TIME_VALUE_PCT = float(os.getenv("PAPER_TIME_VALUE_PCT", "1.0"))
+PAPER_LOT_SIZE = int(os.getenv("PAPER_LOT_SIZE", "1"))
+PAPER_BALANCE = float(os.getenv("PAPER_BALANCE", "1000000"))
+
+BASE_PRICES = {"NIFTY": 24000.0, "BANKNIFTY": 52000.0, "FINNIFTY": 23000.0, "MIDCPNIFTY": 12000.0}
+STRIKE_STEPS = {"NIFTY": 50, "BANKNIFTY": 100, "FINNIFTY": 50, "MIDCPNIFTY": 25}
+SYNTHETIC_MINUTES = 100_000
+
+IST = datetime.timezone(datetime.timedelta(hours=5, minutes=30))
+IST_OFFSET_MINUTES = 330
+SESSION_START_MINUTES = 9 * 60 + 15
+
+_series = {}
+_series_lock = threading.Lock()
+_accounts = {}
+_accounts_lock = threading.Lock()
+_order_ids = itertools.count(1)
+
+
+def _latency():
+    if PAPER_LATENCY_MS > 0:
+        clock.pause(PAPER_LATENCY_MS / 1000)
+
+
+# ---------- prices ----------
+def _load_series(symbol):
+    for ext in (".parquet", ".csv"):
+        path = os.path.join(PAPER_DATA_DIR, f"{symbol}{ext}")
+        if os.path.exists(path):
+            df = pd.read_parquet(path) if ext == ".parquet" else pd.read_csv(path)
+            df.columns = [str(c).strip().lower() for c in df.columns]
+            return {c: df[c].to_numpy(dtype=float) for c in ("open", "high", "low", "close")}
+    rng = np.random.default_rng(zlib.crc32(symbol.encode()))
+    close = BASE_PRICES.get(symbol, 1000.0) * np.exp(np.cumsum(rng.normal(0, 0.0004, SYNTHETIC_MINUTES)))
+    spread = close * np.abs(rng.normal(0, 0.0003, SYNTHETIC_MINUTES))
+    open_ = np.concatenate(([close[0]], close[:-1]))
+    return {
+        "open": open_,
+        "high": np.maximum(open_, close) + spread,
+        "low": np.minimum(open_, close) - spread,
+        "close": close,
+    }
+
+
+def _prices(symbol):
+    series = _series.get(symbol)
+    if series is None:
+        with _series_lock:
+            series = _series.get(symbol)
+            if series is None:
+                series = _series[symbol] = _load_series(symbol)
+    return series
+
+
+def _minute(ts=None):
+    return int((ts if ts is not None else clock.time()) // 60)
+
+
+def _parse_key(instrument_key):
+    """PAPER|NIFTY -> ("NIFTY", None, None); PAPER|NIFTY|25000|CE -> ("NIFTY", 25000, "CE")."""
+    parts = str(instrument_key).split("|")
+    if len(parts) == 4:
+        return parts[1], int(parts[2]), parts[3]
+    return parts[-1], None, None
+
+
+def _option_price(spot, strike, option_type):
+    intrinsic = max(spot - strike, 0.0) if option_type == "CE" else max(strike - spot, 0.0)
+    time_value = spot * PAPER_TIME_VALUE_PCT / 100 * max(0.0, 1 - abs(spot - strike) / (spot * 0.05))
+    return round(intrinsic + time_value, 2)
+
+
+def _ohlc(instrument_key, minutes):
+    """OHLC arrays of `instrument_key` at the given wall-clock minutes (an int array)."""
+    symbol, strike, option_type = _parse_key(instrument_key)
+    series = _prices(symbol)
+    index = minutes % len(series["close"])
+    ohlc = {name: values[index] for name, values in series.items()}
+    if strike is None:
+        return ohlc
+    price = np.vectorize(lambda s: _option_price(s, strike, option_type))
+    # Calls follow the underlying, puts move against it
+    high, low = (ohlc["high"], ohlc["low"]) if option_type == "CE" else (ohlc["low"], ohlc["high"])
+    return {"open": price(ohlc["open"]), "high": price(high), "low": price(low), "close": price(ohlc["close"])}
+
+
+def _candles(instrument_key, interval, bars, end_minute):
+    """`bars` closed candles of `interval` minutes ending before `end_minute`, datetime-indexed in IST."""
+    interval = max(int(interval), 1)
+    # Candle boundaries fall on 09:15 IST plus multiples of the interval, as in live trading
+    end = end_minute - (end_minute + IST_OFFSET_MINUTES - SESSION_START_MINUTES) % interval
+    starts = end - interval * np.arange(bars, 0, -1)
+    minutes = starts[:, None] + np.arange(interval)[None, :]
+    ohlc = _ohlc(instrument_key, minutes)
+    index = pd.to_datetime(starts * 60, unit="s", utc=True).tz_convert(IST).tz_localize(None)
+    return pd.DataFrame({
+        "open": ohlc["open"][:, 0],
+        "high": ohlc["high"].max(axis=1),
+        "low": ohlc["low"].min(axis=1),
+        "close": ohlc["close"][:, -1],
+        "volume": np.zeros(len(starts)),
+    }, index=pd.Index(index, name="datetime"))
+
+
+def paper_instrument_key(symbol):
+    _latency()
+    return f"PAPER|{symbol}"
+
+
+def paper_option_instrument(symbol, spot, option_type):
+    step = STRIKE_STEPS.get(symbol, 10)
+    strike = int(round(spot / step) * step)
+    return f"PAPER|{symbol}|{strike}|{option_type}", f"{symbol}{strike}{option_type}"
+
+
+def paper_historical_data(instrument_key, interval, bars=PAPER_HISTORY_BARS):
+    """The last `bars` closed candles, across days."""
+    _latency()
+    return _candles(instrument_key, interval, bars, _minute())
+
+
+def paper_intraday_data(instrument_key, interval):
+    """Today's closed candles; empty before 09:15."""
+    _latency()
+    now = clock.now(IST)
+    session_minutes = (now.hour * 60 + now.minute) - SESSION_START_MINUTES
+    bars = max(session_minutes // max(int(interval), 1), 0)
+    return _candles(instrument_key, interval, bars, _minute())
+
+
+def paper_quote(instrument_key):
+    """The forming 1-minute candle as an OHLC dict."""
+    _latency()
+    ohlc = _ohlc(instrument_key, np.array([_minute()]))
+    return {name: float(values[0]) for name, values in ohlc.items()}
+
+
+# ---------- accounts and matching ----------
+class _Account:
+    def __init__(self, account):
+        self.account = account
+        self.lock = threading.Lock()
+        self.cash = PAPER_BALANCE
+        self.positions = {}    # instrument_key -> position dict
+        self.orders = {}       # order_id -> order dict
+        self.triggers = {}     # order_id -> GTT target leg
+
+
+def _account(account):
+    acct = _accounts.get(account)
+    if acct is None:
+        with _accounts_lock:
+            acct = _accounts.setdefault(account, _Account(account))
+    return acct
+
+
+def _fill(acct, instrument_key, tradingsymbol, quantity, side, tag=None):
+    """Market fill at the quote with slippage; caller holds acct.lock."""
+    ltp = paper_quote(instrument_key)["close"]
+    sign = 1 if side == "BUY" else -1
+    price = round(ltp * (1 + sign * PAPER_SLIPPAGE_PCT / 100), 2)
+    pos = acct.positions.setdefault(instrument_key, {
+        "instrument_token": instrument_key, "tradingsymbol": tradingsymbol,
+        "quantity": 0, "average_price": 0.0, "realised": 0.0,
+    })
+    if side == "BUY":
+        total = pos["quantity"] + quantity
+        pos["average_price"] = round((pos["average_price"] * pos["quantity"] + price * quantity) / total, 2) if total else 0.0
+        pos["quantity"] = total
+    else:
+        quantity = min(quantity, pos["quantity"])
+        pos["realised"] = round(pos["realised"] + (price - pos["average_price"]) * quantity, 2)
+        pos["quantity"] -= quantity
+    acct.cash -= sign * price * quantity
+    order_id = f"PAPER-{next(_order_ids)}"
+    acct.orders[order_id] = {"order_id": order_id, "status": "complete", "side": side, "quantity": quantity,
+                             "price": price, "instrument_token": instrument_key, "tag": tag, "time": clock.time()}
+    return order_id
+
+
+def _match_triggers(acct):
+    """Fire GTT target legs whose price has been reached; caller holds acct.lock."""
+    for gtt_id, leg in list(acct.triggers.items()):
+        pos = acct.positions.get(leg["instrument_token"])
+        if pos is None or pos["quantity"] <= 0:
+            del acct.triggers[gtt_id]
+            continue
+        if paper_quote(leg["instrument_token"])["close"] >= leg["target"]:
+            _fill(acct, leg["instrument_token"], leg["tradingsymbol"], min(leg["quantity"], pos["quantity"]), "SELL", tag=gtt_id)
+            acct.orders[gtt_id]["status"] = "triggered"
+            del acct.triggers[gtt_id]
+
+
+def paper_fetch_positions(account):
+    """Open and closed positions of the day, after matching pending GTT legs."""
+    _latency()
+    acct = _account(account)
+    with acct.lock:
+        _match_triggers(acct)
+        result = []
+        for pos in acct.positions.values():
+            ltp = paper_quote(pos["instrument_token"])["close"]
+            result.append({**pos, "last_price": ltp,
+                           "pnl": round(pos["realised"] + (ltp - pos["average_price"]) * pos["quantity"], 2)})
+        return result
+
+
+def paper_get_balance(account):
+    _latency()
+    acct = _account(account)
+    with acct.lock:
+        return {"available_margin": round(acct.cash, 2)}
+
+
+def paper_order_status(account, order_id):
+    _latency()
+    order = _account(account).orders.get(order_id)
+    return order["status"] if order else None
+
+
+def paper_place_order(account, instrument_key, tradingsymbol, quantity, side, user_id=None):
+    """Queue a market order on the account's order lane; returns a Future."""
+    quantity = abs(int(quantity))
+    return order_pipeline.submit(
+        "paper", account, side, _paper_submit_order,
+        account, instrument_key, tradingsymbol, quantity, side,
+        instrument=instrument_key, quantity=quantity, tradingsymbol=tradingsymbol,
+        fill=quantity if side == "BUY" else -quantity,
+        confirm=lambda order_id: paper_order_status(account, order_id),
+        user_id=user_id,
+    )
+
+
+def _paper_submit_order(account, instrument_key, tradingsymbol, quantity, side, tag=None):
+    _latency()
+    acct = _account(account)
+    with acct.lock:
+        return _fill(acct, instrument_key, tradingsymbol, quantity, side, tag=tag)
+
+
+def paper_gtt_order(account, instrument_key, tradingsymbol, quantity, target, user_id=None):
+    """Buy now and sell when the option reaches `target` (OCO target leg); returns a Future."""
+    quantity = abs(int(quantity))
+    return order_pipeline.submit(
+        "paper", account, "BUY", _paper_submit_gtt,
+        account, instrument_key, tradingsymbol, quantity, target,
+        instrument=instrument_key, quantity=quantity, tradingsymbol=tradingsymbol,
+        fill=quantity, kind=order_pipeline.ENTRY,
+        confirm=lambda order_id: paper_order_status(account, order_id),
+        user_id=user_id,
+    )
+
+
+def _paper_submit_gtt(account, instrument_key, tradingsymbol, quantity, target, tag=None):
+    _latency()
+    acct = _account(account)
+    with acct.lock:
+        order_id = _fill(acct, instrument_key, tradingsymbol, quantity, "BUY", tag=tag)
+        gtt_id = f"{order_id}-GTT"
+        acct.orders[gtt_id] = {"order_id": gtt_id, "status": "active", "side": "SELL", "quantity": quantity,
+                               "price": target, "instrument_token": instrument_key, "tag": tag, "time": clock.time()}
+        acct.triggers[gtt_id] = {"instrument_token": instrument_key, "tradingsymbol": tradingsymbol,
+                                 "quantity": quantity, "target": target}
+        return order_id
+
+
+def paper_reset(account=None):
+    """Drop one paper account, or all of them."""
+    with _accounts_lock:
+        if account is None:
+            _accounts.clear()
+        else:
+            _accounts.pop(account, None)
+
+
+# ---------- strategy ----------
+def paper_fetch_option_data(user_id, account, stock, close_price, tgt, lots, option_type):
+    """Buy the nearest option with a GTT target `tgt` percent above its price; returns the target price."""
+    instrument_key, tradingsymbol = paper_option_instrument(stock, close_price, option_type)
+    entry = paper_quote(instrument_key)["close"]
+    quantity = int(lots or 1) * PAPER_LOT_SIZE
+    target_price = 0
+    tgt = float(tgt or 0)
+    if tgt:
+        target_price = round(entry * (100 + tgt) / 100, 2)
+        paper_gtt_order(account, instrument_key, tradingsymbol, quantity, target_price, user_id=user_id)
+    else:
+        paper_place_order(account, instrument_key, tradingsymbol, quantity, "BUY", user_id=user_id)
+    logger_util.push_log(f"📝 Paper {option_type} {tradingsymbol} x{quantity} at {entry}, target {target_price}", level="info", user_id=user_id, log_type="trading")
+    return target_price
+
+
+def paper_trade_conditions_check(user_id, lots, tgt, indicators_df, credentials, stock, strategy):
+    account = credentials['access_token']
+    rules = strategy_rules.get(strategy)
+    if rules is None:
+        logger_util.push_log(f"❌ Unknown strategy {strategy}", level="error", user_id=user_id, log_type="trading")
+        return
+    signals = rules.latest(indicators_df)
+    strategy_rules.run(
+        rules, signals, "paper",
+        fetch_positions=lambda: positions_snapshot.positions("paper", account, paper_fetch_positions, account),
+        exit_position=lambda pos: paper_place_order(account, pos.raw['instrument_token'], pos.tradingsymbol, pos.quantity, "SELL", user_id=user_id),
+        enter=lambda option_type: paper_fetch_option_data(user_id, account, stock, signals.close, tgt, lots, option_type),
+        user_id=user_id,
+    )
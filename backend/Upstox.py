@@ -1,5 +1,5 @@
 import sys
-import time
+import threading
 from collections import deque
 import requests
 import pandas as pd
@@ -8,8 +8,15 @@ import calendar
 import pytz
 from tabulate import tabulate
 from backend import Next_Now_intervals
+from backend import candle_readiness
+from backend import market_calendar
+from backend import broker_http
+from backend import positions_snapshot
+from backend import order_pipeline
 import backend.logger_util as logger_util
-import backend.save_to_json as stj
+from backend import strategy_state
+from backend import strategy_rules
+from backend import clock
 import re
 
 """logger = logging.getLogger(__name__)
@@ -37,7 +44,7 @@ def upstox_trade_history(access_token, segment,  start_date, end_date):
         'page_size': '100'
     }
 
-    response = requests.get(url, headers=headers, params=params)
+    response = broker_http.get(url, headers=headers, params=params)
 
     if response.status_code == 200:
         data = response.json().get('data')
@@ -61,7 +68,7 @@ def upstox_profit_loss(user_id, access_token, segment, from_date, to_date, year)
         'page_number': '1',
         'page_size': '100'
     }
-    response = requests.get(url, headers=headers, params=params)
+    response = broker_http.get(url, headers=headers, params=params)
     data = response.json().get('data', [])
 
     # --- Fetch charges breakdown ---
@@ -72,7 +79,7 @@ def upstox_profit_loss(user_id, access_token, segment, from_date, to_date, year)
         'segment': segment,
         'financial_year': year
     }
-    response = requests.get(url, headers=headers, params=params)
+    response = broker_http.get(url, headers=headers, params=params)
     data_charges = response.json().get('data', {})
 
     # ✅ Handle None or missing structure gracefully
@@ -94,58 +101,75 @@ def upstox_profit_loss(user_id, access_token, segment, from_date, to_date, year)
             rows.append([key.capitalize(), value if value is not None else 0.0])
     return data, rows
 
-def upstox_profile(user_id, access_token):
-    url = 'https://api.upstox.com/v2/user/profile'
-    headers = {
+UPSTOX_PROFILE_URL = 'https://api.upstox.com/v2/user/profile'
+UPSTOX_FUNDS_URL = 'https://api.upstox.com/v2/user/get-funds-and-margin'
+
+def _upstox_auth_headers(access_token):
+    return {
         'Accept': 'application/json',
         'Authorization': f'Bearer {access_token}'
     }
-    try:
-        response = requests.get(url, headers=headers)
-        if response.status_code == 200:
-            response_data = response.json()
-            # Extract available_margin from equity section
-            if response_data.get('status') == 'success' and 'data' in response_data:
-                #profile = response_data['data']['equity']['available_margin']
-                profile = {'User ID': response_data.get('data')['user_id'],
-                           'User Name': response_data.get('data')['user_name'],
-                           'Email':response_data.get('data')['email']}
-                return profile
-            else:
-                logger_util.push_log("⚠️ Failed to retrieve balance: Invalid response structure", user_id = user_id, level = "warning", log_type = "fastapi")
-                return None
+
+def _upstox_profile_from_response(user_id, response):
+    if response.status_code == 200:
+        response_data = response.json()
+        if response_data.get('status') == 'success' and 'data' in response_data:
+            profile = {'User ID': response_data.get('data')['user_id'],
+                       'User Name': response_data.get('data')['user_name'],
+                       'Email':response_data.get('data')['email']}
+            return profile
+        else:
+            logger_util.push_log("⚠️ Failed to retrieve balance: Invalid response structure", user_id = user_id, level = "warning", log_type = "fastapi")
+            return None
+    else:
+        logger_util.push_log(f"🚨 API Error {response.status_code}: {response.text}", user_id = user_id, level = "error", log_type = "fastapi")
+        return None
+
+def _upstox_balance_from_response(user_id, response):
+    if response.status_code == 200:
+        response_data = response.json()
+        # Extract available_margin from equity section
+        if response_data.get('status') == 'success' and 'data' in response_data:
+            total_balance = response_data['data']['equity']['available_margin'] + response_data['data']['equity']['used_margin']
+            balance = {"Total Balance":total_balance, "Available Margin":response_data['data']['equity']['available_margin'],"Used Margin":response_data['data']['equity']['used_margin']}
+            return balance
         else:
-            logger_util.push_log(f"🚨 API Error {response.status_code}: {response.text}", user_id = user_id, level = "error", log_type = "fastapi")
+            logger_util.push_log("⚠️ Failed to retrieve balance: Invalid response structure", user_id = user_id, level = "error", log_type = "fastapi")
             return None
+    else:
+        logger_util.push_log(f"🚨 API Error {response.status_code}: {response.text}", user_id = user_id, level = "warning", log_type = "fastapi")
+        return None
+
+def upstox_profile(user_id, access_token):
+    try:
+        response = broker_http.get(UPSTOX_PROFILE_URL, headers=_upstox_auth_headers(access_token))
+        return _upstox_profile_from_response(user_id, response)
     except Exception as e:
         logger_util.push_log(f"🚨 Exception in profile function: {e}", user_id = user_id, level = "error", log_type = "fastapi")
     return None
 
 def upstox_balance(user_id, access_token):
-    url = 'https://api.upstox.com/v2/user/get-funds-and-margin'
-    headers = {
-        'Accept': 'application/json',
-        'Authorization': f'Bearer {access_token}'
-    }
+    try:
+        response = broker_http.get(UPSTOX_FUNDS_URL, headers=_upstox_auth_headers(access_token))
+        return _upstox_balance_from_response(user_id, response)
+    except Exception as e:
+        logger_util.push_log(f"🚨 Exception in balance function: {e}", user_id = user_id, level = "error", log_type = "fastapi")
+        return None
 
+async def upstox_profile_async(user_id, access_token):
+    """Async upstox_profile for the FastAPI endpoints."""
     try:
-        response = requests.get(url, headers=headers)
-        #logger_util.push_log(f"Status Code: {response.status_code}")
+        response = await broker_http.aget(UPSTOX_PROFILE_URL, headers=_upstox_auth_headers(access_token))
+        return _upstox_profile_from_response(user_id, response)
+    except Exception as e:
+        logger_util.push_log(f"🚨 Exception in profile function: {e}", user_id = user_id, level = "error", log_type = "fastapi")
+    return None
 
-        if response.status_code == 200:
-            response_data = response.json()
-            # Extract available_margin from equity section
-            if response_data.get('status') == 'success' and 'data' in response_data:
-                #logger_util.push_log(response_data['data']['equity'])
-                total_balance = response_data['data']['equity']['available_margin'] + response_data['data']['equity']['used_margin']
-                balance = {"Total Balance":total_balance, "Available Margin":response_data['data']['equity']['available_margin'],"Used Margin":response_data['data']['equity']['used_margin']}
-                return balance
-            else:
-                logger_util.push_log("⚠️ Failed to retrieve balance: Invalid response structure", user_id = user_id, level = "error", log_type = "fastapi")
-                return None
-        else:
-            logger_util.push_log(f"🚨 API Error {response.status_code}: {response.text}", user_id = user_id, level = "warning", log_type = "fastapi")
-            return None
+async def upstox_balance_async(user_id, access_token):
+    """Async upstox_balance for the FastAPI endpoints."""
+    try:
+        response = await broker_http.aget(UPSTOX_FUNDS_URL, headers=_upstox_auth_headers(access_token))
+        return _upstox_balance_from_response(user_id, response)
     except Exception as e:
         logger_util.push_log(f"🚨 Exception in balance function: {e}", user_id = user_id, level = "error", log_type = "fastapi")
         return None
@@ -178,15 +202,16 @@ def upstox_equity_instrument_key(user_id, name):
         logger_util.push_log(f"❌ No matching instrument found for {name}", user_id = user_id, level = "error", log_type = "trading")
         return
 
-def upstox_fetch_historical_data_with_retry(user_id, access_token, instrument_key, interval):
-    """Fetches historical 30-minute OHLC data, retrying for previous days."""
-    today = datetime.date.today()
+def upstox_fetch_historical_data_with_retry(user_id, access_token, instrument_key, interval, exchange="NSE"):
+    """Fetches enough closed-session history for the indicators, sized in trading bars."""
+    today = clock.today()
     end_date = (today - datetime.timedelta(days=1)).strftime('%Y-%m-%d')
-    if interval == "1" or interval == "5" or interval == "15":
+    # Upstox allows one month of minute candles up to 15 minutes, one quarter above that
+    if str(interval) in ("1", "5", "15"):
         candle_days = 30
     else:
         candle_days = 90
-    start = today - datetime.timedelta(candle_days)
+    start = market_calendar.history_start_date(exchange, interval, end_date=end_date, max_calendar_days=candle_days)
     start_date = start.strftime('%Y-%m-%d')
     
     url = f"https://api.upstox.com/v3/historical-candle/{instrument_key}/minutes/{interval}/{end_date}/{start_date}"
@@ -195,7 +220,7 @@ def upstox_fetch_historical_data_with_retry(user_id, access_token, instrument_ke
         'Authorization': f'Bearer {access_token}'
     }
 
-    response = requests.get(url, headers=headers)
+    response = broker_http.get(url, headers=headers)
 
     if response.status_code == 200:
         data = response.json().get('data', {})
@@ -218,54 +243,49 @@ def upstox_fetch_historical_data_with_retry(user_id, access_token, instrument_ke
     else:
         logger_util.push_log(f"❌ Failed to fetch data for {start_date}. HTTP {response.status_code} and {response.json()}. Retrying...", user_id = user_id, level = "error", log_type = "trading")
 
-    logger_util.push_log(f"❗Could not fetch historical data for {instrument_key} from 25 days.", user_id = user_id, level = "error", log_type = "trading")
+    logger_util.push_log(f"❗Could not fetch historical data for {instrument_key} from {start_date}.", user_id = user_id, level = "error", log_type = "trading")
     return pd.DataFrame()
 
-def upstox_fetch_intraday_data(user_id, access_token, instrument_key, interval):
-    now_interval, next_interval = Next_Now_intervals.round_to_next_interval(interval)
+def upstox_fetch_intraday_data(user_id, access_token, instrument_key, interval, exchange="NSE", wait=True):
+    """
+    Today's completed candles. With wait=False it returns what is published now
+    instead of waiting for the latest closed candle (for bars that closed long ago).
+    """
+    now_interval, next_interval = Next_Now_intervals.round_to_next_interval(interval, exchange)
     url = f"https://api.upstox.com/v3/historical-candle/intraday/{instrument_key}/minutes/{interval}"
     headers = {
         'Accept': 'application/json',
         'Authorization': f'Bearer {access_token}'
     }
 
-    max_wait_seconds = 30
-    sleep_interval = 5
-    waited = 0
+    # The candle starting at now_interval is still forming; the one before it is the candle we wait for
+    forming_start = pd.Timestamp(now_interval)
+    closed_start = pd.Timestamp(market_calendar.closed_bar_start(exchange, interval, now_interval))
+    candle_close = forming_start.tz_localize("Asia/Kolkata").timestamp()
 
-    while waited <= max_wait_seconds:
-        try:
-            response = requests.get(url, headers=headers)
-            if response.status_code == 200:
-                candles = response.json().get('data', {}).get('candles', [])
-                if candles:
-                    df = pd.DataFrame(candles, columns=['datetime', 'open', 'high', 'low', 'close', 'volume', 'oi'])
-                    df['datetime'] = pd.to_datetime(df['datetime']).dt.tz_localize(None)
-                    df.sort_values('datetime', inplace=True)
-                    df.set_index('datetime', inplace=True)
-                    df.drop(['volume', 'oi'], axis=1, inplace=True)
-
-                    if df.index[-1] == now_interval:
-                        completed_df = df[:-1]
-                    # Filter to return only fully completed candles
-                    completed_df = df[df.index.map(lambda x: x.second == 0 and x.microsecond == 0)]
-
-                    if not completed_df.empty:
-                        return completed_df
-                    else:
-                        logger_util.push_log(f"⏳ Waiting for complete candle data... Retry in {sleep_interval}s", user_id = user_id, level = "info", log_type = "trading")
-                else:
-                    logger_util.push_log("⚠️ No candle data found in response.", user_id = user_id, level = "warning", log_type = "trading")
-            else:
-                logger_util.push_log(f"🚨 API Error {response.status_code}: {response.text}", user_id = user_id, level = "error", log_type = "trading")
-        except Exception as e:
-            logger_util.push_log(f"🚨 Exception in fetch_intraday_data: {e}", user_id = user_id, level = "error", log_type = "trading")
+    def fetch_completed():
+        response = broker_http.get(url, headers=headers)
+        if response.status_code != 200:
+            logger_util.push_log(f"🚨 API Error {response.status_code}: {response.text}", user_id = user_id, level = "error", log_type = "trading")
+            return None
+        candles = response.json().get('data', {}).get('candles', [])
+        if not candles:
+            logger_util.push_log("⚠️ No candle data found in response.", user_id = user_id, level = "warning", log_type = "trading")
+            return None
+        df = pd.DataFrame(candles, columns=['datetime', 'open', 'high', 'low', 'close', 'volume', 'oi'])
+        df['datetime'] = pd.to_datetime(df['datetime']).dt.tz_localize(None)
+        df.sort_values('datetime', inplace=True)
+        df.set_index('datetime', inplace=True)
+        df.drop(['volume', 'oi'], axis=1, inplace=True)
+        # Only fully completed candles
+        return df[df.index < forming_start]
 
-        time.sleep(sleep_interval)
-        waited += sleep_interval
+    def is_ready(completed_df):
+        return completed_df is not None and not completed_df.empty and completed_df.index[-1] >= closed_start
 
-    logger_util.push_log("❌ Failed to fetch complete candle data within 30 seconds.", user_id = user_id, level = "error", log_type = "trading")
-    return None
+    if not wait:
+        return fetch_completed()
+    return candle_readiness.readiness.wait_for(fetch_completed, is_ready, instrument_key, interval, candle_close, user_id=user_id)
 
 def upstox_fetch_positions(user_id, access_token):
     """Fetch current open positions from Upstox API."""
@@ -274,7 +294,7 @@ def upstox_fetch_positions(user_id, access_token):
         'Accept': 'application/json',
         'Authorization': f'Bearer {access_token}'
     }
-    response = requests.get(url, headers=headers)
+    response = broker_http.get(url, headers=headers)
     if response.status_code == 200:
         positions = response.json().get('data', [])
         return positions
@@ -297,7 +317,7 @@ def upstox_ohlc_data_fetch(user_id, access_token, instrument_key):
 
     for attempt in range(1, retries + 1):
         try:
-            response = requests.get(url, headers=headers, params=params)
+            response = broker_http.get(url, headers=headers, params=params)
             data_json = response.json()
             if response.status_code == 200:
                 try:
@@ -323,13 +343,76 @@ def upstox_ohlc_data_fetch(user_id, access_token, instrument_key):
                     logger_util.push_log(f"OHLC KeyError in response: {e}", user_id = user_id, level = "error", log_type = "trading")
                     return None
             else:
+                # 429s were already paused and retried by the rate limiter in broker_http
                 logger_util.push_log(f"OHLC Error:, {response.status_code}, {response.text}", user_id = user_id, level = "error", log_type = "trading")
-                time.sleep(2)
                 return None
         except requests.exceptions.RequestException as e:
             logger_util.push_log(f"🔌 OHLC Network error (attempt {attempt}/{retries}): {e}", user_id = user_id, level = "error", log_type = "trading")
 
-        time.sleep(1)
+        clock.sleep(1)
+
+# Upstox market-quote endpoints accept at most 500 comma-separated instrument keys per call
+UPSTOX_QUOTE_BATCH_LIMIT = 500
+
+def _upstox_prev_candle(quote):
+    """Convert one market-quote entry into the candle dict returned by upstox_ohlc_data_fetch."""
+    prev = quote['prev_ohlc']
+    ist = pytz.timezone("Asia/Kolkata")
+    return {
+        "datetime": datetime.datetime.fromtimestamp(prev['ts'] / 1000, tz=ist),
+        "open": prev['open'],
+        "high": prev['high'],
+        "low": prev['low'],
+        "close": prev['close'],
+        "last_price": quote.get('last_price'),
+    }
+
+def upstox_ohlc_batch_fetch(user_id, access_token, instrument_keys, interval="I1"):
+    """
+    Fetch the last completed OHLC candle for many instruments in as few calls as possible.
+
+    Keys are de-duplicated and sent in chunks of UPSTOX_QUOTE_BATCH_LIMIT. Returns a dict
+    keyed by instrument_key; instruments the broker did not return are simply absent.
+    """
+    keys = list(dict.fromkeys(k for k in instrument_keys if k))
+    quotes = {}
+    if not keys:
+        return quotes
+
+    url = 'https://api.upstox.com/v3/market-quote/ohlc'
+    headers = {
+        'Accept': 'application/json',
+        'Authorization': f'Bearer {access_token}',
+    }
+    retries = 3
+
+    for start in range(0, len(keys), UPSTOX_QUOTE_BATCH_LIMIT):
+        chunk = keys[start:start + UPSTOX_QUOTE_BATCH_LIMIT]
+        params = {
+            "instrument_key": ",".join(chunk),
+            "interval": interval
+        }
+        for attempt in range(1, retries + 1):
+            try:
+                response = broker_http.get(url, headers=headers, params=params)
+                if response.status_code == 200:
+                    # Response is keyed by "EXCHANGE:SYMBOL"; map back through instrument_token
+                    for quote in (response.json().get("data") or {}).values():
+                        key = quote.get("instrument_token")
+                        try:
+                            quotes[key] = _upstox_prev_candle(quote)
+                        except (KeyError, TypeError) as e:
+                            logger_util.push_log(f"OHLC KeyError in batch response for {key}: {e}", user_id = user_id, level = "error", log_type = "trading")
+                    break
+                logger_util.push_log(f"OHLC batch Error:, {response.status_code}, {response.text}", user_id = user_id, level = "error", log_type = "trading")
+            except requests.exceptions.RequestException as e:
+                logger_util.push_log(f"🔌 OHLC batch network error (attempt {attempt}/{retries}): {e}", user_id = user_id, level = "error", log_type = "trading")
+            clock.sleep(1)
+
+    missing = len(keys) - len(quotes)
+    if missing:
+        logger_util.push_log(f"⚠️ OHLC batch returned {len(quotes)}/{len(keys)} instruments", user_id = user_id, level = "warning", log_type = "trading")
+    return quotes
 
 def upstox_live_option_Value(access_token, instrument_key):
     url = 'https://api.upstox.com/v3/market-quote/ohlc'
@@ -343,7 +426,7 @@ def upstox_live_option_Value(access_token, instrument_key):
         "interval": "1d"
     }
 
-    response = requests.get(url, headers=headers, params=data)
+    response = broker_http.get(url, headers=headers, params=data)
 
     if response.status_code == 200:
         json_data = response.json()
@@ -390,9 +473,10 @@ def upstox_close_position(credentials, pos):
 
     try:
         # Send the POST request
-        response = requests.post(url, json=data, headers=headers)
+        response = broker_http.post(url, json=data, headers=headers)
 
         if response.status_code == 200:
+            positions_snapshot.record_fill("upstox", access_token, instrument_token, -quantity, pos.get('tradingsymbol'))
             logger_util.push_log("Position closed successfully")
         else:
             logger_util.push_log(f"Order placed not successful. The response code is : {response.status_code}", "warning")
@@ -400,9 +484,20 @@ def upstox_close_position(credentials, pos):
         # Handle exceptions
         logger_util.push_log(f'Error: {str(e)}', "error")
 
-def upstox_place_order_single(user_id, access_token, instrument_token, quantity, transaction_type,price):
-
+def upstox_place_order_single(user_id, access_token, instrument_token, quantity, transaction_type,price, tradingsymbol=None):
+    """Queue a market order on the account's order lane (exits go before entries); returns a Future."""
     quantity = abs(quantity)
+    return order_pipeline.submit(
+        "upstox", access_token, transaction_type, _upstox_submit_order_single,
+        user_id, access_token, instrument_token, quantity, transaction_type, price,
+        instrument=instrument_token, quantity=quantity, tradingsymbol=tradingsymbol,
+        fill=quantity if transaction_type == "BUY" else -quantity,
+        confirm=lambda order_id: upstox_order_status(access_token, order_id),
+        user_id=user_id,
+    )
+
+def _upstox_submit_order_single(user_id, access_token, instrument_token, quantity, transaction_type, price, tag=None):
+    """Send the order now; returns the Upstox order id or None."""
     price = 0
 
     url = 'https://api-hft.upstox.com/v3/order/place'
@@ -417,7 +512,7 @@ def upstox_place_order_single(user_id, access_token, instrument_token, quantity,
         'product': 'D',
         'validity': 'DAY',
         'price': price,
-        'tag': 'string',
+        'tag': tag or 'string',
         'instrument_token': instrument_token,
         'order_type': "MARKET",
         'transaction_type': transaction_type,
@@ -429,13 +524,16 @@ def upstox_place_order_single(user_id, access_token, instrument_token, quantity,
 
     try:
         # Send the POST request
-        response = requests.post(url, json=data, headers=headers)
+        response = broker_http.post(url, json=data, headers=headers)
 
         if response.status_code == 200:
             if transaction_type == "BUY":
                 logger_util.push_log("order placed successfully")
             elif transaction_type == "SELL":
                 logger_util.push_log("Old option position closed successfully")
+            data = response.json().get('data') or {}
+            order_ids = data.get('order_ids') or [data.get('order_id')]
+            return order_ids[0]
         else:
             logger_util.push_log(f"Order placed not successful. The response code is : {response.status_code}",user_id = user_id, level = "warning", log_type = "trading")
 
@@ -443,6 +541,15 @@ def upstox_place_order_single(user_id, access_token, instrument_token, quantity,
     except Exception as e:
         # Handle exceptions
         logger_util.push_log(f'Error: {str(e)}', user_id = user_id, level = "error", log_type = "trading")
+    return None
+
+def upstox_order_status(access_token, order_id):
+    """Latest status of an order ("complete", "rejected", "open", ...)."""
+    response = broker_http.get("https://api.upstox.com/v2/order/details",
+                               headers=_upstox_auth_headers(access_token), params={"order_id": order_id})
+    if response.status_code != 200:
+        return None
+    return (response.json().get('data') or {}).get('status')
 
 def upstox_gtt_place_order(user_id, access_token, instrument_key, quantity, transaction_type, entry,tgt):
     try:
@@ -477,7 +584,7 @@ def upstox_gtt_place_order(user_id, access_token, instrument_key, quantity, tran
                 "trigger_type": "IMMEDIATE",
                 "trigger_price": tgt
             })
-        res = requests.post(url, headers=headers, json=payload)
+        res = broker_http.post(url, headers=headers, json=payload)
         if res.status_code == 200:
             logger_util.push_log("✅ GTT order placed successfully.", user_id =user_id, level = "info", log_type = "trading")
             return res.status_code
@@ -498,8 +605,8 @@ def upstox_equity_option_instrument_key( user_id, stock,symbol, spot_value, opti
     else:
         instrument_type = "OPTSTK"
 
-    today = datetime.datetime.now().date()
-    now_time = datetime.datetime.now().time()
+    now = clock.now()
+    today, now_time = now.date(), now.time()
 
     # Convert expiry column
     instruments['expiry'] = pd.to_datetime(instruments['expiry'], errors='coerce').dt.date
@@ -611,7 +718,35 @@ def upstox_commodity_option_instrument_key(user_id, name, symbol, close_price, o
     logger_util.push_log(tabulate(nearest_rows, headers="keys", tablefmt= "pretty"), user_id = user_id, level = "info", log_type = "trading")
     return nearest_rows
 
-def upstox_fetch_option_data(user_id ,upstox_access_token,stock, symbol, exchange_type,spot_value, tgt,lots, option_type):
+# Resolved option entries: {(candle, stock, symbol, exchange_type, spot, tgt, lots, option_type): entry}
+_option_entries = {}
+_option_entries_lock = threading.Lock()
+OPTION_ENTRIES_MAX = 1024
+
+
+def upstox_option_entry(user_id ,upstox_access_token,stock, symbol, exchange_type,spot_value, tgt,lots, option_type):
+    """
+    Contract, quantity, entry and target price for an option entry, or None.
+    Cached for the candle, so the trading loop can resolve it before taking the
+    account lock and the trade check only does the positions check and the order.
+    """
+    candle = order_pipeline.current_cycle()
+    key = (candle, stock, symbol, exchange_type, float(spot_value), str(tgt), str(lots), option_type)
+    with _option_entries_lock:
+        if candle is not None and key in _option_entries:
+            return _option_entries[key]
+    entry = _resolve_option_entry(user_id, upstox_access_token, stock, symbol, exchange_type, spot_value, tgt, lots, option_type)
+    if candle is not None:
+        with _option_entries_lock:
+            if len(_option_entries) >= OPTION_ENTRIES_MAX:
+                # Keep only the entries of the candle being traded
+                for stale in [k for k in _option_entries if k[0] != candle]:
+                    del _option_entries[stale]
+            _option_entries[key] = entry
+    return entry
+
+
+def _resolve_option_entry(user_id ,upstox_access_token,stock, symbol, exchange_type,spot_value, tgt,lots, option_type):
     # Fetch instruments
     if exchange_type == "EQUITY":
         nearest_option = upstox_equity_option_instrument_key( user_id, stock,symbol, spot_value, option_type)
@@ -621,6 +756,7 @@ def upstox_fetch_option_data(user_id ,upstox_access_token,stock, symbol, exchang
     # Calculate total quantity (lots × lot size)
     lot_size = nearest_option.iloc[0]['lot_size']
     instrument_key = nearest_option.iloc[0]['instrument_key']
+    option_symbol = nearest_option.iloc[0].get('tradingsymbol')
     strike = nearest_option.iloc[0]['strike']
     option_tick_size = nearest_option.iloc[0]['tick_size']
 
@@ -632,7 +768,7 @@ def upstox_fetch_option_data(user_id ,upstox_access_token,stock, symbol, exchang
 
     if option_intraday_data is None or option_intraday_data.empty or len(option_intraday_data) < 1:
         logger_util.push_log("⚠️ Insufficient intraday data for option (need at least 1 candles).", user_id = user_id, level = "warning", log_type = "trading")
-        return
+        return None
 
     # Process only the last two candles
     latest_candle = option_intraday_data.iloc[-1]
@@ -663,7 +799,18 @@ def upstox_fetch_option_data(user_id ,upstox_access_token,stock, symbol, exchang
     elif exchange_type == "COMMODITY":
         quantity = lots
 
-    positions = upstox_fetch_positions(user_id, upstox_access_token)
+    return {"instrument_key": instrument_key, "tradingsymbol": option_symbol, "quantity": quantity,
+            "buy_price": buy_price, "target_price": target_price}
+
+
+def upstox_fetch_option_data(user_id ,upstox_access_token,stock, symbol, exchange_type,spot_value, tgt,lots, option_type):
+    entry = upstox_option_entry(user_id, upstox_access_token, stock, symbol, exchange_type, spot_value, tgt, lots, option_type)
+    if entry is None:
+        return
+    instrument_key, option_symbol, quantity = entry["instrument_key"], entry["tradingsymbol"], entry["quantity"]
+    buy_price, target_price = entry["buy_price"], entry["target_price"]
+
+    positions = positions_snapshot.positions("upstox", upstox_access_token, upstox_fetch_positions, user_id, upstox_access_token)
     if positions:
         count = 0
         for pos in positions:
@@ -675,9 +822,9 @@ def upstox_fetch_option_data(user_id ,upstox_access_token,stock, symbol, exchang
                 logger_util.push_log(f"You have live position for the Trading symbol  {symbol}, Skipping the {option_type}Order placing", user_id = user_id, level = "info", log_type = "trading")
                 count += 1
         if count == 0:
-            upstox_place_order_single(user_id, upstox_access_token, instrument_key, quantity, "BUY", buy_price)
+            upstox_place_order_single(user_id, upstox_access_token, instrument_key, quantity, "BUY", buy_price, option_symbol)
     else:
-        upstox_place_order_single(user_id, upstox_access_token, instrument_key, quantity, "BUY", buy_price)
+        upstox_place_order_single(user_id, upstox_access_token, instrument_key, quantity, "BUY", buy_price, option_symbol)
 
     return target_price
 
@@ -697,7 +844,7 @@ def upstox_commodity_instrument_key(user_id, name, symbol):
         logger_util.push_log(f"❌ No FUTCOM contracts found for {name}", user_id = user_id, level = "warning", log_type = "trading")
         return pd.DataFrame()
 
-    today = datetime.datetime.now().date()
+    today = clock.today()
 
     # Function to generate FUTCOM tradingsymbol like GOLDM25OCTFUT
     def make_symbol(y, m):
@@ -751,426 +898,66 @@ def upstox_commodity_instrument_key(user_id, name, symbol):
 
     return matched
 
-def upstox_trade_conditions_check(user_id, lots, tgt, indicators_df5, credentials, stock,symbol, exchange_type,strategy):
-    target_price = stj.load_variable_from_json(user_id, symbol, "target_price")
-    trade_count = stj.load_variable_from_json(user_id, symbol, "trade_count")
+def upstox_prepare_entry(user_id, lots, tgt, indicators_df5, credentials, stock, symbol, exchange_type, strategy):
+    """Resolve the option contract the candle's signal would enter, outside the account lock."""
+    rules = strategy_rules.get(strategy)
+    if rules is None:
+        return
+    signals = rules.latest(indicators_df5)
+    option_type = "CE" if signals.long else "PE" if signals.short else None
+    if option_type:
+        upstox_option_entry(user_id, credentials['access_token'], stock, symbol, exchange_type, signals.close, float(tgt), lots, option_type)
+
+
+def upstox_trade_conditions_check(user_id, lots, tgt, indicators_df5, credentials, stock,symbol, exchange_type,strategy, quotes=None):
+    rules = strategy_rules.get(strategy)
+    if rules is None:
+        logger_util.push_log(f"❌ Unknown strategy {strategy}", user_id=user_id, level="error", log_type="trading")
+        return
+    state = strategy_state.load(user_id, symbol)
+    target_price = state["target_price"]
+    trade_count = state["trade_count"]
     tgt = float(tgt)
     upstox_access_token = credentials['access_token']
+    signals = rules.latest(indicators_df5)
+
+    def fetch():
+        return positions_snapshot.positions("upstox", upstox_access_token, upstox_fetch_positions, user_id, upstox_access_token)
+
+    def exit_position(pos):
+        upstox_place_order_single(user_id, upstox_access_token, pos.raw['instrument_token'], pos.quantity, "SELL", signals.close, tradingsymbol=pos.tradingsymbol)
+
+    def enter(option_type):
+        return upstox_fetch_option_data(user_id, upstox_access_token, stock, symbol, exchange_type, signals.close, tgt, lots, option_type)
+
+    # Target exits on this symbol's positions
     positions_count = 0
-    positions11 = upstox_fetch_positions(user_id, upstox_access_token)
-    if positions11:
-        for pos in positions11:
-            quantity = pos['quantity']
-            if quantity > 0:
-                instrument_token = pos['instrument_token']
-                tradingsymbol = pos['tradingsymbol']
-                option_type = tradingsymbol[-2:]
-                match = re.match(r'^([A-Z]+)', tradingsymbol)
-                if match:
-                    stock_name = match.group(1)
-                else:
-                    stock_name = None
-                latest_option_data = upstox_ohlc_data_fetch(user_id, upstox_access_token, instrument_token)
-                latest_option_close = float(latest_option_data["close"])
-                saved_target_price = stj.load_variable_from_json(user_id, symbol, "target_price")
-                if stock_name == symbol:
-                    positions_count += 1
-                if latest_option_close > saved_target_price and saved_target_price != 0 and stock_name == symbol:
-                    upstox_place_order_single(user_id, upstox_access_token, instrument_token, quantity, "SELL",saved_target_price)
-                    positions_count = 0
+    for pos in strategy_rules.open_positions("upstox", fetch()):
+        if positions_snapshot.underlying_of(pos.tradingsymbol) != symbol:
+            continue
+        positions_count += 1
+        instrument_token = pos.raw['instrument_token']
+        # Prefer the cycle's batched quotes; fall back to a single fetch for contracts not in the batch
+        latest_option_data = (quotes or {}).get(instrument_token) or upstox_ohlc_data_fetch(user_id, upstox_access_token, instrument_token)
+        if target_price != 0 and float(latest_option_data["close"]) > target_price:
+            upstox_place_order_single(user_id, upstox_access_token, instrument_token, pos.quantity, "SELL", target_price, tradingsymbol=pos.tradingsymbol)
+            positions_count = 0
     if positions_count == 0:
         logger_util.push_log(f"There is no existing positions from Upstox for the symbol {symbol}", user_id=user_id, level="info", log_type="trading")
+
     if trade_count == 0 and positions_count == 0:
-        indic_candle1 = indicators_df5.iloc[-1]
-        indic_candle2 = indicators_df5.iloc[-2]
-        indic_candle3 = indicators_df5.iloc[-3]
-        indic_candle4 = indicators_df5.iloc[-4]
-        if strategy == "ADX_MACD_WillR_Supertrend":
-            # ✅ Check for signal
-            candle1_latest_adx = indic_candle1["ADX"]
-            candle1_latest_adxema = indic_candle1['ADX_EMA21']
-            candle1_latest_willr = indic_candle1['WillR_14']
-            candle1_latest_supertrend = indic_candle1['Supertrend']
-            candle1_latest_macd = indic_candle1['MACD']
-            candle1_latest_macd_signal = indic_candle1['MACD_signal']
-            candle1_close_price = float(indic_candle1['close'])
-            candle2_latest_adx = indic_candle2["ADX"]
-            candle2_latest_adxema = indic_candle2['ADX_EMA21']
-            candle2_latest_willr = indic_candle2['WillR_14']
-            candle2_latest_supertrend = indic_candle2['Supertrend']
-            candle2_latest_macd = indic_candle2['MACD']
-            candle2_latest_macd_signal = indic_candle2['MACD_signal']
-            candle2_close_price = float(indic_candle2['close'])
-            candle3_latest_adx = indic_candle3["ADX"]
-            candle3_latest_adxema = indic_candle3['ADX_EMA21']
-            candle3_latest_willr = indic_candle3['WillR_14']
-            candle3_latest_supertrend = indic_candle3['Supertrend']
-            candle3_latest_macd = indic_candle3['MACD']
-            candle3_latest_macd_signal = indic_candle3['MACD_signal']
-            candle3_close_price = float(indic_candle3['close'])
-            candle4_latest_adx = indic_candle4["ADX"]
-            candle4_latest_adxema = indic_candle4['ADX_EMA21']
-            candle4_latest_willr = indic_candle4['WillR_14']
-            candle4_latest_supertrend = indic_candle4['Supertrend']
-            candle4_latest_macd = indic_candle4['MACD']
-            candle4_latest_macd_signal = indic_candle4['MACD_signal']
-            candle4_close_price = float(indic_candle4['close'])
-
-            if candle1_latest_adx > candle1_latest_adxema and candle1_latest_willr > -30 and candle1_latest_supertrend < candle1_close_price and candle1_latest_macd > candle1_latest_macd_signal:
-                logger_util.push_log(f"BUY SIGNAL GENERATED", user_id=user_id, level="signal_buy", log_type="trading")
-                if candle2_latest_adx < candle2_latest_adxema or candle2_latest_willr < -30 or candle2_latest_supertrend > candle2_close_price or candle2_latest_macd < candle2_latest_macd_signal:
-                    target_price = upstox_fetch_option_data(user_id, upstox_access_token, stock, symbol, exchange_type,candle1_close_price,tgt, lots, "CE")
-                    trade_count = 1
-                    stj.save_variable_to_json(trade_count, user_id, symbol, "trade_count")
-                elif candle3_latest_adx < candle3_latest_adxema or candle3_latest_willr < -30 or candle3_latest_supertrend > candle3_close_price or candle3_latest_macd < candle3_latest_macd_signal:
-                    target_price = upstox_fetch_option_data(user_id, upstox_access_token, stock, symbol, exchange_type,candle1_close_price,tgt, lots, "CE")
-                    trade_count = 1
-                    stj.save_variable_to_json(trade_count, user_id, symbol, "trade_count")
-                elif candle4_latest_adx < candle4_latest_adxema or candle4_latest_willr < -30 or candle4_latest_supertrend > candle4_close_price or candle4_latest_macd < candle4_latest_macd_signal:
-                    target_price = upstox_fetch_option_data(user_id, upstox_access_token, stock, symbol, exchange_type,candle1_close_price,tgt, lots, "CE")
-                    trade_count = 1
-                    stj.save_variable_to_json(trade_count, user_id, symbol, "trade_count")
-                else:
-                    logger_util.push_log("The Trade initiated after the Signal Generated and Signal Generated before 4 Intervals", user_id=user_id, level="info", log_type="trading")
-            elif candle1_latest_adx > candle1_latest_adxema and candle1_latest_willr < -70 and candle1_latest_supertrend > candle1_close_price and candle1_latest_macd < candle1_latest_macd_signal:
-                logger_util.push_log("🔽 SELL SIGNAL GENERATED", user_id=user_id, level="signal_sell", log_type="trading")
-                if candle2_latest_adx > candle2_latest_adxema or candle2_latest_willr > -70 or candle2_latest_supertrend < candle2_close_price or candle2_latest_macd > candle2_latest_macd_signal:
-                    target_price = upstox_fetch_option_data(user_id, upstox_access_token, stock, symbol, exchange_type,candle1_close_price,tgt, lots, "PE")
-                    trade_count = 1
-                    stj.save_variable_to_json(trade_count, user_id, symbol, "trade_count")
-                elif candle3_latest_adx > candle3_latest_adxema or candle3_latest_willr > -70 or candle3_latest_supertrend < candle3_close_price or candle3_latest_macd > candle3_latest_macd_signal:
-                    target_price = upstox_fetch_option_data(user_id, upstox_access_token, stock, symbol, exchange_type,candle1_close_price,tgt, lots, "PE")
-                    trade_count = 1
-                    stj.save_variable_to_json(trade_count, user_id, symbol, "trade_count")
-                elif candle4_latest_adx > candle4_latest_adxema or candle4_latest_willr > -70 or candle4_latest_supertrend < candle4_close_price or candle4_latest_macd > candle4_latest_macd_signal:
-                    target_price = upstox_fetch_option_data(user_id, upstox_access_token, stock, symbol, exchange_type,candle1_close_price,tgt, lots, "PE")
-                    trade_count = 1
-                    stj.save_variable_to_json(trade_count, user_id, symbol, "trade_count")
-                else:
-                    logger_util.push_log("The Trade initiated after the Signal Generated and Signal Generated before 4 Intervals", user_id=user_id, level="info", log_type="trading")
-            else:
-                logger_util.push_log("NO TRADE SIGNAL GENERATED", user_id=user_id, level="signal_none", log_type="trading")
-
-        elif strategy == "Ema10_Ema20_Supertrend":
-            # ✅ Check for signal
-            candle1_latest_Ema10 = indic_candle1["ema10"]
-            candle1_latest_Ema20 = indic_candle1['ema20']
-            candle1_latest_supertrend = indic_candle1['Supertrend']
-            candle1_close_price = float(indic_candle1['close'])
-            candle2_latest_Ema10 = indic_candle2["ema10"]
-            candle2_latest_Ema20 = indic_candle2['ema20']
-            candle2_latest_supertrend = indic_candle2['Supertrend']
-            candle2_close_price = float(indic_candle2['close'])
-            candle3_latest_Ema10 = indic_candle3["ema10"]
-            candle3_latest_Ema20 = indic_candle3['ema20']
-            candle3_latest_supertrend = indic_candle3['Supertrend']
-            candle3_close_price = float(indic_candle3['close'])
-            candle4_latest_Ema10 = indic_candle4["ema10"]
-            candle4_latest_Ema20 = indic_candle4['ema20']
-            candle4_latest_supertrend = indic_candle4['Supertrend']
-            candle4_close_price = float(indic_candle4['close'])
-
-            if candle1_latest_Ema10 > candle1_latest_Ema20 and candle1_latest_supertrend < candle1_close_price:
-                logger_util.push_log(f"BUY SIGNAL GENERATED", user_id=user_id, level="signal_buy", log_type="trading")
-                if candle2_latest_Ema10 < candle2_latest_Ema20 or candle2_latest_supertrend > candle2_close_price:
-                    target_price = upstox_fetch_option_data(user_id, upstox_access_token, stock, symbol, exchange_type,candle1_close_price, tgt, lots, "CE")
-                    trade_count = 1
-                    stj.save_variable_to_json(trade_count, user_id, symbol, "trade_count")
-                elif candle3_latest_Ema10 < candle3_latest_Ema20 or candle3_latest_supertrend > candle3_close_price:
-                    target_price = upstox_fetch_option_data(user_id, upstox_access_token, stock, symbol, exchange_type,candle1_close_price, tgt, lots, "CE")
-                    trade_count = 1
-                    stj.save_variable_to_json(trade_count, user_id, symbol, "trade_count")
-                elif candle4_latest_Ema10 < candle4_latest_Ema20 or candle4_latest_supertrend > candle4_close_price:
-                    target_price = upstox_fetch_option_data(user_id, upstox_access_token, stock, symbol, exchange_type,candle1_close_price, tgt, lots, "CE")
-                    trade_count = 1
-                    stj.save_variable_to_json(trade_count, user_id, symbol, "trade_count")
-                else:
-                    logger_util.push_log("The Trade initiated after the Signal Generated and Signal Generated before 4 Intervals", user_id=user_id, level="info", log_type="trading")
-            elif candle1_latest_Ema10 < candle1_latest_Ema20 and candle1_latest_supertrend > candle1_close_price:
-                logger_util.push_log("🔽 SELL SIGNAL GENERATED", user_id=user_id, level="signal_sell", log_type="trading")
-                if candle2_latest_Ema10 > candle2_latest_Ema20 or candle2_latest_supertrend < candle2_close_price:
-                    target_price = upstox_fetch_option_data(user_id, upstox_access_token, stock, symbol, exchange_type,candle1_close_price, tgt, lots, "PE")
-                    trade_count = 1
-                    stj.save_variable_to_json(trade_count, user_id, symbol, "trade_count")
-                elif candle3_latest_Ema10 > candle3_latest_Ema20 or candle3_latest_supertrend < candle3_close_price:
-                    target_price = upstox_fetch_option_data(user_id, upstox_access_token, stock, symbol, exchange_type,candle1_close_price, tgt, lots, "PE")
-                    trade_count = 1
-                    stj.save_variable_to_json(trade_count, user_id, symbol, "trade_count")
-                elif candle4_latest_Ema10 > candle4_latest_Ema20 or candle4_latest_supertrend < candle4_close_price:
-                    target_price = upstox_fetch_option_data(user_id, upstox_access_token, stock, symbol, exchange_type,candle1_close_price, tgt, lots, "PE")
-                    trade_count = 1
-                    stj.save_variable_to_json(trade_count, user_id, symbol, "trade_count")
-                else:
-                    logger_util.push_log("The Trade initiated after the Signal Generated and Signal Generated before 4 Intervals", user_id=user_id, level="info", log_type="trading")
+        # First trade of the symbol: only on a signal that was not already standing for the whole lookback
+        strategy_rules.log_signal(signals, user_id)
+        option_type = "CE" if signals.long else "PE" if signals.short else None
+        if option_type:
+            if signals.long_fresh if option_type == "CE" else signals.short_fresh:
+                target_price = enter(option_type)
+                trade_count = 1
             else:
-                logger_util.push_log("NO TRADE SIGNAL GENERATED", user_id=user_id, level="signal_none", log_type="trading")
-
-        elif strategy == "Ema10_Ema20_MACD_Supertrend":
-            candle1_latest_Ema10 = indic_candle1["ema10"]
-            candle1_latest_Ema20 = indic_candle1['ema20']
-            candle1_latest_supertrend = indic_candle1['Supertrend']
-            candle1_latest_macd = indic_candle1['MACD']
-            candle1_latest_macd_signal = indic_candle1['MACD_signal']
-            candle1_close_price = float(indic_candle1['close'])
-            candle2_latest_Ema10 = indic_candle2["ema10"]
-            candle2_latest_Ema20 = indic_candle2['ema20']
-            candle2_latest_supertrend = indic_candle2['Supertrend']
-            candle2_latest_macd = indic_candle2['MACD']
-            candle2_latest_macd_signal = indic_candle2['MACD_signal']
-            candle2_close_price = float(indic_candle2['close'])
-            candle3_latest_Ema10 = indic_candle3["ema10"]
-            candle3_latest_Ema20 = indic_candle3['ema20']
-            candle3_latest_supertrend = indic_candle3['Supertrend']
-            candle3_latest_macd = indic_candle3['MACD']
-            candle3_latest_macd_signal = indic_candle3['MACD_signal']
-            candle3_close_price = float(indic_candle3['close'])
-            candle4_latest_Ema10 = indic_candle4["ema10"]
-            candle4_latest_Ema20 = indic_candle4['ema20']
-            candle4_latest_supertrend = indic_candle4['Supertrend']
-            candle4_latest_macd = indic_candle4['MACD']
-            candle4_latest_macd_signal = indic_candle4['MACD_signal']
-            candle4_close_price = float(indic_candle4['close'])
-
-            if candle1_latest_Ema10 > candle1_latest_Ema20 and candle1_latest_supertrend < candle1_close_price and candle1_latest_macd > candle1_latest_macd_signal:
-                logger_util.push_log(f"BUY SIGNAL GENERATED", user_id=user_id, level="signal_buy", log_type="trading")
-                if candle2_latest_Ema10 < candle2_latest_Ema20 or candle2_latest_supertrend > candle2_close_price or candle2_latest_macd < candle2_latest_macd_signal:
-                    target_price = upstox_fetch_option_data(user_id, upstox_access_token, stock, symbol, exchange_type,candle1_close_price, tgt, lots, "CE")
-                    trade_count = 1
-                    stj.save_variable_to_json(trade_count, user_id, symbol, "trade_count")
-                elif candle3_latest_Ema10 < candle3_latest_Ema20 or candle3_latest_supertrend > candle3_close_price or candle3_latest_macd < candle3_latest_macd_signal:
-                    target_price = upstox_fetch_option_data(user_id, upstox_access_token, stock, symbol, exchange_type,candle1_close_price, tgt, lots, "CE")
-                    trade_count = 1
-                    stj.save_variable_to_json(trade_count, user_id, symbol, "trade_count")
-                elif candle4_latest_Ema10 < candle4_latest_Ema20 or candle4_latest_supertrend > candle4_close_price or candle4_latest_macd < candle4_latest_macd_signal:
-                    target_price = upstox_fetch_option_data(user_id, upstox_access_token, stock, symbol, exchange_type,candle1_close_price, tgt, lots, "CE")
-                    trade_count = 1
-                    stj.save_variable_to_json(trade_count, user_id, symbol, "trade_count")
-                else:
-                    logger_util.push_log("The Trade initiated after the Signal Generated and Signal Generated before 4 Intervals", user_id=user_id, level="info", log_type="trading")
-            elif candle1_latest_Ema10 < candle1_latest_Ema20 and candle1_latest_supertrend > candle1_close_price and candle1_latest_macd < candle1_latest_macd_signal:
-                logger_util.push_log("🔽 SELL SIGNAL GENERATED", user_id=user_id, level="signal_sell", log_type="trading")
-                if candle2_latest_Ema10 > candle2_latest_Ema20 or candle2_latest_supertrend < candle2_close_price or candle2_latest_macd > candle2_latest_macd_signal:
-                    target_price = upstox_fetch_option_data(user_id, upstox_access_token, stock, symbol, exchange_type,candle1_close_price, tgt, lots, "CE")
-                    trade_count = 1
-                    stj.save_variable_to_json(trade_count, user_id, symbol, "trade_count")
-                elif candle3_latest_Ema10 > candle3_latest_Ema20 or candle3_latest_supertrend < candle3_close_price or candle3_latest_macd > candle3_latest_macd_signal:
-                    target_price = upstox_fetch_option_data(user_id, upstox_access_token, stock, symbol, exchange_type,candle1_close_price, tgt, lots, "CE")
-                    trade_count = 1
-                    stj.save_variable_to_json(trade_count, user_id, symbol, "trade_count")
-                elif candle4_latest_Ema10 > candle4_latest_Ema20 or candle4_latest_supertrend < candle4_close_price or candle4_latest_macd > candle4_latest_macd_signal:
-                    target_price = upstox_fetch_option_data(user_id, upstox_access_token, stock, symbol, exchange_type,candle1_close_price, tgt, lots, "CE")
-                    trade_count = 1
-                    stj.save_variable_to_json(trade_count, user_id, symbol, "trade_count")
-                else:
-                    logger_util.push_log("The Trade initiated after the Signal Generated and Signal Generated before 4 Intervals", user_id=user_id, level="info", log_type="trading")
-            else:
-                logger_util.push_log("NO TRADE SIGNAL GENERATED", user_id=user_id, level="signal_none", log_type="trading")
-        stj.save_variable_to_json(target_price, user_id, symbol)
+                logger_util.push_log("The Trade initiated after the Signal Generated and Signal Generated before 4 Intervals", user_id=user_id, level="info", log_type="trading")
+        # One atomic write for the whole decision
+        strategy_state.update(user_id, symbol, target_price=target_price, trade_count=trade_count)
     elif trade_count > 0:
-        indicators_df = indicators_df5.tail(1)
-
-        if strategy == "ADX_MACD_WillR_Supertrend":
-            # ✅ Check for signal
-            latest_adx = indicators_df["ADX"].iloc[-1]
-            latest_adxema = indicators_df['ADX_EMA21'].iloc[-1]
-            latest_willr = indicators_df['WillR_14'].iloc[-1]
-            latest_supertrend = indicators_df['Supertrend'].iloc[-1]
-            latest_macd = indicators_df['MACD'].iloc[-1]
-            latest_macd_signal = indicators_df['MACD_signal'].iloc[-1]
-            close_price = float(indicators_df['close'].iloc[-1])
-            tgt = float(tgt)
-
-            positions1 = upstox_fetch_positions(user_id, upstox_access_token)
-            if positions1:
-                for pos in positions1:
-                    quantity = pos['quantity']
-                    if quantity > 0:
-                        instrument_token = pos['instrument_token']
-                        tradingsymbol = pos['tradingsymbol']
-                        option_type = tradingsymbol[-2:]
-                        logger_util.push_log(f"The existing position is type CE with symbol {tradingsymbol}. CE exit condition met, closing existing CE position.",
-                            user_id=user_id, level="info", log_type="trading")
-                        if option_type == "CE" and ((latest_willr < -70 and latest_supertrend > close_price) or (
-                                latest_willr < -70 and latest_macd < latest_macd_signal) or (
-                                                            latest_supertrend > close_price and latest_macd < latest_macd_signal)):
-                            logger_util.push_log(f"The existing position is type CE with symbol {tradingsymbol}. CE exit condition met, closing existing CE position.", user_id = user_id, level = "info", log_type = "trading")
-                            upstox_place_order_single(user_id, upstox_access_token, instrument_token, quantity, "SELL",close_price)
-                        elif option_type == "PE" and ((latest_willr > -30 and latest_supertrend < close_price) or (
-                                latest_willr > -30 and latest_macd > latest_macd_signal) or (
-                                                              latest_supertrend < close_price and latest_macd < latest_macd_signal)):
-                            logger_util.push_log(f"The existing position is type PE with symbol {tradingsymbol}. PE exit condition met, closing existing PE position.", user_id = user_id, level = "info", log_type = "trading")
-                            upstox_place_order_single(user_id, upstox_access_token, instrument_token, quantity, "SELL",close_price)
-
-            positions = upstox_fetch_positions(user_id, upstox_access_token)
-            if latest_adx > latest_adxema and latest_willr > -30 and latest_supertrend < close_price and latest_macd > latest_macd_signal:
-                logger_util.push_log("🔼 BUY SIGNAL GENERATED", user_id = user_id, level = "signal_buy", log_type = "trading")
-                sys.stdout.flush()
-                if positions:
-                    count = 0
-                    for pos in positions:
-                        quantity = pos['quantity']
-                        if quantity > 0:
-                            count +=1
-                            tradingsymbol = pos['tradingsymbol']
-                            option_type = tradingsymbol[-2:]
-                            if option_type == "CE":
-                                logger_util.push_log(f"The existing position is type CE with symbol {tradingsymbol}. No new CALL trade placed ", user_id = user_id, level = "info", log_type = "trading")
-                    if count == 0:
-                        logger_util.push_log(f"There are no live positions and BUY signal generated. Placing a new CE order", user_id = user_id, level = "info", log_type = "trading")
-                        target_price = upstox_fetch_option_data(user_id, upstox_access_token, stock, symbol, exchange_type,close_price, tgt, lots,"CE")
-                else:
-                    logger_util.push_log(f"There are no positions and BUY signal generated. Placing a new CE order", user_id = user_id, level = "info", log_type = "trading")
-                    target_price = upstox_fetch_option_data(user_id, upstox_access_token, stock, symbol, exchange_type, close_price, tgt, lots, "CE")
-
-            elif latest_adx > latest_adxema and latest_willr < -70 and latest_supertrend > close_price and latest_macd < latest_macd_signal:
-                logger_util.push_log("🔽 SELL SIGNAL GENERATED", user_id = user_id, level = "signal_sell", log_type = "trading")
-                sys.stdout.flush()
-                if positions:
-                    count = 0
-                    for pos in positions:
-                        quantity = pos['quantity']
-                        if quantity > 0:
-                            count +=1
-                            tradingsymbol = pos['tradingsymbol']
-                            option_type = tradingsymbol[-2:]
-                            if option_type == "PE":
-                                logger_util.push_log(f"The existing position is type PE with symbol {tradingsymbol}. No new PUT trade placed ", user_id = user_id, level = "info", log_type = "trading")
-                    if count == 0:
-                        target_price = upstox_fetch_option_data(user_id, upstox_access_token, stock, symbol, exchange_type,close_price, tgt, lots,"PE")
-                        logger_util.push_log(f"There are no live positions and SELL signal generated. Placing a new PE order", user_id = user_id, level = "info", log_type = "trading")
-                else:
-                    target_price = upstox_fetch_option_data(user_id, upstox_access_token, stock, symbol, exchange_type,close_price, tgt, lots, "PE")
-                    logger_util.push_log(f"There are no positions and SELL signal generated. Placing a new PE order", user_id = user_id, level = "info", log_type = "trading")
-            else:
-                logger_util.push_log("⏸️ NO TRADE SIGNAL GENERATED", user_id = user_id, level = "signal_none", log_type = "trading")
-                sys.stdout.flush()
-
-        elif strategy == "Ema10_Ema20_Supertrend":
-            # ✅ Check for signal
-            latest_Ema10 = indicators_df["ema10"].iloc[-1]
-            latest_Ema20 = indicators_df['ema20'].iloc[-1]
-            latest_supertrend = indicators_df['Supertrend'].iloc[-1]
-            close_price = float(indicators_df['close'].iloc[-1])
-            tgt = float(tgt)
-
-            positions1 = upstox_fetch_positions(user_id, upstox_access_token)
-            if positions1:
-                for pos in positions1:
-                    quantity = pos['quantity']
-                    if quantity > 0:
-                        instrument_token = pos['instrument_token']
-                        tradingsymbol = pos['tradingsymbol']
-                        option_type = tradingsymbol[-2:]
-
-                        if option_type == "CE" and (latest_Ema10 < latest_Ema20 or latest_supertrend > close_price):
-                            upstox_place_order_single(user_id, upstox_access_token, instrument_token, quantity, "SELL", close_price)
-                            logger_util.push_log(f"The existing position is type CE with symbol {tradingsymbol}. CE exit condition met, closing existing CE position ", user_id = user_id, level = "info", log_type = "trading")
-                        elif option_type == "PE" and (latest_Ema10 > latest_Ema20 or latest_supertrend < close_price):
-                            upstox_place_order_single(user_id, upstox_access_token, instrument_token, quantity, "SELL", close_price)
-                            logger_util.push_log(f"The existing position is type PE with symbol {tradingsymbol}. PE exit condition met, closing existing PE position ", user_id = user_id, level = "info", log_type = "trading")
-
-            positions = upstox_fetch_positions(user_id, upstox_access_token)
-            if latest_Ema10 > latest_Ema20 and latest_supertrend < close_price:
-                logger_util.push_log("🔼BUY SIGNAL GENERATED", user_id = user_id, level = "signal_buy", log_type = "trading")
-                sys.stdout.flush()
-                if positions:
-                    count = 0
-                    for pos in positions:
-                        quantity = pos['quantity']
-                        if quantity > 0:
-                            count =+1
-                            tradingsymbol = pos['tradingsymbol']
-                            option_type = tradingsymbol[-2:]
-                            if option_type == "CE":
-                                logger_util.push_log(f"The existing position is type CE with symbol {tradingsymbol}. No new CALL trade placed ", user_id = user_id, level = "info", log_type = "trading")
-
-                    if count == 0:
-                        target_price = upstox_fetch_option_data(user_id, upstox_access_token, stock, symbol, exchange_type,close_price, tgt, lots, "CE")
-                        logger_util.push_log(f"There are no live positions and BUY signal generated. Placing a new CE order", user_id = user_id, level = "info", log_type = "trading")
-                else:
-                    target_price = upstox_fetch_option_data(user_id, upstox_access_token, stock, symbol, exchange_type,close_price, tgt, lots, "CE")
-                    logger_util.push_log(f"There are no positions and BUY signal generated. Placing a new CE order", user_id = user_id, level = "info", log_type = "trading")
-
-            elif latest_Ema10 < latest_Ema20 and latest_supertrend > close_price:
-                logger_util.push_log("🔽 SELL SIGNAL GENERATED", user_id = user_id, level = "signal_sell", log_type = "trading")
-                sys.stdout.flush()
-                if positions:
-                    count = 0
-                    for pos in positions:
-                        quantity = pos['quantity']
-                        if quantity > 0:
-                            count +=1
-                            tradingsymbol = pos['tradingsymbol']
-                            option_type = tradingsymbol[-2:]
-                            if option_type == "PE":
-                                logger_util.push_log(f"The existing position is type PE with symbol {tradingsymbol}. No new PUT trade placed ", user_id = user_id, level = "info", log_type = "trading")
-
-                    if count == 0:
-                        target_price = upstox_fetch_option_data(user_id, upstox_access_token, stock, symbol, exchange_type,close_price, tgt, lots, "PE")
-                        logger_util.push_log(f"There are no live positions and SELL signal generated. Placing a new PE order", user_id = user_id, level = "info", log_type = "trading")
-                else:
-                    target_price = upstox_fetch_option_data(user_id, upstox_access_token, stock, symbol, exchange_type,close_price, tgt, lots, "PE")
-                    logger_util.push_log(f"There are no positions and SELL signal generated. Placing a new PE order", user_id = user_id, level = "info", log_type = "trading")
-            else:
-                logger_util.push_log("⏸️NO TRADE SIGNAL GENERATED", user_id = user_id, level = "signal_none", log_type = "trading")
-                sys.stdout.flush()
-        elif strategy == "Ema10_Ema20_MACD_Supertrend":
-            latest_Ema10 = indicators_df["ema10"].iloc[-1]
-            latest_Ema20 = indicators_df['ema20'].iloc[-1]
-            latest_supertrend = indicators_df['Supertrend'].iloc[-1]
-            latest_macd = indicators_df['MACD'].iloc[-1]
-            latest_macd_signal = indicators_df['MACD_signal'].iloc[-1]
-            close_price = float(indicators_df['close'].iloc[-1])
-            logger_util.push_log(f"{latest_Ema10}--{latest_Ema20}--{latest_supertrend}--{latest_macd}--{latest_macd_signal}--{close_price}", user_id = user_id, level = "info", log_type = "trading")
-            positions = upstox_fetch_positions(user_id, upstox_access_token)
-            if positions:
-                count = 0
-                for pos in positions:
-                    quantity = pos['quantity']
-                    if quantity > 0:
-                        count += 1
-                        instrument_token = pos['instrument_token']
-                        tradingsymbol = pos['tradingsymbol']
-                        option_type = tradingsymbol[-2:]
-                        if latest_Ema10 > latest_Ema20 and latest_supertrend < close_price and latest_macd > latest_macd_signal:
-                            if option_type == "CE":
-                                logger_util.push_log("BUY SIGNAL GENERATED. You have existing CALL position. No new order placed", user_id = user_id, level = "signal_buy", log_type = "trading")
-                            elif option_type == "PE":
-                                logger_util.push_log("BUY SIGNAL GENERATED.  Closing existing PUT Position and place new CALL order", user_id = user_id, level = "signal_buy", log_type = "trading")
-                                upstox_place_order_single(user_id, upstox_access_token, instrument_token, quantity, "SELL", 0)
-                                target_price = upstox_fetch_option_data(user_id, upstox_access_token, stock, symbol, exchange_type,close_price, tgt, lots, "CE")
-                        elif latest_Ema10 < latest_Ema20 and latest_supertrend > close_price and latest_macd < latest_macd_signal:
-                            if option_type == "PE":
-                                logger_util.push_log("SELL SIGNAL GENERATED. You have existing PUT position. No new order placed", user_id = user_id, level = "signal_sell", log_type = "trading")
-                            elif option_type == "CE":
-                                logger_util.push_log("SELL SIGNAL GENERATED.  Closing existing CALL Position and place new CALL order", user_id = user_id, level = "signal_sell", log_type = "trading")
-                                upstox_place_order_single(user_id, upstox_access_token, instrument_token, quantity, "SELL", 0)
-                                target_price = upstox_fetch_option_data(user_id, upstox_access_token, stock, symbol, exchange_type,close_price, tgt, lots, "PE")
-                        elif option_type == "CE":
-                            if latest_Ema10 < latest_Ema20 or latest_supertrend > close_price or latest_macd < latest_macd_signal:
-                                logger_util.push_log("NO Trade Signal Generated .CALL position exit condition met. Closing existing CALL position", user_id = user_id, level = "signal_none", log_type = "trading")
-                                upstox_place_order_single(user_id, upstox_access_token, instrument_token, quantity, "SELL", 0)
-                        elif option_type == "PE":
-                            if latest_Ema10 > latest_Ema20 or latest_supertrend < close_price or latest_macd > latest_macd_signal:
-                                logger_util.push_log("NO Trade Signal Generated. PUT position exit condition met. Closing existing PUT position", user_id = user_id, level = "signal_none", log_type = "trading")
-                                upstox_place_order_single(user_id, upstox_access_token, instrument_token, quantity, "SELL", 0)
-                if count == 0:
-                    if latest_Ema10 > latest_Ema20 and latest_supertrend < close_price and latest_macd > latest_macd_signal:
-                        logger_util.push_log("BUY SIGNAL GENERATED. No live position exist. Placing new CALL order", user_id = user_id, level = "signal_buy", log_type = "trading")
-                        target_price = upstox_fetch_option_data(user_id, upstox_access_token, stock, symbol, exchange_type,close_price, tgt, lots, "CE")
-                    elif latest_Ema10 < latest_Ema20 and latest_supertrend > close_price and latest_macd < latest_macd_signal:
-                        logger_util.push_log("SELL SIGNAL GENERATED. No live position exist. Placing new PUT order", user_id = user_id, level = "signal_sell", log_type = "trading")
-                        target_price = upstox_fetch_option_data(user_id, upstox_access_token, stock, symbol, exchange_type,close_price, tgt, lots, "PE")
-                    else:
-                        logger_util.push_log("NO Trade Signal Generated", user_id = user_id, level = "signal_none", log_type = "trading")
-            else:
-                if latest_Ema10 > latest_Ema20 and latest_supertrend < close_price and latest_macd > latest_macd_signal:
-                    logger_util.push_log("BUY SIGNAL GENERATED. Placing new CALL order", user_id = user_id, level = "signal_buy", log_type = "trading")
-                    target_price = upstox_fetch_option_data(user_id, upstox_access_token, stock, symbol, exchange_type,close_price, tgt, lots, "CE")
-                elif latest_Ema10 < latest_Ema20 and latest_supertrend > close_price and latest_macd < latest_macd_signal:
-                    logger_util.push_log("SELL SIGNAL GENERATED. Placing new PUT order", user_id = user_id, level = "signal_sell", log_type = "trading")
-                    target_price = upstox_fetch_option_data(user_id, upstox_access_token, stock, symbol, exchange_type,close_price, tgt, lots, "PE")
-                else:
-                    logger_util.push_log("NO Trade Signal Generated", user_id = user_id, level = "signal_none", log_type = "trading")
-
-        stj.save_variable_to_json(target_price, user_id, symbol)
+        entered = strategy_rules.run(rules, signals, "upstox", fetch, exit_position, enter, user_id=user_id)
+        if entered is not None:
+            strategy_state.update(user_id, symbol, target_price=entered)
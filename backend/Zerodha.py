@@ -1,15 +1,23 @@
-from kiteconnect import KiteConnect
-import requests
 import sys
 import pandas as pd
 import datetime
 import backend.logger_util as logger_util
+from backend import broker_http
+from backend import broker_sessions
+from backend import positions_snapshot
+from backend import market_calendar
+from backend import circuit_breaker
+from backend import rate_limiter
+from backend import order_pipeline
+from backend import strategy_rules
+from backend import clock
 
 def zerodha_get_equity_balance(api_key, access_token):
 
-    kite = KiteConnect(api_key)
-    kite.set_access_token(access_token)
-    margins = kite.margins()  # fetch all margins
+    kite = broker_sessions.kite_session(api_key, access_token)
+    rate_limiter.acquire("zerodha", "default", api_key)
+    with circuit_breaker.guard("zerodha", "default"):
+        margins = kite.margins()  # fetch all margins
     equity_data = margins.get("equity", {})
 
     result = {
@@ -19,35 +27,51 @@ def zerodha_get_equity_balance(api_key, access_token):
     }
     return result
 
-def zerodha_get_profile(api_key, access_token):
-    url = "https://api.kite.trade/user/profile"
-    headers = {
+ZERODHA_PROFILE_URL = "https://api.kite.trade/user/profile"
+
+def _zerodha_headers(api_key, access_token):
+    return {
         "X-Kite-Version": "3",
         "Authorization": f"token {api_key}:{access_token}"
     }
 
+def _zerodha_profile_from_response(response):
+    if response.status_code == 200:
+        data = response.json().get("data", {})
+        return {
+            "user_id": data.get("user_id"),
+            "User Name": data.get("user_name"),
+            "email": data.get("email")
+        }
+    else:
+        return {
+            "error": "Failed to fetch profile",
+            "status_code": response.status_code,
+            "response": response.text
+        }
+
+def zerodha_get_profile(api_key, access_token):
+    try:
+        response = broker_http.get(ZERODHA_PROFILE_URL, headers=_zerodha_headers(api_key, access_token))
+        return _zerodha_profile_from_response(response)
+    except Exception as e:
+        return {"error": str(e)}
+
+async def zerodha_get_profile_async(api_key, access_token):
+    """Async zerodha_get_profile for the FastAPI endpoints."""
     try:
-        response = requests.get(url, headers=headers)
-        if response.status_code == 200:
-            data = response.json().get("data", {})
-            return {
-                "user_id": data.get("user_id"),
-                "User Name": data.get("user_name"),
-                "email": data.get("email")
-            }
-        else:
-            return {
-                "error": "Failed to fetch profile",
-                "status_code": response.status_code,
-                "response": response.text
-            }
+        response = await broker_http.aget(ZERODHA_PROFILE_URL, headers=_zerodha_headers(api_key, access_token))
+        return _zerodha_profile_from_response(response)
     except Exception as e:
         return {"error": str(e)}
 
+def kite_connect_from_credentials(credentials):
+    """Shared KiteConnect for a user's Zerodha credentials."""
+    return broker_sessions.kite_session(credentials.get("api_key"), credentials.get("access_token"))
+
 def zerodha_instruments_token(api_key, access_token, tradingsymbol):
     exchange ="NSE"
-    kite = KiteConnect(api_key)
-    kite.set_access_token(access_token)
+    kite = broker_sessions.kite_session(api_key, access_token)
     indices = {"NIFTY": "NIFTY 50", "BANKNIFTY": "NIFTY BANK", "FINNIFTY": "NIFTY FIN SERVICE",
                "MIDCPNIFTY": "NIFTY MID SELECT"}
 
@@ -65,25 +89,27 @@ def zerodha_instruments_token(api_key, access_token, tradingsymbol):
     else:
         return None  # Not found
 
-def zerodha_historical_data(kite, instrument_token, interval):
+def zerodha_historical_data(kite, instrument_token, interval, exchange="NSE"):
     """
-    Fetch historical OHLC data for given instrument.
+    Fetch historical OHLC data for given instrument, sized in trading bars.
     """
-    today = datetime.date.today()
+    today = clock.today()
     end_date = (today - datetime.timedelta(days=1))
-    start_date = today - datetime.timedelta(days=25)
+    start_date = market_calendar.history_start_date(exchange, interval, end_date=end_date, max_calendar_days=25)
     # ✅ map correctly
     if str(interval) == "1":
         interval_str = "minute"
     else:
         interval_str = f"{interval}minute"
-    data = kite.historical_data(
-        instrument_token=instrument_token,
-        from_date=start_date,
-        to_date=end_date,
-        interval=interval_str,
-        continuous=False
-    )
+    rate_limiter.acquire("zerodha", "historical", kite.api_key)
+    with circuit_breaker.guard("zerodha", "historical"):
+        data = kite.historical_data(
+            instrument_token=instrument_token,
+            from_date=start_date,
+            to_date=end_date,
+            interval=interval_str,
+            continuous=False
+        )
     df = pd.DataFrame(data)
     if not df.empty:
         df['date'] = pd.to_datetime(df['date']).dt.tz_localize(None)
@@ -95,19 +121,21 @@ def zerodha_intraday_data(kite, instrument_token, interval):
     """
     Fetch today's intraday OHLC data.
     """
-    today = datetime.date.today()
+    today = clock.today()
     # ✅ map correctly
     if interval == "1":
         interval_str = "minute"
     else:
         interval_str = f"{interval}minute"
-    data = kite.historical_data(
-        instrument_token=instrument_token,
-        from_date=today,
-        to_date=today,
-        interval=interval_str,
-        continuous=False
-    )
+    rate_limiter.acquire("zerodha", "historical", kite.api_key)
+    with circuit_breaker.guard("zerodha", "historical"):
+        data = kite.historical_data(
+            instrument_token=instrument_token,
+            from_date=today,
+            to_date=today,
+            interval=interval_str,
+            continuous=False
+        )
     df = pd.DataFrame(data)
     if df.empty:
         logger_util.push_log(f"⚠️ No intraday data found for {today} (maybe holiday or before market hours).")
@@ -122,16 +150,18 @@ def zerodha_last_candle_data(kite, instrument_token, interval):
     """
     Fetch today's intraday OHLC data.
     """
-    today = datetime.date.today()
+    today = clock.today()
     if interval == "1":
         interval = ""
-    data = kite.historical_data(
-        instrument_token=instrument_token,
-        from_date=today,
-        to_date=today,
-        interval=f"{interval}minute",
-        continuous=False
-    )
+    rate_limiter.acquire("zerodha", "historical", kite.api_key)
+    with circuit_breaker.guard("zerodha", "historical"):
+        data = kite.historical_data(
+            instrument_token=instrument_token,
+            from_date=today,
+            to_date=today,
+            interval=f"{interval}minute",
+            continuous=False
+        )
     df = pd.DataFrame(data)
     if df.empty:
         logger_util.push_log(f"⚠️ No intraday data found for {today} (maybe holiday or before market hours).")
@@ -150,7 +180,7 @@ def fetch_positions(api_key, access_token):
         "Authorization": f"token {api_key}:{access_token}"
     }
 
-    response = requests.get(url, headers=headers)
+    response = broker_http.get(url, headers=headers)
 
     if response.status_code == 200:
         data = response.json().get("data",{})
@@ -163,26 +193,54 @@ def fetch_positions(api_key, access_token):
         return None
 
 def zerodha_place_order(zerodha_api_key, zerodha_access_token, tradingsymbol, quantity):
-    kite = KiteConnect(zerodha_api_key)
-    kite.set_access_token(zerodha_access_token)
+    """Queue a market SELL (exit) on the account's order lane; returns a Future."""
+    kite = broker_sessions.kite_session(zerodha_api_key, zerodha_access_token)
+    return order_pipeline.submit(
+        "zerodha", zerodha_access_token, "SELL", _zerodha_submit_order,
+        kite, tradingsymbol, quantity,
+        instrument=tradingsymbol, quantity=quantity, tradingsymbol=tradingsymbol, fill=-quantity,
+        confirm=lambda order_id: zerodha_order_status(kite, order_id),
+    )
+
+def _zerodha_submit_order(kite, tradingsymbol, quantity, tag=None):
     try:
-        order_id = kite.place_order(
-            variety=kite.VARIETY_REGULAR,  # Regular order
-            exchange="NSE",
-            tradingsymbol=tradingsymbol,
-            transaction_type="SELL",
-            quantity=quantity,
-            product="MIS",
-            order_type="MARKET",
-            price= None,
-        )
+        rate_limiter.acquire("zerodha", "order", zerodha_api_key)
+        with circuit_breaker.guard("zerodha", "order"):
+            order_id = kite.place_order(
+                variety=kite.VARIETY_REGULAR,  # Regular order
+                exchange="NSE",
+                tradingsymbol=tradingsymbol,
+                transaction_type="SELL",
+                quantity=quantity,
+                product="MIS",
+                order_type="MARKET",
+                price= None,
+                tag=tag,
+            )
         logger_util.push_log(f"✅ Order placed successfully! Order ID: {order_id}")
         return order_id
     except Exception as e:
         logger_util.push_log(f"❌ Order placement failed: {e}","error")
         return None
 
+def zerodha_order_status(kite, order_id):
+    """Status of the order's latest state change ("COMPLETE", "REJECTED", "OPEN", ...)."""
+    rate_limiter.acquire("zerodha", "default", kite.api_key)
+    with circuit_breaker.guard("zerodha", "default"):
+        history = kite.order_history(order_id)
+    return history[-1]["status"] if history else None
+
 def zerodha_oco_order(kite, symbol, quantity, entry_price, stoploss_price, target_price):
+    """Queue the GTT OCO entry on the account's order lane; returns a Future."""
+    # The position only exists once the trigger fires, so no fill is applied up front
+    return order_pipeline.submit(
+        "zerodha", kite.access_token, "BUY", _zerodha_submit_oco,
+        kite, symbol, quantity, entry_price, stoploss_price, target_price,
+        instrument=symbol, quantity=quantity, tradingsymbol=symbol,
+    )
+
+def _zerodha_submit_oco(kite, symbol, quantity, entry_price, stoploss_price, target_price, tag=None):
+    # GTTs take no order tag; duplicates are still caught by the pipeline's client order id
     try:
         gtt = kite.place_gtt(
             trigger_type=kite.GTT_TYPE_OCO,
@@ -213,6 +271,7 @@ def zerodha_oco_order(kite, symbol, quantity, entry_price, stoploss_price, targe
 
     except Exception as e:
         logger_util.push_log(f"Error placing GTT order: {e}","error")
+        return None
 
 def zerodha_close_position(credentials, pos):
     zerodha_api_key = credentials['api_key']
@@ -220,19 +279,21 @@ def zerodha_close_position(credentials, pos):
     tradingsymbol = pos.get['tradingsymbol']
     quantity = pos.get['quantity']
 
-    kite = KiteConnect(zerodha_api_key)
-    kite.set_access_token(zerodha_access_token)
+    kite = broker_sessions.kite_session(zerodha_api_key, zerodha_access_token)
     try:
-        order_id = kite.place_order(
-            variety=kite.VARIETY_REGULAR,  # Regular order
-            exchange="NSE",
-            tradingsymbol=tradingsymbol,
-            transaction_type="SELL",
-            quantity=quantity,
-            product="MIS",
-            order_type="MARKET",
-            price=None,
-        )
+        rate_limiter.acquire("zerodha", "order", zerodha_api_key)
+        with circuit_breaker.guard("zerodha", "order"):
+            order_id = kite.place_order(
+                variety=kite.VARIETY_REGULAR,  # Regular order
+                exchange="NSE",
+                tradingsymbol=tradingsymbol,
+                transaction_type="SELL",
+                quantity=quantity,
+                product="MIS",
+                order_type="MARKET",
+                price=None,
+            )
+        positions_snapshot.record_fill("zerodha", zerodha_access_token, tradingsymbol, -quantity, tradingsymbol)
         logger_util.push_log(f"✅ Order placed successfully! Order ID: {order_id}")
         return order_id
     except Exception as e:
@@ -240,8 +301,7 @@ def zerodha_close_position(credentials, pos):
         return None
 
 def zerodha_fetch_option_data(api_key, access_token, stock, close_price, tgt, lots,option_type):
-    kite = KiteConnect(api_key)
-    kite.set_access_token(access_token)
+    kite = broker_sessions.kite_session(api_key, access_token)
 
     # Fetch all instruments
     instruments = kite.instruments()
@@ -289,208 +349,14 @@ def zerodha_fetch_option_data(api_key, access_token, stock, close_price, tgt, lo
 def zerodha_trade_conditions_check(lots, tgt, indicators_df, credentials, stock,strategy):
     zerodha_api_key = credentials['api_key']
     zerodha_access_token = credentials['access_token']
-    #stock = indicators_df['name']
-
-    # ✅ Check for signal
-    if strategy == "ADX_MACD_WillR_Supertrend":
-        latest_adx = indicators_df["ADX"].iloc[-1]
-        latest_adxema = indicators_df['ADX_EMA21'].iloc[-1]
-        latest_willr = indicators_df['WillR_14'].iloc[-1]
-        latest_supertrend = indicators_df['Supertrend'].iloc[-1]
-        latest_macd = indicators_df['MACD'].iloc[-1]
-        latest_macd_signal = indicators_df['MACD_signal'].iloc[-1]
-        close_price = float(indicators_df['close'].iloc[-1])
-
-        positions1 = fetch_positions(zerodha_api_key, zerodha_access_token)
-
-        if positions1:
-            for pos in positions1:
-                quantity = pos.get("quantity", 0)
-                if quantity > 0:
-                    tradingsymbol = pos.get("tradingsymbol")
-                    option_type = tradingsymbol[-2:]
-
-                    if option_type == "CE" and ((latest_willr < -70 and latest_supertrend > close_price) or (
-                            latest_willr < -70 and latest_macd < latest_macd_signal) or (
-                                                        latest_supertrend > close_price and latest_macd < latest_macd_signal)):
-                        zerodha_place_order(zerodha_api_key, zerodha_access_token, tradingsymbol, quantity)
-                        logger_util.push_log(f"The existing position is type CE with symbol {tradingsymbol}. CE exit condition met, closing existing CE position.")
-                    elif option_type == "PE" and ((latest_willr > -30 and latest_supertrend < close_price) or (
-                            latest_willr > -30 and latest_macd > latest_macd_signal) or (
-                                                          latest_supertrend < close_price and latest_macd < latest_macd_signal)):
-                        zerodha_place_order(zerodha_api_key, zerodha_access_token, tradingsymbol, quantity)
-                        logger_util.push_log(f"The existing position is type PE with symbol {tradingsymbol}. PE exit condition met, closing existing PE position.")
-
-        positions = fetch_positions(zerodha_api_key, zerodha_access_token)
-        if latest_adx > latest_adxema and latest_willr > -30 and latest_supertrend < close_price and latest_macd > latest_macd_signal:
-            logger_util.push_log("🔼 BUY SIGNAL GENERATED")
-            sys.stdout.flush()
-            if positions:
-                count = 0
-                for pos in positions:
-                    quantity = pos.get("quantity", 0)
-                    if quantity > 0:
-                        count +=1
-                        tradingsymbol = pos.get("tradingsymbol")
-                        option_type = tradingsymbol[-2:]
-                        if option_type == "CE":
-                            logger_util.push_log(
-                                f"The existing position is type CE with symbol {tradingsymbol}. No new CALL trade placed ")
-
-                if count == 0:
-                    zerodha_fetch_option_data(zerodha_api_key, zerodha_access_token, stock, close_price, tgt, lots, "CE")
-                    logger_util.push_log(f"There are no live positions and BUY signal generated. Placing a new CE order")
-            else:
-                zerodha_fetch_option_data(zerodha_api_key, zerodha_access_token, stock, close_price,  tgt, lots,"CE")
-                logger_util.push_log(f"There are no positions and BUY signal generated. Placing a new CE order")
-
-        elif latest_adx > latest_adxema and latest_willr < -70 and latest_supertrend > close_price and latest_macd < latest_macd_signal:
-            logger_util.push_log("🔽 SELL SIGNAL GENERATED")
-            sys.stdout.flush()
-            if positions:
-                count = 0
-                for pos in positions:
-                    quantity = pos.get("quantity", 0)
-                    if quantity > 0:
-                        count +=1
-                        tradingsymbol = pos.get("tradingsymbol")
-                        option_type = tradingsymbol[-2:]
-                        if option_type == "PE":
-                            logger_util.push_log(f"The existing position is type PE with symbol {tradingsymbol}. No new PUT trade placed ")
-                if count == 0:
-                    zerodha_fetch_option_data(zerodha_api_key, zerodha_access_token, stock, close_price,  tgt, lots,"PE")
-                    logger_util.push_log(f"There are no live positions and SELL signal generated. Placing a new PE order")
-            else:
-                zerodha_fetch_option_data(zerodha_api_key, zerodha_access_token, stock, close_price, tgt, lots, "PE")
-                logger_util.push_log(f"There are no positions and SELL signal generated. Placing a new PE order")
-        else:
-            logger_util.push_log("⏸️ NO TRADE SIGNAL GENERATED")
-            sys.stdout.flush()
-
-    elif strategy == "Ema10_Ema20_Supertrend":
-        latest_Ema10 = indicators_df["ema10"].iloc[-1]
-        latest_Ema20 = indicators_df['ema20'].iloc[-1]
-        latest_supertrend = indicators_df['Supertrend'].iloc[-1]
-        close_price = float(indicators_df['close'].iloc[-1])
-
-        positions1 = fetch_positions(zerodha_api_key, zerodha_access_token)
-        if positions1:
-            for pos in positions1:
-                quantity = pos.get("quantity", 0)
-                if quantity > 0:
-                    tradingsymbol = pos.get("tradingsymbol")
-                    option_type = tradingsymbol[-2:]
-
-                    if option_type == "CE" and (latest_Ema10 < latest_Ema20 or latest_supertrend > close_price):
-                        zerodha_place_order(zerodha_api_key, zerodha_access_token, tradingsymbol, quantity)
-                        logger_util.push_log(
-                            f"The existing position is type CE with symbol {tradingsymbol}. CE exit condition met, closing existing CE position ")
-                    elif option_type == "PE" and (latest_Ema10 > latest_Ema20 or latest_supertrend < close_price):
-                        zerodha_place_order(zerodha_api_key, zerodha_access_token, tradingsymbol, quantity)
-                        logger_util.push_log(
-                            f"The existing position is type PE with symbol {tradingsymbol}. PE exit condition met, closing existing PE position ")
-
-        positions = fetch_positions(zerodha_api_key, zerodha_access_token)
-        if latest_Ema10 > latest_Ema20 and latest_supertrend < close_price:
-            logger_util.push_log("🔼 BUY SIGNAL GENERATED")
-            sys.stdout.flush()
-            if positions:
-                count = 0
-                for pos in positions:
-                    quantity = pos.get("quantity", 0)
-                    if quantity > 0:
-                        count += 1
-                        tradingsymbol = pos.get("tradingsymbol")
-                        option_type = tradingsymbol[-2:]
-                        if option_type == "CE":
-                            logger_util.push_log(
-                                f"The existing position is type CE with symbol {tradingsymbol}. No new CALL trade placed ")
-
-                if count == 0:
-                    zerodha_fetch_option_data(zerodha_api_key, zerodha_access_token, stock, close_price, tgt,lots, "CE")
-                    logger_util.push_log(f"There are no live positions and BUY signal generated. Placing a new CE order")
-            else:
-                zerodha_fetch_option_data(zerodha_api_key, zerodha_access_token, stock, close_price, tgt, lots, "CE")
-                logger_util.push_log(f"There are no positions and BUY signal generated. Placing a new CE order")
-
-        elif latest_Ema10 < latest_Ema20 and latest_supertrend > close_price:
-            logger_util.push_log("🔽 SELL SIGNAL GENERATED")
-            sys.stdout.flush()
-            if positions:
-                count = 0
-                for pos in positions:
-                    quantity = pos.get("quantity", 0)
-                    if quantity > 0:
-                        count +=1
-                        tradingsymbol = pos.get("tradingsymbol")
-                        option_type = tradingsymbol[-2:]
-                        if option_type == "PE":
-                            logger_util.push_log(
-                                f"The existing position is type PE with symbol {tradingsymbol}. No new PUT trade placed ")
-                if count == 0:
-                    zerodha_fetch_option_data(zerodha_api_key, zerodha_access_token, stock, close_price, tgt, lots,"PE")
-                    logger_util.push_log(f"There are no live positions and SELL signal generated. Placing a new PE order")
-            else:
-                zerodha_fetch_option_data(zerodha_api_key, zerodha_access_token, stock, close_price, tgt, lots, "PE")
-                logger_util.push_log(f"There are no positions and SELL signal generated. Placing a new PE order")
-        else:
-            logger_util.push_log("⏸️ NO TRADE SIGNAL GENERATED")
-            sys.stdout.flush()
-    elif strategy == "Ema10_Ema20_MACD_Supertrend":
-        latest_Ema10 = indicators_df["ema10"].iloc[-1]
-        latest_Ema20 = indicators_df['ema20'].iloc[-1]
-        latest_supertrend = indicators_df['Supertrend'].iloc[-1]
-        latest_macd = indicators_df['MACD'].iloc[-1]
-        latest_macd_signal = indicators_df['MACD'].iloc[-1]
-        close_price = float(indicators_df['close'].iloc[-1])
-
-        positions = fetch_positions(zerodha_api_key, zerodha_access_token)
-        if positions:
-            count = 0
-            for pos in positions:
-                quantity = pos['quantity']
-                if quantity > 0:
-                    count += 1
-                    instrument_token = pos['instrument_token']
-                    tradingsymbol = pos['tradingsymbol']
-                    option_type = tradingsymbol[-2:]
-                    if latest_Ema10 > latest_Ema20 and latest_supertrend < close_price and latest_macd > latest_macd_signal:
-                        if option_type == "CE":
-                            logger_util.push_log("BUY SIGNAL GENERATED. You have existing CALL position. No new order placed")
-                        elif option_type == "PE":
-                            logger_util.push_log("BUY SIGNAL GENERATED.  Closing existing PUT Position and place new CALL order")
-                            zerodha_place_order(zerodha_api_key, zerodha_access_token, tradingsymbol, quantity)
-                            zerodha_fetch_option_data(zerodha_api_key, zerodha_access_token, stock, close_price, tgt, lots, "CE")
-                    elif latest_Ema10 < latest_Ema20 and latest_supertrend > close_price and latest_macd < latest_macd_signal:
-                        if option_type == "PE":
-                            logger_util.push_log("SELL SIGNAL GENERATED. You have existing PUT position. No new order placed")
-                        elif option_type == "CE":
-                            logger_util.push_log("SELL SIGNAL GENERATED.  Closing existing CALL Position and place new CALL order")
-                            zerodha_place_order(zerodha_api_key, zerodha_access_token, tradingsymbol, quantity)
-                            zerodha_fetch_option_data(zerodha_api_key, zerodha_access_token, stock, close_price, tgt, lots, "PE")
-                    elif option_type == "CE":
-                        if latest_Ema10 < latest_Ema20 or latest_supertrend > close_price or latest_macd < latest_macd_signal:
-                            logger_util.push_log("NO Trade Signal Generated .CALL position exit condition met. Closing existing CALL position")
-                            zerodha_place_order(zerodha_api_key, zerodha_access_token, tradingsymbol, quantity)
-                    elif option_type == "PE":
-                        if latest_Ema10 > latest_Ema20 or latest_supertrend < close_price or latest_macd > latest_macd_signal:
-                            logger_util.push_log("NO Trade Signal Generated. PUT position exit condition met. Closing existing PUT position")
-                            zerodha_place_order(zerodha_api_key, zerodha_access_token, tradingsymbol, quantity)
-            if count == 0:
-                if latest_Ema10 > latest_Ema20 and latest_supertrend < close_price and latest_macd > latest_macd_signal:
-                    logger_util.push_log("BUY SIGNAL GENERATED. No live position exist. Placing new CALL order")
-                    zerodha_fetch_option_data(zerodha_api_key, zerodha_access_token, stock, close_price, tgt, lots, "CE")
-                elif latest_Ema10 < latest_Ema20 and latest_supertrend > close_price and latest_macd < latest_macd_signal:
-                    logger_util.push_log("SELL SIGNAL GENERATED. No live position exist. Placing new PUT order")
-                    zerodha_fetch_option_data(zerodha_api_key, zerodha_access_token, stock, close_price, tgt, lots, "PE")
-                else:
-                    logger_util.push_log("NO Trade Signal Generated")
-        else:
-            if latest_Ema10 > latest_Ema20 and latest_supertrend < close_price and latest_macd > latest_macd_signal:
-                logger_util.push_log("BUY SIGNAL GENERATED. Placing new CALL order")
-                zerodha_fetch_option_data(zerodha_api_key, zerodha_access_token, stock, close_price, tgt, lots, "CE")
-            elif latest_Ema10 < latest_Ema20 and latest_supertrend > close_price and latest_macd < latest_macd_signal:
-                logger_util.push_log("SELL SIGNAL GENERATED. Placing new PUT order")
-                zerodha_fetch_option_data(zerodha_api_key, zerodha_access_token, stock, close_price, tgt, lots, "PE")
-            else:
-                logger_util.push_log("NO Trade Signal Generated")
+    rules = strategy_rules.get(strategy)
+    if rules is None:
+        logger_util.push_log(f"❌ Unknown strategy {strategy}", level="error", log_type="trading")
+        return
+    signals = rules.latest(indicators_df)
+    strategy_rules.run(
+        rules, signals, "zerodha",
+        fetch_positions=lambda: positions_snapshot.positions("zerodha", zerodha_access_token, fetch_positions, zerodha_api_key, zerodha_access_token),
+        exit_position=lambda pos: zerodha_place_order(zerodha_api_key, zerodha_access_token, pos.tradingsymbol, pos.quantity),
+        enter=lambda option_type: zerodha_fetch_option_data(zerodha_api_key, zerodha_access_token, stock, signals.close, tgt, lots, option_type),
+    )
@@ -0,0 +1,204 @@
+# backend/backtester.py
+"""
+Backtest the production strategies on historical candles.
+
+Candles are read from a Parquet or CSV file (datetime, open, high, low, close),
+resampled to the strategy interval with the same session-open alignment as
+live trading (09:15 NSE, 09:00 MCX), and run through `indicators.all_indicators`
+and the strategy's rules from `strategy_rules` over the whole series at once. Only the trade walk is
+sequential, and it jumps from signal to signal with array searches instead of
+stepping through every candle.
+
+Trades follow the live decision flow: one position at a time, exit on the
+position's exit rule (or the opposite signal for reverse strategies), and
+entry on a signal when flat. Options are modelled from the underlying: the
+premium at entry is PREMIUM_PCT of spot and moves by DELTA per point, and the
+target is `tgt` percent above the entry premium, as upstox_fetch_option_data
+sets it. Targets fill intrabar on the candle's high/low.
+
+Run:
+  python -m backend.backtester candles.parquet Ema10_Ema20_Supertrend --interval 5 --tgt 20 --lot-size 75
+"""
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from backend import indicators as ind
+from backend import market_calendar as mc
+from backend import strategy_rules
+
+PREMIUM_PCT = float(os.getenv("BACKTEST_PREMIUM_PCT", "1.0"))
+DELTA = float(os.getenv("BACKTEST_DELTA", "0.5"))
+
+
+def load_candles(path):
+    """OHLC frame from a .parquet or .csv file, sorted by datetime."""
+    if str(path).endswith(".parquet"):
+        df = pd.read_parquet(path)
+    else:
+        df = pd.read_csv(path)
+    df.columns = [str(c).strip().lower() for c in df.columns]
+    for name in ("datetime", "timestamp", "date", "time"):
+        if name in df.columns:
+            df = df.rename(columns={name: "datetime"})
+            break
+    df["datetime"] = pd.to_datetime(df["datetime"])
+    return df[["datetime", "open", "high", "low", "close"]].sort_values("datetime").reset_index(drop=True)
+
+
+def resample(df, interval, exchange="NSE"):
+    """Candles of `interval` minutes aligned to the exchange's open, like the live resampler."""
+    interval = int(interval)
+    if interval <= 1:
+        return df
+    offset = f"{mc.open_offset(exchange)}min"
+    out = df.set_index("datetime").resample(f"{interval}min", origin="start_day", offset=offset).agg(
+        {"open": "first", "high": "max", "low": "min", "close": "last"}
+    )
+    return out.dropna().reset_index()
+
+
+def _first(mask, start):
+    """Index of the first True at or after `start`, or None."""
+    if start >= len(mask):
+        return None
+    hit = mask[start:].argmax()
+    return start + hit if mask[start + hit] else None
+
+
+def simulate(strategy, indicators_df, tgt=0, lots=1, lot_size=1, fresh_only=False,
+             premium_pct=PREMIUM_PCT, delta=DELTA):
+    """List of trade dicts for one strategy over an indicator frame."""
+    flags = strategy.evaluate(indicators_df)
+    long_entry = flags["long_fresh"] if fresh_only else flags["long"]
+    short_entry = flags["short_fresh"] if fresh_only else flags["short"]
+    entries = np.flatnonzero(long_entry | short_entry)
+    # Exit masks per side; reverse strategies also leave on the opposite signal
+    exit_ce = flags["exit_long"] | (flags["short"] if strategy.reverse else False)
+    exit_pe = flags["exit_short"] | (flags["long"] if strategy.reverse else False)
+
+    close = indicators_df["close"].to_numpy(dtype=float)
+    high = indicators_df["high"].to_numpy(dtype=float)
+    low = indicators_df["low"].to_numpy(dtype=float)
+    times = indicators_df["datetime"].to_numpy() if "datetime" in indicators_df else np.arange(len(close))
+    quantity = int(lots) * int(lot_size)
+    tgt = float(tgt or 0)
+
+    trades = []
+    position = 0
+    while True:
+        k = np.searchsorted(entries, position)
+        if k >= len(entries):
+            break
+        entry = entries[k]
+        if entry == len(close) - 1:
+            break
+        side = "CE" if long_entry[entry] else "PE"
+        sign = 1 if side == "CE" else -1
+        spot = close[entry]
+        premium = spot * premium_pct / 100
+        exit_at = _first(exit_ce if side == "CE" else exit_pe, entry + 1)
+        reason, exit_premium = "rule", None
+
+        if tgt:
+            # Underlying move that lifts the premium to the target
+            target_spot = spot + sign * premium * tgt / 100 / delta
+            # Only candles up to the rule exit can reach it first
+            stop = len(close) if exit_at is None else exit_at + 1
+            reached = (high[entry + 1:stop] >= target_spot) if side == "CE" else (low[entry + 1:stop] <= target_spot)
+            hit = _first(reached, 0)
+            if hit is not None:
+                exit_at, reason = entry + 1 + hit, "target"
+                exit_premium = premium * (100 + tgt) / 100
+        if exit_at is None:
+            exit_at, reason = len(close) - 1, "end"
+        if exit_premium is None:
+            exit_premium = max(premium + sign * delta * (close[exit_at] - spot), 0.0)
+
+        trades.append({
+            "side": side,
+            "entry_time": str(times[entry]),
+            "exit_time": str(times[exit_at]),
+            "entry_spot": round(float(spot), 2),
+            "exit_spot": round(float(close[exit_at]), 2),
+            "entry_premium": round(float(premium), 2),
+            "exit_premium": round(float(exit_premium), 2),
+            "quantity": quantity,
+            "pnl": round(float((exit_premium - premium) * quantity), 2),
+            "reason": reason,
+        })
+        # Flat again on the exit candle: its own signal may open the next trade
+        position = exit_at
+    return trades
+
+
+def summarize(trades):
+    pnl = np.array([t["pnl"] for t in trades], dtype=float)
+    equity = np.cumsum(pnl)
+    drawdown = np.maximum.accumulate(np.concatenate(([0.0], equity)))[1:] - equity if len(pnl) else np.array([0.0])
+    return {
+        "trades": len(trades),
+        "wins": int((pnl > 0).sum()),
+        "win_rate": round(float((pnl > 0).mean() * 100), 2) if len(pnl) else 0.0,
+        "pnl": round(float(pnl.sum()), 2),
+        "avg_pnl": round(float(pnl.mean()), 2) if len(pnl) else 0.0,
+        "max_drawdown": round(float(drawdown.max()), 2),
+        "targets_hit": sum(t["reason"] == "target" for t in trades),
+    }
+
+
+def backtest(candles, strategy_name, interval=1, tgt=0, lots=1, lot_size=1, fresh_only=False, params=None,
+             exchange="NSE"):
+    """Report dict: summary, trades and throughput for one strategy over `candles`; params tune the indicators."""
+    strategy = strategy_rules.get(strategy_name)
+    if strategy is None:
+        raise ValueError(f"Unknown strategy {strategy_name}")
+    started = time.perf_counter()
+    bars = resample(candles, interval, exchange)
+    indicators_df = ind.all_indicators(bars, strategy_name, params=params).reset_index(drop=True)
+    indicators_done = time.perf_counter()
+    trades = simulate(strategy, indicators_df, tgt=tgt, lots=lots, lot_size=lot_size, fresh_only=fresh_only)
+    finished = time.perf_counter()
+    return {
+        "strategy": strategy_name,
+        "interval": int(interval),
+        "exchange": mc.normalize_exchange(exchange),
+        "candles": len(candles),
+        "bars": len(indicators_df),
+        "summary": summarize(trades),
+        "seconds": {
+            "indicators": round(indicators_done - started, 3),
+            "simulation": round(finished - indicators_done, 3),
+            "total": round(finished - started, 3),
+        },
+        "bars_per_second": round(len(indicators_df) / max(finished - started, 1e-9)),
+        "trades": trades,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backtest a production strategy on historical candles")
+    parser.add_argument("path", help="Parquet or CSV file with datetime, open, high, low, close")
+    parser.add_argument("strategy", choices=sorted(strategy_rules.STRATEGIES))
+    parser.add_argument("--interval", type=int, default=1, help="candle minutes")
+    parser.add_argument("--exchange", default="NSE", help="exchange whose session open anchors the bars (NSE, NFO, MCX)")
+    parser.add_argument("--tgt", type=float, default=0, help="target percent on the option premium")
+    parser.add_argument("--lots", type=int, default=1)
+    parser.add_argument("--lot-size", type=int, default=1)
+    parser.add_argument("--fresh-only", action="store_true", help="enter only on fresh signals, like the first trade")
+    parser.add_argument("--trades", action="store_true", help="print every trade")
+    args = parser.parse_args()
+
+    report = backtest(load_candles(args.path), args.strategy, interval=args.interval, tgt=args.tgt,
+                      lots=args.lots, lot_size=args.lot_size, fresh_only=args.fresh_only, exchange=args.exchange)
+    if not args.trades:
+        report.pop("trades")
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,247 @@
+# backend/broker_http.py
+"""
+Pooled HTTP client shared by all broker modules.
+
+One keep-alive connection pool per broker host, default timeouts and one retry
+policy for every call. The sync API (`get`/`post`/`request`) wraps a
+requests.Session per host and is what the Celery trading loop uses; the async API
+(`aget`/`apost`/`arequest`) wraps an httpx.AsyncClient per host for the FastAPI
+endpoints, and falls back to running the sync client in a thread when httpx is
+not installed.
+
+Only idempotent methods are retried, so orders are never sent twice. Retries
+happen here rather than in urllib3/httpx, so calls to known broker APIs take a
+token from rate_limiter for every attempt; a 429 pauses that bucket for every
+worker and idempotent calls are retried once the pause is over. Each
+(broker, endpoint class) also has a circuit breaker, so calls fail fast while a
+broker is down instead of each waiting out its timeout.
+"""
+import asyncio
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import backend.logger_util as logger_util
+from backend import circuit_breaker
+from backend import rate_limiter
+
+try:
+    import httpx
+except ImportError:  # async calls fall back to the sync pool in a worker thread
+    httpx = None
+
+CONNECT_TIMEOUT = float(os.getenv("BROKER_HTTP_CONNECT_TIMEOUT", "3.05"))
+READ_TIMEOUT = float(os.getenv("BROKER_HTTP_READ_TIMEOUT", "10"))
+POOL_SIZE = int(os.getenv("BROKER_HTTP_POOL_SIZE", "16"))
+RETRIES = int(os.getenv("BROKER_HTTP_RETRIES", "2"))
+BACKOFF = float(os.getenv("BROKER_HTTP_BACKOFF", "0.3"))
+HTTP2 = os.getenv("BROKER_HTTP2", "0") == "1"
+
+RETRY_STATUSES = (502, 503, 504)
+RETRY_EXCEPTIONS = (requests.exceptions.ConnectionError, requests.exceptions.Timeout)
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS", "PUT", "DELETE"})
+
+_sessions = {}
+_async_clients = {}
+_lock = threading.Lock()
+
+
+def _host(url):
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc.lower()}"
+
+
+def session_for(url):
+    """The pooled requests.Session for the url's host."""
+    host = _host(url)
+    session = _sessions.get(host)
+    if session is not None:
+        return session
+    with _lock:
+        session = _sessions.get(host)
+        if session is None:
+            session = requests.Session()
+            # No urllib3 retries: request() retries, taking a rate-limit token for each attempt
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE, max_retries=Retry(0, read=False))
+            session.mount(host, adapter)
+            _sessions[host] = session
+    return session
+
+
+def _retry_after(response):
+    try:
+        return min(float(response.headers.get("Retry-After", 1)), 60.0)
+    except (TypeError, ValueError):
+        return 1.0
+
+
+def request(method, url, **kwargs):
+    """Same signature as requests.request, on the host's pooled session."""
+    kwargs.setdefault("timeout", (CONNECT_TIMEOUT, READ_TIMEOUT))
+    limit = rate_limiter.limit_for_request(url, kwargs.get("headers"))
+    breaker = circuit_breaker.breaker_for(limit[0], limit[1]) if limit is not None else None
+    session = session_for(url)
+    attempts = RETRIES + 1 if method.upper() in IDEMPOTENT_METHODS else 1
+    for attempt in range(attempts):
+        if breaker is not None:
+            breaker.before()
+        outcome = None   # (failed, latency) once the call says something about broker health
+        response = None
+        try:
+            if limit is not None:
+                rate_limiter.acquire(*limit)
+            started = time.time()
+            try:
+                response = session.request(method, url, **kwargs)
+            except circuit_breaker.FAILURE_EXCEPTIONS as e:
+                outcome = (True, time.time() - started)
+                if attempt + 1 >= attempts or not isinstance(e, RETRY_EXCEPTIONS):
+                    raise
+            else:
+                outcome = _outcome(response, time.time() - started)
+        finally:
+            _settle_trial(breaker, outcome)
+        if response is not None:
+            if response.status_code == 429 and limit is not None:
+                # The next acquire waits out the pause
+                rate_limiter.throttle(*limit, retry_after=_retry_after(response))
+                if attempt + 1 >= attempts:
+                    return response
+                continue
+            if response.status_code not in RETRY_STATUSES or attempt + 1 >= attempts:
+                return response
+        time.sleep(BACKOFF * (2 ** attempt))
+
+
+def _outcome(response, latency):
+    """(failed, latency) for the breaker, or None for a 4xx, which says nothing about broker health."""
+    if 400 <= response.status_code < 500:
+        return None
+    return response.status_code >= 500, latency
+
+
+def _settle_trial(breaker, outcome):
+    """Record the call's outcome, or hand its breaker trial back when there is none."""
+    if breaker is None:
+        return
+    if outcome is None:
+        breaker.release()
+    else:
+        breaker.record(*outcome)
+
+
+def get(url, **kwargs):
+    return request("GET", url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request("POST", url, **kwargs)
+
+
+def put(url, **kwargs):
+    return request("PUT", url, **kwargs)
+
+
+def delete(url, **kwargs):
+    return request("DELETE", url, **kwargs)
+
+
+# ---------- async ----------
+def _async_client_for(url):
+    # httpx clients are bound to the event loop that first used them
+    key = (id(asyncio.get_running_loop()), _host(url))
+    client = _async_clients.get(key)
+    if client is None:
+        # With a transport given, httpx takes the pool limits and HTTP/2 from it, not from the client.
+        # No transport retries: arequest() retries, taking a rate-limit token for each attempt.
+        client = httpx.AsyncClient(
+            base_url=_host(url),
+            timeout=httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT),
+            transport=httpx.AsyncHTTPTransport(
+                http2=HTTP2,
+                limits=httpx.Limits(max_connections=POOL_SIZE, max_keepalive_connections=POOL_SIZE),
+            ),
+        )
+        _async_clients[key] = client
+    return client
+
+
+async def arequest(method, url, **kwargs):
+    """
+    Async request on the host's pooled client. Accepts the requests-style keywords
+    the broker modules use (params, json, data, headers, timeout).
+    """
+    if httpx is None:
+        return await asyncio.to_thread(request, method, url, **kwargs)
+
+    client = _async_client_for(url)
+    if "timeout" in kwargs and isinstance(kwargs["timeout"], tuple):
+        connect, read = kwargs["timeout"]
+        kwargs["timeout"] = httpx.Timeout(read, connect=connect)
+    if isinstance(kwargs.get("data"), (str, bytes)):
+        kwargs["content"] = kwargs.pop("data")
+
+    limit = rate_limiter.limit_for_request(url, kwargs.get("headers"))
+    breaker = circuit_breaker.breaker_for(limit[0], limit[1]) if limit is not None else None
+    attempts = RETRIES + 1 if method.upper() in IDEMPOTENT_METHODS else 1
+    for attempt in range(attempts):
+        if breaker is not None:
+            breaker.before()
+        outcome = None
+        response = None
+        try:
+            if limit is not None:
+                await rate_limiter.aacquire(*limit)
+            started = time.time()
+            try:
+                response = await client.request(method, url, **kwargs)
+            except httpx.TransportError:
+                outcome = (True, time.time() - started)
+                if attempt + 1 >= attempts:
+                    raise
+            else:
+                outcome = _outcome(response, time.time() - started)
+        finally:
+            _settle_trial(breaker, outcome)
+        if response is not None:
+            if response.status_code == 429 and limit is not None:
+                # The next aacquire waits out the pause instead of sleeping here
+                await asyncio.to_thread(rate_limiter.throttle, *limit, retry_after=_retry_after(response))
+                if attempt + 1 >= attempts:
+                    return response
+                continue
+            if response.status_code not in RETRY_STATUSES or attempt + 1 >= attempts:
+                return response
+        await asyncio.sleep(BACKOFF * (2 ** attempt))
+
+
+async def aget(url, **kwargs):
+    return await arequest("GET", url, **kwargs)
+
+
+async def apost(url, **kwargs):
+    return await arequest("POST", url, **kwargs)
+
+
+# ---------- lifecycle ----------
+def close():
+    with _lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+
+
+async def aclose():
+    """Close the async clients created on the running loop (FastAPI shutdown)."""
+    loop_id = id(asyncio.get_running_loop())
+    for key in [k for k in _async_clients if k[0] == loop_id]:
+        client = _async_clients.pop(key)
+        try:
+            await client.aclose()
+        except Exception as e:
+            logger_util.push_log(f"⚠️ Error closing HTTP client for {key[1]}: {e}", level="warning", user_id="admin", log_type="fastapi")
@@ -0,0 +1,230 @@
+# backend/broker_sessions.py
+"""
+Broker session cache shared across symbols and cycles.
+
+AngelOne: one TOTP login per account. The jwt is refreshed with the refresh token
+shortly before its `exp` claim, and the tokens are mirrored to Redis so every
+worker process reuses the same login instead of creating its own.
+
+Zerodha: one KiteConnect object per (api_key, access_token). Kite tokens cannot be
+refreshed without the user logging in again, so the object is dropped at the
+daily 06:00 IST token expiry or on the first TokenException.
+"""
+import base64
+import datetime
+import hashlib
+import json
+import threading
+import time
+from collections import defaultdict
+from zoneinfo import ZoneInfo
+
+import backend.logger_util as logger_util
+
+try:
+    from SmartApi import SmartConnect
+except ImportError:
+    SmartConnect = None
+
+try:
+    from kiteconnect import KiteConnect
+    from kiteconnect.exceptions import TokenException
+except ImportError:
+    KiteConnect = None
+    TokenException = None
+
+IST = ZoneInfo("Asia/Kolkata")
+
+# Refresh this many seconds before a token expires
+REFRESH_MARGIN = 300
+# AngelOne error codes meaning the jwt is no longer valid
+ANGELONE_AUTH_ERRORS = {"AG8001", "AG8002", "AG8003", "AB1010", "AB8050", "AB8051"}
+
+SESSION_KEY = "broker_session:{broker}:{account}"
+
+
+class _Entry:
+    __slots__ = ("value", "expires_at", "token")
+
+    def __init__(self, value, expires_at, token):
+        self.value = value
+        self.expires_at = expires_at
+        self.token = token
+
+
+_cache = {}
+_locks = defaultdict(threading.Lock)
+_locks_guard = threading.Lock()
+redis_client = logger_util.redis_client
+
+
+def _key_lock(key):
+    with _locks_guard:
+        return _locks[key]
+
+
+def _jwt_expiry(token):
+    """`exp` claim of a JWT (epoch seconds), or None if it cannot be read."""
+    try:
+        payload = str(token).replace("Bearer ", "").split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        return float(json.loads(base64.urlsafe_b64decode(payload))["exp"])
+    except Exception:
+        return None
+
+
+def _next_kite_expiry(now=None):
+    """Kite access tokens expire at 06:00 IST the next morning."""
+    now = now or datetime.datetime.now(IST)
+    expiry = now.replace(hour=6, minute=0, second=0, microsecond=0)
+    if now >= expiry:
+        expiry += datetime.timedelta(days=1)
+    return expiry.timestamp()
+
+
+def _fresh(entry, margin=REFRESH_MARGIN):
+    return entry is not None and time.time() < entry.expires_at - margin
+
+
+# ---------- AngelOne ----------
+def _angelone_store(key, account, entry):
+    _cache[key] = entry
+    if redis_client is None:
+        return
+    value = entry.value
+    ttl = int(entry.expires_at - time.time())
+    if ttl <= 0:
+        return
+    try:
+        redis_client.set(
+            SESSION_KEY.format(broker="angelone", account=account),
+            json.dumps({
+                "auth_token": value["auth_token"],
+                "refresh_token": value["refresh_token"],
+                "feed_token": value["feed_token"],
+                "expires_at": entry.expires_at,
+            }),
+            ex=ttl,
+        )
+    except Exception as e:
+        logger_util.push_log(f"⚠️ Could not share AngelOne session for {account}: {e}", level="warning", user_id="admin", log_type="trading")
+
+
+def _angelone_restore(api_key, account):
+    if redis_client is None or SmartConnect is None:
+        return None
+    try:
+        raw = redis_client.get(SESSION_KEY.format(broker="angelone", account=account))
+        if not raw:
+            return None
+        saved = json.loads(raw)
+        # SmartConnect adds the "Bearer " prefix itself
+        obj = SmartConnect(api_key=api_key, access_token=saved["auth_token"].replace("Bearer ", ""),
+                           refresh_token=saved["refresh_token"], feed_token=saved["feed_token"])
+        value = {"obj": obj, "auth_token": saved["auth_token"],
+                 "refresh_token": saved["refresh_token"], "feed_token": saved["feed_token"]}
+        return _Entry(value, float(saved["expires_at"]), saved["auth_token"])
+    except Exception:
+        return None
+
+
+def _angelone_refresh(entry):
+    obj = entry.value["obj"]
+    try:
+        data = obj.generateToken(entry.value["refresh_token"])["data"]
+        value = {"obj": obj, "auth_token": data["jwtToken"],
+                 "refresh_token": data.get("refreshToken", entry.value["refresh_token"]),
+                 "feed_token": data.get("feedToken", entry.value["feed_token"])}
+        expires_at = _jwt_expiry(value["auth_token"]) or time.time() + 6 * 3600
+        return _Entry(value, expires_at, value["auth_token"])
+    except Exception:
+        return None
+
+
+def angelone_session(api_key, client_id, pin, totp_secret, login, user_id=None):
+    """
+    Cached AngelOne session {"obj", "auth_token", "refresh_token", "feed_token"}.
+    `login(api_key, client_id, pin, totp_secret)` is only called when no valid or
+    refreshable session exists in this process or in Redis.
+    """
+    key = ("angelone", client_id)
+    with _key_lock(key):
+        entry = _cache.get(key)
+        if _fresh(entry):
+            return entry.value
+
+        if entry is not None and time.time() < entry.expires_at:
+            refreshed = _angelone_refresh(entry)
+            if refreshed is not None:
+                _angelone_store(key, client_id, refreshed)
+                logger_util.push_log(f"🔄 AngelOne session refreshed for {client_id}", level="info", user_id=user_id, log_type="trading")
+                return refreshed.value
+
+        restored = _angelone_restore(api_key, client_id)
+        if _fresh(restored):
+            _cache[key] = restored
+            return restored.value
+
+        obj, refresh_token, auth_token, feed_token = login(api_key, client_id, pin, totp_secret)
+        value = {"obj": obj, "auth_token": auth_token, "refresh_token": refresh_token, "feed_token": feed_token}
+        expires_at = _jwt_expiry(auth_token) or time.time() + 6 * 3600
+        _angelone_store(key, client_id, _Entry(value, expires_at, auth_token))
+        logger_util.push_log(f"🔐 AngelOne login for {client_id}", level="info", user_id=user_id, log_type="trading")
+        return value
+
+
+def is_angelone_auth_error(response):
+    """True for an AngelOne API response (dict) reporting an invalid or expired token."""
+    return isinstance(response, dict) and response.get("errorcode") in ANGELONE_AUTH_ERRORS
+
+
+# ---------- Zerodha ----------
+def kite_session(api_key, access_token):
+    """
+    Cached KiteConnect per (api key, access token), so users sharing one Kite app
+    keep their own client; rebuilt once the token expires.
+    """
+    # The token is hashed so it never shows up in cache keys or logs
+    key = ("zerodha", f"{api_key}:{hashlib.sha1(str(access_token).encode()).hexdigest()[:12]}")
+    with _key_lock(key):
+        entry = _cache.get(key)
+        if _fresh(entry, margin=0):
+            return entry.value
+
+        # Clients of tokens that expired (replaced at the daily re-login) are dropped here
+        for stale in [k for k, e in list(_cache.items()) if k[0] == "zerodha" and not _fresh(e, margin=0)]:
+            _cache.pop(stale, None)
+        kite = KiteConnect(api_key)
+        kite.set_access_token(access_token)
+        kite.set_session_expiry_hook(lambda: invalidate_token(access_token))
+        _cache[key] = _Entry(kite, _next_kite_expiry(), access_token)
+        return kite
+
+
+# ---------- invalidation ----------
+def is_auth_error(error):
+    """True if an exception or AngelOne response means the session must be re-created."""
+    if TokenException is not None and isinstance(error, TokenException):
+        return True
+    if is_angelone_auth_error(error):
+        return True
+    text = str(error).lower()
+    return "invalid token" in text or "token expired" in text or "invalid session" in text
+
+
+def invalidate(broker, account):
+    """Drop a cached session so the next call logs in again."""
+    _cache.pop((broker, account), None)
+    if redis_client is not None:
+        try:
+            redis_client.delete(SESSION_KEY.format(broker=broker, account=account))
+        except Exception:
+            pass
+
+
+def invalidate_token(token):
+    """Drop whichever cached session uses `token` (for callers that only hold the token)."""
+    for key, entry in list(_cache.items()):
+        if entry.token == token:
+            invalidate(*key)
+            logger_util.push_log(f"🔑 {key[0]} session for {key[1]} invalidated after an auth error", level="warning", user_id="admin", log_type="trading")
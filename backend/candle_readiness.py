@@ -0,0 +1,152 @@
+# backend/candle_readiness.py
+"""
+Adaptive readiness polling for closed candles.
+
+Brokers publish a closed candle some time after the candle ends. Instead of a fixed
+5 s retry sleep, CandleReadiness learns that publication lag per (instrument,
+interval), sleeps until just before the candle is expected, then polls with short
+exponential backoff and returns as soon as the closed candle is there.
+
+Observed lags are kept in-process and mirrored to the Redis hash
+`candle_readiness:metrics` so other workers start warm and the lag can be monitored.
+"""
+import json
+import statistics
+import threading
+from collections import deque
+
+import backend.logger_util as logger_util
+from backend import circuit_breaker
+from backend import clock
+
+METRICS_KEY = "candle_readiness:metrics"
+
+
+class _LagStats:
+    def __init__(self, initial_lag):
+        self.ewma = initial_lag
+        self.samples = 0
+        self.timeouts = 0
+        self.recent = deque(maxlen=200)
+
+    def as_dict(self):
+        recent = sorted(self.recent)
+        return {
+            "ewma": round(self.ewma, 3),
+            "p50": round(statistics.median(recent), 3) if recent else None,
+            "p90": round(recent[int(0.9 * (len(recent) - 1))], 3) if recent else None,
+            "samples": self.samples,
+            "timeouts": self.timeouts,
+        }
+
+
+class CandleReadiness:
+    def __init__(self, redis_client=None, alpha=0.2, initial_lag=1.0, lead=0.3,
+                 min_backoff=0.1, max_backoff=2.0, max_wait=30.0):
+        self.redis = redis_client
+        self.alpha = alpha
+        self.initial_lag = initial_lag
+        self.lead = lead                # start polling this long before the expected lag
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.max_wait = max_wait        # give up this long after candle close
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _field(instrument_key, interval):
+        return f"{instrument_key}|{interval}"
+
+    def _get_stats(self, instrument_key, interval):
+        field = self._field(instrument_key, interval)
+        with self._lock:
+            stats = self._stats.get(field)
+            if stats is not None:
+                return stats
+            stats = self._stats[field] = _LagStats(self.initial_lag)
+        # Warm start from whatever other workers learned
+        if self.redis is not None:
+            try:
+                raw = self.redis.hget(METRICS_KEY, field)
+                if raw:
+                    stats.ewma = float(json.loads(raw).get("ewma", self.initial_lag))
+            except Exception:
+                pass
+        return stats
+
+    def expected_lag(self, instrument_key, interval):
+        return self._get_stats(instrument_key, interval).ewma
+
+    def record(self, instrument_key, interval, lag):
+        stats = self._get_stats(instrument_key, interval)
+        with self._lock:
+            lag = max(0.0, lag)
+            stats.ewma = lag if stats.samples == 0 else (1 - self.alpha) * stats.ewma + self.alpha * lag
+            stats.samples += 1
+            stats.recent.append(lag)
+            snapshot = stats.as_dict()
+        self._publish(instrument_key, interval, snapshot)
+
+    def _record_timeout(self, instrument_key, interval):
+        stats = self._get_stats(instrument_key, interval)
+        with self._lock:
+            stats.timeouts += 1
+            snapshot = stats.as_dict()
+        self._publish(instrument_key, interval, snapshot)
+
+    def _publish(self, instrument_key, interval, snapshot):
+        if self.redis is None:
+            return
+        try:
+            self.redis.hset(METRICS_KEY, self._field(instrument_key, interval), json.dumps(snapshot))
+        except Exception:
+            pass
+
+    def metrics(self):
+        with self._lock:
+            return {field: stats.as_dict() for field, stats in self._stats.items()}
+
+    def wait_for(self, fetch, is_ready, instrument_key, interval, candle_close, user_id=None):
+        """
+        Poll `fetch()` until `is_ready(result)` for the candle that closed at epoch
+        `candle_close`. Returns the ready result, or None after `max_wait` seconds.
+        """
+        started = clock.time()
+        first_poll = candle_close + max(0.0, self.expected_lag(instrument_key, interval) - self.lead)
+        if first_poll > started:
+            clock.sleep_until(first_poll)
+
+        backoff = self.min_backoff
+        deadline = max(candle_close, started) + self.max_wait
+        polls = 0
+        while True:
+            polls += 1
+            try:
+                result = fetch()
+            except circuit_breaker.CircuitOpenError as e:
+                # Broker is down: give up now rather than polling until max_wait
+                logger_util.push_log(f"⛔ Not polling candle for {instrument_key}: {e}", user_id=user_id, level="warning", log_type="trading")
+                return None
+            except Exception as e:
+                logger_util.push_log(f"🚨 Exception while polling candle for {instrument_key}: {e}", user_id=user_id, level="error", log_type="trading")
+                result = None
+
+            now = clock.time()
+            if is_ready(result):
+                # A caller that arrives late and finds the candle on the first poll says
+                # nothing about the broker's lag, only about our own queueing
+                if started <= first_poll or polls > 1:
+                    self.record(instrument_key, interval, now - candle_close)
+                return result
+            if now + backoff > deadline:
+                break
+            clock.sleep(backoff)
+            backoff = min(backoff * 2, self.max_backoff)
+
+        self._record_timeout(instrument_key, interval)
+        logger_util.push_log(f"❌ Closed candle for {instrument_key} not published within {self.max_wait:.0f}s of close.", user_id=user_id, level="error", log_type="trading")
+        return None
+
+
+# Shared instance used by the broker fetchers
+readiness = CandleReadiness(redis_client=logger_util.redis_client)
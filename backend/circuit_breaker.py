@@ -0,0 +1,189 @@
+# backend/circuit_breaker.py
+"""
+Circuit breakers per (broker, endpoint class).
+
+Each breaker watches the last WINDOW calls. When at least MIN_CALLS have been seen
+and the share of failures (connection errors, timeouts, 5xx) or of slow calls
+crosses its threshold, the breaker opens and calls fail immediately with
+CircuitOpenError instead of waiting out a full timeout. After OPEN_SECONDS it lets
+HALF_OPEN_CALLS trial calls through: if they succeed it closes, otherwise it opens
+again. A call that ends without a verdict on broker health (the rate limiter timed
+out, the call raised an unrelated error, or the broker answered 4xx: bad input,
+auth, 429) is not counted, and its trial is released for another call. A half-open
+breaker whose trials have not finished after HALF_OPEN_SECONDS opens again, so
+lost trials cannot keep it half-open.
+
+Breakers are per process; every state change is written to the Redis hash
+`circuit_breakers` so /api/health shows the state seen by all workers.
+"""
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import requests
+
+import backend.logger_util as logger_util
+
+try:
+    from kiteconnect.exceptions import NetworkException as KiteNetworkException, DataException as KiteDataException
+    _SDK_FAILURES = (KiteNetworkException, KiteDataException)
+except ImportError:
+    _SDK_FAILURES = ()
+
+STATE_KEY = "circuit_breakers"
+
+WINDOW = int(os.getenv("CIRCUIT_WINDOW", "20"))
+MIN_CALLS = int(os.getenv("CIRCUIT_MIN_CALLS", "10"))
+FAILURE_RATE = float(os.getenv("CIRCUIT_FAILURE_RATE", "0.5"))
+SLOW_CALL_SECONDS = float(os.getenv("CIRCUIT_SLOW_CALL_SECONDS", "5"))
+SLOW_CALL_RATE = float(os.getenv("CIRCUIT_SLOW_CALL_RATE", "0.8"))
+OPEN_SECONDS = float(os.getenv("CIRCUIT_OPEN_SECONDS", "30"))
+HALF_OPEN_CALLS = int(os.getenv("CIRCUIT_HALF_OPEN_CALLS", "2"))
+HALF_OPEN_SECONDS = float(os.getenv("CIRCUIT_HALF_OPEN_SECONDS", str(OPEN_SECONDS)))
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+# Failures that count against a broker when raised by a call
+FAILURE_EXCEPTIONS = (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                      ConnectionError, TimeoutError) + _SDK_FAILURES
+
+
+class CircuitOpenError(requests.exceptions.RequestException):
+    """Fast failure while a breaker is open; a RequestException so callers treat it as a network error."""
+
+
+class CircuitBreaker:
+    def __init__(self, broker, endpoint_class):
+        self.name = f"{broker}:{endpoint_class}"
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.half_opened_at = 0.0
+        self._calls = deque(maxlen=WINDOW)   # (failed, slow)
+        self._trials = 0
+        self._lock = threading.Lock()
+
+    def before(self):
+        """Raise CircuitOpenError unless a call may go out now."""
+        with self._lock:
+            if self.state == OPEN:
+                if time.time() - self.opened_at < OPEN_SECONDS:
+                    raise CircuitOpenError(f"{self.name} circuit open, failing fast")
+                self._transition(HALF_OPEN)
+            if self.state == HALF_OPEN:
+                if time.time() - self.half_opened_at >= HALF_OPEN_SECONDS:
+                    # The trials never reported back; start another open period
+                    self._transition(OPEN)
+                    raise CircuitOpenError(f"{self.name} circuit open, half-open trials timed out")
+                if self._trials >= HALF_OPEN_CALLS:
+                    raise CircuitOpenError(f"{self.name} circuit half-open, trial calls in flight")
+                self._trials += 1
+
+    def release(self):
+        """Give back a trial taken by before() for a call that produced no verdict on broker health."""
+        with self._lock:
+            if self.state == HALF_OPEN and self._trials > 0:
+                self._trials -= 1
+
+    def record(self, failed, latency):
+        slow = latency >= SLOW_CALL_SECONDS
+        with self._lock:
+            if self.state == HALF_OPEN:
+                if failed or slow:
+                    self._transition(OPEN)
+                    return
+                self._trials -= 1
+                self._calls.append((False, False))
+                if sum(1 for f, s in self._calls if not f and not s) >= HALF_OPEN_CALLS:
+                    self._transition(CLOSED)
+                return
+            self._calls.append((failed, slow))
+            if self.state == CLOSED and len(self._calls) >= MIN_CALLS:
+                failures = sum(1 for f, _ in self._calls if f) / len(self._calls)
+                slows = sum(1 for _, s in self._calls if s) / len(self._calls)
+                if failures >= FAILURE_RATE or slows >= SLOW_CALL_RATE:
+                    self._transition(OPEN)
+
+    def _transition(self, state):
+        # Called with self._lock held
+        self.state = state
+        self._trials = 0
+        if state == OPEN:
+            self.opened_at = time.time()
+        elif state == HALF_OPEN:
+            self.half_opened_at = time.time()
+        if state in (OPEN, CLOSED):
+            self._calls.clear()
+        level = "warning" if state != CLOSED else "info"
+        logger_util.push_log(f"🔌 Circuit {self.name} is now {state}", level=level, user_id="admin", log_type="trading")
+        _publish(self.name, self.snapshot())
+
+    def snapshot(self):
+        return {
+            "state": self.state,
+            "opened_at": self.opened_at or None,
+            "calls": len(self._calls),
+            "failures": sum(1 for f, _ in self._calls if f),
+            "slow": sum(1 for _, s in self._calls if s),
+            "updated": time.time(),
+        }
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def breaker_for(broker, endpoint_class="default"):
+    key = (broker, endpoint_class)
+    breaker = _breakers.get(key)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.setdefault(key, CircuitBreaker(broker, endpoint_class))
+    return breaker
+
+
+@contextmanager
+def guard(broker, endpoint_class="default"):
+    """
+    Wrap a broker SDK call: fails fast while open and records the outcome.
+    broker_http records its own calls, so only direct SDK calls need this.
+    """
+    breaker = breaker_for(broker, endpoint_class)
+    breaker.before()
+    started = time.time()
+    try:
+        yield
+    except FAILURE_EXCEPTIONS:
+        breaker.record(True, time.time() - started)
+        raise
+    except Exception:
+        # Says nothing about the broker: neither a success nor a failure
+        breaker.release()
+        raise
+    breaker.record(False, time.time() - started)
+
+
+def _publish(name, snapshot):
+    redis_client = logger_util.redis_client
+    if redis_client is None:
+        return
+    try:
+        redis_client.hset(STATE_KEY, name, json.dumps(snapshot))
+    except Exception:
+        pass
+
+
+def report():
+    """Last published state of every breaker across workers, plus this process's unpublished ones."""
+    states = {}
+    redis_client = logger_util.redis_client
+    if redis_client is not None:
+        try:
+            states = {name: json.loads(raw) for name, raw in redis_client.hgetall(STATE_KEY).items()}
+        except Exception:
+            states = {}
+    for breaker in list(_breakers.values()):
+        states.setdefault(breaker.name, breaker.snapshot())
+    return states
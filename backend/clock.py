@@ -0,0 +1,173 @@
+# backend/clock.py
+"""
+Clock of the trading engine: use it instead of datetime.now, time.time and
+time.sleep wherever the loop's behaviour depends on the time.
+
+The default RealClock is the system clock. A VirtualClock only moves when
+something sleeps on it or it is advanced, and its sleeps return at once, so a
+replay or simulation of a whole session runs as fast as its work allows. Waits
+that move the whole engine forward (to the next candle) use sleep_until; sleep
+moves only the calling thread's time:
+
+    with clock.use(clock.VirtualClock("2025-01-06 09:14:00")):
+        run_trading_logic_for_all(...)
+
+The clock is process-wide, so every worker thread of the loop sees the same time
+(on a VirtualClock, plus whatever that thread itself has slept).
+ENGINE_CLOCK=virtual starts a process on a VirtualClock at ENGINE_CLOCK_START
+(default: now), e.g. to simulate a whole trading day with the scheduler and the
+paper broker.
+
+Use sleep/sleep_until where the wait is part of the market timeline (waiting for
+a candle, retrying a fetch) and pause for background pacing such as order-status
+polls, which should not move simulated time. Credential expiry, leases,
+heartbeats and rate limits are about the real world and stay on time.time.
+"""
+import datetime
+import os
+import threading
+import time as _time
+from contextlib import contextmanager
+from zoneinfo import ZoneInfo
+
+IST = ZoneInfo("Asia/Kolkata")
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def _epoch(value):
+    """Epoch seconds of an epoch number, aware/naive-IST datetime or IST "%Y-%m-%d %H:%M:%S" string."""
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        value = datetime.datetime.strptime(value, TIME_FORMAT)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=IST)
+    return value.timestamp()
+
+
+class RealClock:
+    virtual = False
+
+    def time(self):
+        return _time.time()
+
+    def monotonic(self):
+        return _time.monotonic()
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            _time.sleep(seconds)
+
+    def sleep_until(self, when):
+        self.sleep(when - _time.time())
+
+    def pause(self, seconds):
+        self.sleep(seconds)
+
+
+class VirtualClock:
+    """
+    Simulated time, starting at `start` (default: now).
+
+    sleep(s) returns at once and moves only the calling thread's view of the clock
+    to s seconds past the moment the call started, so symbol threads sleeping at
+    the same time do not add up their sleeps and a replay does not depend on how
+    they interleave. sleep_until, set and advance move the shared clock that every
+    thread sees; a thread's view never falls behind it.
+    """
+    virtual = True
+
+    def __init__(self, start=None):
+        self._now = _epoch(start) if start is not None else _time.time()
+        self._lock = threading.Lock()
+        self._thread = threading.local()
+
+    def time(self):
+        ahead = getattr(self._thread, "now", None)
+        return ahead if ahead is not None and ahead > self._now else self._now
+
+    def monotonic(self):
+        return self.time()
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            self._thread.now = self.time() + seconds
+
+    def sleep_until(self, when):
+        # Threads waiting for the same moment move the clock there once
+        self.set(when)
+
+    def pause(self, seconds):
+        pass
+
+    def advance(self, seconds):
+        """Move the shared clock `seconds` forward."""
+        if seconds > 0:
+            with self._lock:
+                self._now += seconds
+
+    def set(self, when):
+        """Move to `when`; never backwards."""
+        with self._lock:
+            self._now = max(self._now, _epoch(when))
+
+
+_clock = VirtualClock(os.getenv("ENGINE_CLOCK_START") or None) if os.getenv("ENGINE_CLOCK") == "virtual" else RealClock()
+
+
+def current():
+    return _clock
+
+
+def install(new_clock):
+    """Make `new_clock` the process clock; returns the previous one."""
+    global _clock
+    previous, _clock = _clock, new_clock
+    return previous
+
+
+@contextmanager
+def use(new_clock):
+    previous = install(new_clock)
+    try:
+        yield new_clock
+    finally:
+        install(previous)
+
+
+def is_virtual():
+    return _clock.virtual
+
+
+def time():
+    return _clock.time()
+
+
+def monotonic():
+    return _clock.monotonic()
+
+
+def sleep(seconds):
+    _clock.sleep(seconds)
+
+
+def sleep_until(when):
+    """Sleep until epoch `when` (a no-op once it has passed)."""
+    _clock.sleep_until(when)
+
+
+def pause(seconds):
+    """
+    Background wait: a real sleep on the RealClock. On a VirtualClock it returns at
+    once without moving the clock, so a polling loop runs its iterations back to back.
+    """
+    _clock.pause(seconds)
+
+
+def now(tz=IST):
+    return datetime.datetime.fromtimestamp(_clock.time(), tz)
+
+
+def today():
+    """Today's date in IST."""
+    return now().date()
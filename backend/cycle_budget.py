@@ -0,0 +1,178 @@
+# backend/cycle_budget.py
+"""
+Per-cycle latency budget.
+
+A signal acted on long after the candle closed is worse than none, so every
+trading cycle gets a deadline: the candle close plus DEADLINE_FRACTION of the
+interval, clamped to [DEADLINE_MIN_SECONDS, DEADLINE_MAX_SECONDS]. Each symbol
+times its stages (queue, fetch, indicators, decision, order) against it.
+
+A symbol that is still running when the deadline passes is downgraded:
+  exit_only  (default) keeps evaluating it, but the order pipeline drops entries
+  skip       stops it at the next stage boundary
+Entries are never sent after the deadline; exits always are.
+
+At the end of a cycle the report is stored under `cycle_budget:{user_id}` and
+served by /api/cycle-budget/{user_id}.
+"""
+import contextvars
+import datetime
+import json
+import os
+import threading
+from contextlib import contextmanager
+
+import backend.logger_util as logger_util
+from backend import clock
+from backend.cycle_scheduler import IST, TIME_FORMAT
+
+REPORT_KEY = "cycle_budget:{user_id}"
+REPORT_TTL = 24 * 3600
+
+DEADLINE_FRACTION = float(os.getenv("CYCLE_DEADLINE_FRACTION", "0.25"))
+DEADLINE_MIN_SECONDS = float(os.getenv("CYCLE_DEADLINE_MIN_SECONDS", "10"))
+DEADLINE_MAX_SECONDS = float(os.getenv("CYCLE_DEADLINE_MAX_SECONDS", "90"))
+LATE_POLICY = os.getenv("CYCLE_LATE_POLICY", "exit_only")  # exit_only | skip
+
+STAGES = ("queue", "fetch", "indicators", "decision", "order")
+FULL, EXIT_ONLY, SKIP = "full", "exit_only", "skip"
+
+# SymbolBudget of the symbol running in this thread, read by the order pipeline
+_current = contextvars.ContextVar("cycle_budget_symbol", default=None)
+
+
+def budget_seconds(interval_minutes):
+    try:
+        minutes = int(interval_minutes or 1)
+    except (TypeError, ValueError):
+        minutes = 1
+    return min(max(minutes * 60 * DEADLINE_FRACTION, DEADLINE_MIN_SECONDS), DEADLINE_MAX_SECONDS)
+
+
+class CycleBudget:
+    def __init__(self, user_id, now_interval, interval_minutes):
+        self.user_id = user_id
+        self.interval = now_interval
+        self.started = clock.time()
+        try:
+            candle_close = datetime.datetime.strptime(now_interval, TIME_FORMAT).replace(tzinfo=IST).timestamp()
+        except (TypeError, ValueError):
+            candle_close = self.started
+        self.budget = budget_seconds(interval_minutes)
+        self.deadline = candle_close + self.budget
+        self.symbols = {}
+        self._lock = threading.Lock()
+
+    def remaining(self):
+        return self.deadline - clock.time()
+
+    def expired(self):
+        return clock.time() >= self.deadline
+
+    def symbol(self, symbol):
+        budget = SymbolBudget(self, symbol)
+        with self._lock:
+            self.symbols[symbol] = budget
+        return budget
+
+    def report(self):
+        symbols = {name: b.report() for name, b in list(self.symbols.items())}
+        stage_max = {
+            stage: max((s["stages"].get(stage, 0.0) for s in symbols.values()), default=0.0)
+            for stage in STAGES
+        }
+        finished = [s["finished_in"] for s in symbols.values() if s["finished_in"] is not None]
+        return {
+            "interval": self.interval,
+            "budget_seconds": round(self.budget, 3),
+            "deadline": datetime.datetime.fromtimestamp(self.deadline, IST).strftime(TIME_FORMAT),
+            "started_in": round(self.started - (self.deadline - self.budget), 3),
+            "slowest_symbol_in": round(max(finished), 3) if finished else None,
+            "met": all(s["mode"] == FULL for s in symbols.values()),
+            "late": sorted(name for name, s in symbols.items() if s["mode"] != FULL),
+            "stage_max": {k: round(v, 3) for k, v in stage_max.items()},
+            "symbols": symbols,
+            "updated": clock.time(),
+        }
+
+    def publish(self, redis_client):
+        """Store the cycle's report for the API and log a summary when symbols were late."""
+        report = self.report()
+        if report["late"]:
+            logger_util.push_log(
+                f"⏰ {len(report['late'])} symbol(s) missed the {report['budget_seconds']}s budget for {self.interval}: {', '.join(report['late'])}",
+                level="warning", user_id=self.user_id, log_type="trading")
+        try:
+            redis_client.set(REPORT_KEY.format(user_id=self.user_id), json.dumps(report), ex=REPORT_TTL)
+        except Exception:
+            pass
+        return report
+
+
+class SymbolBudget:
+    """Stage timings and late-downgrade state of one symbol in one cycle."""
+
+    def __init__(self, cycle, symbol):
+        self.cycle = cycle
+        self.symbol = symbol
+        self.mode = FULL
+        self.stages = {}
+        self.finished_at = None
+        self._lap = cycle.started
+
+    def lap(self, stage):
+        """Record the time since the previous lap as `stage`."""
+        now = clock.time()
+        self.record(stage, now - self._lap)
+        self._lap = now
+
+    def record(self, stage, seconds):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def proceed(self, stage):
+        """
+        Called before `stage`; returns False when the symbol should stop here.
+        Past the deadline the symbol is downgraded once, following LATE_POLICY.
+        """
+        if self.mode == FULL and self.cycle.expired():
+            self.mode = SKIP if LATE_POLICY == SKIP else EXIT_ONLY
+            action = "skipping it" if self.mode == SKIP else "exits only"
+            logger_util.push_log(f"⏰ {self.symbol} reached {stage} {round(-self.cycle.remaining(), 2)}s past the cycle deadline, {action}",
+                                 level="warning", user_id=self.cycle.user_id, log_type="trading")
+        return self.mode != SKIP
+
+    def allows_entry(self):
+        if self.mode == FULL and self.cycle.expired():
+            self.mode = EXIT_ONLY
+        return self.mode == FULL
+
+    def finish(self):
+        self.finished_at = clock.time()
+
+    def report(self):
+        candle_close = self.cycle.deadline - self.cycle.budget
+        return {
+            "mode": self.mode,
+            "stages": {k: round(v, 3) for k, v in self.stages.items()},
+            "finished_in": round(self.finished_at - candle_close, 3) if self.finished_at else None,
+        }
+
+
+def current():
+    return _current.get()
+
+
+@contextmanager
+def track(symbol_budget):
+    """Make `symbol_budget` the current one for the order pipeline inside the block."""
+    token = _current.set(symbol_budget)
+    try:
+        yield symbol_budget
+    finally:
+        symbol_budget.finish()
+        _current.reset(token)
+
+
+def latest_report(redis_client, user_id):
+    raw = redis_client.get(REPORT_KEY.format(user_id=user_id))
+    return json.loads(raw) if raw else None
@@ -0,0 +1,97 @@
+# backend/cycle_scheduler.py
+"""
+Candle-close aligned waiting for the trading loop.
+
+Instead of spinning between intervals, the loop sleeps until the next candle-close
+deadline (from Next_Now_intervals) and is woken early by control messages published
+on `trading_control:{user_id}` (stop, kill, symbol changes). The same messages go
+to `trading_scheduler:control` for the multi-tenant trading scheduler.
+"""
+import datetime
+import json
+from zoneinfo import ZoneInfo
+
+import backend.logger_util as logger_util
+from backend import clock
+
+IST = ZoneInfo("Asia/Kolkata")
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+SCHEDULER_CHANNEL = "trading_scheduler:control"
+
+
+def control_channel(user_id: str) -> str:
+    return f"trading_control:{user_id}"
+
+
+def publish_control(redis_client, user_id, action, **fields):
+    """Wake a user's trading loop with a control message such as kill/stop/disconnect."""
+    message = json.dumps({"action": action, "user_id": user_id, **fields})
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.publish(control_channel(user_id), message)
+        pipe.publish(SCHEDULER_CHANNEL, message)
+        pipe.execute()
+    except Exception as e:
+        logger_util.push_log(f"⚠️ Could not publish control message {action} for {user_id}: {e}", level="warning", user_id=user_id, log_type="fastapi")
+
+
+def _epoch(deadline: str) -> float:
+    return datetime.datetime.strptime(deadline, TIME_FORMAT).replace(tzinfo=IST).timestamp()
+
+
+def seconds_until(deadline: str) -> float:
+    """Seconds from now until an IST "%Y-%m-%d %H:%M:%S" deadline (negative if passed)."""
+    target = datetime.datetime.strptime(deadline, TIME_FORMAT).replace(tzinfo=IST)
+    return (target - clock.now(IST)).total_seconds()
+
+
+class CandleCloseScheduler:
+    """Sleeps a single user's loop until the next deadline or an incoming control message."""
+
+    def __init__(self, redis_client, user_id):
+        self.user_id = user_id
+        self.pubsub = None
+        try:
+            self.pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+            self.pubsub.subscribe(control_channel(user_id))
+        except Exception as e:
+            logger_util.push_log(f"⚠️ Control channel unavailable, falling back to timed sleeps: {e}", level="warning", user_id=user_id, log_type="trading")
+            self.pubsub = None
+
+    def wait_until(self, deadline: str):
+        """
+        Block until `deadline` passes. Returns the decoded control message if one woke
+        the loop early, otherwise None.
+        """
+        while True:
+            remaining = seconds_until(deadline)
+            if remaining <= 0:
+                return None
+            if self.pubsub is None:
+                if clock.is_virtual():
+                    clock.sleep_until(_epoch(deadline))
+                else:
+                    clock.sleep(min(remaining, 1.0))
+                continue
+            try:
+                # Under a virtual clock only pending messages count; the sleep below jumps to the deadline
+                msg = self.pubsub.get_message(timeout=0 if clock.is_virtual() else remaining)
+            except Exception as e:
+                logger_util.push_log(f"⚠️ Control channel error, falling back to timed sleeps: {e}", level="warning", user_id=self.user_id, log_type="trading")
+                self.pubsub = None
+                continue
+            if msg and msg.get("type") == "message":
+                try:
+                    return json.loads(msg["data"])
+                except (TypeError, ValueError):
+                    return {"action": str(msg["data"])}
+            if clock.is_virtual():
+                clock.sleep_until(_epoch(deadline))
+
+    def close(self):
+        if self.pubsub is not None:
+            try:
+                self.pubsub.close()
+            except Exception:
+                pass
+            self.pubsub = None
@@ -3,9 +3,11 @@ import datetime
 import pytz
 import pandas as pd
 
+from backend import clock
+
 def get_expiry_date(spot_value, stock):
 
-    now = datetime.datetime.now(pytz.timezone('Asia/Kolkata'))
+    now = clock.now(pytz.timezone('Asia/Kolkata'))
     # Switch to next weekly expiry after 3:15 PM on Wednesday
     if now.weekday() == 2 and now.time() >= datetime.time(15, 15):
         weekly_expiry = (now + datetime.timedelta(days=7)).date()
@@ -21,7 +23,7 @@ def get_expiry_date(spot_value, stock):
     instruments['expiry'] = pd.to_datetime(instruments['expiry'], errors='coerce')
 
     # Get today's date
-    today = datetime.datetime.today()
+    today = clock.now().replace(tzinfo=None)
 
     # -- Monthly Expiry Logic --
     target_month = today.month + 1 if today.day > 20 else today.month
@@ -3,6 +3,8 @@ import pandas as pd
 from datetime import datetime
 import calendar
 
+from backend import clock
+
 instruments = pd.read_csv("https://assets.upstox.com/market-quote/instruments/exchange/complete.csv.gz")
 
 def lot_size(name):
@@ -53,7 +55,7 @@ def commodity_lot_size(name, symbol):
         return pd.DataFrame()
 
     # --- Generate current & next month expiry codes ---
-    today = datetime.now()
+    today = clock.now().replace(tzinfo=None)
     year = today.year
     month = today.month
 
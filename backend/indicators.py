@@ -1,82 +1,95 @@
 
 import pandas as pd
 import numpy as np
-import ta
-def supertrend(df, period=8, multiplier=3.2):
-    # --- ATR ---
-    atr = ta.volatility.AverageTrueRange(
-        df['high'], df['low'], df['close'], window=period
-    ).average_true_range()
-
-    hl2 = (df['high'] + df['low']) / 2
-
-    upperband = hl2 + multiplier * atr
-    lowerband = hl2 - multiplier * atr
+from backend import strategy_rules
+def _atr(high, low, close, window):
+    """Wilder ATR over NumPy arrays, value for value the same as ta's AverageTrueRange."""
+    prev_close = np.concatenate(([np.nan], close[:-1]))
+    true_range = np.nanmax(np.vstack([high - low, np.abs(high - prev_close), np.abs(low - prev_close)]), axis=0)
+    atr = np.zeros(len(close))
+    if len(close) < window:
+        return atr
+    atr[window - 1] = true_range[:window].mean()
+    smoothed = pd.Series(np.concatenate(([atr[window - 1]], true_range[window:]))).ewm(alpha=1 / window, adjust=False).mean()
+    atr[window - 1:] = smoothed.to_numpy()
+    return atr
 
-    # Prepare arrays
-    supertrend = [True] * len(df)
-    final_upper = upperband.copy()
-    final_lower = lowerband.copy()
-
-    # --- MAIN LOOP (no deprecated behavior) ---
-    for i in range(1, len(df)):
-        curr_close = df['close'].iat[i]
-        prev_close = df['close'].iat[i - 1]
 
+def supertrend(df, period=8, multiplier=3.2):
+    high = df['high'].to_numpy(dtype=float)
+    low = df['low'].to_numpy(dtype=float)
+    close = df['close'].to_numpy(dtype=float)
+    atr = _atr(high, low, close, period)
+
+    hl2 = (high + low) / 2
+    # The band recursion is sequential; plain floats keep the loop cheap on long histories
+    final_upper = (hl2 + multiplier * atr).tolist()
+    final_lower = (hl2 - multiplier * atr).tolist()
+    closes = close.tolist()
+    trend = [True] * len(closes)
+
+    for i in range(1, len(closes)):
         # Trend flip
-        if curr_close > final_upper.iat[i - 1]:
-            supertrend[i] = True
-        elif curr_close < final_lower.iat[i - 1]:
-            supertrend[i] = False
+        if closes[i] > final_upper[i - 1]:
+            trend[i] = True
+        elif closes[i] < final_lower[i - 1]:
+            trend[i] = False
         else:
             # inherit trend
-            supertrend[i] = supertrend[i - 1]
+            trend[i] = trend[i - 1]
 
             # adjust lower band if trend is bullish
-            if supertrend[i] and final_lower.iat[i] < final_lower.iat[i - 1]:
-                final_lower.iat[i] = final_lower.iat[i - 1]
+            if trend[i] and final_lower[i] < final_lower[i - 1]:
+                final_lower[i] = final_lower[i - 1]
 
             # adjust upper band if trend is bearish
-            if not supertrend[i] and final_upper.iat[i] > final_upper.iat[i - 1]:
-                final_upper.iat[i] = final_upper.iat[i - 1]
+            if not trend[i] and final_upper[i] > final_upper[i - 1]:
+                final_upper[i] = final_upper[i - 1]
 
     # Create final supertrend line
-    df['supertrend'] = [
-        final_lower.iat[i] if supertrend[i] else final_upper.iat[i]
-        for i in range(len(df))
-    ]
-
-    return df['supertrend']
-    
-def all_indicators(df,strategy):
-    df = df.copy()
-    tf =df.copy()
-
-    # ========================
-    # ✅ ATR (for Supertrend & ADX)
-    # ========================
-    high_low = df['high'] - df['low']
-    high_close = (df['high'] - df['close'].shift()).abs()
-    low_close = (df['low'] - df['close'].shift()).abs()
-    tr = pd.concat([high_low, high_close, low_close], axis=1).max(axis=1)
-
-    
-    df['Supertrend'] = supertrend(df, period=8, multiplier=3.2)
-
-    # ========================
-    # ✅ MACD (12,26,9)
-    # ========================
-    ema12 = df['close'].ewm(span=12, adjust=False).mean()
-    ema26 = df['close'].ewm(span=26, adjust=False).mean()
-    df['MACD'] = ema12 - ema26
-    df['MACD_signal'] = df['MACD'].ewm(span=9, adjust=False).mean()
-    df['MACD_hist'] = df['MACD'] - df['MACD_signal']
-
-
-    # ========================
-    # ✅ ADX (14) with EMA 21 smoothing
-    # ========================
-    period = 14
+    return pd.Series(np.where(trend, final_lower, final_upper), index=df.index)
+
+# Indicator parameters; the column names stay the same whatever the values
+DEFAULT_PARAMS = {
+    "supertrend_period": 8,
+    "supertrend_multiplier": 3.2,
+    "macd_fast": 12,
+    "macd_slow": 26,
+    "macd_signal": 9,
+    "adx_period": 14,
+    "adx_ema": 21,
+    "willr_period": 14,
+    "ema_fast": 10,
+    "ema_slow": 20,
+}
+
+# Parameters each strategy column depends on
+PARAMS_BY_COLUMN = {
+    "Supertrend": ("supertrend_period", "supertrend_multiplier"),
+    "MACD": ("macd_fast", "macd_slow"),
+    "MACD_signal": ("macd_fast", "macd_slow", "macd_signal"),
+    "ADX": ("adx_period",),
+    "ADX_EMA21": ("adx_period", "adx_ema"),
+    "WillR_14": ("willr_period",),
+    "ema10": ("ema_fast",),
+    "ema20": ("ema_slow",),
+}
+
+
+def _cached(cache, key, compute):
+    if cache is None:
+        return compute()
+    if key not in cache:
+        cache[key] = compute()
+    return cache[key]
+
+
+def ema(close, span):
+    return close.ewm(span=span, adjust=False).mean()
+
+
+def adx(df, period=14):
+    tf = df.copy()
     tf['upMove'] = tf['high'].diff()
     tf['downMove'] = tf['low'].diff() * -1
 
@@ -97,35 +110,66 @@ def all_indicators(df,strategy):
     tf['-DI14'] = 100 * (tf['-DM14'] / tf['TR14'])
 
     tf['DX'] = (100 * (abs(tf['+DI14'] - tf['-DI14']) / (tf['+DI14'] + tf['-DI14'])))
-    df['ADX'] = tf['DX'].ewm(alpha=1 / period, adjust=False).mean()
+    return tf['DX'].ewm(alpha=1 / period, adjust=False).mean()
 
-    # Optional: EMA 21 smoothing
-    df['ADX_EMA21'] = df['ADX'].ewm(span=21, adjust=False).mean()
+
+def willr(df, window=14):
+    high14 = df['high'].rolling(window).max()
+    low14 = df['low'].rolling(window).min()
+    return (high14 - df['close']) / (high14 - low14) * -100
+
+
+def all_indicators(df, strategy, params=None, cache=None):
+    """
+    Indicator frame for `strategy`. `params` overrides DEFAULT_PARAMS; `cache`
+    (a dict kept for one candle frame) reuses each indicator across calls with
+    different parameters, as parameter sweeps do.
+    """
+    p = {**DEFAULT_PARAMS, **(params or {})}
+    df = df.copy()
+    close = df['close']
+
+    # ========================
+    # ✅ Supertrend (ATR bands)
+    # ========================
+    df['Supertrend'] = _cached(cache, ("supertrend", p["supertrend_period"], p["supertrend_multiplier"]),
+                               lambda: supertrend(df, period=p["supertrend_period"], multiplier=p["supertrend_multiplier"]))
+
+    # ========================
+    # ✅ MACD (12,26,9)
+    # ========================
+    fast = _cached(cache, ("ema", p["macd_fast"]), lambda: ema(close, p["macd_fast"]))
+    slow = _cached(cache, ("ema", p["macd_slow"]), lambda: ema(close, p["macd_slow"]))
+    df['MACD'] = fast - slow
+    df['MACD_signal'] = _cached(cache, ("macd_signal", p["macd_fast"], p["macd_slow"], p["macd_signal"]),
+                                lambda: ema(df['MACD'], p["macd_signal"]))
+    df['MACD_hist'] = df['MACD'] - df['MACD_signal']
+
+    # ========================
+    # ✅ ADX (14) with EMA 21 smoothing
+    # ========================
+    df['ADX'] = _cached(cache, ("adx", p["adx_period"]), lambda: adx(df, p["adx_period"]))
+    df['ADX_EMA21'] = _cached(cache, ("adx_ema", p["adx_period"], p["adx_ema"]), lambda: ema(df['ADX'], p["adx_ema"]))
 
     # ========================
     # ✅ Williams %R (14)
     # ========================
-    window = 14
-    high14 = df['high'].rolling(window).max()
-    low14 = df['low'].rolling(window).min()
-    df['WillR_14'] = (high14 - df['close']) / (high14 - low14) * -100
+    df['WillR_14'] = _cached(cache, ("willr", p["willr_period"]), lambda: willr(df, p["willr_period"]))
     # ========================
-    # ✅ EMA 5, EMA 15
+    # ✅ EMA 10, EMA 20
     # ========================
-    df['ema10'] = df['close'].ewm(span=10, adjust=False).mean()
-    df['ema20'] = df['close'].ewm(span=20, adjust=False).mean()
+    df['ema10'] = _cached(cache, ("ema", p["ema_fast"]), lambda: ema(close, p["ema_fast"]))
+    df['ema20'] = _cached(cache, ("ema", p["ema_slow"]), lambda: ema(close, p["ema_slow"]))
 
     df.dropna(inplace=True)
     df = df.round(2)
     base_cols = ['datetime', 'open', 'high', 'low', 'close']
     indicator_cols = []
 
-    if strategy == "ADX_MACD_WillR_Supertrend":
-        indicator_cols = ['Supertrend', 'MACD', 'MACD_signal', 'ADX', 'WillR_14', 'ema10', 'ema20']
-    elif strategy == "Ema10_Ema20_Supertrend":
-        indicator_cols = ['ema10', 'ema20', 'Supertrend']
-    elif strategy == "Ema10_Ema20_MACD_Supertrend":
-        indicator_cols = ['ema10', 'ema20', 'MACD', 'MACD_signal', 'Supertrend']
+    rules = strategy_rules.get(strategy)
+    if rules is not None:
+        # The columns the strategy's rules read
+        indicator_cols = [c for c in rules.columns if c not in base_cols]
     else:
         # default: return all computed indicators plus base columns
         indicator_cols = ['Supertrend', 'MACD', 'MACD_signal', 'MACD_hist', 'ADX', 'ADX_EMA21', 'WillR_14', 'ema10', 'ema20']
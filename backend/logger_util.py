@@ -7,6 +7,8 @@ from datetime import datetime
 import datetime as _dt
 from zoneinfo import ZoneInfo
 import logging
+import threading
+from contextlib import contextmanager
 from urllib.parse import urlparse
 
 # Event loop is injected from main_fastapi on startup
@@ -71,6 +73,29 @@ def _ensure_dir(path: str):
     except Exception as e:
         console_logger.warning(f"[logger_util] Could not create dir {path}: {e}")
 
+# ==========================================================
+# 🧵 Per-thread log buffering (ordered output from worker pools)
+# ==========================================================
+_log_buffer = threading.local()
+
+@contextmanager
+def buffered_logs():
+    """
+    Collect push_log entries made by the current thread instead of emitting them.
+    Yields the buffer list; pass it to flush_logs() to emit in the original order.
+    """
+    previous = getattr(_log_buffer, "entries", None)
+    _log_buffer.entries = []
+    try:
+        yield _log_buffer.entries
+    finally:
+        _log_buffer.entries = previous
+
+def flush_logs(buffer):
+    """Emit entries collected by buffered_logs(), keeping their original timestamps."""
+    for entry_json, ts, level, user_id, log_type in buffer or []:
+        _emit_log(entry_json, ts, level, user_id, log_type)
+
 # ==========================================================
 # 📡 push_log - main logging API
 # ==========================================================
@@ -105,6 +130,15 @@ def push_log(message: str, level: str = "info", user_id: str | None = None, log_
             "user_id": user_id
         })
 
+    # Inside buffered_logs() the entry is held back and emitted later by flush_logs()
+    buffer = getattr(_log_buffer, "entries", None)
+    if buffer is not None:
+        buffer.append((entry_json, ts, level, user_id, log_type))
+        return
+
+    _emit_log(entry_json, ts, level, user_id, log_type)
+
+def _emit_log(entry_json: str, ts: str, level: str, user_id: str | None, log_type: str):
     # Console output
     try:
         if level.lower() == "error":
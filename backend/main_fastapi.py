@@ -20,6 +20,12 @@ from backend import get_expiry_date as ed
 from backend import find_positions_with_symbol as fps
 from backend import user_manager as usr
 from backend import Upstox as us
+from backend import cycle_scheduler as cs
+from backend import session_lease as sl
+from backend import broker_http
+from backend import rate_limiter
+from backend import circuit_breaker
+from backend import cycle_budget
 
 # Import helpers used in many endpoints
 from backend.update_db import init_db
@@ -40,7 +46,8 @@ broker_map = {
     "z": "Zerodha",
     "a": "AngelOne",
     "g": "Groww",
-    "5": "5paisa"
+    "5": "5paisa",
+    "p": "Paper"
 }
 
 REDIS_URL = os.getenv("REDIS_URL", "").strip()
@@ -70,6 +77,7 @@ except Exception:
 
 # Import the task
 from backend.tasks.trading_tasks import start_trading_loop
+from backend import trading_scheduler as tsch
 
 # Create FastAPI app
 app = FastAPI(title="Astavyuha Backend (FastAPI wrapper)", version="1.0.0")
@@ -95,6 +103,12 @@ async def startup_event():
     logger_util.fastapi_log(f"🔥 logger_util.event_loop SET to: {logger_util.event_loop}", user_id = "admin", level = "info")
 
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    await broker_http.aclose()
+    broker_http.close()
+
+
 async def _redis_listener(pubsub):
     loop = asyncio.get_event_loop()
     while True:
@@ -122,6 +136,9 @@ class RegisterRequest(BaseModel):
 # ---------- DB Helpers ----------
 DB_PATH = os.path.join(os.getcwd(), "user_data_new.db")
 
+# "celery": one Celery task per user; "scheduler": start/stop go to the trading scheduler process
+TRADING_ENGINE = os.getenv("TRADING_ENGINE", "celery")
+
 def get_kill_key(user_id: str) -> str:
     return f"kill_trading:{user_id}"
 
@@ -141,7 +158,27 @@ def get_user_row_by_userid(userId: str):
 # ---------- Endpoints ----------
 @app.get("/api/health")
 async def health():
-    return {"status": "ok", "message": "FastAPI backend running"}
+    brokers = await asyncio.to_thread(circuit_breaker.report)
+    degraded = sorted(name for name, state in brokers.items() if state.get("state") != "closed")
+    return {
+        "status": "degraded" if degraded else "ok",
+        "message": "FastAPI backend running",
+        "degraded": degraded,
+        "brokers": brokers,
+    }
+
+
+@app.get("/api/rate-limits")
+async def rate_limit_metrics():
+    return {"success": True, "metrics": await asyncio.to_thread(rate_limiter.metrics)}
+
+
+@app.get("/api/cycle-budget/{user_id}")
+async def cycle_budget_report(user_id: str):
+    report = await asyncio.to_thread(cycle_budget.latest_report, redis_client, user_id)
+    if report is None:
+        return {"success": False, "message": "No trading cycle recorded yet"}
+    return {"success": True, "report": report}
 
 
 @app.post("/api/login")
@@ -321,8 +358,9 @@ async def stop_all_trading(request: Request):
     if not user_id:
         return {"success": False, "message": "Missing userId"}
 
-    # Set kill flag in Redis
-    redis_client.set(get_kill_key(user_id), "1")
+    # Set kill flag for the running session in Redis and wake the sleeping trading loop
+    redis_client.set(get_kill_key(user_id), sl.current_session(redis_client, user_id) or "1")
+    cs.publish_control(redis_client, user_id, "kill")
     logger_util.fastapi_log(f"Stop All Trades initiated by user {user_id}", user_id=user_id, level="info")
     return {"success": True, "message": f"Stop signal sent for {user_id}"}
 
@@ -343,19 +381,29 @@ async def start_all_trading(request: Request):
         "tradingParameters": trading_params,
         "selectedBrokers": selected_brokers
     }
-    # ❗ Clear STOP flag before starting new trading session
-    redis_client.delete(get_kill_key(user_id))
+    # Default mode: one Celery task per user (TRADING_ENGINE=celery)
+    if TRADING_ENGINE == "celery":
+        # ❗ A new session id ends any previous session, even one that has not seen its STOP flag yet
+        config["session_id"] = sl.new_session(redis_client, user_id)
+        if redis_client.get(get_kill_key(user_id)) == "1":
+            # A STOP flag that names no session would stop this one too
+            redis_client.delete(get_kill_key(user_id))
+        cs.publish_control(redis_client, user_id, "superseded")
+        try:
+            task = start_trading_loop.delay(config)
+            logger_util.push_log(f"🟢 Celery task {task.id} started.", user_id=user_id)
+            return {"success": True, "task_id": task.id, "message": "Trading started"}
+        except Exception as e:
+            logger_util.push_log(f"❌ Failed to start celery task: {e}", user_id=user_id, level="error", log_type = "fastapi")
+            return JSONResponse({"success": False, "message": str(e)}, status_code=500)
+
+    # The trading scheduler replaces any previous session and picks this one up from Redis
     try:
-        task = start_trading_loop.delay(config)
-        logger_util.push_log(f"🟢 Celery task {task.id} started.", user_id=user_id)
-        response = {
-            "success": True,
-            "task_id": task.id,
-            "message": "Trading started"
-        }
-        return response
+        await asyncio.to_thread(tsch.start_session, redis_client, config)
+        logger_util.push_log(f"🟢 Trading session sent to scheduler.", user_id=user_id, log_type = "fastapi")
+        return {"success": True, "message": "Trading started"}
     except Exception as e:
-        logger_util.push_log(f"❌ Failed to start celery task: {e}", user_id=user_id, level="error", log_type = "fastapi")
+        logger_util.push_log(f"❌ Failed to start trading session: {e}", user_id=user_id, level="error", log_type = "fastapi")
         return JSONResponse({"success": False, "message": str(e)}, status_code=500)
 
 
@@ -370,6 +418,7 @@ async def connect_broker(request: Request):
         import backend.Groww as gr
         import backend.Fivepaisa as fp
         import backend.AngelOne as ar
+        import backend.Paper as pp
 
         data = await request.json()
         # ✅ Extract user_id safely
@@ -396,8 +445,10 @@ async def connect_broker(request: Request):
             try:
                 if broker_name == "Upstox":
                     access_token = creds.get("access_token")
-                    profile = us.upstox_profile(user_id, access_token)
-                    balance = us.upstox_balance(user_id, access_token)
+                    profile, balance = await asyncio.gather(
+                        us.upstox_profile_async(user_id, access_token),
+                        us.upstox_balance_async(user_id, access_token),
+                    )
                     if profile and balance:
                         status, message = "success", "Connected successfully."
                     else:
@@ -406,8 +457,10 @@ async def connect_broker(request: Request):
                 elif broker_name == "Zerodha":
                     api_key = creds.get("api_key")
                     access_token = creds.get("access_token")
-                    profile = zr.zerodha_get_profile(api_key, access_token)
-                    balance = zr.zerodha_get_equity_balance(api_key, access_token)
+                    profile, balance = await asyncio.gather(
+                        zr.zerodha_get_profile_async(api_key, access_token),
+                        asyncio.to_thread(zr.zerodha_get_equity_balance, api_key, access_token),
+                    )
                     if profile and balance:
                         status, message = "success", "Connected successfully."
                     else:
@@ -418,10 +471,13 @@ async def connect_broker(request: Request):
                     angel_user_id = creds.get("user_id")
                     pin = creds.get("pin")
                     totp_secret = creds.get("totp_secret")
-                    obj, refresh_token, auth_token, feed_token = ar.angelone_connect(
-                        api_key, angel_user_id, pin, totp_secret
+                    # Shared with the trading loop, so connecting does not force another TOTP login later
+                    session = await asyncio.to_thread(
+                        ar.angelone_get_session, api_key, angel_user_id, pin, totp_secret, user_id
                     )
-                    profile, balance = ar.angelone_fetch_profile_and_balance(obj, refresh_token)
+                    obj, refresh_token = session["obj"], session["refresh_token"]
+                    auth_token, feed_token = session["auth_token"], session["feed_token"]
+                    profile, balance = await asyncio.to_thread(ar.angelone_fetch_profile_and_balance, obj, refresh_token)
                     if profile and balance:
                         status, message = "success", "Connected successfully."
                         broker_sessions[broker_name] = {
@@ -438,7 +494,7 @@ async def connect_broker(request: Request):
                     access_token = creds.get("access_token")
                     client_code = creds.get("client_id")
                     profile = {"User Name": client_code}
-                    balance = fp.fivepaisa_get_balance(app_key, access_token, client_code)
+                    balance = await asyncio.to_thread(fp.fivepaisa_get_balance, app_key, access_token, client_code)
                     if profile and balance:
                         status, message = "success", "Connected successfully."
                     else:
@@ -454,6 +510,15 @@ async def connect_broker(request: Request):
                     else:
                         message = "Connection failed. Missing credentials."
 
+                elif broker_name == "Paper":
+                    account = creds.get("access_token")
+                    if account:
+                        profile = {"User Name": f"Paper {account}"}
+                        balance = {"Available Margin": f"{pp.paper_get_balance(account)['available_margin']:.2f}"}
+                        status, message = "success", "Connected successfully."
+                    else:
+                        message = "Connection failed. Missing paper account id."
+
             except Exception as e:
                 status, message = "failed", f"An error occurred for user ID {user_id}: {str(e)}"
                 logger_util.fastapi_log(message, user_id = user_id,  level = "error")
@@ -538,6 +603,7 @@ async def disconnect_stock(request: Request):
         removed = r.srem(active_key, symbol)
 
         if removed:
+            cs.publish_control(r, user_id, "disconnect", symbol=symbol)
             logger_util.push_log(
                 f"🛑 Disconnect requested for {symbol} — it will not be traded from next cycle.",
                 user_id=user_id,
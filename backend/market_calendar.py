@@ -0,0 +1,291 @@
+# backend/market_calendar.py
+"""
+Exchange session and holiday calendar for NSE/NFO and MCX.
+
+Interval boundaries are anchored at each session open (09:15 for NSE, 09:00 for MCX)
+and the last bar of a session ends at the session close, matching the broker
+candles. Per-day session and boundary arrays are computed once and cached, so the
+current bar is a bisect into the day's boundaries. The candle resample and the
+streamed bars (market_data_ingest) take their bucket origin from here too.
+
+Holidays come from data/market_holidays.json (override with MARKET_HOLIDAYS_FILE).
+"""
+import bisect
+import datetime
+import json
+import math
+import os
+from functools import lru_cache
+from zoneinfo import ZoneInfo
+
+import backend.logger_util as logger_util
+from backend import clock
+
+IST = ZoneInfo("Asia/Kolkata")
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Regular sessions per exchange, IST
+REGULAR_SESSIONS = {
+    "NSE": (("09:15", "15:30"),),
+    "MCX": (("09:00", "23:30"),),
+}
+
+# Segments that share a calendar with another exchange
+EXCHANGE_ALIASES = {
+    "NFO": "NSE",
+    "BSE": "NSE",
+    "BFO": "NSE",
+    "CDS": "NSE",
+}
+
+# Trading-parameter "type" -> exchange
+TYPE_EXCHANGES = {
+    "EQUITY": "NSE",
+    "FNO": "NFO",
+    "OPTIONS": "NFO",
+    "FUTURES": "NFO",
+    "COMMODITY": "MCX",
+}
+
+# Bars of history the indicators need to settle (EMA/MACD/ADX/Supertrend warm-up)
+DEFAULT_HISTORY_BARS = 500
+
+# Safety stop when walking across long holiday runs
+_MAX_DAY_SCAN = 30
+
+HOLIDAYS_FILE = os.getenv(
+    "MARKET_HOLIDAYS_FILE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "market_holidays.json"),
+)
+
+
+def _load_holidays(path):
+    try:
+        with open(path, "r") as f:
+            raw = json.load(f)
+    except Exception as e:
+        logger_util.push_log(f"⚠️ Could not load market holidays from {path}: {e}", level="warning", user_id="admin", log_type="trading")
+        return {}
+    return {exchange: days for exchange, days in raw.items() if not exchange.startswith("_")}
+
+
+HOLIDAYS = _load_holidays(HOLIDAYS_FILE)
+
+
+def normalize_exchange(exchange):
+    exchange = str(exchange or "NSE").upper()
+    exchange = EXCHANGE_ALIASES.get(exchange, exchange)
+    if exchange not in REGULAR_SESSIONS:
+        raise ValueError(f"Unknown exchange {exchange}")
+    return exchange
+
+
+def exchange_for_type(exchange_type):
+    """Map a trading-parameter type (EQUITY/COMMODITY/...) to its exchange."""
+    return TYPE_EXCHANGES.get(str(exchange_type or "").upper(), "NSE")
+
+
+def exchange_for_instrument(instrument_key):
+    """Exchange of an Upstox-style instrument key ("MCX_FO|...", "NSE_EQ|..."); NSE when unknown."""
+    segment = str(instrument_key or "").split("|", 1)[0].split("_", 1)[0].upper()
+    return "MCX" if segment == "MCX" else "NSE"
+
+
+def open_offset(exchange):
+    """Minutes from midnight to the exchange's regular open, the bucket origin for resampling."""
+    hour, minute = (int(x) for x in REGULAR_SESSIONS[normalize_exchange(exchange)][0][0].split(":"))
+    return hour * 60 + minute
+
+
+def _to_date(day):
+    if isinstance(day, datetime.datetime):
+        return day.astimezone(IST).date() if day.tzinfo else day.date()
+    if isinstance(day, str):
+        return datetime.date.fromisoformat(day[:10])
+    return day
+
+
+def _epoch(day, hhmm):
+    hour, minute = (int(x) for x in hhmm.split(":"))
+    return datetime.datetime.combine(day, datetime.time(hour, minute), tzinfo=IST).timestamp()
+
+
+def _format(epoch):
+    return datetime.datetime.fromtimestamp(epoch, IST).strftime(TIME_FORMAT)
+
+
+def _parse(value):
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, datetime.datetime):
+        return (value if value.tzinfo else value.replace(tzinfo=IST)).timestamp()
+    return datetime.datetime.strptime(str(value), TIME_FORMAT).replace(tzinfo=IST).timestamp()
+
+
+@lru_cache(maxsize=4096)
+def _day_sessions(exchange, day):
+    if day.weekday() >= 5:
+        return ()
+    holiday = HOLIDAYS.get(exchange, {}).get(day.isoformat())
+    if holiday is None:
+        sessions = REGULAR_SESSIONS[exchange]
+    elif isinstance(holiday, dict):
+        sessions = tuple(tuple(s) for s in holiday.get("sessions", ()))
+    else:
+        return ()
+    return tuple((_epoch(day, start), _epoch(day, end)) for start, end in sessions)
+
+
+def sessions_on(exchange, day):
+    """(open_epoch, close_epoch) pairs for `day`; empty on weekends and holidays."""
+    return _day_sessions(normalize_exchange(exchange), _to_date(day))
+
+
+def is_trading_day(exchange, day):
+    return bool(sessions_on(exchange, day))
+
+
+def is_open(exchange, now=None):
+    ts = _parse(now) if now is not None else clock.now(IST).timestamp()
+    return any(start <= ts < end for start, end in sessions_on(exchange, datetime.datetime.fromtimestamp(ts, IST)))
+
+
+@lru_cache(maxsize=4096)
+def _day_boundaries(exchange, day, step):
+    boundaries = []
+    for start, end in _day_sessions(exchange, day):
+        boundaries.extend(range(int(start), int(end), step))
+        boundaries.append(int(end))
+    return tuple(boundaries)
+
+
+def bar_starts(exchange, day, interval):
+    """Start of every bar of `day` as IST strings, in order."""
+    step = int(interval or 1) * 60
+    return [_format(ts) for start, end in sessions_on(exchange, day) for ts in range(int(start), int(end), step)]
+
+
+def day_boundaries(exchange, day, interval):
+    """Every bar boundary (bar starts plus each session close) for `day`, as epochs."""
+    return _day_boundaries(normalize_exchange(exchange), _to_date(day), int(interval) * 60)
+
+
+def _bar_at(exchange, ts, step):
+    """(start, end) epochs of the bar containing `ts`, or None outside a session."""
+    day = datetime.datetime.fromtimestamp(ts, IST).date()
+    for start, end in _day_sessions(exchange, day):
+        if start <= ts < end:
+            boundaries = _day_boundaries(exchange, day, step)
+            i = bisect.bisect_right(boundaries, ts) - 1
+            return boundaries[i], boundaries[i + 1]
+    return None
+
+
+def bar_start(exchange, interval_minutes, ts):
+    """
+    Epoch start of the bar containing epoch `ts`. Outside a session (ticks from a
+    special session missing from the calendar) bars are laid from the regular open.
+    """
+    exchange = normalize_exchange(exchange)
+    step = int(interval_minutes or 1) * 60
+    bar = _bar_at(exchange, ts, step)
+    if bar is not None:
+        return bar[0]
+    day = datetime.datetime.fromtimestamp(ts, IST).date()
+    anchor = _epoch(day, REGULAR_SESSIONS[exchange][0][0])
+    return anchor + ((ts - anchor) // step) * step
+
+
+def bars_on(exchange, day, interval):
+    """Number of bars in `day` for the interval (a short last bar counts as one)."""
+    step = int(interval) * 60
+    return sum(math.ceil((end - start) / step) for start, end in sessions_on(exchange, day))
+
+
+def _shift_trading_day(exchange, day, direction):
+    for _ in range(_MAX_DAY_SCAN):
+        day = day + datetime.timedelta(days=direction)
+        if _day_sessions(exchange, day):
+            return day
+    raise ValueError(f"No {exchange} trading day within {_MAX_DAY_SCAN} days of {day}")
+
+
+def previous_trading_day(exchange, day):
+    return _shift_trading_day(normalize_exchange(exchange), _to_date(day), -1)
+
+
+def next_trading_day(exchange, day):
+    return _shift_trading_day(normalize_exchange(exchange), _to_date(day), 1)
+
+
+def _last_close_before(exchange, ts, day):
+    closes = [end for _, end in _day_sessions(exchange, day) if end <= ts]
+    if closes:
+        return closes[-1]
+    return _day_sessions(exchange, _shift_trading_day(exchange, day, -1))[-1][1]
+
+
+def _next_open_after(exchange, ts, day, step):
+    for start, end in _day_sessions(exchange, day):
+        if start > ts:
+            return start, min(start + step, end)
+    start, end = _day_sessions(exchange, _shift_trading_day(exchange, day, 1))[0]
+    return start, min(start + step, end)
+
+
+def current_interval(exchange, interval_minutes, now=None):
+    """
+    Same contract as Next_Now_intervals.round_to_next_interval, but session aware:
+    returns (latest boundary <= now, next bar close) as IST strings. Outside a session
+    the latest boundary is the last session close and the next one is the close of
+    the first bar of the next session, so loops never wake while the market is shut.
+    """
+    exchange = normalize_exchange(exchange)
+    step = int(interval_minutes or 1) * 60
+    ts = _parse(now) if now is not None else clock.now(IST).timestamp()
+    day = datetime.datetime.fromtimestamp(ts, IST).date()
+
+    bar = _bar_at(exchange, ts, step)
+    if bar is not None:
+        return _format(bar[0]), _format(bar[1])
+
+    latest = _last_close_before(exchange, ts, day)
+    _, first_close = _next_open_after(exchange, ts, day, step)
+    return _format(latest), _format(first_close)
+
+
+def closed_bar_start(exchange, interval_minutes, boundary):
+    """Start of the bar that closed at `boundary` (handles the short last bar of a session)."""
+    exchange = normalize_exchange(exchange)
+    step = int(interval_minutes or 1) * 60
+    ts = _parse(boundary)
+    day = datetime.datetime.fromtimestamp(ts, IST).date()
+    for start, end in _day_sessions(exchange, day):
+        if start < ts <= end:
+            boundaries = _day_boundaries(exchange, day, step)
+            return _format(boundaries[bisect.bisect_left(boundaries, ts) - 1])
+    return _format(ts - step)
+
+
+def history_start_date(exchange, interval_minutes, bars=DEFAULT_HISTORY_BARS, end_date=None, max_calendar_days=None):
+    """
+    Earliest date whose trading days up to `end_date` (inclusive, default yesterday)
+    hold at least `bars` bars, optionally capped to a broker's calendar-day limit.
+    """
+    exchange = normalize_exchange(exchange)
+    end_date = _to_date(end_date) if end_date is not None else clock.now(IST).date() - datetime.timedelta(days=1)
+    day = end_date
+    if not _day_sessions(exchange, day):
+        day = _shift_trading_day(exchange, day, -1)
+
+    total = bars_on(exchange, day, interval_minutes)
+    while total < bars:
+        try:
+            day = _shift_trading_day(exchange, day, -1)
+        except ValueError:
+            break
+        total += bars_on(exchange, day, interval_minutes)
+
+    if max_calendar_days is not None:
+        day = max(day, end_date - datetime.timedelta(days=max_calendar_days))
+    return day
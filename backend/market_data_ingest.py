@@ -0,0 +1,398 @@
+# backend/market_data_ingest.py
+"""
+Market-data ingest service.
+
+Subscribes to a broker tick feed, builds candles locally and publishes completed
+bars and LTPs over Redis, so trading workers can build the interval frame from
+streamed bars within milliseconds of the close instead of polling REST endpoints.
+Ticks older than the bar being built (late or out of order) are dropped.
+
+Redis layout (all JSON values, IST naive timestamps like the rest of the engine):
+  md:bars:{instrument_key}:{interval}      list of the most recent completed bars
+  md:bar_last:{instrument_key}:{interval}  last completed bar
+  md:ltp                                    hash instrument_key -> last traded price
+  channel md:bars:{instrument_key}:{interval} published on every completed bar
+
+Run standalone:
+  python -m backend.market_data_ingest --feed replay --file ticks.jsonl --intervals 1,5
+"""
+import abc
+import argparse
+import csv
+import datetime
+import json
+import os
+import queue
+import threading
+import time
+from zoneinfo import ZoneInfo
+
+import pandas as pd
+
+import backend.logger_util as logger_util
+from backend import clock
+from backend import market_calendar as mc
+
+IST = ZoneInfo("Asia/Kolkata")
+BAR_HISTORY = 500
+
+
+def bars_key(instrument_key, interval):
+    return f"md:bars:{instrument_key}:{int(interval)}"
+
+
+def bar_last_key(instrument_key, interval):
+    return f"md:bar_last:{instrument_key}:{int(interval)}"
+
+
+LTP_KEY = "md:ltp"
+
+
+def bucket_start(ts, interval, exchange="NSE"):
+    """
+    Epoch seconds of the start of the `interval`-minute candle containing `ts`,
+    anchored at the exchange's session open like Next_Now_intervals / resample_candle_data.
+    """
+    return mc.bar_start(exchange, interval, ts)
+
+
+def _ist_str(ts):
+    return datetime.datetime.fromtimestamp(ts, tz=IST).strftime("%Y-%m-%d %H:%M:%S")
+
+
+# ==========================================================
+# Tick feeds
+# ==========================================================
+class TickFeed(abc.ABC):
+    """
+    Pluggable tick source. `ticks()` yields dicts with instrument_key, ltp, ts (epoch
+    seconds) and optional volume, or None as a heartbeat when no tick arrived within
+    `timeout` seconds so the ingest loop can close bars on time.
+    """
+
+    @abc.abstractmethod
+    def subscribe(self, instrument_keys):
+        ...
+
+    @abc.abstractmethod
+    def ticks(self, timeout=0.25):
+        ...
+
+    def close(self):
+        pass
+
+
+class _QueueTickFeed(TickFeed):
+    """Base for websocket feeds whose client library calls back on its own thread."""
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._closed = threading.Event()
+
+    def _put(self, tick):
+        self._queue.put(tick)
+
+    def ticks(self, timeout=0.25):
+        while not self._closed.is_set():
+            try:
+                yield self._queue.get(timeout=timeout)
+            except queue.Empty:
+                yield None
+
+    def close(self):
+        self._closed.set()
+
+
+class ReplayTickFeed(TickFeed):
+    """
+    Replays recorded ticks from a JSONL or CSV file (columns instrument_key, ts, ltp,
+    volume). speed=0 replays as fast as possible; speed=1 replays in real time.
+    """
+
+    def __init__(self, path, speed=0.0):
+        self.path = path
+        self.speed = float(speed)
+        self.instrument_keys = None
+
+    def subscribe(self, instrument_keys):
+        self.instrument_keys = set(instrument_keys) if instrument_keys else None
+
+    def _rows(self):
+        with open(self.path, "r", encoding="utf-8") as f:
+            if self.path.endswith(".csv"):
+                yield from csv.DictReader(f)
+            else:
+                for line in f:
+                    if line.strip():
+                        yield json.loads(line)
+
+    def ticks(self, timeout=0.25):
+        prev_ts = None
+        for row in self._rows():
+            key = row["instrument_key"]
+            if self.instrument_keys and key not in self.instrument_keys:
+                continue
+            ts = float(row["ts"])
+            if self.speed > 0 and prev_ts is not None and ts > prev_ts:
+                clock.sleep((ts - prev_ts) / self.speed)
+            prev_ts = ts
+            yield {"instrument_key": key, "ltp": float(row["ltp"]), "ts": ts, "volume": float(row.get("volume") or 0)}
+
+
+class KiteTickFeed(_QueueTickFeed):
+    """Zerodha KiteTicker websocket. `token_map` maps instrument_token -> instrument_key."""
+
+    def __init__(self, api_key, access_token, token_map):
+        super().__init__()
+        from kiteconnect import KiteTicker
+        self.token_map = {int(k): v for k, v in token_map.items()}
+        self.ticker = KiteTicker(api_key, access_token)
+        self.ticker.on_ticks = self._on_ticks
+        self.ticker.on_connect = self._on_connect
+
+    def _on_connect(self, ws, response):
+        tokens = list(self.token_map)
+        ws.subscribe(tokens)
+        ws.set_mode(ws.MODE_LTP, tokens)
+
+    def _on_ticks(self, ws, ticks):
+        now = time.time()
+        for t in ticks:
+            key = self.token_map.get(t.get("instrument_token"))
+            if key is None:
+                continue
+            exch_ts = t.get("exchange_timestamp")
+            ts = exch_ts.replace(tzinfo=IST).timestamp() if exch_ts else now
+            self._put({"instrument_key": key, "ltp": float(t["last_price"]), "ts": ts, "volume": 0})
+
+    def subscribe(self, instrument_keys):
+        self.ticker.connect(threaded=True)
+
+    def close(self):
+        super().close()
+        self.ticker.close()
+
+
+class UpstoxTickFeed(_QueueTickFeed):
+    """Upstox market-data feed v3 (LTPC mode). Needs the optional upstox-python-sdk."""
+
+    def __init__(self, access_token):
+        super().__init__()
+        try:
+            import upstox_client
+        except ImportError as e:
+            raise RuntimeError("UpstoxTickFeed requires the 'upstox-python-sdk' package") from e
+        configuration = upstox_client.Configuration()
+        configuration.access_token = access_token
+        self._client = upstox_client
+        self._api_client = upstox_client.ApiClient(configuration)
+        self.streamer = None
+
+    def _on_message(self, message):
+        for key, feed in (message.get("feeds") or {}).items():
+            ltpc = feed.get("ltpc") or feed.get("fullFeed", {}).get("marketFF", {}).get("ltpc")
+            if not ltpc or ltpc.get("ltp") is None:
+                continue
+            ltt = ltpc.get("ltt")
+            ts = int(ltt) / 1000 if ltt else time.time()
+            self._put({"instrument_key": key, "ltp": float(ltpc["ltp"]), "ts": ts, "volume": 0})
+
+    def subscribe(self, instrument_keys):
+        self.streamer = self._client.MarketDataStreamerV3(self._api_client, list(instrument_keys), "ltpc")
+        self.streamer.on("message", self._on_message)
+        self.streamer.connect()
+
+    def close(self):
+        super().close()
+        if self.streamer:
+            self.streamer.disconnect()
+
+
+# ==========================================================
+# Candle building
+# ==========================================================
+class CandleBuilder:
+    """
+    Aggregates ticks into candles for several intervals at once. A bar is emitted
+    through `on_bar` when the first tick of the next bucket arrives, or from
+    `flush_due` once its period has ended (plus `grace` seconds) without one.
+    """
+
+    def __init__(self, intervals, on_bar, grace=0.25, exchange_for=mc.exchange_for_instrument):
+        self.intervals = [int(i) for i in intervals]
+        self.on_bar = on_bar
+        self.grace = grace
+        self.exchange_for = exchange_for
+        self.bars = {}  # (instrument_key, interval) -> open bar
+        self.emitted = {}  # (instrument_key, interval) -> start of the last emitted bar
+        self.late_ticks = 0
+
+    def add_tick(self, tick):
+        key, ltp, ts = tick["instrument_key"], tick["ltp"], tick["ts"]
+        exchange = None
+        for interval in self.intervals:
+            bar = self.bars.get((key, interval))
+            if bar is not None and bar["_start"] <= ts < bar["_end"]:
+                start = bar["_start"]
+            else:
+                exchange = exchange or self.exchange_for(key)
+                start = bucket_start(ts, interval, exchange)
+            if start <= self.emitted.get((key, interval), float("-inf")) or (bar is not None and start < bar["_start"]):
+                # Tick for a bar that was already emitted or is older than the open one
+                self.late_ticks += 1
+                continue
+            if bar is not None and start > bar["_start"]:
+                self._emit(key, interval)
+                bar = None
+            if bar is None:
+                self.bars[(key, interval)] = {
+                    "_start": start, "_end": start + interval * 60, "open": ltp, "high": ltp, "low": ltp, "close": ltp,
+                    "volume": tick.get("volume", 0), "ticks": 1,
+                }
+            else:
+                bar["high"] = max(bar["high"], ltp)
+                bar["low"] = min(bar["low"], ltp)
+                bar["close"] = ltp
+                bar["volume"] += tick.get("volume", 0)
+                bar["ticks"] += 1
+
+    def flush_due(self, now=None):
+        now = time.time() if now is None else now
+        for (key, interval), bar in list(self.bars.items()):
+            if bar["_start"] + interval * 60 + self.grace <= now:
+                self._emit(key, interval)
+
+    def flush_all(self):
+        for key, interval in list(self.bars):
+            self._emit(key, interval)
+
+    def _emit(self, key, interval):
+        bar = self.bars.pop((key, interval))
+        start = bar.pop("_start")
+        bar.pop("_end")
+        self.emitted[(key, interval)] = start
+        self.on_bar(dict(bar, instrument_key=key, interval=interval, start=_ist_str(start)))
+
+
+# ==========================================================
+# Redis publishing / consumption
+# ==========================================================
+class RedisBarPublisher:
+    """Publishes completed bars and LTPs to Redis for trading workers."""
+
+    def __init__(self, redis_client, history=BAR_HISTORY):
+        self.redis = redis_client
+        self.history = history
+        self.bars_published = 0
+
+    def publish_bar(self, bar):
+        payload = json.dumps(bar)
+        lkey = bars_key(bar["instrument_key"], bar["interval"])
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.rpush(lkey, payload)
+        pipe.ltrim(lkey, -self.history, -1)
+        pipe.set(bar_last_key(bar["instrument_key"], bar["interval"]), payload)
+        pipe.publish(lkey, payload)
+        pipe.execute()
+        self.bars_published += 1
+
+    def publish_ltps(self, ltps):
+        if ltps:
+            self.redis.hset(LTP_KEY, mapping=ltps)
+
+
+def streamed_bars_frame(redis_client, instrument_key, interval, until, exchange="NSE"):
+    """
+    OHLC DataFrame of today's streamed bars up to and including the one starting
+    at `until` ("%Y-%m-%d %H:%M:%S" IST), or None when that bar has not been
+    published or a bar between the first streamed one and it is missing (the
+    ingest service restarted), so callers fall back to REST.
+    """
+    try:
+        raw = redis_client.lrange(bars_key(instrument_key, interval), 0, -1)
+    except Exception:
+        return None
+    bars = {}
+    for bar in (json.loads(item) for item in raw):
+        if bar["start"][:10] == until[:10] and bar["start"] <= until:
+            bars[bar["start"]] = bar
+    starts = sorted(bars)
+    if not starts or starts[-1] != until:
+        return None
+    expected = [s for s in mc.bar_starts(exchange, until, interval) if starts[0] <= s <= until]
+    if starts != expected:
+        logger_util.push_log(f"⚠️ Streamed bars for {instrument_key} have gaps ({len(expected) - len(starts)} missing), using REST",
+                             level="warning", user_id="admin", log_type="trading")
+        return None
+    return pd.DataFrame(
+        [{k: bars[s][k] for k in ("open", "high", "low", "close")} for s in starts],
+        index=pd.DatetimeIndex([pd.Timestamp(s) for s in starts], name="datetime"),
+    )
+
+
+# ==========================================================
+# Ingest loop
+# ==========================================================
+def run_ingest(feed, instrument_keys, intervals, publisher, ltp_flush_seconds=0.2, stop_event=None):
+    """Consume `feed` until it ends (or `stop_event` is set), publishing bars and LTPs."""
+    builder = CandleBuilder(intervals, publisher.publish_bar)
+    feed.subscribe(instrument_keys)
+    pending_ltps = {}
+    last_ltp_flush = last_bar_flush = time.time()
+    replay = isinstance(feed, ReplayTickFeed)
+
+    try:
+        for tick in feed.ticks():
+            if stop_event is not None and stop_event.is_set():
+                break
+            if tick is not None:
+                builder.add_tick(tick)
+                pending_ltps[tick["instrument_key"]] = tick["ltp"]
+            now = time.time()
+            # Replays close bars on the next tick; live feeds also close them on the clock
+            if not replay and (tick is None or now - last_bar_flush >= 0.05):
+                builder.flush_due(now)
+                last_bar_flush = now
+            if now - last_ltp_flush >= ltp_flush_seconds:
+                publisher.publish_ltps(pending_ltps)
+                pending_ltps = {}
+                last_ltp_flush = now
+    finally:
+        builder.flush_all()
+        publisher.publish_ltps(pending_ltps)
+        feed.close()
+
+    logger_util.push_log(
+        f"📡 Market-data ingest stopped: {publisher.bars_published} bars published, {builder.late_ticks} late ticks dropped",
+        level="info", user_id="admin", log_type="trading")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Market-data ingest service")
+    parser.add_argument("--feed", choices=["replay", "upstox", "kite"], default="replay")
+    parser.add_argument("--file", help="recorded tick file for --feed replay")
+    parser.add_argument("--speed", type=float, default=0.0, help="replay speed (0 = as fast as possible)")
+    parser.add_argument("--keys", default=os.getenv("MD_INGEST_KEYS", ""), help="comma separated instrument keys")
+    parser.add_argument("--token-map", help="JSON file mapping Kite instrument_token -> instrument_key")
+    parser.add_argument("--intervals", default=os.getenv("MD_INGEST_INTERVALS", "1,5,15"))
+    args = parser.parse_args(argv)
+
+    keys = [k for k in args.keys.split(",") if k]
+    intervals = [int(i) for i in args.intervals.split(",") if i]
+
+    if args.feed == "replay":
+        feed = ReplayTickFeed(args.file, speed=args.speed)
+    elif args.feed == "upstox":
+        feed = UpstoxTickFeed(os.environ["UPSTOX_ACCESS_TOKEN"])
+    else:
+        with open(args.token_map, "r", encoding="utf-8") as f:
+            token_map = json.load(f)
+        feed = KiteTickFeed(os.environ["KITE_API_KEY"], os.environ["KITE_ACCESS_TOKEN"], token_map)
+        keys = keys or list(token_map.values())
+
+    publisher = RedisBarPublisher(logger_util.connect_redis())
+    run_ingest(feed, keys, intervals, publisher)
+
+
+if __name__ == "__main__":
+    main()
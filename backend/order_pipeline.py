@@ -0,0 +1,310 @@
+# backend/order_pipeline.py
+"""
+Order execution pipeline.
+
+Strategy checks no longer place orders inline: they queue them here and move on
+to the next symbol. Every broker account has one submission lane, so its orders
+go out one at a time, and a lane always sends queued exits before entries. An
+exit always gets a drain on a separate pool, even when its lane is already
+queued on the entry pool, so exits are never stuck behind other accounts'
+entries; the drains share the lane's heap and lock, so orders still go out once
+each, exits first.
+
+Each order queued by a trading cycle gets a client order id derived from
+(broker, account, instrument, side, quantity, candle). It is claimed with SET NX
+on `order:{client_order_id}` before submission, so an order retried within the
+same candle is sent only once. Orders outside a cycle (manual and API orders)
+get a random nonce instead, so two identical requests are both sent. The id is also passed to the broker as the order tag where the API has one.
+
+The expected fill is applied to the cycle's positions snapshot when the order is
+queued, so later symbols of the same account see it straight away. It is undone
+if submission fails. Entries queued after the cycle's deadline (cycle_budget) are
+dropped. Fills are confirmed in the background through the broker's
+order-status call; a rejection undoes the fill and marks the snapshot stale.
+"""
+import contextvars
+import hashlib
+import heapq
+import itertools
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+
+import backend.logger_util as logger_util
+from backend import clock
+from backend import positions_snapshot
+from backend import cycle_budget
+
+ORDER_KEY = "order:{client_order_id}"
+ORDER_TTL = 24 * 3600
+
+EXIT, ENTRY = "exit", "entry"
+PRIORITY = {EXIT: 0, ENTRY: 1}
+
+ORDER_WORKERS = int(os.getenv("ORDER_WORKERS", "16"))
+EXIT_WORKERS = int(os.getenv("ORDER_EXIT_WORKERS", "8"))
+CONFIRM_TIMEOUT = float(os.getenv("ORDER_CONFIRM_TIMEOUT", "60"))
+
+# Broker order statuses, lower-cased, that end confirmation
+COMPLETE_STATUSES = {"complete", "completed", "filled", "traded", "fully executed", "executed"}
+REJECTED_STATUSES = {"rejected", "cancelled", "canceled", "failed", "expired"}
+
+redis_client = logger_util.redis_client
+
+_entry_pool = ThreadPoolExecutor(max_workers=ORDER_WORKERS, thread_name_prefix="orders")
+_exit_pool = ThreadPoolExecutor(max_workers=EXIT_WORKERS, thread_name_prefix="exits")
+_confirm_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="order-confirm")
+
+# Candle the current symbol is trading, set by the trading loop for idempotency keys
+_cycle = contextvars.ContextVar("order_cycle", default=None)
+
+
+@contextmanager
+def cycle(candle):
+    """Mark orders queued inside the block as belonging to `candle` (the cycle's interval start)."""
+    token = _cycle.set(str(candle))
+    try:
+        yield
+    finally:
+        _cycle.reset(token)
+
+
+def current_cycle():
+    """Candle of the cycle running in this thread, or None."""
+    return _cycle.get()
+
+
+def client_order_id(broker, account, instrument, side, quantity, candle=None):
+    """20-character id, stable for the same order within one candle (fits Kite's tag limit)."""
+    # Outside a trading cycle (manual and API orders) every request is a new order
+    candle = candle or _cycle.get() or uuid.uuid4().hex
+    raw = f"{broker}|{account}|{instrument}|{side}|{abs(int(quantity or 0))}|{candle}"
+    return hashlib.sha1(raw.encode()).hexdigest()[:20]
+
+
+def _set_status(coid, **fields):
+    if redis_client is None:
+        return
+    try:
+        key = ORDER_KEY.format(client_order_id=coid)
+        raw = redis_client.get(key)
+        record = json.loads(raw) if raw else {}
+        record.update(fields, updated=clock.time())
+        redis_client.set(key, json.dumps(record), ex=ORDER_TTL)
+    except Exception:
+        pass
+
+
+def _claim(coid, record):
+    """True if this order id has not been submitted (or only failed) before; without Redis every order is sent."""
+    if redis_client is None:
+        return True
+    key = ORDER_KEY.format(client_order_id=coid)
+    try:
+        if redis_client.set(key, json.dumps(record), nx=True, ex=ORDER_TTL):
+            return True
+        # An order the broker never accepted may be retried
+        previous = json.loads(redis_client.get(key) or "{}")
+        if previous.get("status") == "failed":
+            redis_client.set(key, json.dumps(record), ex=ORDER_TTL)
+            return True
+        return False
+    except Exception:
+        return True
+
+
+def order_status(coid):
+    if redis_client is None:
+        return None
+    raw = redis_client.get(ORDER_KEY.format(client_order_id=coid))
+    return json.loads(raw) if raw else None
+
+
+class _Order:
+    def __init__(self, lane_key, coid, kind, place, args, fill, confirm, user_id, label, budget=None):
+        self.lane_key = lane_key  # (broker, account)
+        self.coid = coid
+        self.kind = kind
+        self.place = place
+        self.args = args
+        self.fill = fill          # (broker, account, instrument, qty_delta, tradingsymbol) or None
+        self.confirm = confirm
+        self.user_id = user_id
+        self.label = label
+        self.budget = budget      # SymbolBudget of the symbol that queued it
+        self.future = Future()
+        self.queued_at = clock.time()
+
+
+class _Lane:
+    """Serialized submission for one broker account; exits first."""
+
+    def __init__(self, name):
+        self.name = name
+        self._heap = []
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self._send = threading.Lock()   # one order of the account in flight at a time
+        self._drains = 0                # drains submitted and not finished
+        self._exit_drain = False        # one of them is on the exit pool
+
+    @property
+    def _draining(self):
+        return self._drains > 0
+
+    def put(self, order):
+        with self._lock:
+            heapq.heappush(self._heap, (PRIORITY[order.kind], next(self._seq), order))
+            if order.kind == EXIT and not self._exit_drain:
+                self._exit_drain = True
+                pool = _exit_pool
+            elif self._drains == 0:
+                pool = _entry_pool
+            else:
+                return
+            self._drains += 1
+        pool.submit(self._drain, pool is _exit_pool)
+
+    def _drain(self, exit_pool=False):
+        while True:
+            with self._send:
+                with self._lock:
+                    if not self._heap:
+                        # Under the same lock as put(), so no order is left without a drain
+                        self._drains -= 1
+                        if exit_pool:
+                            self._exit_drain = False
+                        return
+                    order = heapq.heappop(self._heap)[2]
+                _execute(order)
+
+
+_lanes = {}
+_lanes_lock = threading.Lock()
+
+
+def idle():
+    """True when no account has orders queued or being submitted."""
+    with _lanes_lock:
+        lanes = list(_lanes.values())
+    return not any(lane._draining for lane in lanes)
+
+
+def wait_idle(poll=0.005):
+    """Block until every queued order has been submitted (confirmations may still be pending)."""
+    while not idle():
+        time.sleep(poll)
+
+
+def _lane(broker, account):
+    key = (broker, account)
+    with _lanes_lock:
+        lane = _lanes.get(key)
+        if lane is None:
+            lane = _lanes[key] = _Lane(f"{broker}:{str(account)[-6:]}")
+        return lane
+
+
+def _undo_fill(order):
+    if order.fill is None:
+        return
+    broker, account, instrument, delta, tradingsymbol = order.fill
+    positions_snapshot.record_fill(broker, account, instrument, -delta, tradingsymbol)
+    positions_snapshot.mark_stale(broker, account)
+
+
+def _execute(order):
+    started = clock.time()
+    try:
+        order_id = order.place(*order.args, tag=order.coid)
+    except Exception as e:
+        logger_util.push_log(f"❌ Order {order.label} failed: {e}", level="error", user_id=order.user_id, log_type="trading")
+        order_id = None
+
+    latency = round(started - order.queued_at, 3)
+    if order.budget is not None:
+        order.budget.record("order", clock.time() - order.queued_at)
+    if not order_id:
+        _undo_fill(order)
+        _set_status(order.coid, status="failed", queue_seconds=latency)
+        order.future.set_result(None)
+        return
+
+    _set_status(order.coid, status="submitted", order_id=str(order_id), queue_seconds=latency,
+                submit_seconds=round(clock.time() - started, 3))
+    logger_util.push_log(f"📤 {order.kind.title()} order {order.label} submitted ({order_id}) after {latency}s in queue", level="info", user_id=order.user_id, log_type="trading")
+    order.future.set_result(order_id)
+    if order.confirm is not None:
+        _confirm_pool.submit(_confirm, order, order_id)
+
+
+def _confirm(order, order_id):
+    """Poll the broker's order status until the order completes, is rejected, or CONFIRM_TIMEOUT passes."""
+    # Counted rather than timed: on a virtual clock the polls run back to back without moving it
+    waited = 0.0
+    delay = 0.5
+    status = None
+    while waited < CONFIRM_TIMEOUT:
+        clock.pause(delay)
+        waited += delay
+        delay = min(delay * 2, 8.0)
+        try:
+            status = str(order.confirm(order_id) or "").lower()
+        except Exception:
+            continue
+        if status in COMPLETE_STATUSES:
+            _set_status(order.coid, status="complete")
+            if order.fill is None:
+                # The fill was not applied up front (limit/GTT orders), so refetch
+                positions_snapshot.mark_stale(*order.lane_key)
+            return
+        if status in REJECTED_STATUSES:
+            _undo_fill(order)
+            _set_status(order.coid, status="rejected")
+            logger_util.push_log(f"❌ Order {order.label} ({order_id}) was {status} by the broker", level="error", user_id=order.user_id, log_type="trading")
+            return
+    _set_status(order.coid, status=status or "unconfirmed")
+    positions_snapshot.mark_stale(*order.lane_key)
+
+
+def submit(broker, account, side, place, *args, instrument=None, quantity=0, fill=None, tradingsymbol=None,
+           kind=None, confirm=None, user_id=None):
+    """
+    Queue `place(*args, tag=client_order_id)` on the account's lane and return a
+    Future for its order id (None if it failed or was a duplicate).
+
+    side      BUY/SELL; SELL is an exit and BUY an entry unless `kind` says otherwise
+    fill      signed quantity to apply to the positions snapshot now, or None when
+              the fill is not known up front (limit and GTT orders)
+    confirm   callable(order_id) -> broker order status, polled in the background
+    """
+    kind = kind or (EXIT if str(side).upper() in ("SELL", "S") else ENTRY)
+    coid = client_order_id(broker, account, instrument, side, quantity)
+    label = f"{side} {abs(int(quantity or 0))} {tradingsymbol or instrument}"
+
+    budget = cycle_budget.current()
+    if kind == ENTRY and budget is not None and not budget.allows_entry():
+        logger_util.push_log(f"⏰ Entry order {label} dropped, the cycle deadline has passed", level="warning", user_id=user_id, log_type="trading")
+        done = Future()
+        done.set_result(None)
+        return done
+
+    if not _claim(coid, {"status": "queued", "broker": broker, "kind": kind, "label": label,
+                         "user_id": user_id, "queued": clock.time()}):
+        logger_util.push_log(f"♻️ Duplicate order {label} ({coid}) already submitted this candle, skipping", level="warning", user_id=user_id, log_type="trading")
+        done = Future()
+        done.set_result(None)
+        return done
+
+    fill_record = None
+    if fill is not None:
+        fill_record = (broker, account, instrument, int(fill), tradingsymbol)
+        positions_snapshot.record_fill(*fill_record)
+
+    order = _Order((broker, account), coid, kind, place, args, fill_record, confirm, user_id, label, budget)
+    _lane(broker, account).put(order)
+    return order.future
@@ -0,0 +1,314 @@
+# backend/param_sweep.py
+"""
+Parallel parameter sweep for the strategies' indicator parameters.
+
+The candles are resampled once and placed in shared memory; every worker of
+the process pool attaches to the same arrays instead of receiving a pickled
+copy. Parameter sets are batched so that sets sharing the expensive
+indicators (Supertrend first) land on the same worker, whose indicator cache
+then computes each (indicator, parameters) pair once. Only the parameters the
+strategy's columns depend on are swept, so no two sets give the same backtest.
+
+Sampling:
+  grid      every combination of the space
+  random    `samples` draws from the space
+  bayes     optuna's TPE sampler, asked in pool-sized batches (needs optuna)
+
+Results are ranked by the chosen metric and written to the SQLite store
+SWEEP_DB (tables sweep_runs and sweep_results).
+
+Run:
+  python -m backend.param_sweep candles.parquet Ema10_Ema20_Supertrend --interval 5 --mode random --samples 200
+"""
+import argparse
+import datetime
+import itertools
+import json
+import os
+import random
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+from backend import backtester
+from backend import indicators as ind
+from backend import strategy_rules
+
+try:
+    import optuna
+except ImportError:  # only needed for mode=bayes
+    optuna = None
+
+SWEEP_DB = os.getenv("SWEEP_DB", "sweep_results.db")
+SWEEP_WORKERS = int(os.getenv("SWEEP_WORKERS", str(os.cpu_count() or 1)))
+# Indicator series kept per worker before the cache is dropped
+CACHE_LIMIT = int(os.getenv("SWEEP_CACHE_LIMIT", "256"))
+# mode=bayes gives up after this many ask rounds in a row without a new valid set
+BAYES_IDLE_ROUNDS = int(os.getenv("SWEEP_BAYES_IDLE_ROUNDS", "10"))
+
+DEFAULT_SPACE = {
+    "supertrend_period": [7, 8, 10, 12, 14],
+    "supertrend_multiplier": [2.0, 2.5, 3.0, 3.2, 3.5],
+    "macd_fast": [8, 12, 16],
+    "macd_slow": [21, 26, 34],
+    "macd_signal": [7, 9, 12],
+    "adx_period": [10, 14, 20],
+    "adx_ema": [14, 21, 30],
+    "willr_period": [10, 14, 21],
+    "ema_fast": [5, 8, 10, 13],
+    "ema_slow": [20, 26, 34],
+}
+
+METRICS = {
+    "pnl": lambda s: s["pnl"],
+    "calmar": lambda s: s["pnl"] / max(s["max_drawdown"], 1.0),
+    "win_rate": lambda s: s["win_rate"],
+}
+
+_COLUMNS = ("open", "high", "low", "close", "datetime")
+
+
+# ---------- shared candles ----------
+class SharedCandles:
+    """OHLC arrays of one candle frame in shared memory, owned by the parent process."""
+
+    def __init__(self, df):
+        self._blocks = []
+        self.layout = {}
+        for name in _COLUMNS:
+            values = df[name].to_numpy(dtype="datetime64[ns]" if name == "datetime" else float)
+            block = shared_memory.SharedMemory(create=True, size=max(values.nbytes, 1))
+            np.ndarray(values.shape, dtype=values.dtype, buffer=block.buf)[:] = values
+            self._blocks.append(block)
+            self.layout[name] = (block.name, values.dtype.str, values.shape)
+
+    def close(self):
+        for block in self._blocks:
+            block.close()
+            block.unlink()
+
+
+# Worker state, set once per process by _init_worker
+_candles = None
+_blocks = []
+_cache = {}
+
+
+def _init_worker(layout):
+    global _candles
+    columns = {}
+    for name, (block_name, dtype, shape) in layout.items():
+        block = shared_memory.SharedMemory(name=block_name)
+        _blocks.append(block)
+        columns[name] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+    _candles = pd.DataFrame(columns, copy=False)
+
+
+def _run_batch(strategy_name, param_sets, tgt, lots, lot_size, fresh_only):
+    strategy = strategy_rules.get(strategy_name)
+    results = []
+    for params in param_sets:
+        if len(_cache) > CACHE_LIMIT:
+            _cache.clear()
+        started = time.perf_counter()
+        indicators_df = ind.all_indicators(_candles, strategy_name, params=params, cache=_cache).reset_index(drop=True)
+        trades = backtester.simulate(strategy, indicators_df, tgt=tgt, lots=lots, lot_size=lot_size, fresh_only=fresh_only)
+        summary = backtester.summarize(trades)
+        summary["seconds"] = round(time.perf_counter() - started, 4)
+        results.append((params, summary))
+    return results
+
+
+# ---------- sampling ----------
+def strategy_space(strategy_name, space=None):
+    """The part of `space` the strategy's columns depend on."""
+    space = space or DEFAULT_SPACE
+    strategy = strategy_rules.get(strategy_name)
+    used = {p for column in strategy.columns for p in ind.PARAMS_BY_COLUMN.get(column, ())}
+    return {name: list(values) for name, values in space.items() if name in used}
+
+
+def _valid(params):
+    return params.get("macd_fast", 0) < params.get("macd_slow", 1) and params.get("ema_fast", 0) < params.get("ema_slow", 1)
+
+
+def grid(space):
+    names = sorted(space)
+    for values in itertools.product(*(space[n] for n in names)):
+        params = dict(zip(names, values))
+        if _valid(params):
+            yield params
+
+
+def sample(space, samples, seed=None):
+    """Up to `samples` distinct valid parameter sets drawn at random."""
+    rng = random.Random(seed)
+    names = sorted(space)
+    seen = set()
+    for _ in range(samples * 20):
+        if len(seen) >= samples:
+            break
+        params = {name: rng.choice(space[name]) for name in names}
+        key = tuple(params.items())
+        if key in seen or not _valid(params):
+            continue
+        seen.add(key)
+        yield params
+
+
+def _batches(param_sets, workers):
+    """Batches of param sets grouped by their Supertrend parameters, a few per worker."""
+    param_sets = sorted(param_sets, key=lambda p: (p.get("supertrend_period", 0), p.get("supertrend_multiplier", 0),
+                                                   tuple(sorted(p.items()))))
+    size = max(1, len(param_sets) // (workers * 4))
+    return [param_sets[i:i + size] for i in range(0, len(param_sets), size)]
+
+
+# ---------- store ----------
+def _connect(db_path=SWEEP_DB):
+    conn = sqlite3.connect(db_path)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS sweep_runs (
+            run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            strategy TEXT, interval INTEGER, mode TEXT, metric TEXT, source TEXT,
+            candles INTEGER, workers INTEGER, evaluated INTEGER, seconds REAL, created TEXT
+        )""")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS sweep_results (
+            run_id INTEGER, rank INTEGER, score REAL, params TEXT,
+            trades INTEGER, pnl REAL, win_rate REAL, max_drawdown REAL, seconds REAL
+        )""")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_sweep_results_run ON sweep_results (run_id, rank)")
+    return conn
+
+
+def save(run, ranked, db_path=SWEEP_DB):
+    conn = _connect(db_path)
+    try:
+        cur = conn.execute(
+            "INSERT INTO sweep_runs (strategy, interval, mode, metric, source, candles, workers, evaluated, seconds, created) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (run["strategy"], run["interval"], run["mode"], run["metric"], run["source"], run["candles"],
+             run["workers"], len(ranked), run["seconds"], datetime.datetime.now().isoformat(timespec="seconds")))
+        run_id = cur.lastrowid
+        conn.executemany(
+            "INSERT INTO sweep_results (run_id, rank, score, params, trades, pnl, win_rate, max_drawdown, seconds) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [(run_id, rank, score, json.dumps(params), s["trades"], s["pnl"], s["win_rate"], s["max_drawdown"], s["seconds"])
+             for rank, (score, params, s) in enumerate(ranked, start=1)])
+        conn.commit()
+        return run_id
+    finally:
+        conn.close()
+
+
+def top(run_id, limit=10, db_path=SWEEP_DB):
+    conn = _connect(db_path)
+    try:
+        rows = conn.execute(
+            "SELECT rank, score, params, trades, pnl, win_rate, max_drawdown FROM sweep_results "
+            "WHERE run_id = ? ORDER BY rank LIMIT ?", (run_id, limit)).fetchall()
+    finally:
+        conn.close()
+    return [{"rank": r[0], "score": r[1], "params": json.loads(r[2]), "trades": r[3], "pnl": r[4],
+             "win_rate": r[5], "max_drawdown": r[6]} for r in rows]
+
+
+# ---------- sweep ----------
+def sweep(candles, strategy_name, interval=1, mode="grid", samples=100, space=None, metric="pnl",
+          tgt=0, lots=1, lot_size=1, fresh_only=False, workers=SWEEP_WORKERS, seed=None,
+          source="", db_path=SWEEP_DB, exchange="NSE"):
+    """Run the sweep, store it and return (run_id, ranked [(score, params, summary)])."""
+    if strategy_rules.get(strategy_name) is None:
+        raise ValueError(f"Unknown strategy {strategy_name}")
+    if mode == "bayes" and optuna is None:
+        raise RuntimeError("mode=bayes needs optuna (pip install optuna)")
+    score = METRICS[metric]
+    space = strategy_space(strategy_name, space)
+    bars = backtester.resample(candles, interval, exchange)
+    started = time.perf_counter()
+    shared = SharedCandles(bars)
+    results = []
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(shared.layout,)) as pool:
+            def evaluate(param_sets):
+                futures = [pool.submit(_run_batch, strategy_name, batch, tgt, lots, lot_size, fresh_only)
+                           for batch in _batches(param_sets, workers)]
+                return [r for f in futures for r in f.result()]
+
+            if mode == "grid":
+                results = evaluate(list(grid(space)))
+            elif mode == "random":
+                results = evaluate(list(sample(space, samples, seed)))
+            elif mode == "bayes":
+                optuna.logging.set_verbosity(optuna.logging.WARNING)
+                study = optuna.create_study(direction="maximize", sampler=optuna.samplers.TPESampler(seed=seed))
+                # TPE repeats itself and proposes invalid sets: stop once the valid space is
+                # exhausted or after BAYES_IDLE_ROUNDS rounds without a new valid set
+                target = min(samples, sum(1 for _ in grid(space)))
+                scores = {}
+                idle = 0
+                while len(results) < target and idle < BAYES_IDLE_ROUNDS:
+                    trials = [study.ask() for _ in range(min(workers * 2, target - len(results)))]
+                    param_sets = [{name: t.suggest_categorical(name, values) for name, values in sorted(space.items())}
+                                  for t in trials]
+                    fresh = {}
+                    for params in param_sets:
+                        key = tuple(sorted(params.items()))
+                        if _valid(params) and key not in scores:
+                            fresh[key] = params
+                    evaluated = evaluate(list(fresh.values()))
+                    for params, summary in evaluated:
+                        scores[tuple(sorted(params.items()))] = score(summary)
+                    for trial, params in zip(trials, param_sets):
+                        study.tell(trial, scores.get(tuple(sorted(params.items())), float("-inf")))
+                    results.extend(evaluated)
+                    idle = 0 if evaluated else idle + 1
+            else:
+                raise ValueError(f"Unknown sweep mode {mode}")
+    finally:
+        shared.close()
+
+    ranked = sorted(((round(float(score(s)), 4), p, s) for p, s in results), key=lambda r: r[0], reverse=True)
+    run = {"strategy": strategy_name, "interval": int(interval), "mode": mode, "metric": metric, "source": source,
+           "candles": len(bars), "workers": workers, "seconds": round(time.perf_counter() - started, 3)}
+    run_id = save(run, ranked, db_path)
+    return run_id, ranked
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep indicator parameters of a strategy over historical candles")
+    parser.add_argument("path", help="Parquet or CSV file with datetime, open, high, low, close")
+    parser.add_argument("strategy", choices=sorted(strategy_rules.STRATEGIES))
+    parser.add_argument("--interval", type=int, default=1)
+    parser.add_argument("--exchange", default="NSE", help="exchange whose session open anchors the bars")
+    parser.add_argument("--mode", choices=("grid", "random", "bayes"), default="grid")
+    parser.add_argument("--samples", type=int, default=100, help="parameter sets for random and bayes")
+    parser.add_argument("--space", help="JSON file {param: [values]} replacing the default space")
+    parser.add_argument("--metric", choices=sorted(METRICS), default="pnl")
+    parser.add_argument("--tgt", type=float, default=0)
+    parser.add_argument("--lots", type=int, default=1)
+    parser.add_argument("--lot-size", type=int, default=1)
+    parser.add_argument("--fresh-only", action="store_true")
+    parser.add_argument("--workers", type=int, default=SWEEP_WORKERS)
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    space = None
+    if args.space:
+        with open(args.space) as f:
+            space = json.load(f)
+    run_id, ranked = sweep(backtester.load_candles(args.path), args.strategy, interval=args.interval, mode=args.mode,
+                           samples=args.samples, space=space, metric=args.metric, tgt=args.tgt, lots=args.lots,
+                           lot_size=args.lot_size, fresh_only=args.fresh_only, workers=args.workers, seed=args.seed,
+                           source=os.path.basename(args.path), exchange=args.exchange)
+    print(json.dumps({"run_id": run_id, "evaluated": len(ranked), "top": top(run_id, args.top)}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
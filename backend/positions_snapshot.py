@@ -0,0 +1,189 @@
+# backend/positions_snapshot.py
+"""
+Per-cycle positions snapshot shared by all strategy checks of an account.
+
+The trading loop registers one snapshot per account at the start of a cycle; it
+is fetched from the broker on its first read. Broker strategy checks read positions through
+`positions()`, which serves the snapshot instead of calling the broker, and order
+helpers report fills through `record_fill()` so later symbols in the same cycle
+see the new quantity without another positions call. A fill the snapshot cannot
+apply locally (unknown contract) marks it stale and the next read refetches once.
+
+Accounts are keyed by the token the broker helpers already receive: the access
+token for Upstox, Zerodha and 5paisa, the jwt for AngelOne.
+"""
+import re
+import threading
+
+import backend.logger_util as logger_util
+from backend import clock
+
+# broker -> (quantity field, instrument field, trading symbol field)
+POSITION_FIELDS = {
+    "upstox": ("quantity", "instrument_token", "tradingsymbol"),
+    "zerodha": ("quantity", "tradingsymbol", "tradingsymbol"),
+    "angelone": ("netqty", "symboltoken", "tradingsymbol"),
+    "5paisa": ("NetQty", "ScripCode", "ScripName"),
+    "paper": ("quantity", "instrument_token", "tradingsymbol"),
+}
+
+_UNDERLYING = re.compile(r"^([A-Z&-]+)")
+
+
+def _to_int(value):
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return 0
+
+
+def option_type_of(tradingsymbol):
+    """CE/PE for an option trading symbol (NIFTY25OCT25000CE, "NIFTY 30 OCT 2025 CE 25000.00")."""
+    text = str(tradingsymbol or "").upper()
+    if text[-2:] in ("CE", "PE"):
+        return text[-2:]
+    for option_type in ("CE", "PE"):
+        if f" {option_type} " in f" {text} ":
+            return option_type
+    return None
+
+
+def underlying_of(tradingsymbol):
+    match = _UNDERLYING.match(str(tradingsymbol or "").upper())
+    return match.group(1) if match else None
+
+
+class PositionsSnapshot:
+    """One account's positions for the current cycle, indexed by underlying and option type."""
+
+    def __init__(self, broker, account, fetch):
+        self.broker = broker
+        self.account = account
+        self.fetch = fetch
+        self.qty_field, self.token_field, self.symbol_field = POSITION_FIELDS[broker]
+        # Held by the strategy checks of this account so check-then-order stays atomic
+        self.lock = threading.RLock()
+        self._positions = []
+        self._index = {}
+        self._stale = True
+        self.fetched_at = 0.0
+        self.fetches = 0
+
+    def _reindex(self):
+        index = {}
+        for pos in self._positions:
+            symbol = pos.get(self.symbol_field)
+            key = (underlying_of(symbol), option_type_of(symbol))
+            index.setdefault(key, []).append(pos)
+        self._index = index
+
+    def refresh(self):
+        with self.lock:
+            positions = self.fetch()
+            self.fetches += 1
+            self.fetched_at = clock.time()
+            if positions is None:
+                # Broker error: keep whatever we had, try again on the next read
+                return self._positions
+            self._positions = list(positions)
+            self._stale = False
+            self._reindex()
+            return self._positions
+
+    def positions(self):
+        """All positions in the broker's own format (same list the fetch helper returns)."""
+        with self.lock:
+            if self._stale:
+                self.refresh()
+            return list(self._positions)
+
+    def open_positions(self, underlying=None, option_type=None):
+        """Positions with a non-zero quantity, optionally for one underlying and/or CE/PE."""
+        with self.lock:
+            if self._stale:
+                self.refresh()
+            if underlying is None and option_type is None:
+                candidates = self._positions
+            else:
+                candidates = [
+                    pos for (und, opt), items in self._index.items()
+                    if (underlying is None or und == str(underlying).upper())
+                    and (option_type is None or opt == option_type)
+                    for pos in items
+                ]
+            return [pos for pos in candidates if _to_int(pos.get(self.qty_field)) != 0]
+
+    def apply_fill(self, instrument, quantity_delta, tradingsymbol=None):
+        """Apply an order fill locally: +qty for a buy, -qty for a sell."""
+        with self.lock:
+            for pos in self._positions:
+                if str(pos.get(self.token_field)) == str(instrument) or (tradingsymbol and pos.get(self.symbol_field) == tradingsymbol):
+                    pos[self.qty_field] = _to_int(pos.get(self.qty_field)) + int(quantity_delta)
+                    return
+            if tradingsymbol is None:
+                # Cannot index a contract we know nothing about; refetch on the next read
+                self._stale = True
+                return
+            self._positions.append({
+                self.qty_field: int(quantity_delta),
+                self.token_field: instrument,
+                self.symbol_field: tradingsymbol,
+            })
+            self._reindex()
+
+
+# ---------- cycle registry ----------
+_snapshots = {}
+_registry_lock = threading.Lock()
+
+
+def begin(broker, account, fetch):
+    """Register (or replace) the snapshot for an account at the start of a cycle."""
+    snapshot = PositionsSnapshot(broker, account, fetch)
+    with _registry_lock:
+        _snapshots[(broker, account)] = snapshot
+    return snapshot
+
+
+def current(broker, account):
+    return _snapshots.get((broker, account))
+
+
+def end(snapshots):
+    """Unregister the cycle's snapshots so nothing outside the cycle reads stale positions."""
+    with _registry_lock:
+        for snapshot in snapshots:
+            if _snapshots.get((snapshot.broker, snapshot.account)) is snapshot:
+                del _snapshots[(snapshot.broker, snapshot.account)]
+
+
+def positions(broker, account, fetch, *args):
+    """Snapshot positions for the account if a cycle registered one, else `fetch(*args)`."""
+    snapshot = current(broker, account)
+    if snapshot is None:
+        return fetch(*args)
+    return snapshot.positions()
+
+
+def record_fill(broker, account, instrument, quantity_delta, tradingsymbol=None):
+    snapshot = current(broker, account)
+    if snapshot is None:
+        return
+    try:
+        snapshot.apply_fill(instrument, quantity_delta, tradingsymbol)
+    except Exception as e:
+        mark_stale(broker, account)
+        logger_util.push_log(f"⚠️ Could not apply fill to positions snapshot: {e}", level="warning", user_id="admin", log_type="trading")
+
+
+def mark_stale(broker, account):
+    """Force the next read to refetch (e.g. after a limit order whose fill is unknown)."""
+    snapshot = current(broker, account)
+    if snapshot is not None:
+        snapshot._stale = True
+
+
+def account_lock(broker, account):
+    """The snapshot's lock for the account, or a throwaway lock when no cycle is running."""
+    snapshot = current(broker, account)
+    return snapshot.lock if snapshot is not None else threading.RLock()
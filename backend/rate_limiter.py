@@ -0,0 +1,415 @@
+# backend/rate_limiter.py
+"""
+Broker API rate limiter shared by every worker through Redis.
+
+One token bucket per (broker, endpoint class, account), refilled inside a Lua
+script so all Celery workers and the FastAPI process draw from the same budget.
+Data calls lease a few tokens at a time and serve them from memory, which keeps
+Redis off the hot path during candle-close bursts; order calls always go to
+Redis and, on brokers whose endpoint classes share one account-wide limit, may
+use a reserve of that shared bucket that data calls cannot touch.
+
+A 429 pauses the bucket for every worker until the broker's Retry-After has
+passed. Without Redis each process falls back to in-memory buckets with the same
+limits; after a Redis error it uses them for RATE_LIMIT_REDIS_RETRY seconds and
+then tries Redis again, logging when the fallback starts and ends. Counters are
+mirrored to the Redis hash `rate_limiter:metrics`.
+"""
+import asyncio
+import hashlib
+import os
+import random
+import threading
+import time
+from collections import Counter
+from urllib.parse import urlsplit
+
+import requests
+
+import backend.logger_util as logger_util
+
+METRICS_KEY = "rate_limiter:metrics"
+BUCKET_KEY = "ratelimit:{{{broker}:{account}}}:{name}"
+
+# broker -> endpoint class -> (requests per second, burst)
+LIMITS = {
+    "upstox": {"order": (10, 10), "historical": (25, 25), "quote": (25, 25), "portfolio": (10, 10), "default": (25, 25)},
+    "zerodha": {"order": (10, 10), "historical": (3, 3), "quote": (1, 1), "portfolio": (10, 10), "default": (10, 10)},
+    "angelone": {"order": (20, 20), "historical": (3, 3), "quote": (10, 10), "portfolio": (1, 1), "default": (10, 10)},
+    "5paisa": {"order": (10, 10), "historical": (5, 5), "quote": (10, 10), "portfolio": (5, 5), "default": (10, 10)},
+    "groww": {"order": (5, 5), "default": (10, 10)},
+}
+
+# Account-wide limit shared by all endpoint classes: (rate, burst, tokens reserved for orders)
+ACCOUNT_LIMITS = {
+    "upstox": (50, 50, 5),
+    "5paisa": (20, 20, 4),
+}
+
+HOSTS = {
+    "api.upstox.com": "upstox",
+    "api-hft.upstox.com": "upstox",
+    "api.kite.trade": "zerodha",
+    "apiconnect.angelone.in": "angelone",
+    "apiconnect.angelbroking.com": "angelone",
+    "openapi.5paisa.com": "5paisa",
+}
+
+# First matching (lower-case path fragment, endpoint class) wins
+PATH_CLASSES = {
+    "upstox": (("/order/", "order"), ("/historical-candle", "historical"), ("/market-quote", "quote"), ("/portfolio", "portfolio")),
+    "zerodha": (("/orders", "order"), ("/instruments/historical", "historical"), ("/quote", "quote"), ("/portfolio", "portfolio")),
+    "angelone": (("getposition", "portfolio"), ("/order/", "order"), ("/gtt/", "order"), ("/historical/", "historical"), ("/market/", "quote")),
+    "5paisa": (("placeorderrequest", "order"), ("netposition", "portfolio"), ("/historical/", "historical"), ("marketfeed", "quote")),
+}
+
+LEASE_SIZE = int(os.getenv("RATE_LIMIT_LEASE", "3"))
+LEASE_TTL = float(os.getenv("RATE_LIMIT_LEASE_TTL", "0.25"))
+DATA_TIMEOUT = float(os.getenv("RATE_LIMIT_DATA_TIMEOUT", "5"))
+ORDER_TIMEOUT = float(os.getenv("RATE_LIMIT_ORDER_TIMEOUT", "15"))
+REDIS_RETRY = float(os.getenv("RATE_LIMIT_REDIS_RETRY", "10"))
+METRICS_FLUSH_SECONDS = 5.0
+
+# KEYS: class bucket, account bucket, pause key
+# ARGV: rate, burst, account rate (0 = none), account burst, tokens wanted, account reserve
+_ACQUIRE_LUA = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local pause = redis.call('PTTL', KEYS[3])
+if pause > 0 then return {0, pause} end
+
+local function level(key, rate, burst)
+  local b = redis.call('HMGET', key, 'tokens', 'ts')
+  local tokens = tonumber(b[1]) or burst
+  local ts = tonumber(b[2]) or now
+  return math.min(burst, tokens + math.max(0, now - ts) * rate / 1000)
+end
+
+local rate, burst = tonumber(ARGV[1]), tonumber(ARGV[2])
+local arate, aburst = tonumber(ARGV[3]), tonumber(ARGV[4])
+local want, reserve = tonumber(ARGV[5]), tonumber(ARGV[6])
+
+local tokens = level(KEYS[1], rate, burst)
+local grant = math.min(want, math.floor(tokens))
+local atokens = 0
+if arate > 0 then
+  atokens = level(KEYS[2], arate, aburst)
+  grant = math.min(grant, math.floor(atokens - reserve))
+end
+
+local wait = 0
+if grant < 1 then
+  grant = 0
+  wait = math.ceil((1 - tokens) * 1000 / rate)
+  if arate > 0 then
+    wait = math.max(wait, math.ceil((reserve + 1 - atokens) * 1000 / arate))
+  end
+end
+
+redis.call('HSET', KEYS[1], 'tokens', tokens - grant, 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst * 1000 / rate) + 1000)
+if arate > 0 then
+  redis.call('HSET', KEYS[2], 'tokens', atokens - grant, 'ts', now)
+  redis.call('PEXPIRE', KEYS[2], math.ceil(aburst * 1000 / arate) + 1000)
+end
+return {grant, math.max(wait, 1)}
+"""
+
+
+class RateLimitTimeout(requests.exceptions.RequestException):
+    """No token within the timeout; a RequestException so broker helpers treat it like a network failure."""
+
+
+redis_client = logger_util.redis_client
+_script = None
+# While set, the shared buckets are skipped until time.monotonic() passes it
+_redis_retry_at = None
+
+_leases = {}
+_local_buckets = {}
+_local_pauses = {}
+_lock = threading.Lock()
+
+_counters = Counter()
+_last_flush = time.monotonic()
+
+
+def _env_limit(broker, endpoint_class, default):
+    raw = os.getenv(f"RATE_LIMIT_{broker.upper()}_{endpoint_class.upper()}")
+    if not raw:
+        return default
+    rate, _, burst = raw.partition("/")
+    return float(rate), float(burst or rate)
+
+
+def limits_for(broker, endpoint_class):
+    """(rate, burst) for the class, falling back to the broker's default class."""
+    classes = LIMITS[broker]
+    endpoint_class = endpoint_class if endpoint_class in classes else "default"
+    return _env_limit(broker, endpoint_class, classes[endpoint_class])
+
+
+def account_id(token):
+    """Stable short id for an account from its token, api key or Authorization header."""
+    text = str(token or "").strip()
+    for prefix in ("bearer ", "token "):
+        if text.lower().startswith(prefix):
+            text = text[len(prefix):]
+    # Kite "api_key:access_token": Zerodha limits are per app
+    text = text.split(":", 1)[0]
+    return hashlib.sha1(text.encode()).hexdigest()[:16] if text else "anonymous"
+
+
+def classify(url):
+    """(broker, endpoint class) for a broker API url, or None for anything else."""
+    parts = urlsplit(url)
+    broker = HOSTS.get(parts.netloc.lower())
+    if broker is None:
+        return None
+    path = parts.path.lower()
+    for fragment, endpoint_class in PATH_CLASSES.get(broker, ()):
+        if fragment in path:
+            return broker, endpoint_class
+    return broker, "default"
+
+
+def limit_for_request(url, headers=None):
+    """(broker, endpoint class, account) to acquire before calling `url`, or None."""
+    target = classify(url)
+    if target is None:
+        return None
+    headers = headers or {}
+    token = headers.get("Authorization") or headers.get("authorization") or headers.get("X-PrivateKey")
+    return target[0], target[1], token
+
+
+# ---------- metrics ----------
+def _count(broker, endpoint_class, field, amount=1):
+    global _last_flush
+    with _lock:
+        _counters[f"{broker}:{endpoint_class}:{field}"] += amount
+        if time.monotonic() - _last_flush < METRICS_FLUSH_SECONDS:
+            return
+        pending = dict(_counters)
+        _counters.clear()
+        _last_flush = time.monotonic()
+    _flush(pending)
+
+
+def _flush(pending):
+    if redis_client is None or not pending:
+        return
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        for field, amount in pending.items():
+            pipe.hincrbyfloat(METRICS_KEY, field, amount)
+        pipe.execute()
+    except Exception:
+        pass
+
+
+def metrics():
+    """Counters per broker:class (granted, redis_calls, waits, wait_ms, timeouts, throttled)."""
+    with _lock:
+        pending = dict(_counters)
+    totals = Counter()
+    if redis_client is not None:
+        try:
+            totals.update({k: float(v) for k, v in redis_client.hgetall(METRICS_KEY).items()})
+        except Exception:
+            pass
+    totals.update(pending)
+
+    result = {}
+    for field, value in totals.items():
+        broker, endpoint_class, name = field.rsplit(":", 2)
+        result.setdefault(f"{broker}:{endpoint_class}", {})[name] = round(value, 3)
+    return result
+
+
+# ---------- buckets ----------
+def _local_take(key, want, rate, burst, account_limit):
+    """In-memory version of the Lua script for when Redis is unavailable."""
+    broker, endpoint_class, account = key
+    now = time.monotonic()
+    with _lock:
+        pause_until = _local_pauses.get((broker, endpoint_class, account), 0)
+        if pause_until > now:
+            return 0, int((pause_until - now) * 1000) + 1
+
+        def level(bucket_key, r, b):
+            tokens, ts = _local_buckets.get(bucket_key, (b, now))
+            return min(b, tokens + (now - ts) * r)
+
+        tokens = level(key, rate, burst)
+        grant = min(want, int(tokens))
+        account_key = (broker, "account", account)
+        if account_limit:
+            arate, aburst, reserve = account_limit
+            atokens = level(account_key, arate, aburst)
+            grant = min(grant, int(atokens - reserve))
+        wait = 0
+        if grant < 1:
+            grant = 0
+            wait = (1 - tokens) * 1000 / rate
+            if account_limit:
+                wait = max(wait, (reserve + 1 - atokens) * 1000 / arate)
+        _local_buckets[key] = (tokens - grant, now)
+        if account_limit:
+            _local_buckets[account_key] = (atokens - grant, now)
+        return grant, max(int(wait) + 1, 1)
+
+
+def _redis_take(key, want, rate, burst, account_limit):
+    global _script
+    broker, endpoint_class, account = key
+    if _script is None:
+        _script = redis_client.register_script(_ACQUIRE_LUA)
+    arate, aburst, reserve = account_limit or (0, 0, 0)
+    grant, wait_ms = _script(
+        keys=[
+            BUCKET_KEY.format(broker=broker, account=account, name=endpoint_class),
+            BUCKET_KEY.format(broker=broker, account=account, name="account"),
+            BUCKET_KEY.format(broker=broker, account=account, name=f"{endpoint_class}:pause"),
+        ],
+        args=[rate, burst, arate, aburst, want, reserve],
+    )
+    return int(grant), int(wait_ms)
+
+
+def _redis_usable():
+    return redis_client is not None and (_redis_retry_at is None or time.monotonic() >= _redis_retry_at)
+
+
+def _redis_down(error):
+    global _redis_retry_at
+    started = _redis_retry_at is None
+    _redis_retry_at = time.monotonic() + REDIS_RETRY
+    if started:
+        logger_util.push_log(f"⚠️ Rate limiter falling back to in-process buckets, retrying Redis every {REDIS_RETRY:g}s: {error}", level="warning", user_id="admin", log_type="trading")
+
+
+def _redis_up():
+    global _redis_retry_at
+    if _redis_retry_at is not None:
+        _redis_retry_at = None
+        logger_util.push_log("✅ Rate limiter is back on the shared Redis buckets", level="info", user_id="admin", log_type="trading")
+
+
+def _take(key, is_order):
+    """Serve a token from this process's lease, else reserve from the shared bucket."""
+    now = time.monotonic()
+    with _lock:
+        lease = _leases.get(key)
+        if lease and lease[0] > 0 and lease[1] > now:
+            lease[0] -= 1
+            return True, 0
+
+    broker, endpoint_class, _ = key
+    rate, burst = limits_for(broker, endpoint_class)
+    account_limit = ACCOUNT_LIMITS.get(broker)
+    if account_limit and is_order:
+        # Orders may dip into the reserve data calls leave behind
+        account_limit = (account_limit[0], account_limit[1], 0)
+    want = 1 if is_order else max(1, min(LEASE_SIZE, int(burst)))
+
+    shared = False
+    if _redis_usable():
+        try:
+            grant, wait_ms = _redis_take(key, want, rate, burst, account_limit)
+            _count(broker, endpoint_class, "redis_calls")
+            shared = True
+            _redis_up()
+        except Exception as e:
+            _redis_down(e)
+    if not shared:
+        grant, wait_ms = _local_take(key, want, rate, burst, account_limit)
+
+    if grant > 1:
+        with _lock:
+            _leases[key] = [grant - 1, now + LEASE_TTL]
+    return grant > 0, wait_ms
+
+
+def _prepare(broker, endpoint_class, account, timeout):
+    classes = LIMITS.get(broker)
+    if classes is None:
+        return None, None
+    endpoint_class = endpoint_class if endpoint_class in classes else "default"
+    key = (broker, endpoint_class, account_id(account))
+    if timeout is None:
+        timeout = ORDER_TIMEOUT if endpoint_class == "order" else DATA_TIMEOUT
+    return key, time.monotonic() + timeout
+
+
+def _on_wait(key, deadline, wait_ms, waited):
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        _count(key[0], key[1], "timeouts")
+        raise RateLimitTimeout(f"No {key[0]} {key[1]} rate-limit token after {waited:.2f}s")
+    # Jitter so workers woken by the same refill do not collide
+    return min(wait_ms / 1000 * (1 + random.random() * 0.2), remaining)
+
+
+def acquire(broker, endpoint_class="default", account=None, timeout=None):
+    """
+    Block until a token for (broker, endpoint class, account) is available and
+    return the seconds waited. Raises RateLimitTimeout after `timeout` (5 s for data,
+    15 s for orders by default). Unknown brokers are not limited.
+    """
+    key, deadline = _prepare(broker, endpoint_class, account, timeout)
+    if key is None:
+        return 0.0
+    waited = 0.0
+    while True:
+        granted, wait_ms = _take(key, key[1] == "order")
+        if granted:
+            break
+        delay = _on_wait(key, deadline, wait_ms, waited)
+        time.sleep(delay)
+        waited += delay
+    _count(key[0], key[1], "granted")
+    if waited:
+        _count(key[0], key[1], "waits")
+        _count(key[0], key[1], "wait_ms", waited * 1000)
+    return waited
+
+
+async def aacquire(broker, endpoint_class="default", account=None, timeout=None):
+    """Async `acquire` for the FastAPI endpoints; waits without blocking the event loop."""
+    key, deadline = _prepare(broker, endpoint_class, account, timeout)
+    if key is None:
+        return 0.0
+    waited = 0.0
+    while True:
+        granted, wait_ms = await asyncio.to_thread(_take, key, key[1] == "order")
+        if granted:
+            break
+        delay = _on_wait(key, deadline, wait_ms, waited)
+        await asyncio.sleep(delay)
+        waited += delay
+    _count(key[0], key[1], "granted")
+    if waited:
+        _count(key[0], key[1], "waits")
+        _count(key[0], key[1], "wait_ms", waited * 1000)
+    return waited
+
+
+def throttle(broker, endpoint_class, account, retry_after=1.0):
+    """The broker answered 429: pause this bucket for every worker for `retry_after` seconds."""
+    key, _ = _prepare(broker, endpoint_class, account, 0)
+    if key is None:
+        return
+    pause_ms = max(int(retry_after * 1000), 1)
+    with _lock:
+        _leases.pop(key, None)
+        _local_pauses[key] = time.monotonic() + pause_ms / 1000
+    if _redis_usable():
+        try:
+            redis_client.set(
+                BUCKET_KEY.format(broker=key[0], account=key[2], name=f"{key[1]}:pause"), 1, px=pause_ms
+            )
+        except Exception:
+            pass
+    _count(key[0], key[1], "throttled")
+    logger_util.push_log(f"🚦 {broker} {key[1]} rate limited, pausing {retry_after:.1f}s", level="warning", user_id="admin", log_type="trading")
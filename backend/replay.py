@@ -0,0 +1,461 @@
+# backend/replay.py
+"""
+Record a trading session's broker traffic and replay it offline.
+
+`record` runs `run_trading_logic_for_all` for a config against the live
+brokers and writes every broker_http response, every signal and every order the
+loop queued to a recording, one frame per cycle. `run` replays a recording: the
+same loop runs on a virtual clock (see backend.clock) with fakeredis, broker
+calls are answered from the recording and sleeps until the next candle return at
+once, so a full session replays in seconds. The replay's signals and orders are
+then diffed against the recorded ones per candle, which makes a recording a
+regression and performance test.
+
+Format: b"AVRP1\\n", then frames of a 4-byte big-endian length and zlib-compressed
+JSON. The first frame holds the config, the following ones a cycle each.
+Credential values are replaced by placeholders before anything is written.
+
+Only calls made through broker_http are recorded; SDK calls (KiteConnect,
+SmartAPI logins) are not, so sessions replay fully on Upstox, 5paisa and paper.
+
+Run:
+  python -m backend.replay record config.json session.avrp --cycles 30
+  python -m backend.replay run session.avrp
+"""
+import argparse
+import base64
+import collections
+import contextlib
+import hashlib
+import json
+import re
+import struct
+import threading
+import time
+import zlib
+from urllib.parse import parse_qsl, urlsplit
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+import backend.logger_util as logger_util
+from backend import broker_http
+from backend import clock
+from backend import order_pipeline
+from backend import signal_service
+
+try:
+    import fakeredis
+except ImportError:  # replays need it; recording does not
+    fakeredis = None
+
+MAGIC = b"AVRP1\n"
+VERSION = 1
+
+_DATE = re.compile(r"\d{4}-\d{2}-\d{2}")
+_TIME = re.compile(r"\d{2}:\d{2}(:\d{2})?")
+_EPOCH = re.compile(r"\b1\d{9}(\d{3})?\b")
+
+
+# ---------- format ----------
+def _write_frame(fh, frame):
+    data = zlib.compress(json.dumps(frame, separators=(",", ":"), default=str).encode())
+    fh.write(struct.pack(">I", len(data)))
+    fh.write(data)
+    fh.flush()
+
+
+def read_frames(path):
+    with open(path, "rb") as fh:
+        if fh.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a replay recording")
+        while True:
+            header = fh.read(4)
+            if len(header) < 4:
+                return
+            (size,) = struct.unpack(">I", header)
+            yield json.loads(zlib.decompress(fh.read(size)))
+
+
+def load(path):
+    """(meta, cycle frames) of a recording."""
+    frames = list(read_frames(path))
+    if not frames or frames[0].get("t") != "meta":
+        raise ValueError(f"{path} has no meta frame")
+    return frames[0], frames[1:]
+
+
+# ---------- requests ----------
+class _Redactor:
+    """Replaces credential values with stable placeholders."""
+
+    def __init__(self, config):
+        self.secrets = {}
+        for broker in config.get("selectedBrokers", []):
+            for name, value in (broker.get("credentials") or {}).items():
+                if isinstance(value, str) and len(value) >= 6:
+                    digest = hashlib.sha1(value.encode()).hexdigest()[:8]
+                    self.secrets[value] = f"<{broker.get('name')}:{name}:{digest}>"
+
+    def __call__(self, text):
+        for secret, placeholder in self.secrets.items():
+            text = text.replace(secret, placeholder)
+        return text
+
+    def config(self, config):
+        return json.loads(self(json.dumps(config)))
+
+
+def _body_text(body):
+    if body is None:
+        return ""
+    if isinstance(body, bytes):
+        return body.decode("utf-8", "replace")
+    if isinstance(body, str):
+        return body
+    return json.dumps(body, sort_keys=True, default=str)
+
+
+def request_key(method, url, kwargs):
+    """Method, host, path, sorted query/params and body of a call; headers are ignored."""
+    parts = urlsplit(url)
+    params = kwargs.get("params") or {}
+    params = params.items() if isinstance(params, dict) else params
+    query = sorted(parse_qsl(parts.query) + [(str(k), str(v)) for k, v in params])
+    body = kwargs.get("json") if kwargs.get("json") is not None else kwargs.get("data")
+    # Not url-encoded, so credential placeholders read the same in recorded and live keys
+    query = "&".join(f"{k}={v}" for k, v in query)
+    return f"{method.upper()} {parts.netloc}{parts.path}?{query} {_body_text(body)}"
+
+
+def loose_key(key):
+    """The key with dates, times and epochs blanked, for calls whose range moves with the clock."""
+    return _EPOCH.sub("{ts}", _TIME.sub("{time}", _DATE.sub("{date}", key)))
+
+
+def _response_record(response):
+    content = response.content or b""
+    try:
+        body, encoding = content.decode("utf-8"), "text"
+    except UnicodeDecodeError:
+        body, encoding = base64.b64encode(content).decode(), "b64"
+    return {"s": response.status_code, "ct": response.headers.get("Content-Type"), "b": body, "e": encoding}
+
+
+def _response(record, url):
+    response = requests.Response()
+    response.status_code = record["s"]
+    response.url = url
+    response.encoding = "utf-8"
+    response.headers = CaseInsensitiveDict({"Content-Type": record.get("ct") or "application/json"})
+    body = record.get("b") or ""
+    response._content = base64.b64decode(body) if record.get("e") == "b64" else body.encode()
+    return response
+
+
+def _account_id(account, redact):
+    return redact(str(account)) if account is not None else None
+
+
+# ---------- recording ----------
+class Recorder:
+    """Collects a session's calls and decisions and writes them one frame per cycle."""
+
+    def __init__(self, path, config):
+        self.redact = _Redactor(config)
+        self._lock = threading.Lock()
+        self._fh = open(path, "wb")
+        self._fh.write(MAGIC)
+        _write_frame(self._fh, {"t": "meta", "version": VERSION, "started": clock.time(),
+                                "config": self.redact.config(config)})
+        self._frame = self._new_frame(None)
+
+    @staticmethod
+    def _new_frame(candle):
+        return {"t": "cycle", "candle": candle, "at": clock.time(), "calls": [], "signals": [], "orders": []}
+
+    def call(self, method, url, kwargs, response=None, error=None):
+        key = self.redact(request_key(method, url, kwargs))
+        entry = {"k": key}
+        if error is not None:
+            entry["x"] = [type(error).__name__, self.redact(str(error))]
+        else:
+            entry.update(_response_record(response))
+            entry["b"] = self.redact(entry["b"]) if entry["e"] == "text" else entry["b"]
+        with self._lock:
+            self._frame["calls"].append(entry)
+
+    def decision(self, kind, record):
+        with self._lock:
+            self._frame[kind].append(record)
+
+    def begin_cycle(self):
+        # Calls between cycles (setup, late confirmations) get a frame of their own
+        with self._lock:
+            frame, self._frame = self._frame, self._new_frame(None)
+        if frame["calls"] or frame["orders"]:
+            frame["t"] = "between"
+            _write_frame(self._fh, frame)
+
+    def end_cycle(self, candle):
+        with self._lock:
+            frame, self._frame = self._frame, self._new_frame(None)
+        frame["candle"] = candle
+        _write_frame(self._fh, frame)
+
+    def close(self):
+        with self._lock:
+            frame = self._frame
+        if frame["calls"] or frame["orders"]:
+            frame["t"] = "between"
+            _write_frame(self._fh, frame)
+        self._fh.close()
+
+
+# ---------- playback ----------
+class Player:
+    """Answers broker_http calls from a recording, in recorded order per request."""
+
+    def __init__(self, frames):
+        self._exact = collections.defaultdict(collections.deque)
+        self._loose = collections.defaultdict(collections.deque)
+        self._last = {}
+        self._lock = threading.Lock()
+        self.served = 0
+        self.misses = collections.Counter()
+        for frame in frames:
+            for call in frame["calls"]:
+                entry = [call, False]    # [record, used]
+                self._exact[call["k"]].append(entry)
+                self._loose[loose_key(call["k"])].append(entry)
+
+    @staticmethod
+    def _take(queue):
+        while queue:
+            entry = queue.popleft()
+            if not entry[1]:
+                entry[1] = True
+                return entry[0]
+        return None
+
+    def respond(self, method, url, kwargs, redact):
+        key = redact(request_key(method, url, kwargs))
+        loose = loose_key(key)
+        with self._lock:
+            record = self._take(self._exact[key]) or self._take(self._loose[loose])
+            if record is None:
+                # Polled more often than when recorded (order status, quotes): repeat the last answer
+                record = self._last.get(key) or self._last.get(loose)
+            if record is None:
+                self.misses[loose] += 1
+                raise requests.ConnectionError(f"No recorded response for {key}")
+            self._last[key] = self._last[loose] = record
+            self.served += 1
+        if "x" in record:
+            name, message = record["x"]
+            raise getattr(requests.exceptions, name, requests.RequestException)(message)
+        return _response(record, url)
+
+
+# ---------- harness ----------
+def _trading_tasks():
+    from backend.tasks import trading_tasks
+    return trading_tasks
+
+
+@contextlib.contextmanager
+def _patched(*patches):
+    """Set (object, attribute, value) patches for the duration of the block."""
+    saved = [(obj, name, getattr(obj, name)) for obj, name, _ in patches]
+    for obj, name, value in patches:
+        setattr(obj, name, value)
+    try:
+        yield
+    finally:
+        for obj, name, value in reversed(saved):
+            setattr(obj, name, value)
+
+
+def _decision_patches(sink, redact):
+    """Patches that report every signal and queued order of the loop to sink(kind, record)."""
+    submit, signal_for = order_pipeline.submit, signal_service.signal_for
+
+    def recording_submit(broker, account, side, place, *args, instrument=None, quantity=0, tradingsymbol=None,
+                         kind=None, **kwargs):
+        sink("orders", {
+            "candle": order_pipeline.current_cycle(), "broker": broker, "account": _account_id(account, redact),
+            "side": side, "instrument": str(instrument), "quantity": quantity, "tradingsymbol": tradingsymbol,
+            "kind": kind,
+        })
+        return submit(broker, account, side, place, *args, instrument=instrument, quantity=quantity,
+                      tradingsymbol=tradingsymbol, kind=kind, **kwargs)
+
+    def recording_signal_for(redis_client, key, candle, strategy, compute, *args, **kwargs):
+        event = signal_for(redis_client, key, candle, strategy, compute, *args, **kwargs)
+        sink("signals", {"candle": candle, "key": key, "event": event.event if event else None})
+        return event
+
+    return [(order_pipeline, "submit", recording_submit), (signal_service, "signal_for", recording_signal_for)]
+
+
+def record(config, path, cycles=None, resume=False, symbol_workers=1):
+    """
+    Run a live session for `config`, recording it to `path`; stops after `cycles` cycles when given.
+    Symbols run `symbol_workers` at a time; with one, symbols sharing an account are checked in a
+    fixed order, so their decisions do not depend on thread timing.
+    """
+    tt = _trading_tasks()
+    recorder = Recorder(path, config)
+    request, run_cycle = broker_http.request, tt.TradingSession.run_cycle
+    done = [0]
+
+    def recording_request(method, url, **kwargs):
+        try:
+            response = request(method, url, **kwargs)
+        except Exception as e:
+            recorder.call(method, url, kwargs, error=e)
+            raise
+        recorder.call(method, url, kwargs, response=response)
+        return response
+
+    def recording_run_cycle(session, symbol_pool):
+        recorder.begin_cycle()
+        try:
+            run_cycle(session, symbol_pool)
+        finally:
+            recorder.end_cycle(session.now_interval)
+        done[0] += 1
+        if cycles is not None and done[0] >= cycles:
+            tt.r.delete(session.active_key)
+
+    patches = [(broker_http, "request", recording_request), (tt.TradingSession, "run_cycle", recording_run_cycle),
+               (tt, "SYMBOL_WORKERS", symbol_workers)]
+    try:
+        with _patched(*patches, *_decision_patches(recorder.decision, recorder.redact)):
+            tt.run_trading_logic_for_all(config.get("user_id"), config.get("tradingParameters", []),
+                                         config.get("selectedBrokers", []), resume=resume)
+    finally:
+        recorder.close()
+    return path
+
+
+def _use_redis(client):
+    """Point every module-level Redis client of the engine at `client`."""
+    from backend import broker_sessions, rate_limiter, strategy_state
+    tt = _trading_tasks()
+    return [(logger_util, "redis_client", client), (broker_sessions, "redis_client", client),
+            (order_pipeline, "redis_client", client), (rate_limiter, "redis_client", client),
+            (strategy_state, "redis_client", client), (tt, "r", client)]
+
+
+def _by_candle(records):
+    grouped = collections.defaultdict(list)
+    for rec in records:
+        grouped[str(rec.get("candle"))].append(json.dumps(rec, sort_keys=True))
+    return {candle: sorted(items) for candle, items in grouped.items()}
+
+
+def diff(expected, actual):
+    """{candle: {"missing": [...], "extra": [...]}} of decision records that differ."""
+    expected, actual = _by_candle(expected), _by_candle(actual)
+    result = {}
+    for candle in sorted(set(expected) | set(actual)):
+        want = collections.Counter(expected.get(candle, []))
+        got = collections.Counter(actual.get(candle, []))
+        missing, extra = list((want - got).elements()), list((got - want).elements())
+        if missing or extra:
+            result[candle] = {"missing": [json.loads(m) for m in missing], "extra": [json.loads(e) for e in extra]}
+    return result
+
+
+def replay(path, redis_client=None, symbol_workers=1):
+    """Replay a recording; returns a report with the decision diff and timings."""
+    meta, frames = load(path)
+    cycles = [f for f in frames if f["t"] == "cycle"]
+    if redis_client is None:
+        if fakeredis is None:
+            raise RuntimeError("fakeredis is required to replay without a Redis server")
+        redis_client = fakeredis.FakeStrictRedis(decode_responses=True)
+
+    tt = _trading_tasks()
+    config = meta["config"]
+    redact = lambda text: text   # the recorded config already holds the placeholders
+    player = Player(frames)
+    virtual = clock.VirtualClock(meta["started"])
+    run_cycle = tt.TradingSession.run_cycle
+    decisions = {"signals": [], "orders": []}
+    lock = threading.Lock()
+    done = [0]
+
+    def sink(kind, rec):
+        with lock:
+            decisions[kind].append(rec)
+
+    def replay_request(method, url, **kwargs):
+        return player.respond(method, url, kwargs, redact)
+
+    def replay_run_cycle(session, symbol_pool):
+        if done[0] >= len(cycles):
+            # Past the end of the recording: empty the active set so the loop exits
+            tt.r.delete(session.active_key)
+            return
+        # Start the cycle when the recorded one started
+        virtual.set(cycles[done[0]]["at"])
+        done[0] += 1
+        run_cycle(session, symbol_pool)
+
+    patches = [(broker_http, "request", replay_request), (tt.TradingSession, "run_cycle", replay_run_cycle),
+               (tt, "SYMBOL_WORKERS", symbol_workers)]
+    started = time.perf_counter()
+    with clock.use(virtual), _patched(*patches, *_use_redis(redis_client), *_decision_patches(sink, redact)):
+        tt.run_trading_logic_for_all(config.get("user_id"), config.get("tradingParameters", []),
+                                     config.get("selectedBrokers", []))
+    wall = time.perf_counter() - started
+
+    recorded = {kind: [rec for f in frames for rec in f[kind]] for kind in ("signals", "orders")}
+    differences = {kind: diff(recorded[kind], decisions[kind]) for kind in ("signals", "orders")}
+    simulated = virtual.time() - meta["started"]
+    return {
+        "recording": str(path),
+        "cycles": {"recorded": len(cycles), "replayed": done[0]},
+        "calls": {"recorded": sum(len(f["calls"]) for f in frames), "served": player.served,
+                  "misses": dict(player.misses)},
+        "signals": {"recorded": len(recorded["signals"]), "replayed": len(decisions["signals"])},
+        "orders": {"recorded": len(recorded["orders"]), "replayed": len(decisions["orders"])},
+        "diff": differences,
+        "identical": not any(differences.values()),
+        "seconds": {"wall": round(wall, 3), "simulated": round(simulated, 1)},
+        "speedup": round(simulated / max(wall, 1e-9), 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Record and replay trading sessions")
+    sub = parser.add_subparsers(dest="command", required=True)
+    rec = sub.add_parser("record", help="run a live session and record it")
+    rec.add_argument("config", help="JSON config as sent to start_trading_loop")
+    rec.add_argument("path", help="recording to write")
+    rec.add_argument("--cycles", type=int, help="stop after this many cycles")
+    rec.add_argument("--symbol-workers", type=int, default=1)
+    run = sub.add_parser("run", help="replay a recording and diff its decisions")
+    run.add_argument("path")
+    run.add_argument("--redis-url", help="replay against this Redis instead of fakeredis")
+    run.add_argument("--symbol-workers", type=int, default=1)
+    args = parser.parse_args()
+
+    if args.command == "record":
+        with open(args.config) as fh:
+            config = json.load(fh)
+        print(record(config, args.path, cycles=args.cycles, symbol_workers=args.symbol_workers))
+        return
+    redis_client = None
+    if args.redis_url:
+        import redis
+        redis_client = redis.StrictRedis.from_url(args.redis_url, decode_responses=True)
+    report = replay(args.path, redis_client=redis_client, symbol_workers=args.symbol_workers)
+    print(json.dumps(report, indent=2))
+    raise SystemExit(0 if report["identical"] else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+# backend/session_lease.py
+"""
+Leases and checkpoints for crash-safe trading sessions.
+
+A running session holds a lease: a Redis key with a short TTL that its holder
+keeps renewing. If the process dies the lease expires within LEASE_TTL, and the
+session supervisor (Celery engine) or the shard coordinator (trading scheduler,
+whose `trading_owner:{user_id}` key is the same kind of lease) resumes the
+session elsewhere.
+
+After every cycle the session writes a compact checkpoint to
+`trading_checkpoint:{user_id}`: resolved instrument keys and the last processed
+candle of each exchange. The per-symbol strategy variables already live in the strategy-state
+store. A resumed session restores the checkpoint, skipping the instrument-key
+lookups and never re-running a candle that was already processed. Orders of a
+candle that was cut short are not sent twice because their client order ids are
+claimed in Redis.
+
+Every start gets a new session id, stored under `trading_session_id:{user_id}`.
+A stop names the session it stops, and a session whose id is no longer the
+current one ends at its next refresh, so a stop followed at once by a start
+can never leave the old loop running next to the new one.
+"""
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+
+import backend.logger_util as logger_util
+
+SESSIONS_KEY = "trading_sessions"
+LEASE_KEY = "trading_lease:{user_id}"
+CHECKPOINT_KEY = "trading_checkpoint:{user_id}"
+RESUME_KEY = "trading_resume:{user_id}"
+SESSION_ID_KEY = "trading_session_id:{user_id}"
+
+LEASE_TTL = float(os.getenv("TRADING_LEASE_TTL", "30"))
+# Upper bound on how long a queued resume may wait for a worker before it is queued again
+RESUME_CLAIM_TTL = int(os.getenv("TRADING_RESUME_CLAIM_TTL", "1800"))
+
+_RENEW_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+  return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+_RELEASE_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+  return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+def holder_id(suffix=None):
+    base = f"{socket.gethostname()}-{os.getpid()}"
+    return f"{base}-{suffix}" if suffix else base
+
+
+class SessionLease:
+    """Renewable lease on one user's trading session."""
+
+    def __init__(self, redis_client, user_id, holder=None, ttl=LEASE_TTL):
+        self.redis = redis_client
+        self.user_id = user_id
+        self.key = LEASE_KEY.format(user_id=user_id)
+        self.holder = holder or holder_id()
+        self.ttl_ms = int(ttl * 1000)
+        # Set when a renewal fails: another holder may take over, so stop trading
+        self.lost = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._renew = redis_client.register_script(_RENEW_LUA)
+        self._release = redis_client.register_script(_RELEASE_LUA)
+
+    def acquire(self, wait=0):
+        """True if the lease is free (or already ours), waiting up to `wait` seconds for it."""
+        deadline = time.time() + wait
+        while True:
+            if self.redis.set(self.key, self.holder, nx=True, px=self.ttl_ms) or self.renew():
+                return True
+            if time.time() >= deadline:
+                return False
+            time.sleep(0.25)
+
+    def current_holder(self):
+        return self.redis.get(self.key)
+
+    def renew(self):
+        return self._renew(keys=[self.key], args=[self.holder, self.ttl_ms]) == 1
+
+    def release(self):
+        self.stop_renewing()
+        try:
+            self._release(keys=[self.key], args=[self.holder])
+        except Exception:
+            pass
+
+    def start_renewing(self):
+        """Renew every third of the TTL from a daemon thread until released."""
+        self._thread = threading.Thread(target=self._renew_loop, name=f"lease-{self.user_id}", daemon=True)
+        self._thread.start()
+
+    def stop_renewing(self):
+        self._stop.set()
+
+    def _renew_loop(self):
+        interval = self.ttl_ms / 3000
+        renewed_at = time.time()
+        while not self._stop.wait(interval):
+            try:
+                renewed = self.renew()
+            except Exception as e:
+                if time.time() - renewed_at >= self.ttl_ms / 1000:
+                    # The lease has run out by now and may already have another holder
+                    logger_util.push_log(f"🔒 Trading lease for {self.user_id} expired while Redis was unreachable ({e}), stopping this session", level="warning", user_id="admin", log_type="trading")
+                    self.lost.set()
+                    return
+                logger_util.push_log(f"⚠️ Lease renewal failed for {self.user_id}: {e}", level="warning", user_id="admin", log_type="trading")
+                # Keep trying until the TTL would have run out
+                continue
+            if renewed:
+                renewed_at = time.time()
+                continue
+            logger_util.push_log(f"🔒 Lost trading lease for {self.user_id}, stopping this session", level="warning", user_id="admin", log_type="trading")
+            self.lost.set()
+            return
+
+
+def is_leased(redis_client, user_id):
+    return bool(redis_client.exists(LEASE_KEY.format(user_id=user_id)))
+
+
+def new_session(redis_client, user_id):
+    """Make a new session id the user's current one; older sessions end at their next refresh."""
+    session_id = uuid.uuid4().hex[:12]
+    redis_client.set(SESSION_ID_KEY.format(user_id=user_id), session_id)
+    return session_id
+
+
+def current_session(redis_client, user_id):
+    return redis_client.get(SESSION_ID_KEY.format(user_id=user_id))
+
+
+def claim_resume(redis_client, user_id):
+    """Mark a session as queued for resumption; False if it already is."""
+    return bool(redis_client.set(RESUME_KEY.format(user_id=user_id), "queued", nx=True, ex=RESUME_CLAIM_TTL))
+
+
+def clear_resume(redis_client, user_id):
+    """Called once a queued session has reached a worker and tried its lease."""
+    try:
+        redis_client.delete(RESUME_KEY.format(user_id=user_id))
+    except Exception:
+        pass
+
+
+# ---------- checkpoints ----------
+def _plain(value):
+    # numpy scalars from the instrument frames
+    return value.item() if hasattr(value, "item") else str(value)
+
+
+def save_checkpoint(redis_client, user_id, trading_parameters, last_candles):
+    instrument_keys = {
+        s["symbol_value"]: s["instrument_key"]
+        for s in trading_parameters if s.get("symbol_value") and s.get("instrument_key") is not None
+    }
+    redis_client.hset(CHECKPOINT_KEY.format(user_id=user_id), mapping={
+        "instrument_keys": json.dumps(instrument_keys, default=_plain),
+        "last_candle": json.dumps(last_candles or {}),
+        "updated": time.time(),
+    })
+
+
+def load_checkpoint(redis_client, user_id):
+    """(instrument_keys, {exchange: last_candle}) of the last checkpoint, or ({}, {})."""
+    raw = redis_client.hgetall(CHECKPOINT_KEY.format(user_id=user_id))
+    if not raw:
+        return {}, {}
+    last_candles = raw.get("last_candle") or "{}"
+    if not last_candles.startswith("{"):
+        # Checkpoint written before candles were kept per exchange
+        last_candles = json.dumps({"NSE": last_candles, "MCX": last_candles})
+    return json.loads(raw.get("instrument_keys") or "{}"), json.loads(last_candles)
+
+
+def clear_checkpoint(redis_client, user_id):
+    redis_client.delete(CHECKPOINT_KEY.format(user_id=user_id))
@@ -0,0 +1,71 @@
+# backend/session_supervisor.py
+"""
+Session supervisor for the Celery trading engine (TRADING_ENGINE=celery).
+
+Every SUPERVISOR_INTERVAL seconds it scans the `trading_sessions` hash. A session
+whose lease has expired belongs to a dead worker and is queued again with
+resume=True, so it continues from its checkpoint within LEASE_TTL +
+SUPERVISOR_INTERVAL seconds. A `trading_resume:{user_id}` claim marks the session as queued until
+the resumed task reaches a worker and takes the lease, so a task still waiting
+behind busy workers is not queued again; the lease keeps two workers from
+running it.
+
+The trading scheduler does not need this: its shard coordinator moves users of
+a dead node on its own.
+
+Run:
+  python -m backend.session_supervisor
+"""
+import json
+import os
+import time
+
+import backend.logger_util as logger_util
+from backend import session_lease as sl
+from backend.tasks import trading_tasks as tt
+
+SUPERVISOR_INTERVAL = float(os.getenv("TRADING_SUPERVISOR_INTERVAL", "10"))
+
+
+def sweep(redis_client, enqueue):
+    """Queue every session without a live lease through `enqueue(config)`; returns the resumed user ids."""
+    resumed = []
+    for user_id, raw in redis_client.hgetall(sl.SESSIONS_KEY).items():
+        if sl.is_leased(redis_client, user_id):
+            continue
+        config = json.loads(raw)
+        if redis_client.get(tt.get_kill_key(user_id)) in ("1", config.get("session_id")):
+            # Stopped while its worker was down: nothing to resume
+            redis_client.hdel(sl.SESSIONS_KEY, user_id)
+            sl.clear_checkpoint(redis_client, user_id)
+            continue
+        if not sl.claim_resume(redis_client, user_id):
+            # Already queued and not yet picked up by a worker
+            continue
+        try:
+            enqueue(config)
+        except Exception as e:
+            sl.clear_resume(redis_client, user_id)
+            logger_util.push_log(f"❌ Could not resume trading session for {user_id}: {e}", level="error", user_id="admin", log_type="trading")
+            continue
+        resumed.append(user_id)
+        logger_util.push_log(f"♻️ Trading session for {user_id} lost its worker, resuming it", level="warning", user_id="admin", log_type="trading")
+    return resumed
+
+
+def main():
+    if os.getenv("TRADING_ENGINE", "celery").lower() != "celery":
+        logger_util.push_log("ℹ️ Session supervisor is only needed with TRADING_ENGINE=celery, exiting", level="info", user_id="admin", log_type="trading")
+        return
+    logger_util.push_log("🩺 Trading session supervisor running", level="info", user_id="admin", log_type="trading")
+    enqueue = lambda config: tt.start_trading_loop.delay(config, resume=True)
+    while True:
+        try:
+            sweep(tt.r, enqueue)
+        except Exception as e:
+            logger_util.push_log(f"⚠️ Session supervisor sweep failed: {e}", level="warning", user_id="admin", log_type="trading")
+        time.sleep(SUPERVISOR_INTERVAL)
+
+
+if __name__ == "__main__":
+    main()
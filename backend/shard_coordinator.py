@@ -0,0 +1,124 @@
+# backend/shard_coordinator.py
+"""
+Shard coordinator for trading nodes.
+
+Every trading scheduler process is a node. Nodes heartbeat into the Redis sorted
+set `trading_nodes` and place users on a consistent-hash ring built from the live
+nodes, so adding a node only moves about 1/N of the users and throughput scales
+with the number of nodes. A node that stops heartbeating drops out after
+NODE_TTL and its users move to their new ring owners.
+
+Only one node may run a user at a time: the owner holds `trading_owner:{user_id}`
+(renewed with every heartbeat) and a new owner takes over once it is released or
+expires. A node that finds it could not renew a user (it stalled or was cut off
+for longer than NODE_TTL) drops that user at once, since another node may
+already be running it. The new owner resumes the user from its session checkpoint
+(session_lease); the active-symbol set already lives in Redis.
+"""
+import bisect
+import hashlib
+import os
+import socket
+import threading
+import time
+
+import backend.logger_util as logger_util
+
+NODES_KEY = "trading_nodes"
+OWNER_KEY = "trading_owner:{user_id}"
+
+HEARTBEAT_INTERVAL = float(os.getenv("TRADING_NODE_HEARTBEAT", "5"))
+NODE_TTL = float(os.getenv("TRADING_NODE_TTL", "20"))
+VNODES = 64
+
+# Renew/release an ownership key only while this node still holds it; 1/0 per key
+_RENEW_LUA = """
+local renewed = {}
+for i, key in ipairs(KEYS) do
+  if redis.call('GET', key) == ARGV[1] then
+    redis.call('PEXPIRE', key, ARGV[2])
+    renewed[i] = 1
+  else
+    renewed[i] = 0
+  end
+end
+return renewed
+"""
+_RELEASE_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+  return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+def _hash(value):
+    return int.from_bytes(hashlib.md5(str(value).encode()).digest()[:8], "big")
+
+
+class HashRing:
+    """Consistent-hash ring with VNODES points per node."""
+
+    def __init__(self, nodes, vnodes=VNODES):
+        self.nodes = sorted(nodes)
+        points = sorted((_hash(f"{node}#{i}"), node) for node in self.nodes for i in range(vnodes))
+        self._keys = [p[0] for p in points]
+        self._owners = [p[1] for p in points]
+
+    def owner(self, key):
+        if not self._keys:
+            return None
+        index = bisect.bisect(self._keys, _hash(key)) % len(self._keys)
+        return self._owners[index]
+
+
+class ShardCoordinator:
+    def __init__(self, redis_client, node_id=None):
+        self.redis = redis_client
+        self.node_id = node_id or os.getenv("TRADING_NODE_ID") or f"{socket.gethostname()}-{os.getpid()}"
+        self.ring = HashRing([self.node_id])
+        self._lock = threading.Lock()
+        self._renew = redis_client.register_script(_RENEW_LUA)
+        self._release = redis_client.register_script(_RELEASE_LUA)
+
+    # ---------- membership ----------
+    def heartbeat(self):
+        """Refresh this node and the live-node view. Returns True when membership changed."""
+        now = time.time()
+        pipe = self.redis.pipeline()
+        pipe.zadd(NODES_KEY, {self.node_id: now})
+        pipe.zremrangebyscore(NODES_KEY, "-inf", now - NODE_TTL)
+        pipe.zrange(NODES_KEY, 0, -1)
+        nodes = pipe.execute()[2]
+        with self._lock:
+            if sorted(nodes) == self.ring.nodes:
+                return False
+            self.ring = HashRing(nodes)
+        logger_util.push_log(f"🧭 Trading nodes now {', '.join(sorted(nodes))}", level="info", user_id="admin", log_type="trading")
+        return True
+
+    def leave(self):
+        self.redis.zrem(NODES_KEY, self.node_id)
+
+    def owns(self, user_id):
+        with self._lock:
+            return self.ring.owner(user_id) == self.node_id
+
+    # ---------- ownership ----------
+    def claim(self, user_id):
+        """Take ownership of a user; False while another node still holds it."""
+        key = OWNER_KEY.format(user_id=user_id)
+        ttl = int(NODE_TTL * 1000)
+        if self.redis.set(key, self.node_id, nx=True, px=ttl):
+            return True
+        return self._renew(keys=[key], args=[self.node_id, ttl]) == [1]
+
+    def renew(self, user_ids):
+        """Extend ownership of `user_ids`; returns the ones this node no longer owns."""
+        if not user_ids:
+            return []
+        renewed = self._renew(keys=[OWNER_KEY.format(user_id=u) for u in user_ids], args=[self.node_id, int(NODE_TTL * 1000)])
+        return [u for u, ok in zip(user_ids, renewed) if not ok]
+
+    def release(self, user_id):
+        self._release(keys=[OWNER_KEY.format(user_id=user_id)], args=[self.node_id])
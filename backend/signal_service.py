@@ -0,0 +1,199 @@
+# backend/signal_service.py
+"""
+Signals computed once per candle and shared by every account.
+
+The same (broker, exchange, symbol, interval, strategy) gives the same signal
+for every user, so only one of them fetches candles and runs indicators and rules
+for a candle. The broker is part of the key because each one's candles differ
+(and the paper broker's are simulated), so accounts only share signals computed
+from their own broker's data. The first caller claims `signal_lock:{key}:{candle}` and computes; the
+result is stored as an event under `signal:{key}:{candle}` and published on the
+`signals` channel. Every other caller, in this process or on another node, waits
+for that event and only applies its own position and sizing logic.
+
+An event is BUY, SELL, EXIT or NONE, with the latest Signals and the indicator
+values that produced them. Waiters keep waiting while the computing caller holds
+the lock. If it fails, the lock is released (or expires after LOCK_TTL) and the
+next waiter claims it and computes.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import Future
+
+import backend.logger_util as logger_util
+from backend import indicators
+from backend import session_lease
+from backend import strategy_rules
+
+EVENT_KEY = "signal:{key}:{candle}"
+LOCK_KEY = "signal_lock:{key}:{candle}"
+SIGNAL_CHANNEL = "signals"
+
+EVENT_TTL = int(os.getenv("SIGNAL_EVENT_TTL", "3600"))
+LOCK_TTL = int(os.getenv("SIGNAL_LOCK_TTL", "60"))
+POLL_SECONDS = 0.05
+
+BUY, SELL, EXIT, NONE = "BUY", "SELL", "EXIT", "NONE"
+
+# (key, candle) -> Future of the event, shared by this process's callers
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+
+def signal_key(broker, exchange, symbol, interval, strategy, params=None):
+    """Callers share a signal only when they use the same broker's candles and indicator parameters."""
+    key = f"{broker}:{exchange}:{symbol}:{interval}:{strategy}"
+    tuned = {k: v for k, v in (params or {}).items() if indicators.DEFAULT_PARAMS.get(k) != v}
+    if tuned:
+        key += ":" + hashlib.sha1(json.dumps(tuned, sort_keys=True).encode()).hexdigest()[:12]
+    return key
+
+
+def event_type(signals):
+    if signals.long:
+        return BUY
+    if signals.short:
+        return SELL
+    if signals.exit_long or signals.exit_short:
+        return EXIT
+    return NONE
+
+
+class SignalEvent:
+    def __init__(self, key, candle, strategy, signals, values, computed_by=None, shared=False):
+        self.key = key
+        self.candle = candle
+        self.strategy = strategy
+        self.signals = signals
+        self.values = values
+        self.computed_by = computed_by
+        self.shared = shared        # True when another caller computed it
+
+    @property
+    def event(self):
+        return event_type(self.signals)
+
+    def to_json(self):
+        return json.dumps({
+            "event": self.event,
+            "key": self.key,
+            "candle": self.candle,
+            "strategy": self.strategy,
+            "signals": self.signals._asdict(),
+            "values": self.values,
+            "computed_by": self.computed_by,
+            "ts": time.time(),
+        })
+
+    @classmethod
+    def from_json(cls, raw):
+        data = json.loads(raw)
+        return cls(data["key"], data["candle"], data["strategy"],
+                   strategy_rules.Signals(**data["signals"]), data["values"],
+                   computed_by=data.get("computed_by"), shared=True)
+
+
+def _build(key, candle, strategy, indicators_df):
+    rules = strategy_rules.get(strategy)
+    if rules is None:
+        raise ValueError(f"Unknown strategy {strategy}")
+    last = indicators_df.iloc[-1]
+    values = {c: float(last[c]) for c in rules.columns if c in last.index}
+    return SignalEvent(key, candle, strategy, rules.latest(indicators_df), values,
+                       computed_by=session_lease.holder_id())
+
+
+def _publish(redis_client, event):
+    raw = event.to_json()
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.set(EVENT_KEY.format(key=event.key, candle=event.candle), raw, ex=EVENT_TTL)
+    pipe.publish(SIGNAL_CHANNEL, raw)
+    pipe.execute()
+
+
+def _compute(redis_client, key, candle, strategy, compute, wait):
+    """
+    Cross-process: claim and compute, or wait for whoever claimed it. The lock
+    expires after LOCK_TTL, so a waiter claims it once the holder is gone; `wait`
+    only bounds a holder that keeps the lock without publishing.
+    """
+    event_key = EVENT_KEY.format(key=key, candle=candle)
+    lock_key = LOCK_KEY.format(key=key, candle=candle)
+    deadline = time.time() + wait
+    while True:
+        raw = redis_client.get(event_key)
+        if raw:
+            return SignalEvent.from_json(raw)
+        claimed = redis_client.set(lock_key, session_lease.holder_id(), nx=True, ex=LOCK_TTL)
+        if claimed or time.time() >= deadline:
+            try:
+                indicators_df = compute()
+                event = None if indicators_df is None or indicators_df.empty else _build(key, candle, strategy, indicators_df)
+            except Exception:
+                if claimed:
+                    redis_client.delete(lock_key)
+                raise
+            if event is None:
+                # No data on this account: let the next caller try with its own
+                if claimed:
+                    redis_client.delete(lock_key)
+                return None
+            if claimed:
+                _publish(redis_client, event)
+            else:
+                logger_util.push_log(f"⏳ Signal for {key} at {candle} not published in {wait}s, computed locally",
+                                     level="warning", user_id="admin", log_type="trading")
+            return event
+        time.sleep(POLL_SECONDS)
+
+
+def signal_for(redis_client, key, candle, strategy, compute, wait=LOCK_TTL):
+    """
+    The SignalEvent of `key` for `candle`, or None when there is no data.
+
+    compute() returns the indicator frame; it runs at most once per candle
+    across all callers unless the computing caller fails.
+    """
+    if redis_client is None:
+        indicators_df = compute()
+        return None if indicators_df is None or indicators_df.empty else _build(key, candle, strategy, indicators_df)
+
+    with _inflight_lock:
+        future = _inflight.get((key, candle))
+        owner = future is None
+        if owner:
+            future = _inflight[(key, candle)] = Future()
+    if not owner:
+        try:
+            event = future.result()
+        except Exception:
+            event = None
+        if event is None:
+            # The computing caller failed or had no data: try with this caller's own fetch
+            return signal_for(redis_client, key, candle, strategy, compute, wait)
+        return SignalEvent(event.key, event.candle, event.strategy, event.signals, event.values,
+                           computed_by=event.computed_by, shared=True)
+
+    try:
+        event = _compute(redis_client, key, candle, strategy, compute, wait)
+    except Exception as e:
+        _done(key, candle)
+        future.set_exception(e)
+        raise
+    _done(key, candle)
+    future.set_result(event)
+    return event
+
+
+def _done(key, candle):
+    # Before the future resolves, so a waiter that retries starts a fresh computation
+    with _inflight_lock:
+        _inflight.pop((key, candle), None)
+
+
+def latest(redis_client, key, candle):
+    raw = redis_client.get(EVENT_KEY.format(key=key, candle=candle))
+    return SignalEvent.from_json(raw) if raw else None
@@ -0,0 +1,315 @@
+# backend/strategy_rules.py
+"""
+Declarative strategy rules.
+
+A strategy is four rules over indicator columns: when to go long (buy CE),
+when to go short (buy PE), and when to close an open CE or PE. Rules are built
+from column comparisons combined with & | ~, and `shift(n)` looks n candles back:
+
+    ema10, ema20 = col("ema10"), col("ema20")
+    long = (ema10 > ema20) & (col("Supertrend") < col("close"))
+
+Each rule is compiled once into a function over NumPy arrays, so evaluating a
+strategy on an indicator frame is a handful of vectorised comparisons over all
+of its rows (the backtester uses every row, live trading the last one).
+
+`run` is the one decision flow shared by every broker. The broker passes in
+how to read its positions, close one and open a new option; adding a strategy
+means adding an entry to STRATEGIES.
+"""
+from collections import namedtuple
+
+import numpy as np
+
+import backend.logger_util as logger_util
+from backend import positions_snapshot
+
+# Candles a signal may already have been true for and still count as fresh
+FRESH_LOOKBACK = 4
+
+
+def _shift(values, n):
+    if n <= 0:
+        return values
+    out = np.empty_like(values)
+    out[:n] = False if values.dtype == bool else np.nan
+    out[n:] = values[:-n]
+    return out
+
+
+class Column:
+    """An indicator column, optionally `n` candles back."""
+
+    def __init__(self, name, lag=0):
+        self.name = name
+        self.lag = lag
+
+    def shift(self, n=1):
+        return Column(self.name, self.lag + n)
+
+    def compile(self):
+        name, lag = self.name, self.lag
+        return lambda cols: _shift(cols[name], lag)
+
+    @property
+    def columns(self):
+        return {self.name}
+
+    @property
+    def depth(self):
+        return self.lag
+
+    def _compare(self, other, op):
+        return Rule(op, self, other if isinstance(other, Column) else _Const(other))
+
+    def __gt__(self, other):
+        return self._compare(other, np.greater)
+
+    def __ge__(self, other):
+        return self._compare(other, np.greater_equal)
+
+    def __lt__(self, other):
+        return self._compare(other, np.less)
+
+    def __le__(self, other):
+        return self._compare(other, np.less_equal)
+
+    def __repr__(self):
+        return f"{self.name}[-{self.lag}]" if self.lag else self.name
+
+
+class _Const:
+    def __init__(self, value):
+        self.value = float(value)
+
+    def compile(self):
+        value = self.value
+        return lambda cols: value
+
+    columns = frozenset()
+    depth = 0
+
+    def __repr__(self):
+        return repr(self.value)
+
+
+def col(name):
+    return Column(name)
+
+
+class Rule:
+    """Boolean condition over columns; combine with & | ~, look back with shift(n)."""
+
+    def __init__(self, op, *args):
+        self.op = op
+        self.args = args
+
+    def __and__(self, other):
+        return Rule(np.logical_and, self, other)
+
+    def __or__(self, other):
+        return Rule(np.logical_or, self, other)
+
+    def __invert__(self):
+        return Rule(np.logical_not, self)
+
+    def shift(self, n=1):
+        return Rule(_Shift(n), self)
+
+    def compile(self):
+        op = self.op
+        fns = [arg.compile() for arg in self.args]
+        if len(fns) == 1:
+            (fn,) = fns
+            return lambda cols: op(fn(cols))
+        left, right = fns
+        return lambda cols: op(left(cols), right(cols))
+
+    @property
+    def columns(self):
+        return set().union(*(arg.columns for arg in self.args))
+
+    @property
+    def depth(self):
+        own = self.op.n if isinstance(self.op, _Shift) else 0
+        return own + max(arg.depth for arg in self.args)
+
+    def __repr__(self):
+        name = getattr(self.op, "__name__", repr(self.op))
+        return f"{name}({', '.join(map(repr, self.args))})"
+
+
+class _Shift:
+    def __init__(self, n):
+        self.n = n
+
+    def __call__(self, values):
+        return _shift(values, self.n)
+
+    def __repr__(self):
+        return f"shift{self.n}"
+
+
+def all_of(*rules):
+    rule = rules[0]
+    for other in rules[1:]:
+        rule = rule & other
+    return rule
+
+
+def any_of(*rules):
+    rule = rules[0]
+    for other in rules[1:]:
+        rule = rule | other
+    return rule
+
+
+def fresh(rule, lookback=FRESH_LOOKBACK):
+    """True where `rule` holds now but did not hold on every one of the previous lookback-1 candles."""
+    return rule & ~all_of(*(rule.shift(n) for n in range(1, lookback)))
+
+
+# ---------- strategies ----------
+Signals = namedtuple("Signals", "long short exit_long exit_short long_fresh short_fresh close")
+
+_RULES = ("long", "short", "exit_long", "exit_short", "long_fresh", "short_fresh")
+
+
+class Strategy:
+    """
+    Entry and exit rules of one strategy, compiled once.
+
+    reverse: an opposite signal closes the open position and enters the other
+    side right away; otherwise positions are closed on their exit rule and new
+    ones only opened when the account has none.
+    """
+
+    def __init__(self, name, long, short, exit_long, exit_short, reverse=False, lookback=FRESH_LOOKBACK):
+        self.name = name
+        self.reverse = reverse
+        rules = dict(long=long, short=short, exit_long=exit_long, exit_short=exit_short,
+                     long_fresh=fresh(long, lookback), short_fresh=fresh(short, lookback))
+        self.columns = sorted(set().union(*(r.columns for r in rules.values())) | {"close"})
+        # Rows needed to evaluate the latest candle
+        self.window = max(r.depth for r in rules.values()) + 1
+        self._compiled = {name: rules[name].compile() for name in _RULES}
+
+    def evaluate(self, indicators_df):
+        """{rule: bool array} over every row of the frame."""
+        cols = {c: indicators_df[c].to_numpy(dtype=float) for c in self.columns}
+        return {name: np.asarray(fn(cols), dtype=bool) for name, fn in self._compiled.items()}
+
+    def latest(self, indicators_df):
+        """Signals of the last candle; Signals already computed by the signal service pass through."""
+        if isinstance(indicators_df, Signals):
+            return indicators_df
+        frame = indicators_df.tail(self.window)
+        flags = self.evaluate(frame)
+        return Signals(**{name: bool(values[-1]) for name, values in flags.items()},
+                       close=float(frame["close"].iloc[-1]))
+
+
+ema10, ema20 = col("ema10"), col("ema20")
+supertrend, close = col("Supertrend"), col("close")
+macd, macd_signal = col("MACD"), col("MACD_signal")
+adx, adx_ema, willr = col("ADX"), col("ADX_EMA21"), col("WillR_14")
+
+STRATEGIES = {s.name: s for s in (
+    Strategy(
+        "ADX_MACD_WillR_Supertrend",
+        long=all_of(adx > adx_ema, willr > -30, supertrend < close, macd > macd_signal),
+        short=all_of(adx > adx_ema, willr < -70, supertrend > close, macd < macd_signal),
+        exit_long=any_of((willr < -70) & (supertrend > close), (willr < -70) & (macd < macd_signal),
+                         (supertrend > close) & (macd < macd_signal)),
+        exit_short=any_of((willr > -30) & (supertrend < close), (willr > -30) & (macd > macd_signal),
+                          (supertrend < close) & (macd > macd_signal)),
+    ),
+    Strategy(
+        "Ema10_Ema20_Supertrend",
+        long=(ema10 > ema20) & (supertrend < close),
+        short=(ema10 < ema20) & (supertrend > close),
+        exit_long=(ema10 < ema20) | (supertrend > close),
+        exit_short=(ema10 > ema20) | (supertrend < close),
+    ),
+    Strategy(
+        "Ema10_Ema20_MACD_Supertrend",
+        long=all_of(ema10 > ema20, supertrend < close, macd > macd_signal),
+        short=all_of(ema10 < ema20, supertrend > close, macd < macd_signal),
+        exit_long=any_of(ema10 < ema20, supertrend > close, macd < macd_signal),
+        exit_short=any_of(ema10 > ema20, supertrend < close, macd > macd_signal),
+        reverse=True,
+    ),
+)}
+
+
+def get(name):
+    return STRATEGIES.get(name)
+
+
+# ---------- decision flow ----------
+Position = namedtuple("Position", "option_type quantity tradingsymbol raw")
+
+_SIDES = {"CE": ("CALL", "BUY"), "PE": ("PUT", "SELL")}
+
+
+def open_positions(broker, positions):
+    """Open option positions of a broker's raw position list."""
+    qty_field, _, symbol_field = positions_snapshot.POSITION_FIELDS[broker]
+    result = []
+    for pos in positions or []:
+        quantity = positions_snapshot._to_int(pos.get(qty_field))
+        if quantity > 0:
+            tradingsymbol = pos.get(symbol_field) or pos.get("tradingsymbol")
+            result.append(Position(positions_snapshot.option_type_of(tradingsymbol), quantity, tradingsymbol, pos))
+    return result
+
+
+def log_signal(signals, user_id=None):
+    if signals.long:
+        logger_util.push_log("🔼 BUY SIGNAL GENERATED", level="signal_buy", user_id=user_id, log_type="trading")
+    elif signals.short:
+        logger_util.push_log("🔽 SELL SIGNAL GENERATED", level="signal_sell", user_id=user_id, log_type="trading")
+    else:
+        logger_util.push_log("⏸️ NO TRADE SIGNAL GENERATED", level="signal_none", user_id=user_id, log_type="trading")
+
+
+def run(strategy, signals, broker, fetch_positions, exit_position, enter, user_id=None):
+    """
+    Act on one candle's signals for one account.
+
+    fetch_positions() returns the broker's raw positions, exit_position(position)
+    closes one and enter(option_type) opens a new option; enter's return value
+    (the target price for Upstox) is returned, or None when nothing was entered.
+    """
+    log = lambda msg: logger_util.push_log(msg, level="info", user_id=user_id, log_type="trading")
+    wanted = "CE" if signals.long else "PE" if signals.short else None
+    entered = None
+    reversed_any = False
+
+    for position in open_positions(broker, fetch_positions()):
+        if strategy.reverse and wanted and position.option_type in _SIDES and position.option_type != wanted:
+            kind = _SIDES[position.option_type][0]
+            log(f"{_SIDES[wanted][1]} SIGNAL GENERATED. Closing existing {kind} position {position.tradingsymbol} and placing new {_SIDES[wanted][0]} order")
+            exit_position(position)
+            entered = enter(wanted)
+            reversed_any = True
+        elif position.option_type == "CE" and signals.exit_long and not (strategy.reverse and wanted == "CE"):
+            log(f"The existing position is type CE with symbol {position.tradingsymbol}. CE exit condition met, closing existing CE position.")
+            exit_position(position)
+        elif position.option_type == "PE" and signals.exit_short and not (strategy.reverse and wanted == "PE"):
+            log(f"The existing position is type PE with symbol {position.tradingsymbol}. PE exit condition met, closing existing PE position.")
+            exit_position(position)
+
+    log_signal(signals, user_id)
+    if wanted is None or reversed_any:
+        return entered
+
+    # Re-read: exits above may have closed positions
+    remaining = open_positions(broker, fetch_positions())
+    if remaining:
+        for position in remaining:
+            if position.option_type == wanted:
+                log(f"The existing position is type {wanted} with symbol {position.tradingsymbol}. No new {_SIDES[wanted][0]} trade placed")
+        return entered
+    log(f"There are no live positions and {_SIDES[wanted][1]} signal generated. Placing a new {wanted} order")
+    return enter(wanted)
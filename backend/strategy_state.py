@@ -0,0 +1,271 @@
+# backend/strategy_state.py
+"""
+Strategy-state store.
+
+All strategy variables of one (user, symbol), target_price and trade_count
+today, live in one Redis hash `strategy_state:{user_id}:{symbol}` with one
+JSON-encoded field per variable. Several variables are updated in a single
+HSET, so a reader never sees half an update, and every worker and scheduler node
+reads the same record. `load_many` fetches all of a user's symbols in a single
+round trip.
+
+The first read of a (user, symbol) that has no hash yet migrates the old
+per-variable files from `upstox_data_store/` (see `migrate_folder` for a bulk
+run). Without a Redis client the store falls back to those files.
+
+A trading session keeps its symbols' state in a StateCache: it is loaded once
+when the session starts or resumes, strategy checks read and update it in memory,
+and updates are written through to Redis in the background and flushed at the
+end of every cycle. While a cache is active (`use`), `load`/`update`/`reset` for
+its user go to the cache, so the hot path never waits on the network.
+
+Run:
+  python -m backend.strategy_state migrate [folder]
+"""
+import contextvars
+import json
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import backend.logger_util as logger_util
+
+STATE_KEY = "strategy_state:{user_id}:{symbol}"
+LEGACY_FOLDER = "upstox_data_store"
+
+# Variables every strategy record has; missing ones read as DEFAULT
+VARIABLES = ("target_price", "trade_count")
+DEFAULT = 0
+
+redis_client = logger_util.redis_client
+
+# Background write-through for every session's cache
+_writer = ThreadPoolExecutor(max_workers=int(os.getenv("STATE_WRITER_WORKERS", "2")), thread_name_prefix="state-writer")
+
+# StateCache of the session running in this thread
+_active = contextvars.ContextVar("strategy_state_cache", default=None)
+
+
+def _key(user_id, symbol):
+    return STATE_KEY.format(user_id=user_id, symbol=symbol)
+
+
+def _plain(value):
+    # numpy scalars coming from indicator frames
+    return value.item() if hasattr(value, "item") else str(value)
+
+
+def _decode(raw, names=VARIABLES):
+    state = {name: DEFAULT for name in names}
+    for name, value in (raw or {}).items():
+        try:
+            state[name] = json.loads(value)
+        except (TypeError, ValueError):
+            state[name] = DEFAULT
+    return state
+
+
+# ---------- legacy per-variable JSON files ----------
+def _file_name(user_id, symbol, name, folder=LEGACY_FOLDER):
+    return f"{folder}/{user_id}_{symbol}_{name}.json"
+
+
+def _file_load(user_id, symbol, name, folder=LEGACY_FOLDER):
+    try:
+        with open(_file_name(user_id, symbol, name, folder)) as f:
+            return json.load(f).get(name, DEFAULT)
+    except Exception:
+        return DEFAULT
+
+
+def _file_save(user_id, symbol, fields, folder=LEGACY_FOLDER):
+    os.makedirs(folder, exist_ok=True)
+    for name, value in fields.items():
+        with open(_file_name(user_id, symbol, name, folder), "w") as f:
+            json.dump({name: value}, f, default=_plain)
+
+
+def _legacy_fields(user_id, symbol, folder=LEGACY_FOLDER):
+    return {
+        name: _file_load(user_id, symbol, name, folder)
+        for name in VARIABLES if os.path.exists(_file_name(user_id, symbol, name, folder))
+    }
+
+
+def _migrate_record(user_id, symbol, fields):
+    """Copy legacy values into the hash without overwriting anything already there."""
+    pipe = redis_client.pipeline()
+    for name, value in fields.items():
+        pipe.hsetnx(_key(user_id, symbol), name, json.dumps(value, default=_plain))
+    pipe.execute()
+
+
+# ---------- store ----------
+def _cache_for(user_id):
+    cache = _active.get()
+    return cache if cache is not None and cache.user_id == user_id else None
+
+
+def load(user_id, symbol):
+    """All variables of one symbol as a dict (missing ones are 0)."""
+    cache = _cache_for(user_id)
+    if cache is not None:
+        return cache.get(symbol)
+    return load_many(user_id, [symbol])[symbol]
+
+
+def load_many(user_id, symbols):
+    """{symbol: {variable: value}} for all the symbols in one round trip."""
+    symbols = list(symbols)
+    if redis_client is None:
+        return {s: {name: _file_load(user_id, s, name) for name in VARIABLES} for s in symbols}
+    pipe = redis_client.pipeline(transaction=False)
+    for symbol in symbols:
+        pipe.hgetall(_key(user_id, symbol))
+    results = dict(zip(symbols, pipe.execute()))
+    for symbol, raw in results.items():
+        if not raw:
+            legacy = _legacy_fields(user_id, symbol)
+            if legacy:
+                _migrate_record(user_id, symbol, legacy)
+                results[symbol] = {name: json.dumps(value, default=_plain) for name, value in legacy.items()}
+    return {symbol: _decode(raw) for symbol, raw in results.items()}
+
+
+def get(user_id, symbol, name):
+    return load(user_id, symbol).get(name, DEFAULT)
+
+
+def update(user_id, symbol, **fields):
+    """Set several variables of one symbol atomically."""
+    if not fields:
+        return
+    cache = _cache_for(user_id)
+    if cache is not None:
+        cache.update(symbol, **fields)
+        return
+    _write(user_id, {symbol: fields})
+
+
+def _write(user_id, records):
+    """records: {symbol: fields}; one pipelined round trip."""
+    if redis_client is None:
+        for symbol, fields in records.items():
+            _file_save(user_id, symbol, fields)
+        return
+    pipe = redis_client.pipeline(transaction=False)
+    for symbol, fields in records.items():
+        pipe.hset(_key(user_id, symbol), mapping={
+            name: json.dumps(value, default=_plain) for name, value in fields.items()
+        })
+    pipe.execute()
+
+
+def reset(user_id, symbol, names=VARIABLES):
+    update(user_id, symbol, **{name: DEFAULT for name in names})
+
+
+def delete(user_id, symbol):
+    if redis_client is not None:
+        redis_client.delete(_key(user_id, symbol))
+
+
+class StateCache:
+    """In-memory strategy state of one session's symbols, written through to the store."""
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self._state = {}
+        self._dirty = {}
+        self._lock = threading.Lock()
+        # Held across take-and-write so writes reach the store in update order
+        self._write_lock = threading.Lock()
+        self._pending = None   # scheduled background write
+
+    def hydrate(self, symbols):
+        """Load the symbols' state from the store (session start or resume)."""
+        loaded = load_many(self.user_id, symbols)
+        with self._lock:
+            self._state.update(loaded)
+
+    def get(self, symbol):
+        with self._lock:
+            state = self._state.get(symbol)
+        if state is None:
+            # Symbol added after hydrate: one store read, then cached
+            state = load_many(self.user_id, [symbol])[symbol]
+            with self._lock:
+                state = self._state.setdefault(symbol, state)
+        return dict(state)
+
+    def update(self, symbol, **fields):
+        with self._lock:
+            self._state.setdefault(symbol, {name: DEFAULT for name in VARIABLES}).update(fields)
+            self._dirty.setdefault(symbol, {}).update(fields)
+            if self._pending is None:
+                self._pending = _writer.submit(self._write_dirty)
+
+    def reset(self, symbol, names=VARIABLES):
+        self.update(symbol, **{name: DEFAULT for name in names})
+
+    def _write_dirty(self):
+        with self._write_lock:
+            with self._lock:
+                dirty, self._dirty = self._dirty, {}
+                self._pending = None
+            if not dirty:
+                return
+            try:
+                _write(self.user_id, dirty)
+            except Exception as e:
+                # Put the fields back unless they were updated again meanwhile; the next update or flush retries
+                with self._lock:
+                    for symbol, fields in dirty.items():
+                        self._dirty[symbol] = {**fields, **self._dirty.get(symbol, {})}
+                logger_util.push_log(f"⚠️ Strategy state write-through failed for {self.user_id}: {e}", level="warning", user_id="admin", log_type="trading")
+
+    def flush(self):
+        """Write every pending update now (end of cycle, stop, handoff); waits for an in-flight write."""
+        self._write_dirty()
+
+
+@contextmanager
+def use(cache):
+    """Route load/update/reset for the cache's user through `cache` inside the block."""
+    token = _active.set(cache)
+    try:
+        yield cache
+    finally:
+        _active.reset(token)
+
+
+def migrate_folder(folder=LEGACY_FOLDER):
+    """
+    Move every `{user_id}_{symbol}_{variable}.json` file under `folder` into the
+    store. Symbols are taken to be the part after the last underscore, as symbols
+    never contain one. Existing hash fields win. Returns the number of records.
+    """
+    if not os.path.isdir(folder):
+        return 0
+    records = {}
+    for filename in os.listdir(folder):
+        for name in VARIABLES:
+            suffix = f"_{name}.json"
+            if filename.endswith(suffix):
+                user_id, _, symbol = filename[:-len(suffix)].rpartition("_")
+                if user_id and symbol:
+                    records.setdefault((user_id, symbol), {})[name] = _file_load(user_id, symbol, name, folder)
+                break
+    for (user_id, symbol), fields in records.items():
+        _migrate_record(user_id, symbol, fields)
+    logger_util.push_log(f"📦 Migrated {len(records)} strategy-state records from {folder}/", level="info", user_id="admin", log_type="trading")
+    return len(records)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) >= 2 and sys.argv[1] == "migrate":
+        migrate_folder(sys.argv[2] if len(sys.argv) > 2 else LEGACY_FOLDER)
+    else:
+        print("usage: python -m backend.strategy_state migrate [folder]")
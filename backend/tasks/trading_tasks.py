@@ -1,7 +1,8 @@
 # tasks/trading_tasks.py
 from backend.celery_app import celery_app
 import backend.logger_util as logger_util
-import json, datetime, time, gc
+import json, gc, threading
+from concurrent.futures import ThreadPoolExecutor
 from zoneinfo import ZoneInfo
 
 # ---- import your broker and helper modules ----
@@ -10,12 +11,22 @@ from backend import Zerodha as zr
 from backend import AngelOne as ar
 from backend import Groww as gr
 from backend import Fivepaisa as fp
+from backend import Paper as pp
 from backend import Next_Now_intervals as nni
 from backend import combinding_dataframes as cdf
 from backend import indicators as ind
-import backend.save_to_json as stj
+from backend import market_data_ingest as mdi
+from backend import cycle_scheduler as cs
+from backend import market_calendar as mc
+from backend import broker_sessions
+from backend import positions_snapshot as ps
+from backend import order_pipeline
+from backend import cycle_budget
+from backend import session_lease as sl
+from backend import strategy_state
+from backend import signal_service
+from backend import clock
 from tabulate import tabulate
-from time import sleep as gsleep
 import redis
 import os
 import ssl
@@ -87,9 +98,19 @@ stock_map = {
 }
 
 # keep same broker maps (lowercase names used internally)
-broker_map = {"u": "upstox", "z": "zerodha", "a": "angelone", "f": "5paisa", "g": "groww"}
+broker_map = {"u": "upstox", "z": "zerodha", "a": "angelone", "f": "5paisa", "g": "groww", "p": "paper"}
 reverse_stock_map = {}
 
+# Per-symbol strategy variables cleared when a symbol or the whole loop stops
+VARIABLES_TO_RESET = ["target_price", "trade_count"]
+
+# Symbols of one cycle run concurrently; each broker account gets its own cap on in-flight symbols
+SYMBOL_WORKERS = int(os.getenv("TRADING_SYMBOL_WORKERS", "8"))
+BROKER_CONCURRENCY = {"upstox": 8, "zerodha": 3, "angelone": 3, "5paisa": 3, "groww": 2, "paper": 8}
+# (broker, account) -> BoundedSemaphore, created on first use
+broker_semaphores = {}
+_semaphores_lock = threading.Lock()
+
 celery_app.conf.task_track_started = True
 celery_app.conf.worker_concurrency = 4
 
@@ -102,7 +123,7 @@ def get_kill_key(user_id: str) -> str:
 
 # ---- Celery task entrypoint (bound) ----
 @celery_app.task(bind=True)
-def start_trading_loop(self, config: dict):
+def start_trading_loop(self, config: dict, resume: bool = False):
 
     logger_util.push_log("🚀 Trading engine started inside Celery worker.", level = "info", user_id = "admin", log_type = "trading")
     try:
@@ -115,25 +136,25 @@ def start_trading_loop(self, config: dict):
         return
 
     try:
-        run_trading_logic_for_all(user_id, trading_params, selected_brokers)
+        run_trading_logic_for_all(user_id, trading_params, selected_brokers, resume=resume, config=config)
     except Exception as e:
         logger_util.push_log(f"💥 Trading loop crashed: {e}", level = "error", user_id = "admin", log_type = "trading")
         return
 
     logger_util.push_log("✅ Trading engine task finished successfully.", level = "info", user_id = "admin", log_type = "trading")
 
-def resample_candle_data(intra_df_1m, interval):
+def resample_candle_data(intra_df_1m, interval, exchange="NSE"):
     if intra_df_1m is None or intra_df_1m.empty:
         return pd.DataFrame()
 
     interval = int(interval)
     rule = f"{interval}min"
 
-    # RESAMPLE WITH MARKET START TIME ALIGNMENT (09:15 AM)
+    # RESAMPLE WITH SESSION OPEN ALIGNMENT (09:15 NSE, 09:00 MCX), like market_calendar
     df_resampled = intra_df_1m.resample(
         rule,
         origin="start_day",
-        offset="15min"
+        offset=f"{mc.open_offset(exchange)}min"
     ).agg({
         "open": "first",
         "high": "max",
@@ -145,343 +166,735 @@ def resample_candle_data(intra_df_1m, interval):
     df_resampled.dropna(inplace=True)
 
     return df_resampled.tail(1)
-    
-def run_trading_logic_for_all(user_id, trading_parameters, selected_brokers):
-    print(f" ****** {trading_parameters}")
-    print(f" ****** {selected_brokers}")
+
+# Previous days' candles and today's early bars per (instrument, interval, exchange); they do not change during the day
+_history = {}
+_history_lock = threading.Lock()
+
+
+def _cached_frame(kind, instrument_key, interval, exchange, fetch, valid=None):
+    """Frame from `fetch()`, kept for the rest of the day while `valid(frame)` holds."""
+    key = (kind, instrument_key, str(interval), exchange)
+    today = clock.today()
+    with _history_lock:
+        cached = _history.get(key)
+    if cached is not None and cached[0] == today and (valid is None or valid(cached[1])):
+        return cached[1]
+    frame = fetch()
+    if frame is not None and not frame.empty:
+        with _history_lock:
+            for stale in [k for k, v in _history.items() if v[0] != today]:
+                del _history[stale]
+            _history[key] = (today, frame)
+    return frame
+
+
+def upstox_candles(user_id, access_token, instrument_key, interval, exchange, now_interval, quotes):
+    """
+    History plus today's bars up to the candle that closed at `now_interval`.
+    Today's bars come from the market-data ingest stream when it has published
+    the closed bar, so the decision does not wait on the REST candle; history is
+    fetched once a day, and bars from before the stream started once as well.
+    Without a streamed bar it falls back to the REST intraday candles.
+    """
+    hdf = _cached_frame("history", instrument_key, interval, exchange,
+                        lambda: us.upstox_fetch_historical_data_with_retry(user_id, access_token, instrument_key, interval, exchange))
+    if hdf is None:
+        return None
+    closed_start = mc.closed_bar_start(exchange, interval, now_interval)
+    streamed = mdi.streamed_bars_frame(r, instrument_key, interval, closed_start, exchange)
+    if streamed is not None:
+        sessions = mc.sessions_on(exchange, clock.today())
+        first_bar = pd.Timestamp(sessions[0][0], unit="s", tz="Asia/Kolkata").tz_localize(None) if sessions else None
+        if first_bar is None or streamed.index[0] <= first_bar:
+            return cdf.combinding_dataframes(hdf, streamed)
+        # The stream started mid-session: bars before it are closed, so no readiness wait
+        reaches_stream = lambda df: df.index[-1] >= streamed.index[0] - pd.Timedelta(minutes=int(interval))
+        early = _cached_frame("early", instrument_key, interval, exchange,
+                              lambda: us.upstox_fetch_intraday_data(user_id, access_token, instrument_key, interval, exchange, wait=False),
+                              valid=reaches_stream)
+        if early is not None and not early.empty and reaches_stream(early):
+            return cdf.combinding_dataframes(hdf, early, streamed)
+
+    idf = us.upstox_fetch_intraday_data(user_id, access_token, instrument_key, interval, exchange)
+    resampled_candle = None
+    idf_1m = us.upstox_fetch_intraday_data(user_id, access_token, instrument_key, 1, exchange)
+    ohlc_df = quotes.get(instrument_key) or us.upstox_ohlc_data_fetch(user_id, access_token, instrument_key)
+    if idf_1m is not None and ohlc_df is not None:
+        combine_1m = cdf.combinding_dataframes(idf_1m, ohlc_df)
+        resampled_candle = resample_candle_data(combine_1m, interval, exchange)
+    if idf is None or resampled_candle is None:
+        return None
+    return cdf.combinding_dataframes(hdf, idf, resampled_candle)
+
+
+def begin_positions_snapshots(user_id, trading_parameters, selected_brokers):
+    """
+    Register one positions snapshot per broker account used this cycle. Each is
+    fetched on its first read, so an account costs at most one positions call.
+    """
+    snapshots = []
+    seen = set()
+    for stock in trading_parameters:
+        broker_key = stock.get('broker')
+        broker_name = broker_map.get(broker_key)
+        if broker_key in seen:
+            continue
+        seen.add(broker_key)
+        creds = next((b['credentials'] for b in selected_brokers if b['name'] == broker_key), None)
+        if not creds:
+            continue
+        try:
+            if broker_name == "upstox":
+                token = creds.get("access_token")
+                fetch = lambda token=token: us.upstox_fetch_positions(user_id, token)
+            elif broker_name == "zerodha":
+                token = creds.get("access_token")
+                fetch = lambda api_key=creds.get("api_key"), token=token: zr.fetch_positions(api_key, token)
+            elif broker_name == "angelone":
+                session = ar.angelone_get_session(creds.get("api_key"), creds.get("user_id"), creds.get("pin"), creds.get("totp_secret"), user_id=user_id)
+                token = session.get("auth_token")
+                fetch = lambda api_key=creds.get("api_key"), token=token: ar.angelone_fetch_positions(api_key, token)
+            elif broker_name == "5paisa":
+                token = creds.get("access_token")
+                fetch = lambda app_key=creds.get("app_key"), token=token, client=creds.get("client_id"): fp.fivepaisa_fetch_positions(app_key, token, client)
+            elif broker_name == "paper":
+                token = creds.get("access_token")
+                fetch = lambda token=token: pp.paper_fetch_positions(token)
+            else:
+                continue
+            snapshots.append(ps.begin(broker_name, token, fetch))
+        except Exception as e:
+            logger_util.push_log(f"⚠️ Positions snapshot unavailable for {broker_name}: {e}", level = "warning", user_id = user_id, log_type = "trading")
+    return snapshots
+
+def prefetch_upstox_quotes(user_id, trading_parameters, selected_brokers):
     """
-    Main trading loop for a single user.
-    This function preserves your original logic but uses per-user Redis keys
-    instead of a global in-memory active_trades dict.
+    Batch-fetch the OHLC quotes one cycle needs for every Upstox account of a user:
+    the underlyings being traded plus the option contracts currently held.
+    Returns {access_token: {instrument_key: candle_dict}}.
     """
-    logger_util.push_log("✅ Trading loop started for all selected stocks",level = "info", user_id = user_id, log_type = "trading")
-    logger_util.push_log("⏳ Starting trading cycle setup...", level = "info", user_id = user_id, log_type = "trading")
-    VARIABLES_TO_RESET = ["target_price", "trade_count"]
+    keys_by_token = {}
+    for stock in trading_parameters:
+        if broker_map.get(stock.get('broker')) != "upstox":
+            continue
+        access_token = next(
+            (b['credentials']['access_token']
+             for b in selected_brokers if b['name'] == stock.get('broker')),
+            None
+        )
+        if access_token:
+            keys_by_token.setdefault(access_token, []).append(stock.get('instrument_key'))
+
+    quotes_by_token = {}
+    for access_token, keys in keys_by_token.items():
+        try:
+            positions = ps.positions("upstox", access_token, us.upstox_fetch_positions, user_id, access_token) or []
+            keys += [pos['instrument_token'] for pos in positions if pos.get('quantity', 0) > 0]
+            quotes_by_token[access_token] = us.upstox_ohlc_batch_fetch(user_id, access_token, keys)
+        except Exception as e:
+            logger_util.push_log(f"⚠️ Batched quote prefetch failed: {e}", level = "warning", user_id = user_id, log_type = "trading")
+            quotes_by_token[access_token] = {}
+    return quotes_by_token
 
-    # Build per-user active set
+def process_symbol(user_id, stock, selected_brokers, now_interval, upstox_quotes):
+    """
+    Fetch, indicators and trade checks for one symbol of a cycle. Runs on the cycle
+    worker pool, so every failure stays inside this symbol.
+    """
     active_key = get_active_key(user_id)
-    # Use the global redis client `r` defined at module top
+    symbol = stock.get('symbol_value')
+    # Quick check if this symbol has been deactivated mid-run
+    if not r.sismember(active_key, symbol):
+        return
+
+    # ⭐ NEW: Per-stock stop flag check
+    stop_key = f"stop:{user_id}:{symbol}"
+    if r.get(stop_key):
+        logger_util.push_log(
+            f"🛑 Stopping trade for {symbol}",
+            level="info",
+            user_id=user_id,
+            log_type="trading"
+        )
+        strategy_state.reset(user_id, symbol, VARIABLES_TO_RESET)
+        r.srem(active_key, symbol)   # remove from active list
+        r.delete(stop_key)           # clean flag
+        return     # skip trading this stock (but keep others running)
+
+    broker_key = stock.get('broker')
+    broker_name = broker_map.get(broker_key)
+    company = stock.get('symbol_key')
+    interval = stock.get('interval')
+    instrument_key = stock.get('instrument_key')
+    strategy = stock.get('strategy')
+    exchange_type = stock.get('type')
+    exchange = mc.exchange_for_type(exchange_type)
+
+    budget = cycle_budget.current()
+    budget.lap("queue")
+    if not budget.proceed("fetch"):
+        return
+
+    # local holders for session/auth_token used in different broker flows
+    session = None
+    auth_token = None
+    angel_api_key = None
+    if broker_name == "angelone":
+        # The AngelOne session is needed for its orders even when another account computed the signal
+        broker_info = next(
+            (b for b in selected_brokers if b['name'] == broker_key), None
+        )
+        if broker_info:
+            angel_api_key = broker_info['credentials'].get("api_key")
+            try:
+                session = ar.angelone_get_session(
+                    angel_api_key, broker_info['credentials'].get("user_id"),
+                    broker_info['credentials'].get("pin"), broker_info['credentials'].get("totp_secret"), user_id=user_id)
+            except Exception as e:
+                logger_util.push_log(f"❌ Error code 1004 : Error fetching data for {symbol}", level="error", user_id=user_id,log_type="trading")
+                logger_util.push_log(f"❌ Error code 1004 : AngelOne session failed for {symbol}: {e}", level = "error", user_id = "admin", log_type = "trading")
+                return
+            # session may include auth_token and obj (used in execution)
+            auth_token = session.get("auth_token") if isinstance(session, dict) else None
+
+    def compute_indicators():
+        """Fetch candles and run indicators; only runs on the account that computes this candle's signal."""
+        logger_util.push_log(f"🕯 Fetching candles for {symbol}-{company} from {broker_name}", level = "info", user_id = user_id, log_type = "trading")
+        combined_df = None
+        if broker_name == "upstox":
+            access_token = next(
+                (b['credentials']['access_token']
+                 for b in selected_brokers if b['name'] == broker_key),
+                None
+            )
+            if access_token:
+                combined_df = upstox_candles(user_id, access_token, instrument_key, interval, exchange,
+                                             now_interval, upstox_quotes.get(access_token, {}))
+
+        elif broker_name == "zerodha":
+            broker_info = next(
+                (b for b in selected_brokers if b['name'] == broker_key), None
+            )
+            if broker_info:
+                kite = zr.kite_connect_from_credentials(
+                    broker_info['credentials']
+                )
+                hdf = zr.zerodha_historical_data(kite, instrument_key, interval, exchange)
+                idf = zr.zerodha_intraday_data(kite, instrument_key, interval)
+                if hdf is not None and idf is not None:
+                    combined_df = cdf.combinding_dataframes(hdf, idf)
+
+        elif broker_name == "angelone":
+            if session is not None:
+                combined_df = ar.angelone_get_historical_data(
+                    angel_api_key, auth_token, session.get("obj") if isinstance(session, dict) else None, "NSE",
+                    instrument_key, ar.number_to_interval(interval)
+                )
+
+        elif broker_name == "5paisa":
+            broker_info = next(
+                (b for b in selected_brokers if b['name'] == broker_key), None
+            )
+            if broker_info:
+                access_token = broker_info['credentials'].get("access_token")
+                combined_df = fp.fivepaisa_historical_data_fetch(
+                    access_token, instrument_key, interval, 25
+                )
+
+        elif broker_name == "paper":
+            hdf = pp.paper_historical_data(instrument_key, interval)
+            idf = pp.paper_intraday_data(instrument_key, interval)
+            combined_df = cdf.combinding_dataframes(hdf, idf)
+
+        budget.lap("fetch")
+        if combined_df is None or combined_df.empty:
+            logger_util.push_log(f"⚠️ No data returned for {symbol}, skipping.", level = "warning", user_id = user_id, log_type = "trading")
+            return None
+        logger_util.push_log(f"✅ Data ready for {symbol}", level = "info", user_id = user_id, log_type = "trading")
+        if not budget.proceed("indicators"):
+            return None
+        indicators_df = ind.all_indicators(combined_df, strategy)
+        budget.lap("indicators")
+        if indicators_df is None or indicators_df.empty:
+            logger_util.push_log(f"⚠️ Indicators empty for {symbol}, skipping.", level = "warning", user_id = user_id, log_type = "trading")
+        return indicators_df
+
     try:
-        symbols = [s['symbol_value'] for s in trading_parameters if s.get("symbol_value")]
-    except Exception:
-        symbols = []
+        # Computed once per candle for everyone trading this symbol, interval and strategy on this broker
+        signal = signal_service.signal_for(
+            r, signal_service.signal_key(broker_name, exchange, symbol, interval, strategy), now_interval, strategy, compute_indicators
+        )
+    except Exception as e:
+        logger_util.push_log(f"❌ Error code 1004 : Error fetching data for {symbol}", level="error", user_id=user_id,log_type="trading")
+        logger_util.push_log(f"❌ Error code 1004 : Error fetching data for {symbol}: {e}", level = "error", user_id = "admin", log_type = "trading")
+        # If fetching fails repeatedly for a symbol, consider deactivating it
+        # but to mimic old logic, we simply skip this iteration.
+        return
+    if signal is None:
+        return
+    if signal.shared:
+        budget.lap("fetch")
+    logger_util.push_log(f"📊 Indicators ({signal.event}):", level = "info", user_id = user_id, log_type = "trading")
+    logger_util.push_log(tabulate([signal.values], headers="keys", tablefmt="pretty"), user_id=user_id,level="indicator", log_type="trading")
 
-    if symbols:
-        # Reset existing user-specific set and add initial symbols
+    # Past the deadline the checks still run for exits; the order pipeline drops their entries
+    if not budget.proceed("decision"):
+        return
+    try:
+        creds = next(
+            (b["credentials"] for b in selected_brokers if b["name"] == broker_key),
+            None
+        )
+        lots = stock.get("lots")
+        target_pct = stock.get("target_percentage")
+        if target_pct == 0 or target_pct == None or target_pct == "0":
+            target_pct = 0
+
+        if broker_name == "upstox":
+            # Contract lookup and option candle are slow and do not depend on positions: resolve them before the lock
+            us.upstox_prepare_entry(user_id, lots, target_pct, signal.signals, creds, company, symbol, exchange_type, strategy)
+
+        # Checks of one account run one at a time so each sees the previous symbol's orders
+        account = auth_token if broker_name == "angelone" else (creds or {}).get("access_token")
+        with ps.account_lock(broker_name, account):
+            if broker_name == "upstox":
+                # Upstox execution uses access_token inside creds
+                us.upstox_trade_conditions_check(user_id,
+                    lots, target_pct, signal.signals,
+                    creds, company, symbol, exchange_type, strategy,
+                    quotes=upstox_quotes.get(creds.get("access_token"), {})
+                )
+            elif broker_name == "zerodha":
+                zr.zerodha_trade_conditions_check(
+                    lots, target_pct, signal.signals,
+                    creds, symbol, strategy
+                )
+            elif broker_name == "angelone":
+                # Ensure session/auth_token used if available; original code used session/auth_token variables
+                try:
+                    ar.angelone_trade_conditions_check(
+                        session.get("obj") if isinstance(session, dict) else session,
+                        auth_token,
+                        lots, target_pct,
+                        signal.signals, creds, symbol, strategy
+                    )
+                except Exception as e:
+                    if broker_sessions.is_auth_error(e):
+                        broker_sessions.invalidate_token(auth_token)
+                    logger_util.push_log(f"❌ Error code 1005 : AngelOne trade execution error for {symbol}", level="error",user_id=user_id, log_type="trading")
+                    logger_util.push_log(f"❌ Error code 1005 : AngelOne trade execution error for {symbol}: {e}", level = "error", user_id = "admin", log_type = "trading")
+            elif broker_name == "5paisa":
+                fp.fivepaisa_trade_conditions_check(
+                    lots, target_pct, signal.signals, creds, stock, strategy
+                )
+            elif broker_name == "paper":
+                pp.paper_trade_conditions_check(
+                    user_id, lots, target_pct, signal.signals, creds, symbol, strategy
+                )
+
+    except Exception as e:
+        logger_util.push_log(f"❌ Error code 1006 : Error executing trade for {symbol}", level="error", user_id=user_id,log_type="trading")
+        logger_util.push_log(f"❌ Error code 1006 : Error executing trade for {symbol}: {e}", level = "error", user_id = "admin", log_type = "trading")
+    budget.lap("decision")
+
+
+def _account_semaphore(stock, selected_brokers):
+    """Concurrency slot per broker account, so one user's symbols cannot starve another's."""
+    broker_key = stock.get('broker')
+    broker_name = broker_map.get(broker_key)
+    limit = BROKER_CONCURRENCY.get(broker_name)
+    if limit is None:
+        return None
+    creds = next((b['credentials'] for b in selected_brokers if b['name'] == broker_key), None) or {}
+    account = creds.get("access_token") or creds.get("user_id") or creds.get("client_id") or broker_key
+    key = (broker_name, account)
+    with _semaphores_lock:
+        semaphore = broker_semaphores.get(key)
+        if semaphore is None:
+            semaphore = broker_semaphores[key] = threading.BoundedSemaphore(
+                int(os.getenv(f"{broker_name.upper()}_CONCURRENCY", limit))
+            )
+    return semaphore
+
+def _run_symbol(user_id, stock, selected_brokers, now_interval, upstox_quotes, budget, state):
+    """
+    Worker wrapper: buffers the symbol's logs, times it against the cycle budget,
+    serves its strategy state from the session cache and holds its account's concurrency slot.
+    """
+    semaphore = _account_semaphore(stock, selected_brokers)
+    # Orders queued by this symbol are keyed to the candle, so a retried cycle cannot resend them
+    with logger_util.buffered_logs() as buffer, order_pipeline.cycle(now_interval), \
+            cycle_budget.track(budget.symbol(stock.get('symbol_value'))), strategy_state.use(state):
         try:
-            r.delete(active_key)
-            r.sadd(active_key, *symbols)
-            logger_util.push_log(f"🟢 Active trades initialized for {user_id}: {', '.join(symbols)}", level = "info", user_id = user_id, log_type = "trading")
+            if semaphore is None:
+                process_symbol(user_id, stock, selected_brokers, now_interval, upstox_quotes)
+            else:
+                with semaphore:
+                    process_symbol(user_id, stock, selected_brokers, now_interval, upstox_quotes)
         except Exception as e:
-            logger_util.push_log(f"❌ Redis error initializing active trades for {user_id}: {e}", level ="error", user_id = user_id, log_type = "trading")
+            logger_util.push_log(f"❌ Error code 1007 : Unexpected error processing {stock.get('symbol_value')}", level="error", user_id=user_id, log_type="trading")
+            logger_util.push_log(f"❌ Error code 1007 : Unexpected error processing {stock.get('symbol_value')}: {e}", level = "error", user_id = "admin", log_type = "trading")
+    return buffer
 
 
-    # STEP 1: Fetch instrument keys (only for symbols still marked active for this user)
-    for stock in trading_parameters:
-        # Skip symbols not active for this user
+class TradingSession:
+    """
+    One user's trading state between candle closes. `run_trading_logic_for_all`
+    drives a single session inside a Celery task; the trading scheduler drives
+    thousands of them from shared pools.
+    """
+
+    def __init__(self, user_id, trading_parameters, selected_brokers, session_id=None):
+        self.user_id = user_id
+        # Id given by the start that created this session; None for sessions started without one
+        self.session_id = session_id
+        self.trading_parameters = trading_parameters
+        self.selected_brokers = selected_brokers
+        self.active_key = get_active_key(user_id)
+        self.cycle_interval = None
+        # exchange -> (latest boundary, next boundary); each exchange keeps its own bar boundaries
+        self.intervals = {}
+        self.now_interval = None
+        self.next_interval = None
+        # exchange -> last candle whose cycle completed; restored from the checkpoint on resume
+        self.last_candles = {}
+        # Symbols' strategy state in memory, written through to the strategy-state store
+        self.state = strategy_state.StateCache(user_id)
+        # Set while a cycle is running so an overrunning cycle is never started twice
+        self.busy = False
+        # Set by the trading scheduler when this user moves to another node
+        self.handoff = False
+        # Session lease the trading scheduler holds while it runs this user
+        self.lease = None
+
+    def setup(self, resume=False):
+        """
+        Initialise the active set, resolve instrument keys and the first interval.
+        Returns False when there is nothing to trade. With `resume`, an existing
+        active set is kept so symbols disconnected before a restart stay disconnected,
+        and instrument keys come from the session checkpoint.
+        """
+        user_id = self.user_id
+        trading_parameters = self.trading_parameters
+        selected_brokers = self.selected_brokers
+        active_key = self.active_key
+
+        logger_util.push_log("✅ Trading loop started for all selected stocks",level = "info", user_id = user_id, log_type = "trading")
+        logger_util.push_log("⏳ Starting trading cycle setup...", level = "info", user_id = user_id, log_type = "trading")
+
+        # Build per-user active set
         try:
-            if not r.sismember(active_key, stock.get('symbol_value')):
-                continue
+            symbols = [s['symbol_value'] for s in trading_parameters if s.get("symbol_value")]
         except Exception:
-            # Redis issue: be conservative and continue
-            continue
+            symbols = []
 
-        broker_key = stock.get('broker')
-        broker_name = broker_map.get(broker_key, "unknown")
-        symbol = stock.get('symbol_value')
-        name = stock.get('symbol_key')
-        strategy = stock.get('strategy')
-        company = stock.get("symbol_key", symbol)
-        interval = stock.get('interval')
-        exchange_type = stock.get('type')
+        if symbols and not (resume and r.exists(active_key)):
+            # Reset existing user-specific set and add initial symbols
+            try:
+                r.delete(active_key)
+                r.sadd(active_key, *symbols)
+                logger_util.push_log(f"🟢 Active trades initialized for {user_id}: {', '.join(symbols)}", level = "info", user_id = user_id, log_type = "trading")
+            except Exception as e:
+                logger_util.push_log(f"❌ Redis error initializing active trades for {user_id}: {e}", level ="error", user_id = user_id, log_type = "trading")
 
-        logger_util.push_log(
-            f"🔑 Fetching instrument key for company : {company}, Name : {name} symbol :{symbol} via Broker : {broker_name}...", level = "info", user_id = user_id, log_type = "trading")
 
-        instrument_key = None
-        try:
-            if exchange_type == "EQUITY":
-                if broker_name == "upstox":
-                    instrument_key = us.upstox_equity_instrument_key(user_id, company)
-                elif broker_name == "zerodha":
-                    broker_info = next(
-                        (b for b in selected_brokers if b['name'] == broker_key), None
-                    )
-                    if broker_info:
-                        api_key = broker_info['credentials'].get("api_key")
-                        access_token = broker_info['credentials'].get("access_token")
-                        instrument_key = zr.zerodha_instruments_token(
-                            api_key, access_token, symbol
+        restored_keys = {}
+        if resume:
+            try:
+                restored_keys, self.last_candles = sl.load_checkpoint(r, user_id)
+            except Exception as e:
+                logger_util.push_log(f"⚠️ Could not load checkpoint for {user_id}, resolving instrument keys again: {e}", level = "warning", user_id = "admin", log_type = "trading")
+            if restored_keys:
+                logger_util.push_log(f"♻️ Resuming {user_id} from checkpoint (last candles {self.last_candles})", level = "info", user_id = user_id, log_type = "trading")
+
+        # STEP 1: Fetch instrument keys (only for symbols still marked active for this user)
+        for stock in trading_parameters:
+            # Skip symbols not active for this user
+            try:
+                if not r.sismember(active_key, stock.get('symbol_value')):
+                    continue
+            except Exception:
+                # Redis issue: be conservative and continue
+                continue
+
+            if stock.get('symbol_value') in restored_keys:
+                stock['instrument_key'] = restored_keys[stock['symbol_value']]
+                continue
+
+            broker_key = stock.get('broker')
+            broker_name = broker_map.get(broker_key, "unknown")
+            symbol = stock.get('symbol_value')
+            name = stock.get('symbol_key')
+            company = stock.get("symbol_key", symbol)
+            exchange_type = stock.get('type')
+
+            logger_util.push_log(
+                f"🔑 Fetching instrument key for company : {company}, Name : {name} symbol :{symbol} via Broker : {broker_name}...", level = "info", user_id = user_id, log_type = "trading")
+
+            instrument_key = None
+            try:
+                if broker_name == "paper":
+                    instrument_key = pp.paper_instrument_key(symbol)
+
+                elif exchange_type == "EQUITY":
+                    if broker_name == "upstox":
+                        instrument_key = us.upstox_equity_instrument_key(user_id, company)
+                    elif broker_name == "zerodha":
+                        broker_info = next(
+                            (b for b in selected_brokers if b['name'] == broker_key), None
                         )
-                elif broker_name == "angelone":
-                    instrument_key = ar.angelone_get_token_by_name(symbol)
-                elif broker_name == "5paisa":
-                    instrument_key = fp.fivepaisa_scripcode_fetch(symbol)
-
-            elif exchange_type == "COMMODITY" and broker_name == "upstox":
-                matched = us.upstox_commodity_instrument_key(user_id, name, symbol)
-                # matched may be a dataframe — keep original behavior
-                instrument_key = matched['instrument_key'].iloc[0]
-
-            # Set instrument_key if found; else mark symbol inactive for this user
-            if instrument_key:
-                stock['instrument_key'] = instrument_key
-                logger_util.push_log(f"✅ Found instrument key {instrument_key} for {symbol}", level = "info", user_id = user_id, log_type = "trading")
-            else:
-                logger_util.push_log(f"⚠️ No instrument key found for {symbol}, skipping.", level = "warning", user_id = user_id, log_type = "trading")
+                        if broker_info:
+                            api_key = broker_info['credentials'].get("api_key")
+                            access_token = broker_info['credentials'].get("access_token")
+                            instrument_key = zr.zerodha_instruments_token(
+                                api_key, access_token, symbol
+                            )
+                    elif broker_name == "angelone":
+                        instrument_key = ar.angelone_get_token_by_name(symbol)
+                    elif broker_name == "5paisa":
+                        instrument_key = fp.fivepaisa_scripcode_fetch(symbol)
+
+                elif exchange_type == "COMMODITY" and broker_name == "upstox":
+                    matched = us.upstox_commodity_instrument_key(user_id, name, symbol)
+                    # matched may be a dataframe — keep original behavior
+                    instrument_key = matched['instrument_key'].iloc[0]
+
+                # Set instrument_key if found; else mark symbol inactive for this user
+                if instrument_key:
+                    stock['instrument_key'] = instrument_key
+                    logger_util.push_log(f"✅ Found instrument key {instrument_key} for {symbol}", level = "info", user_id = user_id, log_type = "trading")
+                else:
+                    logger_util.push_log(f"⚠️ No instrument key found for {symbol}, skipping.", level = "warning", user_id = user_id, log_type = "trading")
+                    try:
+                        r.srem(active_key, symbol)
+                    except Exception:
+                        pass
+
+            except Exception as e:
+                logger_util.push_log(f"❌ Error code 1001 : Error fetching instrument key for {symbol}", level="error", user_id=user_id,log_type="trading")
+                logger_util.push_log(f"❌ Error code 1001 : Error fetching instrument key for {symbol}: {e}", level = "error", user_id = "admin", log_type = "trading")
                 try:
                     r.srem(active_key, symbol)
                 except Exception:
                     pass
 
-        except Exception as e:
-            logger_util.push_log(f"❌ Error code 1001 : Error fetching instrument key for {symbol}", level="error", user_id=user_id,log_type="trading")
-            logger_util.push_log(f"❌ Error code 1001 : Error fetching instrument key for {symbol}: {e}", level = "error", user_id = "admin", log_type = "trading")
-            try:
-                r.srem(active_key, symbol)
-            except Exception:
-                pass
-
-    # STEP 2: Interval setup
-    if not trading_parameters:
-        logger_util.push_log("⚠️ No trading parameters supplied. Exiting.", level = "warning", user_id = user_id, log_type = "trading")
-        return
+        # STEP 2: Interval setup
+        if not trading_parameters:
+            logger_util.push_log("⚠️ No trading parameters supplied. Exiting.", level = "warning", user_id = user_id, log_type = "trading")
+            return False
 
-    interval = trading_parameters[0].get("interval", "1minute")
-    now_interval, next_interval = nni.round_to_next_interval(interval)
-    logger_util.push_log(f"🕓 Present Interval Start: {now_interval}, Next Interval: {next_interval}", level = "info", user_id = user_id, log_type = "trading")
+        # `interval` is reused per stock (AngelOne remaps it), so keep the cycle's own copy
+        self.cycle_interval = trading_parameters[0].get("interval", "1minute")
+        # NSE and MCX bars start at different opens, so each exchange's symbols run on its own boundaries
+        self.advance_intervals()
+        for exchange, (now_interval, _) in self.intervals.items():
+            # Bars that closed before the session started are not traded, as with a single exchange
+            self.last_candles[exchange] = max(self.last_candles.get(exchange) or "", now_interval)
+        logger_util.push_log(f"🕓 Present Interval Start: {self.now_interval}, Next Interval: {self.next_interval}", level = "info", user_id = user_id, log_type = "trading")
 
-    # Ensure redis client (use module-level r)
-    # (r already defined at top using REDIS_URL)
-    try:
-        # Recompute symbol list from active set for user
-        active_symbols = list(r.smembers(active_key))
-    except Exception as e:
-        logger_util.push_log(f"❌ Error Code 1002 : Error reading active symbols for {user_id}", level="error", user_id=user_id,log_type="trading")
-        logger_util.push_log(f"❌ Error code 1002 : Redis error reading active symbols for {user_id}: {e}", level = "error", user_id = "admin", log_type = "trading")
-        active_symbols = [s["symbol_value"] for s in trading_parameters if s.get("symbol_value")]
-
-    symbols = [s for s in active_symbols if s]  # cleaned list
-    if not symbols:
-        logger_util.push_log("⚠️ No valid symbols to start trading. Exiting.", level = "warning", user_id = user_id, log_type = "trading")
-        return
+        try:
+            # Recompute symbol list from active set for user
+            active_symbols = list(r.smembers(active_key))
+        except Exception as e:
+            logger_util.push_log(f"❌ Error Code 1002 : Error reading active symbols for {user_id}", level="error", user_id=user_id,log_type="trading")
+            logger_util.push_log(f"❌ Error code 1002 : Redis error reading active symbols for {user_id}: {e}", level = "error", user_id = "admin", log_type = "trading")
+            active_symbols = [s["symbol_value"] for s in trading_parameters if s.get("symbol_value")]
 
-    # Small pause for any async initialization
-    time.sleep(0.5)
+        symbols = [s for s in active_symbols if s]  # cleaned list
+        if not symbols:
+            logger_util.push_log("⚠️ No valid symbols to start trading. Exiting.", level = "warning", user_id = user_id, log_type = "trading")
+            return False
 
-    # STEP 3: Trading loop
-    while True:
+        # One batched read of every symbol's state; cycles then read it from memory
+        try:
+            self.state.hydrate(symbols)
+        except Exception as e:
+            logger_util.push_log(f"⚠️ Could not preload strategy state for {user_id}: {e}", level = "warning", user_id = "admin", log_type = "trading")
+        return True
+
+    def refresh(self):
+        """
+        Apply stop/kill flags and the current active set. Returns False (after
+        resetting the symbols' strategy state) when the session should end.
+        """
+        user_id = self.user_id
+        active_key = self.active_key
         # Refresh active symbols for this user
         try:
             active_symbols = set(r.smembers(active_key))
         except Exception as e:
             logger_util.push_log(f"❌ Error Code 1003 : Error reading active symbols for {user_id}", level="error",user_id=user_id, log_type="trading")
             logger_util.push_log(f"❌ Error code 1003 : Redis error reading active symbols for {user_id}: {e}",level="error", user_id="admin", log_type="trading")
-            # On Redis error, break to avoid uncontrolled looping
-            break
+            # On Redis error, stop to avoid uncontrolled looping
+            return False
 
         # Filter trading_parameters by currently active symbols for this user
-        trading_parameters = [
-            s for s in trading_parameters if s.get("symbol_value") in active_symbols
+        self.trading_parameters = [
+            s for s in self.trading_parameters if s.get("symbol_value") in active_symbols
         ]
 
-        # If no active trades remain for this user, exit
-        # ⭐ NEW: Global kill flag (backend stop all)
+        # A newer start replaced this session: leave the symbols' state to the new one
+        if self.session_id and sl.current_session(r, user_id) not in (None, self.session_id):
+            logger_util.push_log(f"🔁 Trading session {self.session_id} for {user_id} was replaced by a newer start, exiting.", level = "info", user_id = "admin", log_type = "trading")
+            return False
+
+        # ⭐ NEW: Global kill flag (backend stop all); it names the session it stops
         kill_key = get_kill_key(user_id)
-        if r.get(kill_key) == "1":
+        if r.get(kill_key) in ("1", self.session_id):
             for symbol in active_symbols:
-                stj.reset_json_variables(user_id, symbol, VARIABLES_TO_RESET)
+                self.state.reset(symbol, VARIABLES_TO_RESET)
+            self.state.flush()
             logger_util.push_log(f"🛑 STOP SIGNAL RECEIVED for {user_id} — exiting trading loop.", level = "info",  user_id = user_id, log_type = "trading")
             r.delete(kill_key)
             r.delete(active_key)
-
-            break
+            return False
 
         # ⭐ Existing logic: no active trades
-        if not trading_parameters or len(active_symbols) == 0 or r.scard(active_key) == 0:
+        if not self.trading_parameters or len(active_symbols) == 0 or r.scard(active_key) == 0:
             logger_util.push_log(f"🏁 All trades stopped for {user_id} — exiting trading loop.", level = "info", user_id = user_id, log_type = "trading")
             for symbol in active_symbols:
-                stj.reset_json_variables(user_id, symbol, VARIABLES_TO_RESET)
-
-            break
-
-        now = datetime.datetime.now(ZoneInfo("Asia/Kolkata")).strftime("%Y-%m-%d %H:%M:%S")
-
-        if now >= next_interval:
-            # Recompute intervals
-            now_interval, next_interval = nni.round_to_next_interval(interval)
-            logger_util.push_log(f"⏱ New interval reached: {now_interval}", level = "info", user_id = user_id, log_type = "trading")
+                self.state.reset(symbol, VARIABLES_TO_RESET)
+            self.state.flush()
+            return False
+        return True
+
+    def advance_intervals(self):
+        """Recompute every exchange's intervals; the session wakes at the earliest next boundary."""
+        exchanges = {mc.exchange_for_type(s.get("type")) for s in self.trading_parameters} or {"NSE"}
+        self.intervals = {ex: nni.round_to_next_interval(self.cycle_interval, ex) for ex in sorted(exchanges)}
+        self.now_interval = max(now for now, _ in self.intervals.values())
+        upcoming = [nxt for _, nxt in self.intervals.values() if nxt]
+        self.next_interval = min(upcoming) if upcoming else None
+
+    def due(self, now=None):
+        now = now or clock.now(ZoneInfo("Asia/Kolkata")).strftime("%Y-%m-%d %H:%M:%S")
+        return self.next_interval is not None and now >= self.next_interval
+
+    def run_cycle(self, symbol_pool):
+        """Advance to the new intervals and run the symbols of every exchange whose bar closed on `symbol_pool`."""
+        user_id = self.user_id
+        selected_brokers = self.selected_brokers
+
+        # Recompute intervals; an exchange is due once its own next boundary has passed
+        # (not at another exchange's boundary or its session open) and that candle is unprocessed
+        previous = self.intervals
+        self.advance_intervals()
+        due = {
+            ex: now for ex, (now, _) in self.intervals.items()
+            if now != self.last_candles.get(ex) and now >= (previous.get(ex, (None, None))[1] or "")
+        }
+        if not due:
+            # Another exchange's boundary, or already processed before this session was resumed
+            logger_util.push_log(f"♻️ Interval {self.now_interval} was already processed, waiting for the next one", level = "info", user_id = user_id, log_type = "trading")
+            return
+        now_interval = max(due.values())
+        trading_parameters = [s for s in self.trading_parameters if mc.exchange_for_type(s.get("type")) in due]
+        logger_util.push_log(f"⏱ New interval reached: {', '.join(f'{ex} {now}' for ex, now in due.items())}", level = "info", user_id = user_id, log_type = "trading")
+
+        # Deadline each exchange's symbols are timed against
+        budgets = {ex: cycle_budget.CycleBudget(user_id, now, self.cycle_interval) for ex, now in due.items()}
+
+        # One positions fetch per account, shared by every symbol's strategy check
+        snapshots = begin_positions_snapshots(user_id, trading_parameters, selected_brokers)
+        try:
+            # One batched quote call per Upstox account instead of one call per symbol/position
+            upstox_quotes = prefetch_upstox_quotes(user_id, trading_parameters, selected_brokers)
 
-            # Loop through each active stock and perform fetch, indicators, trade checks
+            # Fan symbols out to the worker pool; per-account semaphores keep each API within its limits
+            futures = []
             for stock in trading_parameters:
-                symbol = stock.get('symbol_value')
-                # Quick check if this symbol has been deactivated mid-run
-                if not r.sismember(active_key, symbol):
-                    continue
-
-                # ⭐ NEW: Per-stock stop flag check
-                stop_key = f"stop:{user_id}:{symbol}"
-                if r.get(stop_key):
-                    logger_util.push_log(
-                        f"🛑 Stopping trade for {symbol}",
-                        level="info",
-                        user_id=user_id,
-                        log_type="trading"
-                    )
-                    stj.reset_json_variables(user_id, symbol, VARIABLES_TO_RESET)
-                    r.srem(active_key, symbol)   # remove from active list
-                    r.delete(stop_key)           # clean flag
-                    continue     # skip trading this stock (but keep others running)
-
-                broker_key = stock.get('broker')
-                broker_name = broker_map.get(broker_key)
-                company = stock.get('symbol_key')
-                interval = stock.get('interval')
-                instrument_key = stock.get('instrument_key')
-                strategy = stock.get('strategy')
-                exchange_type = stock.get('type')
-                tick_size = stock.get('tick_size')
-
-                logger_util.push_log(f"🕯 Fetching candles for {symbol}-{company} from {broker_name}", level = "info", user_id = user_id, log_type = "trading")
-
-                combined_df = None
-                resampled_candle = None
-                # local holders for session/auth_token used in different broker flows
-                session = None
-                auth_token = None
-
-                try:
-                    if broker_name == "upstox":
-                        access_token = next(
-                            (b['credentials']['access_token']
-                             for b in selected_brokers if b['name'] == broker_key),
-                            None
-                        )
-                        if access_token:
-                            hdf = us.upstox_fetch_historical_data_with_retry(user_id, access_token, instrument_key,interval)
-                            idf = us.upstox_fetch_intraday_data(user_id, access_token, instrument_key, interval)
-                            idf_1m = us.upstox_fetch_intraday_data(user_id, access_token, instrument_key, 1)
-                            ohlc_df = us.upstox_ohlc_data_fetch(user_id, access_token, instrument_key)
-                            if idf_1m is not None and ohlc_df is not None:
-                                combine_1m = cdf.combinding_dataframes(idf_1m, ohlc_df)
-                                resampled_candle = resample_candle_data(combine_1m, interval)
-                            if hdf is not None and idf is not None and resampled_candle is not None:
-                                combined_df = cdf.combinding_dataframes(hdf, idf, resampled_candle)
-
-                    elif broker_name == "zerodha":
-                        broker_info = next(
-                            (b for b in selected_brokers if b['name'] == broker_key), None
-                        )
-                        if broker_info:
-                            kite = zr.kite_connect_from_credentials(
-                                broker_info['credentials']
-                            )
-                            hdf = zr.zerodha_historical_data(user_id, kite, instrument_key, interval)
-                            idf = zr.zerodha_intraday_data(user_id, kite, instrument_key, interval)
-                            if hdf is not None and idf is not None:
-                                combined_df = cdf.combinding_dataframes(hdf, idf)
-
-                    elif broker_name == "angelone":
-                        broker_info = next(
-                            (b for b in selected_brokers if b['name'] == broker_key), None
-                        )
-                        if broker_info:
-                            api_key = broker_info['credentials'].get("api_key")
-                            user_id_cred = broker_info['credentials'].get("user_id")
-                            pin = broker_info['credentials'].get("pin")
-                            totp_secret = broker_info['credentials'].get("totp_secret")
-                            session = ar.angelone_get_session(api_key, user_id_cred, pin, totp_secret)
-                            # session may include auth_token and obj (used in execution)
-                            auth_token = session.get("auth_token") if isinstance(session, dict) else None
-                            interval = ar.number_to_interval(interval)
-                            combined_df = ar.angelone_get_historical_data(
-                                api_key, auth_token, session.get("obj") if isinstance(session, dict) else None, "NSE",
-                                instrument_key, interval
-                            )
-
-                    elif broker_name == "5paisa":
-                        broker_info = next(
-                            (b for b in selected_brokers if b['name'] == broker_key), None
-                        )
-                        if broker_info:
-                            access_token = broker_info['credentials'].get("access_token")
-                            combined_df = fp.fivepaisa_historical_data_fetch(
-                                access_token, instrument_key, interval, 25
-                            )
-
-                except Exception as e:
-                    logger_util.push_log(f"❌ Error code 1004 : Error fetching data for {symbol}", level="error", user_id=user_id,log_type="trading")
-                    logger_util.push_log(f"❌ Error code 1004 : Error fetching data for {symbol}: {e}", level = "error", user_id = "admin", log_type = "trading")
-                    # If fetching fails repeatedly for a symbol, consider deactivating it
-                    # but to mimic old logic, we simply skip this iteration.
-                    continue
-
-                if combined_df is None or combined_df.empty:
-                    logger_util.push_log(f"⚠️ No data returned for {symbol}, skipping.", level = "warning", user_id = user_id, log_type = "trading")
-                    continue
+                exchange = mc.exchange_for_type(stock.get("type"))
+                futures.append(symbol_pool.submit(_run_symbol, user_id, stock, selected_brokers, due[exchange],
+                                                  upstox_quotes, budgets[exchange], self.state))
+            # Flush each symbol's buffered logs in parameter order as soon as it and its predecessors finish
+            for future in futures:
+                logger_util.flush_logs(future.result())
+        finally:
+            ps.end(snapshots)
+            self.state.flush()
+        for budget in budgets.values():
+            budget.publish(r)
+        self.last_candles.update(due)
+        if clock.is_virtual():
+            # Simulated time jumps to the next candle from here; let this cycle's orders land first
+            order_pipeline.wait_idle()
+
+        logger_util.push_log(f"✅ Trading cycle completed at {now_interval}", level = "info",  user_id = user_id, log_type = "trading")
+        logger_util.push_log(f"⏳ Waiting for next interval at {self.next_interval}...", level = "info", user_id = user_id, log_type = "trading")
+
+    def checkpoint(self):
+        """Save instrument keys and the last processed candle for a resume."""
+        self.state.flush()
+        sl.save_checkpoint(r, self.user_id, self.trading_parameters, self.last_candles)
+
+
+def run_trading_logic_for_all(user_id, trading_parameters, selected_brokers, resume=False, config=None):
+    """
+    Main trading loop for a single user, run inside one Celery task.
+    The trading scheduler runs the same TradingSession without holding a worker.
+    The session holds a lease while it runs; if the worker dies, the session
+    supervisor resumes it from its checkpoint on another worker.
+    """
+    session_id = (config or {}).get("session_id")
+    lease = sl.SessionLease(r, user_id, holder=sl.holder_id(session_id))
+    acquired = lease.acquire()
+    if not acquired and session_id and not (lease.current_holder() or "").endswith(session_id):
+        # The session this start replaced still holds the lease; it exits at its next refresh
+        acquired = lease.acquire(wait=sl.LEASE_TTL)
+    # A queued resume has reached a worker: the supervisor may queue it again from now on
+    sl.clear_resume(r, user_id)
+    if not acquired:
+        logger_util.push_log(f"🔒 Trading session for {user_id} is already running on another worker", level = "warning", user_id = "admin", log_type = "trading")
+        return
+    lease.start_renewing()
+    if config is not None:
+        # Lets the supervisor restart the session if this worker dies
+        r.hset(sl.SESSIONS_KEY, user_id, json.dumps(config))
 
-                logger_util.push_log(f"✅ Data ready for {symbol}", level = "info", user_id = user_id, log_type = "trading")
-                indicators_df = ind.all_indicators(combined_df, strategy)
-                # if indicators_df might be empty after dropna, guard:
-                if indicators_df is None or indicators_df.empty:
-                    logger_util.push_log(f"⚠️ Indicators empty for {symbol}, skipping.", level = "warning", user_id = user_id, log_type = "trading")
-                    continue
-                logger_util.push_log(f"📊 Indicators:", level = "info", user_id = user_id, log_type = "trading")
-                logger_util.push_log(tabulate(indicators_df.tail(1), headers="keys", tablefmt="pretty"), user_id=user_id,level="indicator", log_type="trading")
+    session = TradingSession(user_id, trading_parameters, selected_brokers, session_id=session_id)
+    try:
+        if session.setup(resume=resume):
+            _run_session_loop(session, lease)
+    finally:
+        if not lease.lost.is_set():
+            # Ended normally (stop, kill, nothing left to trade): nothing to resume
+            r.hdel(sl.SESSIONS_KEY, user_id)
+            sl.clear_checkpoint(r, user_id)
+        lease.release()
 
-                try:
-                    creds = next(
-                        (b["credentials"] for b in selected_brokers if b["name"] == broker_key),
-                        None
-                    )
-                    lots = stock.get("lots")
-                    target_pct = stock.get("target_percentage")
-                    if target_pct == 0 or target_pct == None or target_pct == "0":
-                        target_pct = 0
 
-                    if broker_name == "upstox":
-                        # Upstox execution uses access_token inside creds
-                        us.upstox_trade_conditions_check(user_id,
-                            lots, target_pct, indicators_df.tail(5),
-                            creds, company, symbol, exchange_type, strategy
-                        )
-                    elif broker_name == "zerodha":
-                        zr.zerodha_trade_conditions_check(user_id,
-                            lots, target_pct, indicators_df.tail(1),
-                            creds, symbol, strategy
-                        )
-                    elif broker_name == "angelone":
-                        # Ensure session/auth_token used if available; original code used session/auth_token variables
-                        try:
-                            ar.angelone_trade_conditions_check(
-                                session.get("obj") if isinstance(session, dict) else session,
-                                auth_token,
-                                lots, target_pct,
-                                indicators_df, creds, symbol, strategy
-                            )
-                        except Exception as e:
-                            logger_util.push_log(f"❌ Error code 1005 : AngelOne trade execution error for {symbol}", level="error",user_id=user_id, log_type="trading")
-                            logger_util.push_log(f"❌ Error code 1005 : AngelOne trade execution error for {symbol}: {e}", level = "error", user_id = "admin", log_type = "trading")
-                    elif broker_name == "5paisa":
-                        fp.fivepaisa_trade_conditions_check(
-                            lots, target_pct, indicators_df, creds, stock, strategy
-                        )
+def _run_session_loop(session, lease):
+    user_id = session.user_id
 
-                except Exception as e:
-                    logger_util.push_log(f"❌ Error code 1006 : Error executing trade for {symbol}", level="error", user_id=user_id,log_type="trading")
-                    logger_util.push_log(f"❌ Error code 1006 : Error executing trade for {symbol}: {e}", level = "error", user_id = "admin", log_type = "trading")
+    # Small pause for any async initialization
+    clock.sleep(0.5)
 
-                # Clean up per-symbol memory
-                del combined_df
-                del indicators_df
-                gc.collect()
+    # Sleeps until candle close; stop/kill/disconnect messages wake it early
+    scheduler = cs.CandleCloseScheduler(r, user_id)
+    symbol_pool = ThreadPoolExecutor(max_workers=SYMBOL_WORKERS, thread_name_prefix=f"symbols-{user_id}")
 
-            # END FOR each stock
-            logger_util.push_log(f"✅ Trading cycle completed at {now_interval}", level = "info",  user_id = user_id, log_type = "trading")
-            logger_util.push_log(f"⏳ Waiting for next interval at {next_interval}...", level = "info", user_id = user_id, log_type = "trading")
+    # STEP 3: Trading loop
+    while not lease.lost.is_set() and session.refresh():
+        if not session.due():
+            # Idle until the candle closes instead of spinning; a control message
+            # returns early so the stop/kill/active-set checks above run immediately
+            msg = scheduler.wait_until(session.next_interval or session.now_interval)
+            if msg:
+                logger_util.push_log(f"📨 Control message received: {msg.get('action')}", level = "info", user_id = user_id, log_type = "trading")
+            elif session.next_interval is None:
+                session.advance_intervals()
+            continue
 
-            gsleep(1)
+        session.run_cycle(symbol_pool)
+        try:
+            session.checkpoint()
+        except Exception as e:
+            logger_util.push_log(f"⚠️ Could not checkpoint {user_id}: {e}", level = "warning", user_id = "admin", log_type = "trading")
+        gc.collect()
 
     # END WHILE loop
+    scheduler.close()
+    symbol_pool.shutdown(wait=True)
     logger_util.push_log(f"🏁 All active trades ended for {user_id}. Exiting trading loop.", level = "info", user_id = user_id, log_type = "trading")
     gc.collect()
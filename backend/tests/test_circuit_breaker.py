@@ -0,0 +1,109 @@
+# backend/tests/test_circuit_breaker.py
+"""Half-open trials must be given back however a guarded broker call ends."""
+import pytest
+import requests
+
+from backend import broker_http
+from backend import circuit_breaker
+from backend import rate_limiter
+
+
+class _Session:
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+
+    def request(self, method, url, **kwargs):
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        response = requests.Response()
+        response.status_code = outcome
+        return response
+
+
+@pytest.fixture
+def breaker(monkeypatch):
+    monkeypatch.setattr(circuit_breaker, "OPEN_SECONDS", 0.0)
+    monkeypatch.setattr(circuit_breaker, "HALF_OPEN_SECONDS", 60.0)
+    monkeypatch.setattr(circuit_breaker, "HALF_OPEN_CALLS", 2)
+    monkeypatch.setattr(rate_limiter, "limit_for_request", lambda url, headers=None: ("testbroker", "quotes", None))
+    monkeypatch.setattr(rate_limiter, "acquire", lambda *limit, **kwargs: None)
+    monkeypatch.setattr(circuit_breaker, "_breakers", {})
+    breaker = circuit_breaker.breaker_for("testbroker", "quotes")
+    with breaker._lock:
+        breaker._transition(circuit_breaker.OPEN)
+    return breaker
+
+
+def _use(monkeypatch, session):
+    monkeypatch.setattr(broker_http, "session_for", lambda url: session)
+
+
+@pytest.mark.parametrize("error", [requests.exceptions.ChunkedEncodingError("cut"),
+                                   requests.exceptions.TooManyRedirects("loop")])
+def test_unclassified_errors_release_the_trial(monkeypatch, breaker, error):
+    _use(monkeypatch, _Session(error, error, 200, 200))
+    for _ in range(2):
+        with pytest.raises(type(error)):
+            broker_http.post("https://broker.test/quote")
+    assert breaker.state == circuit_breaker.HALF_OPEN
+    broker_http.post("https://broker.test/quote")
+    broker_http.post("https://broker.test/quote")
+    assert breaker.state == circuit_breaker.CLOSED
+
+
+def test_rate_limit_timeout_releases_the_trial(monkeypatch, breaker):
+    def timed_out(*limit, **kwargs):
+        raise rate_limiter.RateLimitTimeout("no token")
+
+    _use(monkeypatch, _Session(200, 200))
+    monkeypatch.setattr(rate_limiter, "acquire", timed_out)
+    for _ in range(3):
+        with pytest.raises(rate_limiter.RateLimitTimeout):
+            broker_http.post("https://broker.test/quote")
+    monkeypatch.setattr(rate_limiter, "acquire", lambda *limit, **kwargs: None)
+    broker_http.post("https://broker.test/quote")
+    broker_http.post("https://broker.test/quote")
+    assert breaker.state == circuit_breaker.CLOSED
+
+
+def test_failed_trial_reopens(monkeypatch, breaker):
+    _use(monkeypatch, _Session(requests.exceptions.ConnectionError("down")))
+    with pytest.raises(requests.exceptions.ConnectionError):
+        broker_http.post("https://broker.test/quote")
+    assert breaker.state == circuit_breaker.OPEN
+
+
+def test_lost_trials_time_out_to_open(monkeypatch, breaker):
+    breaker.before()
+    breaker.before()
+    with pytest.raises(circuit_breaker.CircuitOpenError):
+        breaker.before()
+    monkeypatch.setattr(circuit_breaker, "HALF_OPEN_SECONDS", 0.0)
+    with pytest.raises(circuit_breaker.CircuitOpenError):
+        breaker.before()
+    assert breaker.state == circuit_breaker.OPEN
+    # The next open period ends at once (OPEN_SECONDS=0) with fresh trials
+    monkeypatch.setattr(circuit_breaker, "HALF_OPEN_SECONDS", 60.0)
+    breaker.before()
+    assert breaker.state == circuit_breaker.HALF_OPEN
+
+
+def test_client_errors_are_not_counted(monkeypatch, breaker):
+    _use(monkeypatch, _Session(400, 401, 400))
+    for _ in range(3):
+        assert broker_http.post("https://broker.test/quote").status_code >= 400
+    assert breaker.state == circuit_breaker.HALF_OPEN
+    assert breaker._trials == 0
+
+
+def test_guard_releases_the_trial_on_unrelated_errors(breaker):
+    for _ in range(3):
+        with pytest.raises(ValueError):
+            with circuit_breaker.guard("testbroker", "quotes"):
+                raise ValueError("bad symbol")
+    assert breaker.state == circuit_breaker.HALF_OPEN
+    for _ in range(2):
+        with circuit_breaker.guard("testbroker", "quotes"):
+            pass
+    assert breaker.state == circuit_breaker.CLOSED
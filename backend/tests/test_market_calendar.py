@@ -0,0 +1,100 @@
+# backend/tests/test_market_calendar.py
+"""Session-anchored bar boundaries, the short last bar, and holiday/weekend roll-over."""
+import datetime
+
+import pytest
+
+from backend import market_calendar as mc
+
+# Mon 2025-01-06 .. Fri 2025-01-10; Tue 2025-01-07 is a test holiday for NSE and an
+# evening-only day for MCX
+HOLIDAYS = {
+    "NSE": {"2025-01-07": "Test holiday"},
+    "MCX": {"2025-01-07": {"sessions": [["17:00", "23:30"]]}},
+}
+
+
+@pytest.fixture(autouse=True)
+def holidays(monkeypatch):
+    monkeypatch.setattr(mc, "HOLIDAYS", HOLIDAYS)
+    mc._day_sessions.cache_clear()
+    mc._day_boundaries.cache_clear()
+    yield
+    mc._day_sessions.cache_clear()
+    mc._day_boundaries.cache_clear()
+
+
+def _epoch(value):
+    return mc._parse(value)
+
+
+@pytest.mark.parametrize("exchange, now, expected", [
+    ("NSE", "2025-01-06 09:15:00", ("2025-01-06 09:15:00", "2025-01-06 09:45:00")),
+    ("NSE", "2025-01-06 10:31:00", ("2025-01-06 10:15:00", "2025-01-06 10:45:00")),
+    ("NFO", "2025-01-06 10:31:00", ("2025-01-06 10:15:00", "2025-01-06 10:45:00")),
+    ("MCX", "2025-01-06 10:31:00", ("2025-01-06 10:30:00", "2025-01-06 11:00:00")),
+])
+def test_boundaries_are_anchored_at_the_session_open(exchange, now, expected):
+    assert mc.current_interval(exchange, 30, now) == expected
+
+
+def test_last_bar_of_the_session_is_short():
+    assert mc.current_interval("NSE", 30, "2025-01-06 15:20:00") == ("2025-01-06 15:15:00", "2025-01-06 15:30:00")
+    assert mc.closed_bar_start("NSE", 30, "2025-01-06 15:30:00") == "2025-01-06 15:15:00"
+    assert mc.closed_bar_start("NSE", 60, "2025-01-06 15:30:00") == "2025-01-06 15:15:00"
+    assert mc.bars_on("NSE", "2025-01-06", 60) == 7
+
+
+def test_closed_bar_start_on_full_bars():
+    assert mc.closed_bar_start("NSE", 30, "2025-01-06 09:45:00") == "2025-01-06 09:15:00"
+    assert mc.closed_bar_start("MCX", 30, "2025-01-06 09:30:00") == "2025-01-06 09:00:00"
+
+
+def test_bar_starts_cover_the_session():
+    starts = mc.bar_starts("NSE", "2025-01-06", 60)
+    assert starts[0] == "2025-01-06 09:15:00"
+    assert starts[-1] == "2025-01-06 15:15:00"
+    assert len(starts) == mc.bars_on("NSE", "2025-01-06", 60)
+    assert len(mc.bar_starts("NSE", "2025-01-06", 1)) == 375
+    assert mc.bar_starts("MCX", "2025-01-06", 30)[0] == "2025-01-06 09:00:00"
+
+
+def test_bar_start_of_a_tick():
+    tick = _epoch("2025-01-06 10:20:30")
+    assert mc._format(mc.bar_start("NSE", 15, tick)) == "2025-01-06 10:15:00"
+    assert mc._format(mc.bar_start("MCX", 15, tick)) == "2025-01-06 10:15:00"
+    assert mc._format(mc.bar_start("NSE", 30, tick)) == "2025-01-06 10:15:00"
+    assert mc._format(mc.bar_start("MCX", 30, tick)) == "2025-01-06 10:00:00"
+
+
+def test_after_the_close_waits_for_the_first_bar_of_the_next_day():
+    assert mc.current_interval("NSE", 5, "2025-01-08 16:00:00") == ("2025-01-08 15:30:00", "2025-01-09 09:20:00")
+    assert mc.current_interval("NSE", 5, "2025-01-08 08:00:00") == ("2025-01-06 15:30:00", "2025-01-08 09:20:00")
+
+
+def test_weekend_rolls_over_to_monday():
+    assert mc.current_interval("NSE", 15, "2025-01-11 12:00:00") == ("2025-01-10 15:30:00", "2025-01-13 09:30:00")
+    assert mc.current_interval("MCX", 15, "2025-01-10 23:45:00") == ("2025-01-10 23:30:00", "2025-01-13 09:15:00")
+
+
+def test_holiday_is_closed_and_skipped():
+    assert not mc.is_trading_day("NSE", "2025-01-07")
+    assert not mc.is_open("NSE", "2025-01-07 11:00:00")
+    assert mc.current_interval("NSE", 5, "2025-01-06 15:45:00") == ("2025-01-06 15:30:00", "2025-01-08 09:20:00")
+    assert mc.next_trading_day("NSE", "2025-01-06") == datetime.date(2025, 1, 8)
+    assert mc.previous_trading_day("NSE", "2025-01-08") == datetime.date(2025, 1, 6)
+    assert mc.previous_trading_day("NSE", "2025-01-13") == datetime.date(2025, 1, 10)
+
+
+def test_special_session_replaces_the_regular_hours():
+    assert mc.is_trading_day("MCX", "2025-01-07")
+    assert not mc.is_open("MCX", "2025-01-07 10:00:00")
+    assert mc.current_interval("MCX", 15, "2025-01-07 10:00:00") == ("2025-01-06 23:30:00", "2025-01-07 17:15:00")
+    assert mc.current_interval("MCX", 15, "2025-01-07 17:20:00") == ("2025-01-07 17:15:00", "2025-01-07 17:30:00")
+    assert mc.bar_starts("MCX", "2025-01-07", 30)[0] == "2025-01-07 17:00:00"
+
+
+def test_history_start_skips_holidays():
+    # 375 one-minute bars a day: 500 bars need Wed plus Mon, skipping the Tue holiday
+    assert mc.history_start_date("NSE", 1, bars=500, end_date="2025-01-08") == datetime.date(2025, 1, 6)
+    assert mc.history_start_date("NSE", 1, bars=500, end_date="2025-01-08", max_calendar_days=1) == datetime.date(2025, 1, 7)
@@ -0,0 +1,92 @@
+# backend/tests/test_order_pipeline.py
+"""Client order ids dedupe retries within a candle, and lanes send exits first."""
+import threading
+
+import fakeredis
+import pytest
+
+from backend import order_pipeline
+
+
+@pytest.fixture(autouse=True)
+def redis(monkeypatch):
+    client = fakeredis.FakeStrictRedis(decode_responses=True)
+    monkeypatch.setattr(order_pipeline, "redis_client", client)
+    monkeypatch.setattr(order_pipeline, "_lanes", {})
+    return client
+
+
+class _Broker:
+    def __init__(self, fail=False):
+        self.sent = []
+        self.fail = fail
+        self._lock = threading.Lock()
+
+    def place(self, label, tag=None):
+        with self._lock:
+            self.sent.append(label)
+            if self.fail:
+                raise RuntimeError("rejected")
+            return f"id-{len(self.sent)}"
+
+
+def _submit(broker, label, side="BUY", account="acct"):
+    return order_pipeline.submit("paper", account, side, broker.place, label,
+                                 instrument=label, quantity=1, tradingsymbol=label)
+
+
+def test_retry_within_a_candle_is_sent_once():
+    broker = _Broker()
+    with order_pipeline.cycle("2025-01-06 09:15:00"):
+        first = _submit(broker, "X")
+        second = _submit(broker, "X")
+    assert first.result(5) == "id-1"
+    assert second.result(5) is None
+    assert broker.sent == ["X"]
+
+
+def test_next_candle_sends_again():
+    broker = _Broker()
+    for candle in ("2025-01-06 09:15:00", "2025-01-06 09:16:00"):
+        with order_pipeline.cycle(candle):
+            assert _submit(broker, "X").result(5)
+    assert broker.sent == ["X", "X"]
+
+
+def test_identical_orders_outside_a_cycle_are_both_sent():
+    broker = _Broker()
+    assert _submit(broker, "X").result(5) == "id-1"
+    assert _submit(broker, "X").result(5) == "id-2"
+
+
+def test_failed_order_may_be_retried_in_the_same_candle():
+    broker = _Broker(fail=True)
+    with order_pipeline.cycle("2025-01-06 09:15:00"):
+        assert _submit(broker, "X").result(5) is None
+        broker.fail = False
+        assert _submit(broker, "X").result(5) == "id-2"
+
+
+def test_exits_go_out_before_queued_entries():
+    broker = _Broker()
+    started, release = threading.Event(), threading.Event()
+
+    def blocking(label, tag=None):
+        # Holds the account's lane while the other orders queue up behind it
+        order_id = broker.place(label, tag=tag)
+        started.set()
+        release.wait(5)
+        return order_id
+
+    with order_pipeline.cycle("2025-01-06 09:15:00"):
+        busy = order_pipeline.submit("paper", "acct", "BUY", blocking, "first",
+                                     instrument="first", quantity=1)
+        assert started.wait(5)
+        entries = [_submit(broker, f"entry-{i}") for i in range(3)]
+        exit_order = _submit(broker, "exit", side="SELL")
+    release.set()
+    for future in [busy, exit_order, *entries]:
+        assert future.result(5)
+    assert broker.sent == ["first", "exit", "entry-0", "entry-1", "entry-2"]
+    order_pipeline.wait_idle()
+    assert order_pipeline.idle()
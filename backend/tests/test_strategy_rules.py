@@ -0,0 +1,163 @@
+# backend/tests/test_strategy_rules.py
+"""Entries, exits and first-trade freshness of every strategy on fixed indicator frames."""
+import pandas as pd
+import pytest
+
+from backend import strategy_rules as sr
+
+# One candle per state; indicator values chosen so each state is unambiguous
+BULL = dict(close=100.0, Supertrend=95.0, ema10=101.0, ema20=99.0, MACD=1.0, MACD_signal=0.5,
+            ADX=30.0, ADX_EMA21=20.0, WillR_14=-10.0)
+BEAR = dict(close=100.0, Supertrend=105.0, ema10=99.0, ema20=101.0, MACD=-1.0, MACD_signal=-0.5,
+            ADX=30.0, ADX_EMA21=20.0, WillR_14=-90.0)
+FLAT = dict(close=100.0, Supertrend=95.0, ema10=99.0, ema20=101.0, MACD=-1.0, MACD_signal=-0.5,
+            ADX=10.0, ADX_EMA21=20.0, WillR_14=-50.0)
+
+
+def _frame(*rows):
+    return pd.DataFrame(list(rows))
+
+
+def _latest(name, *rows):
+    return sr.get(name).latest(_frame(*rows))
+
+
+@pytest.mark.parametrize("name", sorted(sr.STRATEGIES))
+def test_bull_candle_goes_long_and_exits_short(name):
+    signals = _latest(name, FLAT, FLAT, FLAT, BULL)
+    assert signals.long and not signals.short
+    assert signals.exit_short and not signals.exit_long
+    assert signals.close == 100.0
+
+
+@pytest.mark.parametrize("name", sorted(sr.STRATEGIES))
+def test_bear_candle_goes_short_and_exits_long(name):
+    signals = _latest(name, FLAT, FLAT, FLAT, BEAR)
+    assert signals.short and not signals.long
+    assert signals.exit_long and not signals.exit_short
+
+
+def test_macd_strategy_reads_the_signal_column():
+    # Everything bullish except MACD under its signal line: no entry
+    row = dict(BULL, MACD=0.5, MACD_signal=1.0)
+    signals = _latest("Ema10_Ema20_MACD_Supertrend", FLAT, FLAT, FLAT, row)
+    assert not signals.long
+    assert signals.exit_long
+
+
+def test_adx_strategy_exits_pe_when_macd_crosses_up():
+    # %R above -30 and MACD above its signal close a PE, not a CE
+    row = dict(FLAT, WillR_14=-20.0, MACD=1.0, MACD_signal=0.5, Supertrend=105.0)
+    signals = _latest("ADX_MACD_WillR_Supertrend", row)
+    assert signals.exit_short
+    assert not signals.exit_long
+
+
+def test_adx_strategy_needs_adx_above_its_ema():
+    assert "ADX_EMA21" in sr.get("ADX_MACD_WillR_Supertrend").columns
+    signals = _latest("ADX_MACD_WillR_Supertrend", dict(BULL, ADX=15.0))
+    assert not signals.long
+
+
+@pytest.mark.parametrize("history, fresh", [
+    ((FLAT, FLAT, FLAT), True),
+    ((BULL, BULL, FLAT), True),
+    ((FLAT, BULL, BULL), True),
+    ((BULL, BULL, BULL), False),
+])
+def test_first_trade_only_on_a_fresh_signal(history, fresh):
+    signals = _latest("Ema10_Ema20_Supertrend", *history, BULL)
+    assert signals.long
+    assert signals.long_fresh is fresh
+    assert not signals.short_fresh
+
+
+def test_evaluate_matches_latest_on_every_row():
+    strategy = sr.get("Ema10_Ema20_MACD_Supertrend")
+    frame = _frame(FLAT, BULL, BULL, BEAR, FLAT, BULL)
+    flags = strategy.evaluate(frame)
+    for i in range(len(frame)):
+        latest = strategy.latest(frame.iloc[:i + 1])
+        assert latest.long == flags["long"][i]
+        assert latest.short == flags["short"][i]
+        assert latest.exit_long == flags["exit_long"][i]
+
+
+# ---------- decision flow ----------
+class _Account:
+    def __init__(self, *symbols):
+        self.positions = [{"quantity": 50, "instrument_token": s, "tradingsymbol": s} for s in symbols]
+        self.actions = []
+
+    def fetch(self):
+        return list(self.positions)
+
+    def exit_position(self, position):
+        self.actions.append(("exit", position.tradingsymbol))
+        self.positions = [p for p in self.positions if p["tradingsymbol"] != position.tradingsymbol]
+
+    def enter(self, option_type):
+        self.actions.append(("enter", option_type))
+        return 123.0
+
+    def run(self, name, *rows):
+        strategy = sr.get(name)
+        return sr.run(strategy, strategy.latest(_frame(*rows)), "paper", self.fetch, self.exit_position, self.enter)
+
+
+@pytest.mark.parametrize("name", sorted(sr.STRATEGIES))
+def test_short_signal_without_positions_buys_pe(name):
+    account = _Account()
+    assert account.run(name, FLAT, BEAR) == 123.0
+    assert account.actions == [("enter", "PE")]
+
+
+def test_exit_then_entry_when_the_account_is_flat_again():
+    account = _Account("NIFTY25OCT25000CE")
+    account.run("Ema10_Ema20_Supertrend", FLAT, BEAR)
+    assert account.actions == [("exit", "NIFTY25OCT25000CE"), ("enter", "PE")]
+
+
+def test_no_entry_while_a_position_stays_open():
+    account = _Account("NIFTY25OCT25000CE")
+    assert account.run("Ema10_Ema20_Supertrend", FLAT, BULL) is None
+    assert account.actions == []
+
+
+def test_reverse_strategy_flips_the_open_position():
+    account = _Account("NIFTY25OCT25000CE")
+    assert account.run("Ema10_Ema20_MACD_Supertrend", FLAT, BEAR) == 123.0
+    assert account.actions == [("exit", "NIFTY25OCT25000CE"), ("enter", "PE")]
+
+
+def test_reverse_strategy_keeps_a_position_on_its_own_side():
+    account = _Account("NIFTY25OCT25000PE")
+    account.run("Ema10_Ema20_MACD_Supertrend", FLAT, BEAR)
+    assert account.actions == []
+
+
+# ---------- Upstox first trade ----------
+@pytest.fixture
+def upstox(monkeypatch):
+    from backend import Upstox as us
+
+    calls = {"entered": [], "state": {}}
+    monkeypatch.setattr(us.strategy_state, "load", lambda user_id, symbol: {"target_price": 0, "trade_count": 0})
+    monkeypatch.setattr(us.strategy_state, "update", lambda user_id, symbol, **fields: calls["state"].update(fields))
+    monkeypatch.setattr(us.positions_snapshot, "positions", lambda *args, **kwargs: [])
+    monkeypatch.setattr(us, "upstox_fetch_option_data",
+                        lambda *args: calls["entered"].append(args[-1]) or 150.0)
+    return lambda *rows: (us.upstox_trade_conditions_check(
+        "u1", 1, 1.0, _frame(*rows), {"access_token": "t"}, {}, "NIFTY", "EQUITY", "Ema10_Ema20_Supertrend"), calls)[1]
+
+
+def test_upstox_first_trade_enters_on_a_fresh_signal(upstox):
+    calls = upstox(FLAT, FLAT, FLAT, BEAR)
+    assert calls["entered"] == ["PE"]
+    assert calls["state"] == {"target_price": 150.0, "trade_count": 1}
+
+
+def test_upstox_first_trade_skips_a_standing_signal(upstox):
+    calls = upstox(BULL, BULL, BULL, BULL)
+    assert calls["entered"] == []
+    assert calls["state"] == {"target_price": 0, "trade_count": 0}
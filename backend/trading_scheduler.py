@@ -0,0 +1,431 @@
+# backend/trading_scheduler.py
+"""
+Multi-tenant trading scheduler.
+
+Replaces one long-running Celery task per user. A single process keeps every
+user's TradingSession in memory and a heap of their next candle-close deadlines;
+a due session runs one cycle on a shared cycle pool and its symbols fan out to a
+shared symbol pool, so idle sessions hold no thread and one process serves
+thousands of user-symbols.
+
+Sessions are stored in the Redis hash `trading_sessions` (user_id -> config) and
+checkpointed after every cycle (session_lease), so a restarted scheduler resumes
+them without repeating lookups or candles. With several scheduler processes, the shard
+coordinator decides which node runs which user and moves users when nodes join
+or die. Each running session also holds the user's session lease, the same one
+a Celery trading task takes, so the two engines never trade a user at once. With
+TRADING_ENGINE=scheduler the API controls it through messages on
+`trading_scheduler:control`:
+  {"action": "start", "user_id": ...}           config is read from the hash
+  {"action": "kill" | "stop" | "disconnect", "user_id": ..., ...}
+  {"action": "rebalance"}                        a node joined or left
+
+With ENGINE_CLOCK=virtual (clock) the scheduler waits for each round of cycles
+and their orders, then jumps to the next deadline, so a simulated day with the
+paper broker runs as fast as the cycles do.
+
+Run (only with TRADING_ENGINE=scheduler; otherwise it exits):
+  python -m backend.trading_scheduler
+"""
+import heapq
+import itertools
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import backend.logger_util as logger_util
+from backend import clock
+from backend import order_pipeline
+from backend import cycle_scheduler as cs
+from backend import shard_coordinator as shc
+from backend import session_lease as sl
+from backend.tasks import trading_tasks as tt
+
+SESSIONS_KEY = sl.SESSIONS_KEY
+CONTROL_CHANNEL = cs.SCHEDULER_CHANNEL
+
+CYCLE_WORKERS = int(os.getenv("TRADING_SCHEDULER_CYCLE_WORKERS", "64"))
+SYMBOL_WORKERS = int(os.getenv("TRADING_SCHEDULER_SYMBOL_WORKERS", "128"))
+# Longest the control loop blocks, so the heap is re-checked even without messages
+MAX_IDLE = 1.0
+
+
+def start_session(redis_client, config):
+    """Store a user's trading config and ask the scheduler to start it (called by the API)."""
+    user_id = config["user_id"]
+    config = {**config, "session_id": sl.new_session(redis_client, user_id)}
+    redis_client.hset(SESSIONS_KEY, user_id, json.dumps(config))
+    if redis_client.get(tt.get_kill_key(user_id)) == "1":
+        # A STOP flag that names no session would stop this one too
+        redis_client.delete(tt.get_kill_key(user_id))
+    redis_client.publish(CONTROL_CHANNEL, json.dumps({"action": "start", "user_id": user_id}))
+
+
+class TradingScheduler:
+    def __init__(self, redis_client, cycle_workers=CYCLE_WORKERS, symbol_workers=SYMBOL_WORKERS, coordinator=None):
+        self.redis = redis_client
+        self.coordinator = coordinator
+        self.sessions = {}
+        # Users this node owns but whose previous node has not released them yet
+        self._pending = set()
+        # user_id -> resume flag of a start waiting for that user's running cycle to end
+        self._restarts = {}
+        self._heap = []
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        # Cycles submitted and not yet rescheduled
+        self._running = 0
+        self._stop = threading.Event()
+        self.cycle_pool = ThreadPoolExecutor(max_workers=cycle_workers, thread_name_prefix="cycles")
+        self.symbol_pool = ThreadPoolExecutor(max_workers=symbol_workers, thread_name_prefix="symbols")
+
+    # ---------- session lifecycle ----------
+    def start(self, user_id, resume=False):
+        if self.coordinator is not None:
+            if not self.coordinator.owns(user_id):
+                return
+            if not self.coordinator.claim(user_id):
+                self._pending.add(user_id)
+                return
+            self._pending.discard(user_id)
+        with self._lock:
+            running = self.sessions.get(user_id)
+            if running is not None and running.busy:
+                # Two sessions must never run a candle for the same user: start once its cycle ends
+                self._restarts[user_id] = resume
+                return
+        raw = self.redis.hget(SESSIONS_KEY, user_id)
+        if not raw:
+            logger_util.push_log(f"⚠️ No stored trading config for {user_id}", level="warning", user_id="admin", log_type="trading")
+            return
+        config = json.loads(raw)
+        session = tt.TradingSession(user_id, config.get("tradingParameters", []), config.get("selectedBrokers", []),
+                                    session_id=config.get("session_id"))
+        with self._lock:
+            # A newer start replaces the running session; its queued deadlines are ignored
+            self.sessions[user_id] = session
+        self._submit(self._setup, session, resume)
+
+    def _submit(self, fn, *args):
+        """Run `fn(*args)` on the cycle pool; an exception it lets through is logged and its session recovered."""
+        future = self.cycle_pool.submit(fn, *args)
+        future.add_done_callback(lambda f: self._on_done(f, fn, args))
+        return future
+
+    def _on_done(self, future, fn, args):
+        if future.cancelled() or future.exception() is None:
+            return
+        session = args[0] if args and isinstance(args[0], tt.TradingSession) else None
+        user_id = session.user_id if session is not None else "-"
+        logger_util.push_log(f"💥 Scheduler task {fn.__name__} failed for {user_id}: {future.exception()}", level="error", user_id="admin", log_type="trading")
+        if session is None or not self._current(session):
+            return
+        if fn == self._setup:
+            self._finish(session)
+            return
+        if fn == self._cycle:
+            # Keep the session on the heap instead of silently dropping it
+            session.busy = False
+            try:
+                self._schedule(session)
+            except Exception as e:
+                logger_util.push_log(f"💥 Could not reschedule {user_id}, ending its session: {e}", level="error", user_id="admin", log_type="trading")
+                self._finish(session)
+
+    def _setup(self, session, resume):
+        lease = sl.SessionLease(self.redis, session.user_id)
+        if not lease.acquire():
+            # A Celery task, or a node that has not let go yet, still runs this user
+            with self._lock:
+                if self._current(session):
+                    del self.sessions[session.user_id]
+                self._pending.add(session.user_id)
+            logger_util.push_log(f"🔒 Trading session for {session.user_id} is already running elsewhere, not starting it", level="warning", user_id="admin", log_type="trading")
+            return
+        session.lease = lease
+        try:
+            ready = session.setup(resume=resume)
+        except Exception as e:
+            logger_util.push_log(f"💥 Trading session setup crashed for {session.user_id}: {e}", level="error", user_id="admin", log_type="trading")
+            ready = False
+        if ready:
+            logger_util.push_log(f"🚀 Trading session scheduled for {session.user_id}", level="info", user_id="admin", log_type="trading")
+            self._schedule(session)
+        else:
+            self._finish(session)
+
+    def _finish(self, session):
+        with self._lock:
+            if self.sessions.get(session.user_id) is not session:
+                return
+            del self.sessions[session.user_id]
+            # A start waiting for this session's cycle takes over its stored config and ownership
+            replaced = session.user_id in self._restarts
+        if replaced:
+            return
+        try:
+            if session.lease is not None:
+                # Only the lease holder may forget the session; otherwise it belongs to another engine
+                self.redis.hdel(SESSIONS_KEY, session.user_id)
+                sl.clear_checkpoint(self.redis, session.user_id)
+                session.lease.release()
+            if self.coordinator is not None:
+                self.coordinator.release(session.user_id)
+        except Exception:
+            pass
+        logger_util.push_log(f"🏁 All active trades ended for {session.user_id}. Exiting trading loop.", level="info", user_id=session.user_id, log_type="trading")
+
+    def _current(self, session):
+        return self.sessions.get(session.user_id) is session
+
+    def _handoff(self, session):
+        """Hand a user to its new owner: checkpoint its state, then release ownership."""
+        try:
+            session.checkpoint()
+            if session.lease is not None:
+                session.lease.release()
+            self.coordinator.release(session.user_id)
+            logger_util.push_log(f"🔀 {session.user_id} handed off from {self.coordinator.node_id}", level="info", user_id="admin", log_type="trading")
+        except Exception as e:
+            logger_util.push_log(f"⚠️ Handoff of {session.user_id} failed, its ownership will expire instead: {e}", level="warning", user_id="admin", log_type="trading")
+
+    def rebalance(self):
+        """Drop users the ring moved elsewhere and start the ones it moved here."""
+        with self._lock:
+            moved = [s for s in self.sessions.values() if not self.coordinator.owns(s.user_id)]
+            for session in moved:
+                del self.sessions[session.user_id]
+                session.handoff = True
+        for session in moved:
+            # A running cycle hands off when it finishes
+            if not session.busy:
+                self._handoff(session)
+        for user_id in self.redis.hkeys(SESSIONS_KEY):
+            if user_id not in self.sessions and self.coordinator.owns(user_id):
+                self.start(user_id, resume=True)
+
+    def _heartbeat(self):
+        changed = self.coordinator.heartbeat()
+        with self._lock:
+            owned = list(self.sessions)
+        lost = self.coordinator.renew(owned)
+        if lost:
+            self._drop(lost)
+        if changed or lost or self._pending:
+            self.rebalance()
+
+    def _drop(self, user_ids):
+        """Stop running users whose ownership or lease expired; their new owner resumes them, so no handoff."""
+        with self._lock:
+            for user_id in user_ids:
+                session = self.sessions.pop(user_id, None)
+                if session is not None:
+                    session.handoff = False
+        for user_id in user_ids:
+            logger_util.push_log(f"🔒 Lost ownership of {user_id} on {sl.holder_id()}, dropping its session", level="warning", user_id="admin", log_type="trading")
+
+    def _renew_leases(self):
+        """Renew the session lease of every running user; drop the ones another holder took."""
+        with self._lock:
+            held = [s for s in self.sessions.values() if s.lease is not None]
+        lost = []
+        for session in held:
+            try:
+                if not session.lease.renew():
+                    lost.append(session.user_id)
+            except Exception as e:
+                logger_util.push_log(f"⚠️ Lease renewal failed for {session.user_id}: {e}", level="warning", user_id="admin", log_type="trading")
+        if lost:
+            self._drop(lost)
+
+    # ---------- deadlines ----------
+    def _schedule(self, session):
+        deadline = clock.time() + max(cs.seconds_until(session.next_interval), 0)
+        with self._lock:
+            heapq.heappush(self._heap, (deadline, next(self._seq), session))
+
+    def _run_due(self):
+        now = clock.time()
+        due = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                due.append(heapq.heappop(self._heap)[2])
+        for session in due:
+            if not self._current(session):
+                continue
+            if session.busy:
+                logger_util.push_log(f"⚠️ Previous cycle for {session.user_id} still running, skipping {session.next_interval}", level="warning", user_id=session.user_id, log_type="trading")
+                continue
+            session.busy = True
+            with self._lock:
+                self._running += 1
+            self._submit(self._cycle, session)
+
+    def _cycle(self, session):
+        try:
+            self._run_cycle(session)
+        finally:
+            with self._lock:
+                self._running -= 1
+
+    def _run_cycle(self, session):
+        try:
+            if not session.refresh():
+                self._finish(session)
+                return
+            session.run_cycle(self.symbol_pool)
+        except Exception as e:
+            logger_util.push_log(f"💥 Trading cycle crashed for {session.user_id}: {e}", level="error", user_id="admin", log_type="trading")
+        finally:
+            with self._lock:
+                session.busy = False
+                restart = self._restarts.pop(session.user_id, None)
+        if restart is not None:
+            self.start(session.user_id, resume=restart)
+            return
+        if self._current(session):
+            self._checkpoint(session)
+            self._schedule(session)
+        elif session.handoff:
+            self._handoff(session)
+
+    def _settled(self):
+        """True when no cycle is running and every queued order has been submitted."""
+        with self._lock:
+            running = self._running
+        return running == 0 and order_pipeline.idle()
+
+    def _checkpoint(self, session):
+        # Keep the checkpoint one cycle fresh, so a node crash loses at most one cycle
+        try:
+            session.checkpoint()
+        except Exception as e:
+            logger_util.push_log(f"⚠️ Could not checkpoint {session.user_id}: {e}", level="warning", user_id="admin", log_type="trading")
+
+    def _check(self, session):
+        """Apply a stop/kill/disconnect right away instead of at the next candle close."""
+        if session.busy:
+            return
+        try:
+            active = session.refresh()
+        except Exception:
+            active = True
+        if not active:
+            self._finish(session)
+
+    # ---------- control ----------
+    def handle(self, message):
+        action = message.get("action")
+        user_id = message.get("user_id")
+        if action == "rebalance" and self.coordinator is not None:
+            self._submit(self._heartbeat)
+            return
+        if not user_id:
+            return
+        logger_util.push_log(f"📨 Control message received: {action}", level="info", user_id=user_id, log_type="trading")
+        if action == "start":
+            self.start(user_id)
+            return
+        session = self.sessions.get(user_id)
+        if session is not None:
+            self._submit(self._check, session)
+
+    def resume(self):
+        """Restart every session stored in Redis (scheduler restart)."""
+        for user_id in self.redis.hkeys(SESSIONS_KEY):
+            self.start(user_id, resume=True)
+
+    def status(self):
+        with self._lock:
+            next_deadline = self._heap[0][0] if self._heap else None
+            return {
+                "sessions": len(self.sessions),
+                "busy": sum(1 for s in self.sessions.values() if s.busy),
+                "symbols": sum(len(s.trading_parameters) for s in self.sessions.values()),
+                "next_deadline_in": round(next_deadline - clock.time(), 3) if next_deadline else None,
+            }
+
+    def run(self):
+        pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(CONTROL_CHANNEL)
+        next_heartbeat = 0.0
+        next_renewal = time.time() + sl.LEASE_TTL / 3
+        if self.coordinator is not None:
+            self.coordinator.heartbeat()
+            self.redis.publish(CONTROL_CHANNEL, json.dumps({"action": "rebalance"}))
+            next_heartbeat = time.time() + shc.HEARTBEAT_INTERVAL
+        self.resume()
+        logger_util.push_log(f"🗓 Trading scheduler running with {len(self.sessions)} resumed sessions", level="info", user_id="admin", log_type="trading")
+        try:
+            while not self._stop.is_set():
+                if clock.is_virtual():
+                    msg = self._virtual_wait(pubsub)
+                else:
+                    with self._lock:
+                        wait = self._heap[0][0] - clock.time() if self._heap else MAX_IDLE
+                    msg = pubsub.get_message(timeout=min(max(wait, 0.0), MAX_IDLE))
+                if msg and msg.get("type") == "message":
+                    try:
+                        self.handle(json.loads(msg["data"]))
+                    except Exception as e:
+                        logger_util.push_log(f"⚠️ Bad scheduler control message {msg.get('data')}: {e}", level="warning", user_id="admin", log_type="trading")
+                self._run_due()
+                if time.time() >= next_renewal:
+                    next_renewal = time.time() + sl.LEASE_TTL / 3
+                    self._submit(self._renew_leases)
+                if self.coordinator is not None and time.time() >= next_heartbeat:
+                    next_heartbeat = time.time() + shc.HEARTBEAT_INTERVAL
+                    try:
+                        self._heartbeat()
+                    except Exception as e:
+                        logger_util.push_log(f"⚠️ Trading node heartbeat failed: {e}", level="warning", user_id="admin", log_type="trading")
+        finally:
+            pubsub.close()
+
+    def _virtual_wait(self, pubsub):
+        """
+        Under a virtual clock, let the running cycles and their orders finish, then
+        jump straight to the next deadline unless a control message is waiting.
+        """
+        while not self._settled() and not self._stop.is_set():
+            time.sleep(0.005)
+        msg = pubsub.get_message(timeout=0)
+        if msg is None:
+            with self._lock:
+                deadline = self._heap[0][0] if self._heap else None
+            if deadline is not None:
+                clock.sleep_until(deadline)
+            else:
+                time.sleep(0.05)
+        return msg
+
+    def stop(self):
+        self._stop.set()
+        self.cycle_pool.shutdown(wait=True)
+        self.symbol_pool.shutdown(wait=True)
+        if self.coordinator is not None:
+            # Leave cleanly so the other nodes take these users over immediately
+            for session in list(self.sessions.values()):
+                self._handoff(session)
+            self.coordinator.leave()
+            self.redis.publish(CONTROL_CHANNEL, json.dumps({"action": "rebalance"}))
+
+
+def main():
+    if os.getenv("TRADING_ENGINE", "celery").lower() != "scheduler":
+        # Celery tasks run the sessions; starting them here too would trade every user twice
+        logger_util.push_log("ℹ️ Trading scheduler is only used with TRADING_ENGINE=scheduler, exiting", level="info", user_id="admin", log_type="trading")
+        return
+    scheduler = TradingScheduler(tt.r, coordinator=shc.ShardCoordinator(tt.r))
+    try:
+        scheduler.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        scheduler.stop()
+
+
+if __name__ == "__main__":
+    main()